@@ -0,0 +1,58 @@
+""" Bench_bus
+
+    Micro benchmark of the per frame dispatch cost of CanBus with many subscribers
+    compared to a linear scan over all subscribers.
+
+    Run from the repository root with python3 -m benchmarks.bench_bus
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import socket
+import timeit
+
+from socketcan import CanFrame
+from socketcan.bus import CanBus, Subscription
+
+
+class NullSocket:
+    """ a placeholder for the socket of an interface, only the dispatch is measured """
+
+    def __init__(self):
+        self.s = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+
+def linear_dispatch(subscriptions, interface, frames):
+    """ the naive approach, every subscriber checks every frame """
+    for frame in frames:
+        for subscription in subscriptions:
+            if subscription.matches(interface) and \
+                    ((subscription.can_ids is None) or (frame.can_id in subscription.can_ids)):
+                subscription.put(interface, frame)
+
+
+def main(number=20, nframes=1000):
+    frames = [CanFrame(can_id=0x100 + (idx % 256), data=bytes(8)) for idx in range(nframes)]
+    results = []
+    for nsubscribers in (1, 10, 100, 1000):
+        bus = CanBus()
+        bus.add_interface("can0", sock=NullSocket())
+        for idx in range(nsubscribers):
+            bus.subscribe(can_ids=[0x100 + (idx % 256)], callback=lambda interface, frame: None)
+        subscriptions = [Subscription(can_ids=[0x100 + (idx % 256)], callback=lambda interface, frame: None)
+                         for idx in range(nsubscribers)]
+        namespace = {"bus": bus, "frames": frames, "subscriptions": subscriptions,
+                     "linear_dispatch": linear_dispatch}
+        for name, stmt in (("linear", "linear_dispatch(subscriptions, 'can0', frames)"),
+                           ("CanBus", "bus.dispatch('can0', frames)")):
+            result = min(timeit.repeat(stmt, globals=namespace, number=number, repeat=5)) / number / nframes * 1E9
+            results.append((name, nsubscribers, result))
+        bus.close()
+
+    for name, nsubscribers, result in results:
+        print("{0:8} {1:5} subscribers {2:10.0f} ns/frame".format(name, nsubscribers, result))
+    return results
+
+
+if __name__ == "__main__":
+    main()
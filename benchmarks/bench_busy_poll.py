@@ -0,0 +1,130 @@
+""" Bench_busy_poll
+
+    Round trip latency and cpu time of the receive side with different busy poll budgets.
+    A responder process answers every frame, the main process sends a frame and receives the answer.
+
+    With vcan0, CanRawSockets are used. With --socketpair, the responder answers on a unix datagram
+    socket pair, which measures the wake up cost of the scheduler without the CAN stack.
+
+    Run from the repository root with python3 -m benchmarks.bench_busy_poll
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import argparse
+import multiprocessing
+import socket
+import time
+
+from benchmarks.bench_suite import percentiles
+from socketcan import CanFilter, CanFrame, CanRawSocket
+from socketcan.socketcan import SocketOptionsMixin
+
+# None is plain blocking
+BUDGETS = (None, 50E-6, 200E-6, 1E-3)
+
+REQUEST_ID = 0x123
+RESPONSE_ID = 0x124
+
+
+class PairSocket(SocketOptionsMixin):
+    """ one end of a unix datagram socket pair with the receive path of a CanRawSocket """
+
+    def __init__(self, s: socket.socket):
+        self.s = s
+
+    def send(self, frame: CanFrame):
+        self.s.send(frame.to_bytes())
+
+    def recv(self) -> CanFrame:
+        if self.busy_poll is not None:
+            self.busy_wait()
+        return CanFrame.from_bytes(self.s.recv(CanFrame.get_size()))
+
+
+def respond_can(interface: str, count: int):
+    """ answer count requests on a CanRawSocket """
+    s = CanRawSocket(interface=interface, filters=[CanFilter(can_id=REQUEST_ID)])
+    response = CanFrame(can_id=RESPONSE_ID, data=bytes(8))
+    for idx in range(count):
+        s.recv()
+        s.send(response)
+
+
+def respond_pair(s: socket.socket, count: int):
+    """ answer count requests on a socket """
+    response = CanFrame(can_id=RESPONSE_ID, data=bytes(8)).to_bytes()
+    for idx in range(count):
+        s.recv(CanFrame.get_size())
+        s.send(response)
+
+
+def measure(sock,
+            responder: multiprocessing.Process,
+            count: int,
+            gap: float) -> dict:
+    """ return the round trip latency percentiles and the cpu time per round trip """
+    request = CanFrame(can_id=REQUEST_ID, data=bytes(8))
+    latencies = []
+    responder.start()
+    # let the responder start up
+    time.sleep(0.5)
+    cpu_start = time.process_time()
+    for idx in range(count):
+        start = time.perf_counter()
+        sock.send(request)
+        sock.recv()
+        latencies.append(time.perf_counter() - start)
+        if gap:
+            time.sleep(gap)
+    cpu = time.process_time() - cpu_start
+    responder.join()
+    result = percentiles(latencies)
+    result["cpu_us"] = (cpu / count) * 1E6
+    return result
+
+
+def run(interface: str = "vcan0",
+        use_socketpair: bool = False,
+        count: int = 10000,
+        gap: float = 0) -> dict:
+    """ run the benchmark for all budgets
+
+        @param interface: the interface for CanRawSockets
+        @param use_socketpair: use a unix datagram socket pair instead of CAN
+        @param count: the number of round trips per budget
+        @param gap: the time in seconds between round trips, the spin budget is wasted if the answer takes longer
+    """
+    results = {}
+    for budget in BUDGETS:
+        if use_socketpair:
+            s1, s2 = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock = PairSocket(s1)
+            sock.set_busy_poll(budget)
+            responder = multiprocessing.Process(target=respond_pair, args=(s2, count))
+        else:
+            sock = CanRawSocket(interface=interface, filters=[CanFilter(can_id=RESPONSE_ID)], busy_poll=budget)
+            responder = multiprocessing.Process(target=respond_can, args=(interface, count))
+        name = "blocking" if budget is None else "{0:g}us".format(budget * 1E6)
+        results[name] = measure(sock, responder, count, gap)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--interface", default="vcan0", help="the interface for the CanRawSockets")
+    parser.add_argument("--socketpair", action="store_true", help="use a unix datagram socket pair instead of CAN")
+    parser.add_argument("--count", type=int, default=10000, help="the number of round trips per budget")
+    parser.add_argument("--gap", type=float, default=0, help="the time in seconds between round trips")
+    args = parser.parse_args(argv)
+
+    results = run(interface=args.interface, use_socketpair=args.socketpair, count=args.count, gap=args.gap)
+    print("{0:10} {1:>10} {2:>10} {3:>10}".format("budget", "p50 us", "p99 us", "cpu us"))
+    for name, result in results.items():
+        print("{0:10} {1:10.1f} {2:10.1f} {3:10.1f}".format(name, result["p50_us"], result["p99_us"],
+                                                            result["cpu_us"]))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+""" Bench_canframe
+
+    Micro benchmark of the per frame cost of CanFrame creation, to_bytes and from_bytes
+    compared to the implementation before CanFrame got __slots__ and a precompiled Struct.
+
+    Run from the repository root with python3 -m benchmarks.bench_canframe
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import logging
+import struct
+import timeit
+
+from socketcan import CanFrame, CanFlags
+
+logger = logging.getLogger("socketcan")
+
+
+class LegacyCanFrame:
+    """ the CanFrame implementation of socketcan 0.1.0 for comparison """
+
+    FORMAT = "IB3x8s"
+
+    def __init__(self, can_id, data, flags=0):
+        logger.info("CanFrame creation with {0:08X} {1:08X} {2}".format(can_id, flags, data.hex()))
+        self.can_id = can_id
+        self.flags = flags
+        if (can_id > 0x7FF) and not (CanFlags.CAN_EFF_FLAG & self.flags):
+            logger.debug("adding CAN_EFF_FLAG for extended can_id {0:08X}".format(can_id))
+            self.flags = self.flags | CanFlags.CAN_EFF_FLAG
+        self.data = data
+
+    def to_bytes(self):
+        data = self.data
+        data.ljust(8)
+        return struct.pack(self.FORMAT, (self.can_id | self.flags), len(self.data), data)
+
+    @classmethod
+    def from_bytes(cls, byte_repr):
+        can_id_w_flags, data_length, data = struct.unpack(cls.FORMAT, byte_repr)
+        flags = (can_id_w_flags & 0xE0000000)
+        can_id = (can_id_w_flags & 0x1FFFFFFF)
+        logger.debug("extracted flags {0:08X}".format(flags))
+        return LegacyCanFrame(can_id=can_id, flags=flags, data=data[:data_length])
+
+
+def per_frame_ns(stmt, number, setup_globals):
+    """ return the best per call time in nanoseconds of 5 repetitions """
+    return min(timeit.repeat(stmt, globals=setup_globals, number=number, repeat=5)) / number * 1E9
+
+
+def main(number=100000):
+    data = bytes(range(8))
+    raw = CanFrame(can_id=0x12345678, data=data).to_bytes()
+    buffer = bytearray(CanFrame.get_size())
+    results = []
+    for name, cls in (("before", LegacyCanFrame), ("after", CanFrame)):
+        namespace = {"cls": cls, "data": data, "raw": raw, "frame": cls(can_id=0x12345678, data=data)}
+        results.append((name, "__init__", per_frame_ns("cls(can_id=0x12345678, data=data)", number, namespace)))
+        results.append((name, "to_bytes", per_frame_ns("frame.to_bytes()", number, namespace)))
+        results.append((name, "from_bytes", per_frame_ns("cls.from_bytes(raw)", number, namespace)))
+    namespace = {"cls": CanFrame, "buffer": buffer, "frame": CanFrame(can_id=0x12345678, data=data)}
+    results.append(("after", "pack_into", per_frame_ns("frame.pack_into(buffer)", number, namespace)))
+    results.append(("after", "unpack_from", per_frame_ns("cls.unpack_from(buffer)", number, namespace)))
+
+    for name, operation, result in results:
+        print("{0:8} {1:12} {2:8.0f} ns/frame".format(name, operation, result))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+""" Bench_dbc
+
+    Micro benchmark of the per frame cost of signal decoding with the compiled extractors
+    of a Message and with numpy over a CanFrameBatch, compared to per signal bit shifting.
+
+    Run from the repository root with python3 -m benchmarks.bench_dbc
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import timeit
+
+from socketcan import CanFrameBatch
+from socketcan.dbc import Message, Signal
+
+
+def per_signal_decode(message, data):
+    """ the naive approach, every signal collects its bits one by one """
+    values = {}
+    for signal in message.signals:
+        raw = 0
+        for bit in range(signal.length):
+            position = signal.start_bit + bit
+            raw |= ((data[position // 8] >> (position % 8)) & 1) << bit
+        if signal.is_signed and (raw & (1 << (signal.length - 1))):
+            raw -= (1 << signal.length)
+        values[signal.name] = (raw * signal.factor) + signal.offset
+    return values
+
+
+def main(number=2000, nframes=1000):
+    signals = [Signal(name="Signal{0}".format(idx), start_bit=idx * 8, length=8, is_signed=bool(idx % 2),
+                      factor=0.5, offset=-10) for idx in range(8)]
+    message = Message(can_id=0x123, name="Message", length=8, signals=signals)
+    frame = message.encode_frame({signal.name: idx for idx, signal in enumerate(signals)})
+    batch = CanFrameBatch.from_frames([frame] * nframes)
+    namespace = {"message": message, "data": frame.data, "batch": batch, "per_signal_decode": per_signal_decode}
+    results = []
+    for name, stmt, frames in (("per_signal", "per_signal_decode(message, data)", 1),
+                               ("compiled", "message.decode(data)", 1),
+                               ("numpy", "message.decode_array(batch.data)", nframes)):
+        result = min(timeit.repeat(stmt, globals=namespace, number=number, repeat=5)) / number / frames * 1E9
+        results.append((name, result))
+
+    for name, result in results:
+        print("{0:12} {1:8.0f} ns/frame with {2} signals".format(name, result, len(signals)))
+    return results
+
+
+if __name__ == "__main__":
+    main()
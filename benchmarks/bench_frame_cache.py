@@ -0,0 +1,98 @@
+""" Bench_frame_cache
+
+    Benchmark of receiving cyclic traffic with a FrameCache compared to a new CanFrame per frame.
+
+    The traffic is a receive buffer of 100 cyclic can ids where about 95% of the frames repeat
+    the bytes of the previous frame of their can id, it is decoded in batches of 64 frames
+    the same way CanRawSocket.recv_batch() does it. The frames are kept, like a consumer that
+    buffers them, so the retained memory shows what the shared frames save.
+
+    Run from the repository root with python3 -m benchmarks.bench_frame_cache
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import random
+import sys
+import time
+import tracemalloc
+
+from socketcan import CanFrame, FrameCache
+
+
+def get_cyclic_traffic(count: int = 100000,
+                       nids: int = 100,
+                       change_rate: float = 0.05,
+                       seed: int = 0) -> bytes:
+    """ return the bytes of count frames of nids cyclic can ids, change_rate of them change their data """
+    rng = random.Random(seed)
+    data = {can_id: bytes(8) for can_id in range(0x100, 0x100 + nids)}
+    records = []
+    for idx in range(count):
+        can_id = 0x100 + (idx % nids)
+        if rng.random() < change_rate:
+            data[can_id] = bytes(rng.randrange(256) for _ in range(8))
+        records.append(CanFrame(can_id=can_id, data=data[can_id]).to_bytes())
+    return b"".join(records)
+
+
+def decode_new(view: memoryview, batch_size: int) -> list:
+    """ a new CanFrame per frame, like recv_batch() without a frame cache """
+    mtu = CanFrame.get_size()
+    frames = []
+    for start in range(0, len(view), batch_size * mtu):
+        batch = view[start:start + (batch_size * mtu)]
+        frames.extend([CanFrame.unpack_from(batch, offset) for offset in range(0, len(batch), mtu)])
+    return frames
+
+
+def decode_cached(view: memoryview, batch_size: int, cache: FrameCache) -> list:
+    """ shared frames from a frame cache, like recv_batch() with a frame cache """
+    mtu = CanFrame.get_size()
+    get = cache.get
+    frames = []
+    for start in range(0, len(view), batch_size * mtu):
+        raw = view[start:start + (batch_size * mtu)].tobytes()
+        frames.extend([get(raw[offset:offset + mtu]) for offset in range(0, len(raw), mtu)])
+    return frames
+
+
+def measure(decode, *args) -> dict:
+    """ the time per frame, the number of allocated blocks and the bytes that remain allocated """
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    frames = decode(*args)
+    retained_blocks = sys.getallocatedblocks() - blocks
+    retained_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    nframes = len(frames)
+    del frames
+    durations = []
+    for _ in range(5):
+        start = time.perf_counter()
+        decode(*args)
+        durations.append(time.perf_counter() - start)
+    return {"ns_per_frame": min(durations) / nframes * 1E9,
+            "retained_blocks": retained_blocks,
+            "retained_bytes": retained_bytes,
+            "peak_bytes": peak_bytes,
+            }
+
+
+def main(count: int = 100000, batch_size: int = 64):
+    view = memoryview(get_cyclic_traffic(count=count))
+    cache = FrameCache(maxsize=1024)
+    results = {"new CanFrame": measure(decode_new, view, batch_size),
+               "FrameCache": measure(decode_cached, view, batch_size, cache),
+               }
+    print("{0:13} {1:>12} {2:>16} {3:>15} {4:>11}".format(
+        "", "ns/frame", "retained blocks", "retained bytes", "peak bytes"))
+    for name, result in results.items():
+        print("{0:13} {ns_per_frame:12.0f} {retained_blocks:16} {retained_bytes:15} {peak_bytes:11}".format(
+            name, **result))
+    print("hit ratio {0:.3f}".format(cache.get_hit_ratio()))
+    return results
+
+
+if __name__ == "__main__":
+    main()
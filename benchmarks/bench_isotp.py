@@ -0,0 +1,58 @@
+""" Bench_isotp
+
+    Throughput benchmark of CanIsoTpSocket on vcan0 with different option sets.
+    Requires vcan0 and the isotp kernel module.
+
+    Run from the repository root with python3 -m benchmarks.bench_isotp
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import time
+
+from threading import Thread
+
+from socketcan import CanIsoTpSocket, IsoTpFcOpts, IsoTpOpts
+from socketcan.socketcan import CAN_ISOTP_FRAME_TXTIME_ZERO
+
+OPTION_SETS = {
+    "kernel defaults": {},
+    "bs 0 stmin 0": {"fc_opts": IsoTpFcOpts(bs=0, stmin=0)},
+    "bs 0 stmin 0 no txtime": {"fc_opts": IsoTpFcOpts(bs=0, stmin=0),
+                               "opts": IsoTpOpts(frame_txtime=CAN_ISOTP_FRAME_TXTIME_ZERO)},
+    "bs 8 stmin 1ms": {"fc_opts": IsoTpFcOpts(bs=8, stmin=1)},
+}
+
+
+def measure(interface, kwargs, size, count):
+    """ return the throughput in bytes per second of count pdus of size bytes """
+    receiver = CanIsoTpSocket(interface=interface, rx_addr=0x7e8, tx_addr=0x7e0, **kwargs)
+    sender = CanIsoTpSocket(interface=interface, rx_addr=0x7e0, tx_addr=0x7e8, **kwargs)
+    data = memoryview(bytes(size))
+
+    def send():
+        for idx in range(count):
+            sender.send(data)
+
+    p = Thread(target=send)
+    start = time.perf_counter()
+    p.start()
+    for idx in range(count):
+        receiver.recv_view()
+    duration = time.perf_counter() - start
+    p.join()
+    return size * count / duration
+
+
+def main(interface="vcan0", size=4095, count=20):
+    results = []
+    for name, kwargs in OPTION_SETS.items():
+        results.append((name, measure(interface, kwargs, size, count)))
+
+    for name, result in results:
+        print("{0:24} {1:10.0f} bytes/s".format(name, result))
+    return results
+
+
+if __name__ == "__main__":
+    main()
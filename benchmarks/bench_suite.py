@@ -0,0 +1,286 @@
+""" Bench_suite
+
+    A reproducible benchmark suite that emits JSON, so results of different versions can be compared.
+
+    Covers CanFrame and BcmMsg encoding and decoding, the throughput on a VirtualBus and the rate of
+    the BusAnalyzer, which run everywhere,
+    and CanRawSocket round trip latency, sustained CanRawSocket throughput and CanIsoTpSocket throughput,
+    which require vcan0 and are skipped otherwise.
+
+    Run from the repository root with
+    python3 -m benchmarks.bench_suite --output results.json
+    python3 -m benchmarks.bench_suite --compare results.json
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import argparse
+import json
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+
+from threading import Thread
+
+from benchmarks.bench_isotp import OPTION_SETS, measure as measure_isotp
+from socketcan import BcmMsg, BcmOpCodes, BCMFlags, CanFrame, CanFrameBatch, CanRawSocket
+from socketcan.analyzer import BusAnalyzer
+from socketcan.virtual import VirtualBus
+
+# the default number of repetitions, the best is taken to reduce noise
+REPEAT = 5
+
+
+def per_call_ns(stmt: str,
+                namespace: dict,
+                number: int,
+                repeat: int = REPEAT) -> float:
+    """ return the best per call time in nanoseconds """
+    return min(timeit.repeat(stmt, globals=namespace, number=number, repeat=repeat)) / number * 1E9
+
+
+def bench_can_frame(number: int = 100000) -> dict:
+    """ CanFrame encoding and decoding """
+    frame = CanFrame(can_id=0x12345678, data=bytes(range(8)))
+    namespace = {"CanFrame": CanFrame, "frame": frame, "raw": frame.to_bytes(),
+                 "buffer": bytearray(CanFrame.get_size())}
+    return {"init_ns": per_call_ns("CanFrame(can_id=0x12345678, data=raw[8:])", namespace, number),
+            "to_bytes_ns": per_call_ns("frame.to_bytes()", namespace, number),
+            "from_bytes_ns": per_call_ns("CanFrame.from_bytes(raw)", namespace, number),
+            "pack_into_ns": per_call_ns("frame.pack_into(buffer)", namespace, number),
+            "unpack_from_ns": per_call_ns("CanFrame.unpack_from(buffer)", namespace, number),
+            }
+
+
+def bench_bcm_msg(nframes_list=(1, 16, 64, 256), number: int = 2000) -> dict:
+    """ BcmMsg encoding and decoding with a number of frames """
+    results = {}
+    for nframes in nframes_list:
+        frames = [CanFrame(can_id=0x123, data=bytes((idx & 0xFF,)) * 8) for idx in range(nframes)]
+        bcm = BcmMsg(opcode=BcmOpCodes.TX_SETUP,
+                     flags=(BCMFlags.SETTIMER | BCMFlags.STARTTIMER),
+                     can_id=0x123,
+                     frames=frames,
+                     ival2=0.1,
+                     )
+        namespace = {"BcmMsg": BcmMsg, "bcm": bcm, "raw": bytes(bcm.to_bytes())}
+        results[str(nframes)] = {"to_bytes_ns": per_call_ns("bcm.to_bytes()", namespace, number),
+                                 "from_bytes_ns": per_call_ns("BcmMsg.from_bytes(raw)", namespace, number),
+                                 }
+    return results
+
+
+def percentiles(values, points=(50, 90, 99, 99.9)) -> dict:
+    """ return the percentiles of values in microseconds """
+    values = sorted(values)
+    result = {}
+    for point in points:
+        idx = min(int(len(values) * point / 100), len(values) - 1)
+        result["p{0}_us".format(point)] = values[idx] * 1E6
+    result["mean_us"] = statistics.mean(values) * 1E6
+    return result
+
+
+def bench_raw_round_trip(interface: str, count: int = 10000) -> dict:
+    """ the latency from send on one CanRawSocket to recv on another """
+    tx = CanRawSocket(interface=interface)
+    rx = CanRawSocket(interface=interface)
+    frame = CanFrame(can_id=0x123, data=bytes(8))
+    latencies = []
+    for idx in range(count):
+        start = time.perf_counter()
+        tx.send(frame)
+        rx.recv()
+        latencies.append(time.perf_counter() - start)
+    return percentiles(latencies)
+
+
+def bench_raw_throughput(interface: str,
+                         count: int = 100000,
+                         batch_size: int = 64) -> dict:
+    """ the sustained rate of frames from send_batch on one CanRawSocket to recv_batch on another """
+    tx = CanRawSocket(interface=interface)
+    rx = CanRawSocket(interface=interface)
+    frames = [CanFrame(can_id=0x123, data=bytes(8))] * batch_size
+    received = 0
+
+    def receive():
+        nonlocal received
+        while received < count:
+            batch = rx.recv_batch(max_frames=batch_size, timeout=1)
+            if not batch:
+                break
+            received += len(batch)
+
+    p = Thread(target=receive)
+    start = time.perf_counter()
+    p.start()
+    for idx in range(0, count, batch_size):
+        tx.send_batch(frames, timeout=1, batch_size=batch_size)
+    p.join()
+    duration = time.perf_counter() - start
+    return {"frames": count,
+            "received": received,
+            "frames_per_s": received / duration,
+            }
+
+
+def bench_virtual_throughput(count: int = 100000,
+                             batch_size: int = 64) -> dict:
+    """ the rate of frames from send_batch to recv_batch on a VirtualBus, the cost of the library without the kernel """
+    with VirtualBus() as bus:
+        tx = bus.create_raw_socket()
+        rx = bus.create_raw_socket()
+        frames = [CanFrame(can_id=0x123, data=bytes(8))] * batch_size
+        received = 0
+        start = time.perf_counter()
+        for idx in range(count // batch_size):
+            tx.send_batch(frames, timeout=0, batch_size=batch_size)
+            received += len(rx.recv_batch(max_frames=batch_size, timeout=0))
+        duration = time.perf_counter() - start
+    return {"frames": (count // batch_size) * batch_size,
+            "received": received,
+            "frames_per_s": received / duration,
+            }
+
+
+def bench_analyzer(count: int = 100000,
+                   nids: int = 100,
+                   batch_size: int = 256) -> dict:
+    """ the rate of frames a BusAnalyzer takes per frame and per batch,
+        a saturated 1 Mbit bus carries about 7400 extended to 9000 standard frames with 8 bytes per second
+    """
+    frames = [CanFrame(can_id=0x100 + (idx % nids), data=bytes((idx // nids & 0xFF,)) * 8, timestamp=idx * 111E-6)
+              for idx in range(count)]
+    analyzer = BusAnalyzer(bitrate=1000000)
+    start = time.perf_counter()
+    analyzer.add_frames(frames)
+    duration = time.perf_counter() - start
+    results = {"frames": count,
+               "frames_per_s": count / duration,
+               "batch_frames_per_s": None,
+               }
+    try:
+        batches = [CanFrameBatch.from_frames(frames[idx:idx + batch_size],
+                                             timestamps=[frame.timestamp for frame in frames[idx:idx + batch_size]])
+                   for idx in range(0, count, batch_size)]
+        analyzer = BusAnalyzer(bitrate=1000000)
+        start = time.perf_counter()
+        for batch in batches:
+            analyzer.add_batch(batch)
+        results["batch_frames_per_s"] = count / (time.perf_counter() - start)
+    except ImportError:
+        # numpy is not installed
+        pass
+    return results
+
+
+def bench_isotp(interface: str,
+                sizes=(7, 64, 512, 4095),
+                count: int = 20) -> dict:
+    """ the throughput of CanIsoTpSocket with block size 0 and separation time 0 for different pdu sizes """
+    kwargs = OPTION_SETS["bs 0 stmin 0"]
+    return {str(size): {"bytes_per_s": measure_isotp(interface, kwargs, size, count)} for size in sizes}
+
+
+def is_interface_present(interface: str) -> bool:
+    """ check if a network interface exists """
+    try:
+        socket.if_nametoindex(interface)
+    except OSError:
+        return False
+    return True
+
+
+def get_version() -> str:
+    """ the git version of the working tree, the package has no version attribute """
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(interface: str = "vcan0") -> dict:
+    """ run all benchmarks
+
+        @param interface: the virtual interface for the socket benchmarks
+        @return: a dictionary of results and metadata, benchmarks that could not run are None
+    """
+    results = {"metadata": {"version": get_version(),
+                            "python": sys.version.split()[0],
+                            "implementation": platform.python_implementation(),
+                            "machine": platform.machine(),
+                            "kernel": platform.release(),
+                            "time": time.time(),
+                            },
+               "can_frame": bench_can_frame(),
+               "bcm_msg": bench_bcm_msg(),
+               "virtual_throughput": bench_virtual_throughput(),
+               "analyzer": bench_analyzer(),
+               "raw_round_trip": None,
+               "raw_throughput": None,
+               "isotp": None,
+               }
+    if is_interface_present(interface):
+        results["raw_round_trip"] = bench_raw_round_trip(interface)
+        results["raw_throughput"] = bench_raw_throughput(interface)
+        try:
+            results["isotp"] = bench_isotp(interface)
+        except OSError as e:
+            # the isotp module is not loaded
+            results["isotp"] = {"error": str(e)}
+    return results
+
+
+def flatten(results, prefix: str = "") -> dict:
+    """ flatten nested results into a dictionary of path to number """
+    flat = {}
+    if isinstance(results, dict):
+        for key, value in results.items():
+            if key != "metadata":
+                flat.update(flatten(value, "{0}{1}/".format(prefix, key)))
+    elif isinstance(results, (int, float)):
+        flat[prefix.rstrip("/")] = results
+    return flat
+
+
+def compare(baseline: dict, current: dict) -> list:
+    """ compare two results
+
+        @return: a list of tuples of path, baseline value, current value and ratio current / baseline
+    """
+    flat_baseline = flatten(baseline)
+    flat_current = flatten(current)
+    return [(path, flat_baseline[path], value, value / flat_baseline[path] if flat_baseline[path] else None)
+            for path, value in flat_current.items() if path in flat_baseline]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--interface", default="vcan0", help="the interface for the socket benchmarks")
+    parser.add_argument("--output", help="write the results to this file instead of stdout")
+    parser.add_argument("--compare", help="compare the results to those in this file")
+    args = parser.parse_args(argv)
+
+    results = run(interface=args.interface)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as fp:
+            fp.write(text)
+    elif not args.compare:
+        print(text)
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+        for path, old, new, ratio in compare(baseline, results):
+            print("{0:40} {1:14.1f} {2:14.1f} {3:8.2f}".format(path, old, new, ratio or 0))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -23,6 +23,7 @@ setuptools.setup(
         "Topic :: Software Development :: Embedded Systems",
     ],
     python_requires=">=3.7",
+    extras_require={"numpy": ["numpy"]},
     keywords="socketcan can"
 
 )
@@ -1 +1,5 @@
-from socketcan.socketcan import BCMFlags,BcmMsg,BcmOpCodes,CanFlags,CanFrame,CanRawSocket,CanIsoTpSocket,CanBcmSocket
\ No newline at end of file
+from socketcan.socketcan import (BCMFlags, BcmMsg, BcmOpCodes, BcmRxChanged, BcmRxEvent, BcmRxStatus, BcmRxTimeout,
+                                 CanErrorClass, CanFdFlags, CanFdFrame, CanFilter, CanFlags, CanFrame, CanFrameBatch,
+                                 CanRawSocket, FrameCache, FrozenCanFdFrame, FrozenCanFrame, CanIsoTpSocket,
+                                 CanJ1939Socket, J1939Filter, J1939Message, IsoTpFcOpts, IsoTpFlags, IsoTpLlOpts,
+                                 IsoTpOpts, CanBcmSocket, TimestampingOptions)
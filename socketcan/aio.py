@@ -0,0 +1,134 @@
+""" Aio
+
+    asyncio support for the socketcan sockets
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import asyncio
+import errno
+
+import logging
+logger = logging.getLogger("socketcan.aio")
+
+
+class AsyncCanSocket:
+    """ An asyncio wrapper for CanRawSocket, CanBcmSocket and CanIsoTpSocket
+
+        The wrapped socket is switched to non-blocking mode and the event loop
+        is told to watch its file descriptor, so many sockets can be serviced by
+        a single thread.
+
+        @param sock: a CanRawSocket, CanBcmSocket or CanIsoTpSocket
+        @param recv_kwargs: keyword arguments to the recv() of sock when iterating,
+                            e.g. bufsize for CanIsoTpSocket
+        @param enobufs_delay: the initial delay when the kernel tx queue is full
+        @param enobufs_max_delay: the upper limit of the delay, it doubles on every retry
+    """
+
+    def __init__(self,
+                 sock,
+                 recv_kwargs: dict = None,
+                 enobufs_delay: float = 0.001,
+                 enobufs_max_delay: float = 0.1,
+                 ):
+        self.sock = sock
+        self.sock.s.setblocking(False)
+        self.fd = self.sock.s.fileno()
+        if recv_kwargs is None:
+            recv_kwargs = {}
+        self.recv_kwargs = recv_kwargs
+        self.enobufs_delay = enobufs_delay
+        self.enobufs_max_delay = enobufs_max_delay
+        self.loop = None
+        self.readable = None
+        self.writable = None
+
+    def _get_loop(self):
+        """ bind to the running loop on first use """
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+            self.readable = asyncio.Event()
+            self.writable = asyncio.Event()
+        return self.loop
+
+    def _on_readable(self):
+        """ event loop callback """
+        self.loop.remove_reader(self.fd)
+        self.readable.set()
+
+    def _on_writable(self):
+        """ event loop callback """
+        self.loop.remove_writer(self.fd)
+        self.writable.set()
+
+    async def wait_readable(self):
+        """ wait until the socket is readable """
+        loop = self._get_loop()
+        if self.readable.is_set():
+            # the previous wake up has been consumed
+            self.readable.clear()
+        loop.add_reader(self.fd, self._on_readable)
+        await self.readable.wait()
+
+    async def wait_writable(self):
+        """ wait until the socket is writable """
+        loop = self._get_loop()
+        if self.writable.is_set():
+            # the previous wake up has been consumed
+            self.writable.clear()
+        loop.add_writer(self.fd, self._on_writable)
+        await self.writable.wait()
+
+    async def recv(self, *args, **kwargs):
+        """ receive from the socket, the arguments are passed to recv() of the wrapped socket """
+        while True:
+            try:
+                return self.sock.recv(*args, **kwargs)
+            except BlockingIOError:
+                await self.wait_readable()
+
+    async def recv_batch(self, max_frames: int = 64):
+        """ receive up to max_frames CAN frames, only for CanRawSocket
+
+            @param max_frames: the maximum number of frames to receive
+            @return: a list of CanFrames, at least one
+        """
+        while True:
+            frames = self.sock.recv_batch(max_frames=max_frames, timeout=0)
+            if frames:
+                return frames
+            await self.wait_readable()
+
+    async def send(self, *args, **kwargs):
+        """ send to the socket, the arguments are passed to send() of the wrapped socket
+
+            Waits for the socket to become writable if the socket buffer is full and
+            backs off with an increasing delay while the kernel returns ENOBUFS,
+            which is what a CAN interface does when its tx queue is full.
+        """
+        delay = self.enobufs_delay
+        while True:
+            try:
+                return self.sock.send(*args, **kwargs)
+            except BlockingIOError:
+                await self.wait_writable()
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    raise
+                logger.debug("tx queue full, retry in %f s", delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.enobufs_max_delay)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        """ iterate over the received objects """
+        return await self.recv(**self.recv_kwargs)
+
+    def close(self):
+        """ stop watching the socket """
+        if self.loop is not None:
+            self.loop.remove_reader(self.fd)
+            self.loop.remove_writer(self.fd)
@@ -0,0 +1,494 @@
+""" Analyzer
+
+    Bus load and per can id cycle time statistics of received frames.
+
+    The statistics are kept in array-backed tables with one row per can id,
+    each row takes the same amount of memory no matter how long the analyzer runs.
+    Bus load and rates are aggregated over a sliding window of fixed buckets.
+
+    Frame lengths in bits are calculated per ISO 11898-1, including the interframe space.
+    The worst case adds the maximum number of stuff bits, the nominal case none.
+    CAN FD frames are counted at the nominal bit rate, which overestimates frames with bit rate switch.
+
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import math
+import time
+
+from array import array
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+from socketcan.socketcan import CanFdFrame, CanFrame, CanFrameBatch, CAN_EFF_FLAG, CAN_EFF_MASK, CAN_FD_DLC_TO_LEN, \
+    CAN_RTR_FLAG, get_key
+
+try:
+    import numpy as np
+except ImportError:
+    # numpy is optional, only add_batch() needs it
+    np = None
+
+import logging
+logger = logging.getLogger("socketcan.analyzer")
+
+# the bits of a classic frame without data that are subject to bit stuffing, start of frame to the end of the crc
+STUFFED_BITS = {False: 34, True: 54}
+# the bits of a CAN FD frame without data that are subject to dynamic bit stuffing, start of frame to the dlc
+FD_STUFFED_BITS = {False: 22, True: 41}
+# crc delimiter, ack slot, ack delimiter, end of frame and interframe space
+TRAILER_BITS = 1 + 2 + 7 + 3
+# the stuff count of a CAN FD frame including its parity bit
+FD_STUFF_COUNT_BITS = 4
+
+
+def frame_bits(length: int,
+               extended: bool = False,
+               fd: bool = False,
+               worst_case: bool = True) -> int:
+    """ calculate the length of a frame on the bus in bits
+
+        @param length: the data length in bytes
+        @param extended: an extended can id with 29 bits
+        @param fd: a CAN FD frame
+        @param worst_case: add the maximum number of stuff bits, otherwise none
+        @return: the number of bits including the interframe space
+    """
+    if not fd:
+        stuffed = STUFFED_BITS[extended] + (8 * length)
+        bits = stuffed + TRAILER_BITS
+        if worst_case:
+            bits += (stuffed - 1) // 4
+        return bits
+    crc = 17 if length <= 16 else 21
+    stuffed = FD_STUFFED_BITS[extended] + (8 * length)
+    bits = stuffed + FD_STUFF_COUNT_BITS + crc + TRAILER_BITS
+    # the stuff count and the crc have a fixed stuff bit every 4 bits, stuffed or not
+    bits += math.ceil((FD_STUFF_COUNT_BITS + crc) / 4)
+    if worst_case:
+        bits += (stuffed - 1) // 4
+    return bits
+
+
+def get_bits_table(worst_case: bool) -> List[List[int]]:
+    """ helper to tabulate frame_bits() indexed by [extended + (2 * fd)][length] for lengths up to 64 """
+    return [[frame_bits(length, extended=bool(kind & 1), fd=bool(kind & 2), worst_case=worst_case)
+             for length in range(CAN_FD_DLC_TO_LEN[-1] + 1)]
+            for kind in range(4)]
+
+
+NOMINAL_BITS = get_bits_table(worst_case=False)
+WORST_CASE_BITS = get_bits_table(worst_case=True)
+
+
+class BusAnalyzer:
+    """ Track the bus load and the cycle times, lengths and payload changes of each can id
+
+        Feed it with received frames, they should have a timestamp, see CanRawSocket(timestamping=...),
+        otherwise the time of the call is taken.
+
+        The jitter histogram of a can id counts the relative deviation of each period from the expected period,
+        see set_expected_period(), or from the mean period up to then if none is set.
+
+        @param bitrate: the nominal bit rate of the bus in bits per second
+        @param window: the length of the sliding window for bus load and rates in seconds
+        @param nbuckets: the number of buckets the window is divided into, the window moves by one bucket
+        @param jitter_bounds: the upper bounds of the relative deviation of the jitter histogram,
+                              deviations above the last bound go into an extra bucket
+        @param capacity: the initial number of rows, the tables grow by doubling
+        @param clock: the time source for frames without timestamp and the end of the window for queries,
+                      it must match the timestamps of the frames
+    """
+
+    def __init__(self,
+                 bitrate: int = 500000,
+                 window: float = 1,
+                 nbuckets: int = 10,
+                 jitter_bounds: Sequence[float] = (0.01, 0.05, 0.1, 0.25, 0.5),
+                 capacity: int = 64,
+                 clock: Callable[[], float] = time.time,
+                 ):
+        self.bitrate = bitrate
+        self.window = window
+        self.nbuckets = nbuckets
+        self.bucket_width = window / nbuckets
+        self.jitter_bounds = list(jitter_bounds)
+        self.nbins = len(self.jitter_bounds) + 1
+        self.clock = clock
+        self.rows: Dict[int, int] = {}
+        self.keys: List[int] = []
+        self.last_data: List[Optional[bytes]] = []
+        self.capacity = 0
+        self.grow(max(capacity, 1))
+        self.reset()
+
+    def grow(self, capacity: int):
+        """ extend the tables to a capacity of rows, the existing rows are copied """
+        extra = capacity - self.capacity
+        if extra <= 0:
+            return
+        if not self.capacity:
+            self.counts = array("Q")
+            self.last_ts = array("d")
+            self.min_period = array("d")
+            self.max_period = array("d")
+            self.sum_period = array("d")
+            self.sum_sq_period = array("d")
+            self.nperiods = array("Q")
+            self.expected = array("d")
+            self.lengths = array("B")
+            self.length_changes = array("Q")
+            self.payload_changes = array("Q")
+            self.jitter = array("Q")
+            self.window_counts = array("Q")
+        # concatenation creates new arrays, so numpy views of the old ones do not block the growth
+        self.counts = self.counts + array("Q", bytes(8 * extra))
+        self.last_ts = self.last_ts + array("d", [math.nan]) * extra
+        self.min_period = self.min_period + array("d", [math.inf]) * extra
+        self.max_period = self.max_period + array("d", bytes(8 * extra))
+        self.sum_period = self.sum_period + array("d", bytes(8 * extra))
+        self.sum_sq_period = self.sum_sq_period + array("d", bytes(8 * extra))
+        self.nperiods = self.nperiods + array("Q", bytes(8 * extra))
+        self.expected = self.expected + array("d", bytes(8 * extra))
+        self.lengths = self.lengths + array("B", bytes(extra))
+        self.length_changes = self.length_changes + array("Q", bytes(8 * extra))
+        self.payload_changes = self.payload_changes + array("Q", bytes(8 * extra))
+        self.jitter = self.jitter + array("Q", bytes(8 * extra * self.nbins))
+        self.window_counts = self.window_counts + array("Q", bytes(8 * extra * self.nbuckets))
+        self.capacity = capacity
+        self.zero_column = array("Q", bytes(8 * capacity))
+
+    def reset(self):
+        """ clear all statistics, the expected periods are kept """
+        expected = {key: self.expected[row] for key, row in self.rows.items() if self.expected[row]}
+        capacity = self.capacity
+        self.rows = {}
+        self.keys = []
+        self.last_data = []
+        self.capacity = 0
+        self.grow(capacity)
+        self.bucket = None
+        self.bus_frames = array("Q", bytes(8 * self.nbuckets))
+        self.bus_bits = array("Q", bytes(8 * self.nbuckets))
+        self.bus_worst_bits = array("Q", bytes(8 * self.nbuckets))
+        self.frames = 0
+        self.bits = 0
+        self.worst_bits = 0
+        for key, period in expected.items():
+            self.expected[self.get_row(key)] = period
+
+    def get_row(self, key: int) -> int:
+        """ get the row of a key, a new row is added for an unknown key """
+        row = self.rows.get(key)
+        if row is None:
+            row = len(self.keys)
+            if row == self.capacity:
+                self.grow(2 * self.capacity)
+            self.rows[key] = row
+            self.keys.append(key)
+            self.last_data.append(None)
+        return row
+
+    def set_expected_period(self,
+                            can_id: int,
+                            period: float,
+                            extended: bool = None):
+        """ set the period a can id is supposed to have, the jitter is measured against it
+
+            @param can_id: the can id
+            @param period: the period in seconds, 0 to measure against the mean period
+            @param extended: the frame format, None for extended if the can id exceeds 11 bits
+        """
+        self.expected[self.get_row(get_key(can_id, extended))] = period
+
+    def advance(self, timestamp: float) -> Optional[int]:
+        """ move the window to a timestamp
+
+            @param timestamp: the time in seconds
+            @return: the bucket slot of the timestamp, None if it is older than the window
+        """
+        bucket = int(timestamp // self.bucket_width)
+        current = self.bucket
+        nbuckets = self.nbuckets
+        if current is None or bucket - current >= nbuckets:
+            self.clear_buckets(range(nbuckets))
+            self.bucket = bucket
+        elif bucket > current:
+            self.clear_buckets(idx % nbuckets for idx in range(current + 1, bucket + 1))
+            self.bucket = bucket
+        elif bucket <= current - nbuckets:
+            return None
+        return bucket % nbuckets
+
+    def clear_buckets(self, slots: Iterable[int]):
+        """ zero bucket slots of the bus and of all rows """
+        nbuckets = self.nbuckets
+        for slot in slots:
+            self.bus_frames[slot] = 0
+            self.bus_bits[slot] = 0
+            self.bus_worst_bits[slot] = 0
+            self.window_counts[slot::nbuckets] = self.zero_column
+
+    def add(self,
+            frame: CanFrame,
+            timestamp: float = None):
+        """ add a received frame
+
+            @param frame: a CanFrame or CanFdFrame
+            @param timestamp: the receive time, defaults to the timestamp of the frame or the current time
+        """
+        if timestamp is None:
+            timestamp = frame.timestamp
+            if timestamp is None:
+                timestamp = self.clock()
+        extended = bool(frame.flags & CAN_EFF_FLAG)
+        kind = extended + (2 * isinstance(frame, CanFdFrame))
+        length = len(frame.data)
+        # the data of a remote frame only holds its dlc, there are no data bits on the bus
+        bit_length = 0 if frame.flags & CAN_RTR_FLAG else length
+        row = self.get_row(frame.can_id | (frame.flags & CAN_EFF_FLAG))
+        self.add_bits(row, timestamp, NOMINAL_BITS[kind][bit_length], WORST_CASE_BITS[kind][bit_length])
+        self.add_period(row, timestamp)
+        self.counts[row] += 1
+        if self.counts[row] > 1:
+            if length != self.lengths[row]:
+                self.length_changes[row] += 1
+            if frame.data != self.last_data[row]:
+                self.payload_changes[row] += 1
+        self.lengths[row] = length
+        self.last_data[row] = frame.data
+
+    def add_frames(self, frames: Iterable[CanFrame]):
+        """ add received frames, e.g. the return value of CanRawSocket.recv_batch() """
+        for frame in frames:
+            self.add(frame)
+
+    def add_bits(self,
+                 row: int,
+                 timestamp: float,
+                 bits: int,
+                 worst_bits: int):
+        """ account a frame in the totals and the window """
+        self.frames += 1
+        self.bits += bits
+        self.worst_bits += worst_bits
+        slot = self.advance(timestamp)
+        if slot is not None:
+            self.bus_frames[slot] += 1
+            self.bus_bits[slot] += bits
+            self.bus_worst_bits[slot] += worst_bits
+            self.window_counts[(row * self.nbuckets) + slot] += 1
+
+    def add_period(self,
+                   row: int,
+                   timestamp: float):
+        """ account the period since the previous frame of a row """
+        last = self.last_ts[row]
+        self.last_ts[row] = timestamp
+        if math.isnan(last):
+            return
+        period = timestamp - last
+        nperiods = self.nperiods[row]
+        expected = self.expected[row]
+        if not expected and nperiods:
+            expected = self.sum_period[row] / nperiods
+        if expected:
+            deviation = abs(period - expected) / expected
+            self.jitter[(row * self.nbins) + bisect_left(self.jitter_bounds, deviation)] += 1
+        if period < self.min_period[row]:
+            self.min_period[row] = period
+        if period > self.max_period[row]:
+            self.max_period[row] = period
+        self.sum_period[row] += period
+        self.sum_sq_period[row] += period * period
+        self.nperiods[row] = nperiods + 1
+
+    def add_batch(self, batch: CanFrameBatch):
+        """ add a batch of received classic frames with vectorized operations, requires numpy
+
+            The timestamps of the batch are used if it has any, otherwise the current time for all frames.
+            The jitter of frames without expected period is measured against the mean period before the batch.
+
+            @param batch: a CanFrameBatch, e.g. the return value of CanRawSocket.recv_frame_batch()
+        """
+        if np is None:
+            raise ImportError("add_batch requires numpy")
+        nframes = len(batch)
+        if not nframes:
+            return
+        if batch.timestamps is None:
+            timestamps = np.full(nframes, self.clock())
+        else:
+            # a missing timestamp becomes nan
+            timestamps = np.asarray(batch.timestamps, dtype=np.float64)
+            timestamps[np.isnan(timestamps)] = self.clock()
+        raw_ids = batch.records["can_id_w_flags"]
+        keys, inverse = np.unique(raw_ids & (CAN_EFF_MASK | CAN_EFF_FLAG), return_inverse=True)
+        # all new rows are added before the tables are viewed, growing replaces the arrays
+        rows = np.array([self.get_row(key) for key in keys.tolist()], dtype=np.intp)[inverse.ravel()]
+        lengths = batch.dlc.astype(np.intp)
+        extended = ((raw_ids & CAN_EFF_FLAG) != 0).astype(np.intp)
+        bit_lengths = np.where((raw_ids & CAN_RTR_FLAG) != 0, 0, lengths)
+        bits = np.asarray(NOMINAL_BITS[:2], dtype=np.uint64)[extended, bit_lengths]
+        worst_bits = np.asarray(WORST_CASE_BITS[:2], dtype=np.uint64)[extended, bit_lengths]
+        self.add_batch_bits(rows, timestamps, bits, worst_bits)
+        order = np.lexsort((timestamps, rows))
+        self.add_batch_periods(rows[order], timestamps[order])
+        self.add_batch_changes(rows[order], lengths[order], batch.data[order])
+
+    def add_batch_bits(self, rows, timestamps, bits, worst_bits):
+        """ account a batch in the totals and the window """
+        self.frames += len(rows)
+        self.bits += int(bits.sum())
+        self.worst_bits += int(worst_bits.sum())
+        self.advance(float(timestamps.max()))
+        buckets = np.floor_divide(timestamps, self.bucket_width).astype(np.int64)
+        valid = buckets > (self.bucket - self.nbuckets)
+        slots = buckets[valid] % self.nbuckets
+        np.add.at(np.frombuffer(self.bus_frames, dtype=np.uint64), slots, 1)
+        np.add.at(np.frombuffer(self.bus_bits, dtype=np.uint64), slots, bits[valid])
+        np.add.at(np.frombuffer(self.bus_worst_bits, dtype=np.uint64), slots, worst_bits[valid])
+        np.add.at(np.frombuffer(self.window_counts, dtype=np.uint64), (rows[valid] * self.nbuckets) + slots, 1)
+
+    def add_batch_periods(self, rows, timestamps):
+        """ account the periods of a batch that is sorted by row and time """
+        last_ts = np.frombuffer(self.last_ts)
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = rows[1:] != rows[:-1]
+        last = np.ones(len(rows), dtype=bool)
+        last[:-1] = first[1:]
+        previous = np.empty_like(timestamps)
+        previous[1:] = timestamps[:-1]
+        previous[first] = last_ts[rows[first]]
+        last_ts[rows[last]] = timestamps[last]
+        periods = timestamps - previous
+        valid = ~np.isnan(periods)
+        rows = rows[valid]
+        periods = periods[valid]
+        sum_period = np.frombuffer(self.sum_period)
+        nperiods = np.frombuffer(self.nperiods, dtype=np.uint64)
+        expected = np.frombuffer(self.expected)[rows]
+        counted = nperiods[rows]
+        mean = np.divide(sum_period[rows], counted, out=np.zeros(len(rows)), where=counted > 0)
+        expected = np.where(expected > 0, expected, mean)
+        has_expected = expected > 0
+        deviations = np.abs(periods[has_expected] - expected[has_expected]) / expected[has_expected]
+        bins = np.searchsorted(self.jitter_bounds, deviations, side="left")
+        np.add.at(np.frombuffer(self.jitter, dtype=np.uint64), (rows[has_expected] * self.nbins) + bins, 1)
+        np.minimum.at(np.frombuffer(self.min_period), rows, periods)
+        np.maximum.at(np.frombuffer(self.max_period), rows, periods)
+        np.add.at(sum_period, rows, periods)
+        np.add.at(np.frombuffer(self.sum_sq_period), rows, periods * periods)
+        np.add.at(nperiods, rows, 1)
+
+    def add_batch_changes(self, rows, lengths, data):
+        """ account the frame counts and the length and payload changes of a batch that is sorted by row and time """
+        counts = np.frombuffer(self.counts, dtype=np.uint64)
+        last_lengths = np.frombuffer(self.lengths, dtype=np.uint8)
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = rows[1:] != rows[:-1]
+        last = np.ones(len(rows), dtype=bool)
+        last[:-1] = first[1:]
+        # the first frame of a row is compared with the last frame of the previous call if there was one
+        seen = ~first
+        seen[first] = counts[rows[first]] > 0
+        previous_lengths = np.empty_like(lengths)
+        previous_lengths[1:] = lengths[:-1]
+        previous_lengths[first] = last_lengths[rows[first]]
+        length_changed = lengths != previous_lengths
+        payload_changed = np.zeros(len(rows), dtype=bool)
+        payload_changed[1:] = np.any(data[1:] != data[:-1], axis=1)
+        for idx in np.flatnonzero(first & seen).tolist():
+            payload_changed[idx] = bytes(data[idx][:lengths[idx]]) != self.last_data[rows[idx]]
+        payload_changed |= length_changed
+        np.add.at(np.frombuffer(self.length_changes, dtype=np.uint64), rows[seen & length_changed], 1)
+        np.add.at(np.frombuffer(self.payload_changes, dtype=np.uint64), rows[seen & payload_changed], 1)
+        np.add.at(counts, rows, 1)
+        last_lengths[rows[last]] = lengths[last]
+        for idx in np.flatnonzero(last).tolist():
+            self.last_data[rows[idx]] = bytes(data[idx][:lengths[idx]])
+
+    def get_bus_load(self, worst_case: bool = False) -> float:
+        """ the bus load over the window up to the time of the clock, including the current bucket
+
+            @param worst_case: with the maximum number of stuff bits, otherwise without stuff bits
+            @return: the share of the bit rate that is used, 1.0 is a saturated bus
+        """
+        # a silent bus does not move the window by itself
+        self.advance(self.clock())
+        bits = self.bus_worst_bits if worst_case else self.bus_bits
+        return sum(bits) / (self.bitrate * self.window)
+
+    def get_stats(self,
+                  can_id: int,
+                  extended: bool = None) -> Optional[dict]:
+        """ the statistics of a can id
+
+            @param can_id: the can id
+            @param extended: the frame format, None for extended if the can id exceeds 11 bits
+            @return: a dictionary, None if the can id was not received
+        """
+        row = self.rows.get(get_key(can_id, extended))
+        if row is None or not self.counts[row]:
+            return None
+        self.advance(self.clock())
+        return self.get_row_stats(row)
+
+    def get_row_stats(self, row: int) -> dict:
+        """ the statistics of a row """
+        nperiods = self.nperiods[row]
+        mean = stdev = min_period = max_period = None
+        if nperiods:
+            mean = self.sum_period[row] / nperiods
+            stdev = math.sqrt(max((self.sum_sq_period[row] / nperiods) - (mean * mean), 0))
+            min_period = self.min_period[row]
+            max_period = self.max_period[row]
+        nbuckets = self.nbuckets
+        return {"can_id": self.keys[row] & CAN_EFF_MASK,
+                "extended": bool(self.keys[row] & CAN_EFF_FLAG),
+                "count": self.counts[row],
+                "rate": sum(self.window_counts[row * nbuckets:(row + 1) * nbuckets]) / self.window,
+                "min_period": min_period,
+                "mean_period": mean,
+                "max_period": max_period,
+                "jitter": stdev,
+                "expected_period": self.expected[row] or None,
+                "jitter_histogram": list(self.jitter[row * self.nbins:(row + 1) * self.nbins]),
+                "length_changes": self.length_changes[row],
+                "payload_changes": self.payload_changes[row],
+                "last_timestamp": self.last_ts[row],
+                }
+
+    def check_periods(self,
+                      tolerance: float = 0.1,
+                      now: float = None) -> List[dict]:
+        """ find the can ids with an expected period that were late
+
+            @param tolerance: the allowed relative deviation from the expected period
+            @param now: the current time to also catch can ids that stopped, None to only check received periods
+            @return: the statistics of the can ids whose longest period or silence exceeds the tolerance
+        """
+        late = []
+        for row in range(len(self.keys)):
+            expected = self.expected[row]
+            if not expected:
+                continue
+            longest = self.max_period[row]
+            if now is not None and not math.isnan(self.last_ts[row]):
+                longest = max(longest, now - self.last_ts[row])
+            if longest > expected * (1 + tolerance) or not self.counts[row]:
+                late.append(self.get_row_stats(row))
+        return late
+
+    def snapshot(self) -> dict:
+        """ return all statistics as a dictionary, e.g. for logging or export, the window ends at the clock """
+        self.advance(self.clock())
+        return {"frames": self.frames,
+                "bits": self.bits,
+                "worst_case_bits": self.worst_bits,
+                "bus_load": self.get_bus_load(),
+                "bus_load_worst_case": self.get_bus_load(worst_case=True),
+                "frames_per_s": sum(self.bus_frames) / self.window,
+                "ids": [self.get_row_stats(row) for row in range(len(self.keys)) if self.counts[row]],
+                }
@@ -0,0 +1,253 @@
+""" Bus
+
+    A multiplexer that serves many interfaces and many consumers from a single thread
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import selectors
+
+from queue import Queue, Full, Empty
+from threading import Event, Lock, Thread
+from typing import Callable, Iterable, Optional, Tuple
+
+from socketcan.socketcan import CanFrame, CanRawSocket, CAN_EFF_FLAG, get_key
+
+import logging
+logger = logging.getLogger("socketcan.bus")
+
+
+class Subscription:
+    """ A subscriber of a CanBus
+
+        Frames are put into a bounded queue as (interface, frame) tuples or passed to a callback.
+        If the queue is full, the frame is dropped and counted, so a slow subscriber
+        does not stall the others.
+
+        @param can_ids: the can_ids to receive, None for all, can_ids above 0x7FF are extended,
+                        an extended can_id up to 0x7FF needs CAN_EFF_FLAG
+        @param interface: the interface to receive from, None for all
+        @param callback: a function that is called with interface and frame instead of queueing
+        @param maxsize: the size of the queue
+    """
+
+    def __init__(self,
+                 can_ids: Optional[Iterable[int]] = None,
+                 interface: Optional[str] = None,
+                 callback: Optional[Callable[[str, CanFrame], None]] = None,
+                 maxsize: int = 1024,
+                 ):
+        self.can_ids = None
+        if can_ids is not None:
+            # standard and extended frames of the same can_id are different messages
+            self.can_ids = frozenset(get_key(can_id) for can_id in can_ids)
+        self.interface = interface
+        self.callback = callback
+        self.queue = Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def put(self, interface: str, frame: CanFrame):
+        """ deliver a frame to the subscriber """
+        if self.callback is not None:
+            self.callback(interface, frame)
+            return
+        try:
+            self.queue.put_nowait((interface, frame))
+        except Full:
+            self.dropped += 1
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Tuple[str, CanFrame]]:
+        """ get the next frame from the queue
+
+            @param timeout: the time to wait, None blocks forever
+            @return: a tuple of interface and frame or None on timeout
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def matches(self, interface: str) -> bool:
+        """ check if the subscription receives from interface """
+        return (self.interface is None) or (self.interface == interface)
+
+
+class CanBus:
+    """ A multiplexer for many CAN interfaces and many subscribers
+
+        The bus owns one CanRawSocket per interface and waits on all of them with a
+        single selector, epoll on linux. Frames are routed with a lookup table
+        that maps can_id, with CAN_EFF_FLAG for extended frames, to a tuple of subscriptions, one per interface.
+        The tables are rebuilt when subscribing or unsubscribing,
+        so dispatching a frame is a single dict lookup regardless of the number of subscribers.
+
+        @param interfaces: the interface names
+        @param fd: enable CAN FD frames on the sockets
+        @param max_frames: the maximum number of frames to read from a socket at once
+    """
+
+    def __init__(self,
+                 interfaces: Iterable[str] = (),
+                 fd: bool = False,
+                 max_frames: int = 64,
+                 ):
+        self.fd = fd
+        self.max_frames = max_frames
+        self.selector = selectors.DefaultSelector()
+        self.sockets = {}
+        self.subscriptions = []
+        self.routes = {}
+        # serializes changes of the sockets, subscriptions and routes, dispatching reads routes without it
+        self.lock = Lock()
+        self.thread = None
+        self.stop_event = Event()
+        for interface in interfaces:
+            self.add_interface(interface)
+
+    def add_interface(self,
+                      interface: str,
+                      sock: CanRawSocket = None):
+        """ add an interface to the bus
+
+            @param interface: the interface name
+            @param sock: an already opened socket, a CanRawSocket is created if None
+        """
+        with self.lock:
+            if interface in self.sockets:
+                raise ValueError("Interface {0} is already on the bus".format(interface))
+            if sock is None:
+                sock = CanRawSocket(interface=interface, fd=self.fd)
+            self.sockets[interface] = sock
+            # the routes must exist before the dispatch thread can see the socket
+            self._rebuild_routes()
+            self.selector.register(sock.s, selectors.EVENT_READ, data=(interface, sock))
+
+    def subscribe(self,
+                  can_ids: Optional[Iterable[int]] = None,
+                  interface: Optional[str] = None,
+                  callback: Optional[Callable[[str, CanFrame], None]] = None,
+                  maxsize: int = 1024) -> Subscription:
+        """ subscribe to frames
+
+            @param can_ids: the can_ids to receive, None for all
+            @param interface: the interface to receive from, None for all
+            @param callback: a function that is called with interface and frame in the dispatch thread
+            @param maxsize: the size of the queue if there is no callback
+            @return: the Subscription
+        """
+        subscription = Subscription(can_ids=can_ids,
+                                    interface=interface,
+                                    callback=callback,
+                                    maxsize=maxsize)
+        with self.lock:
+            self.subscriptions = self.subscriptions + [subscription]
+            self._rebuild_routes()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """ remove a subscription
+
+            @param subscription: the Subscription returned by subscribe()
+        """
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+            subscriptions.remove(subscription)
+            self.subscriptions = subscriptions
+            self._rebuild_routes()
+
+    def rebuild_routes(self):
+        """ rebuild the lookup tables
+
+            A table maps can_id to the subscriptions for that can_id including those
+            for all can_ids, key None holds the subscriptions for all can_ids.
+            The tables are replaced as a whole, so a concurrent dispatch sees either the old or the new table.
+        """
+        with self.lock:
+            self._rebuild_routes()
+
+    def _rebuild_routes(self):
+        """ rebuild the lookup tables, the caller holds the lock """
+        routes = {}
+        for interface in self.sockets:
+            subscriptions = [subscription for subscription in self.subscriptions if subscription.matches(interface)]
+            table = {}
+            for subscription in subscriptions:
+                for can_id in (subscription.can_ids or ()):
+                    table[can_id] = None
+            for can_id in table:
+                table[can_id] = tuple(subscription for subscription in subscriptions
+                                      if (subscription.can_ids is None) or (can_id in subscription.can_ids))
+            table[None] = tuple(subscription for subscription in subscriptions if subscription.can_ids is None)
+            routes[interface] = table
+        self.routes = routes
+
+    def dispatch(self,
+                 interface: str,
+                 frames: Iterable[CanFrame]):
+        """ route frames to the subscribers
+
+            @param interface: the interface the frames were received from
+            @param frames: the frames
+        """
+        table = self.routes[interface]
+        default = table[None]
+        for frame in frames:
+            for subscription in table.get(frame.can_id | (frame.flags & CAN_EFF_FLAG), default):
+                subscription.put(interface, frame)
+
+    def poll(self, timeout: Optional[float] = None) -> int:
+        """ wait for frames on all interfaces and dispatch them
+
+            @param timeout: the time to wait, None blocks forever
+            @return: the number of frames dispatched
+        """
+        count = 0
+        for key, events in self.selector.select(timeout):
+            interface, sock = key.data
+            frames = sock.recv_batch(max_frames=self.max_frames, timeout=0)
+            self.dispatch(interface, frames)
+            count += len(frames)
+        return count
+
+    def send(self,
+             interface: str,
+             frame: CanFrame):
+        """ send a frame on an interface
+
+            @param interface: the interface name
+            @param frame: the frame
+        """
+        return self.sockets[interface].send(frame)
+
+    def run(self, poll_interval: float = 0.1):
+        """ dispatch until stop() is called
+
+            @param poll_interval: the time to wait before checking for stop
+        """
+        while not self.stop_event.is_set():
+            self.poll(timeout=poll_interval)
+
+    def start(self, poll_interval: float = 0.1):
+        """ start a thread that dispatches
+
+            @param poll_interval: the time to wait before checking for stop
+        """
+        self.stop_event.clear()
+        self.thread = Thread(target=self.run, kwargs={"poll_interval": poll_interval}, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """ stop the dispatching thread """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def close(self):
+        """ stop dispatching and unregister all sockets """
+        self.stop()
+        for sock in self.sockets.values():
+            self.selector.unregister(sock.s)
+        self.selector.close()
+        self.sockets = {}
+        self.routes = {}
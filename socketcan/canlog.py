@@ -0,0 +1,437 @@
+""" Canlog
+
+    Streaming log file writers and readers for CAN frames
+
+    Two formats are supported, the text format of "candump -l"
+    and a compact binary format of fixed size records, a timestamp
+    followed by the can_frame in CanFrame.FORMAT.
+
+    The readers memory map the file and create the frames lazily,
+    so logs larger than memory can be iterated or sliced by time range.
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import math
+import mmap
+import struct
+import time
+
+from typing import Iterator, Tuple
+
+from socketcan.socketcan import CanFdFrame, CanFlags, CanFrame
+
+import logging
+logger = logging.getLogger("socketcan.canlog")
+
+
+def format_candump_frame(frame: CanFrame) -> str:
+    """ helper to format a frame the way candump and cansend do, e.g. 123#DEADBEEF
+
+        @param frame: a CanFrame or CanFdFrame
+        @return: the frame as string
+    """
+    if frame.flags & CanFlags.CAN_ERR_FLAG:
+        can_id = "{0:08X}".format(frame.can_id | CanFlags.CAN_ERR_FLAG)
+    elif frame.flags & CanFlags.CAN_EFF_FLAG:
+        can_id = "{0:08X}".format(frame.can_id)
+    else:
+        can_id = "{0:03X}".format(frame.can_id)
+    if isinstance(frame, CanFdFrame):
+        return "{0}##{1:X}{2}".format(can_id, frame.fd_flags, frame.data.hex().upper())
+    if frame.flags & CanFlags.CAN_RTR_FLAG:
+        if frame.data:
+            return "{0}#R{1}".format(can_id, len(frame.data))
+        return "{0}#R".format(can_id)
+    return "{0}#{1}".format(can_id, frame.data.hex().upper())
+
+
+def parse_candump_frame(frame_repr: str) -> CanFrame:
+    """ helper to parse a frame the way candump and cansend format it, e.g. 123#DEADBEEF
+
+        A 3 digit can_id is a standard id, an 8 digit can_id is an extended id
+        or an error frame if the CAN_ERR_FLAG bit is set.
+
+        @param frame_repr: the frame as string
+        @return: a CanFrame or a CanFdFrame
+    """
+    can_id_repr, _, data_repr = frame_repr.partition("#")
+    can_id = int(can_id_repr, 16)
+    flags = 0
+    if len(can_id_repr) == 8:
+        flags = can_id & 0xE0000000
+        can_id = can_id & 0x1FFFFFFF
+        if not (flags & CanFlags.CAN_ERR_FLAG):
+            flags = flags | CanFlags.CAN_EFF_FLAG
+    if data_repr.startswith("#"):
+        if len(data_repr) < 2:
+            raise ValueError("Missing the flags of a can fd frame {0}".format(frame_repr))
+        return CanFdFrame(can_id=can_id,
+                          flags=flags,
+                          fd_flags=int(data_repr[1], 16),
+                          data=bytes.fromhex(data_repr[2:]))
+    if data_repr.startswith("R"):
+        return CanFrame(can_id=can_id,
+                        flags=flags | CanFlags.CAN_RTR_FLAG,
+                        data=bytes(int(data_repr[1:] or "0")))
+    return CanFrame(can_id=can_id,
+                    flags=flags,
+                    data=bytes.fromhex(data_repr.replace(".", "")))
+
+
+def format_candump_line(frame: CanFrame, interface: str, timestamp: float) -> str:
+    """ helper to format a line of a candump log, e.g. (1600000000.123456) can0 123#DEADBEEF """
+    return "({0:.6f}) {1} {2}\n".format(timestamp, interface, format_candump_frame(frame))
+
+
+def parse_candump_line(line) -> Tuple[str, CanFrame]:
+    """ helper to parse a line of a candump log
+
+        @param line: the line as str or bytes
+        @return: a tuple of interface and CanFrame with timestamp set
+    """
+    if isinstance(line, (bytes, bytearray)):
+        line = line.decode("ascii")
+    timestamp_repr, interface, frame_repr = line.split()[:3]
+    frame = parse_candump_frame(frame_repr)
+    frame.timestamp = float(timestamp_repr.strip("()"))
+    return interface, frame
+
+
+class CandumpLogWriter:
+    """ A writer for the text format of candump -l
+
+        @param filepath: the path of the log file
+        @param interface: the interface name written to each line
+        @param buffer_size: the size of the write buffer in bytes
+    """
+
+    def __init__(self,
+                 filepath: str,
+                 interface: str = "can0",
+                 buffer_size: int = 1024 * 1024,
+                 ):
+        self.interface = interface
+        self.f = open(filepath, "w", buffering=buffer_size)
+
+    def write(self, frame: CanFrame, interface: str = None):
+        """ write a frame to the log
+
+            @param frame: a CanFrame or CanFdFrame, its timestamp is written or the current time if it has none
+            @param interface: the interface name, defaults to the interface of the writer
+        """
+        timestamp = frame.timestamp
+        if timestamp is None:
+            timestamp = time.time()
+        self.f.write(format_candump_line(frame=frame,
+                                         interface=interface or self.interface,
+                                         timestamp=timestamp))
+
+    def write_frames(self, frames):
+        """ write many frames to the log """
+        for frame in frames:
+            self.write(frame)
+
+    def flush(self):
+        """ flush the write buffer to the file """
+        self.f.flush()
+
+    def close(self):
+        """ close the log file """
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class CandumpLogReader:
+    """ A reader for the text format of candump -l
+
+        The file is memory mapped and parsed line by line on demand.
+        The lines are expected in time order for between(), lines that do not parse are skipped.
+
+        @param filepath: the path of the log file
+    """
+
+    def __init__(self,
+                 filepath: str,
+                 ):
+        self.f = open(filepath, "rb")
+        self.mm = None
+        try:
+            if self.f.seek(0, 2):
+                self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self.f.close()
+            raise
+
+    def iter_lines(self, offset: int = 0) -> Iterator[Tuple[str, CanFrame]]:
+        """ iterate over the lines of the log
+
+            @param offset: the byte offset of the line to start with
+            @return: an iterator over tuples of interface and CanFrame
+        """
+        mm = self.mm
+        if mm is None:
+            return
+        size = len(mm)
+        while offset < size:
+            end = mm.find(b"\n", offset)
+            if end < 0:
+                end = size
+            line = mm[offset:end]
+            offset = end + 1
+            if not line.strip():
+                continue
+            try:
+                parsed = parse_candump_line(line)
+            except ValueError:
+                logger.warning("skipping line that does not parse %s", line)
+                continue
+            yield parsed
+
+    def __iter__(self) -> Iterator[CanFrame]:
+        """ iterate over the frames of the log, the timestamp of each frame is set """
+        for interface, frame in self.iter_lines():
+            yield frame
+
+    def _timestamp_at(self, offset: int) -> Tuple[float, int]:
+        """ return the timestamp of the first line at or after offset that has one and the offset of the next line,
+            inf and the size of the file if there is none
+        """
+        mm = self.mm
+        size = len(mm)
+        while offset < size:
+            end = mm.find(b"\n", offset)
+            if end < 0:
+                end = size
+            fields = mm[offset:end].split(maxsplit=1)
+            try:
+                return float(fields[0].strip(b"()")), end + 1
+            except (IndexError, ValueError):
+                # a blank or broken line
+                offset = end + 1
+        return math.inf, size
+
+    def find(self, timestamp: float) -> int:
+        """ binary search the byte offset of the first line with a timestamp not before timestamp """
+        if self.mm is None:
+            return 0
+        lo = 0
+        hi = len(self.mm)
+        while lo < hi:
+            offset = max(lo, self.mm.rfind(b"\n", 0, (lo + hi) // 2) + 1)
+            line_timestamp, next_offset = self._timestamp_at(offset)
+            if line_timestamp < timestamp:
+                lo = next_offset
+            else:
+                hi = offset
+        return lo
+
+    def between(self, start: float, stop: float) -> Iterator[CanFrame]:
+        """ iterate over the frames with start <= timestamp < stop """
+        if self.mm is None:
+            return
+        for interface, frame in self.iter_lines(offset=self.find(start)):
+            if frame.timestamp >= stop:
+                break
+            yield frame
+
+    def close(self):
+        """ close the log file """
+        if self.mm is not None:
+            self.mm.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class BinaryLogHeader:
+    """ The header of a binary log file
+
+        @param record_size: the size of a record, a timestamp plus a can_frame
+        @param version: the version of the file format
+    """
+
+    FORMAT = "8sII"
+    STRUCT = struct.Struct(FORMAT)
+    MAGIC = b"SCANLOG\x00"
+
+    def __init__(self,
+                 record_size: int,
+                 version: int = 1,
+                 ):
+        self.record_size = record_size
+        self.version = version
+
+    def to_bytes(self):
+        """ return the byte representation of the header """
+        return self.STRUCT.pack(self.MAGIC, self.version, self.record_size)
+
+    @classmethod
+    def from_bytes(cls, byte_repr):
+        """ factory to create instance from bytes representation """
+        magic, version, record_size = cls.STRUCT.unpack(byte_repr)
+        if magic != cls.MAGIC:
+            raise ValueError("Not a binary CAN log, magic {0}".format(magic))
+        return cls(record_size=record_size,
+                   version=version)
+
+    @classmethod
+    def get_size(cls):
+        """ size getter """
+        return cls.STRUCT.size
+
+
+# a record is a timestamp followed by a can_frame, the can_frame stays 8 byte aligned
+TIMESTAMP = struct.Struct("@d")
+RECORD_SIZE = TIMESTAMP.size + CanFrame.get_size()
+
+
+class BinaryLogWriter:
+    """ A writer for the binary log format
+
+        The records are packed into a write buffer that is written to the file when it is full.
+        Only classic CanFrames are supported, the records have a fixed size.
+
+        @param filepath: the path of the log file
+        @param buffer_records: the number of records in the write buffer
+    """
+
+    def __init__(self,
+                 filepath: str,
+                 buffer_records: int = 4096,
+                 ):
+        self.f = open(filepath, "wb")
+        self.f.write(BinaryLogHeader(record_size=RECORD_SIZE).to_bytes())
+        self.buffer = bytearray(RECORD_SIZE * buffer_records)
+        self.buffer_records = buffer_records
+        self.nrecords = 0
+
+    def write(self, frame: CanFrame):
+        """ write a frame to the log
+
+            @param frame: a CanFrame, its timestamp is written or the current time if it has none
+        """
+        if isinstance(frame, CanFdFrame):
+            raise ValueError("CanFdFrames are not supported by the binary log format")
+        timestamp = frame.timestamp
+        if timestamp is None:
+            timestamp = time.time()
+        offset = self.nrecords * RECORD_SIZE
+        TIMESTAMP.pack_into(self.buffer, offset, timestamp)
+        frame.pack_into(self.buffer, offset + TIMESTAMP.size)
+        self.nrecords += 1
+        if self.nrecords == self.buffer_records:
+            self.flush()
+
+    def write_frames(self, frames):
+        """ write many frames to the log """
+        for frame in frames:
+            self.write(frame)
+
+    def flush(self):
+        """ write the buffered records to the file """
+        with memoryview(self.buffer) as view:
+            self.f.write(view[:self.nrecords * RECORD_SIZE])
+        self.nrecords = 0
+        self.f.flush()
+
+    def close(self):
+        """ flush and close the log file """
+        self.flush()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class BinaryLogReader:
+    """ A reader for the binary log format
+
+        The file is memory mapped, records are accessed by index and
+        the frames are created on demand. The records are expected
+        in time order for find() and between().
+
+        @param filepath: the path of the log file
+    """
+
+    def __init__(self,
+                 filepath: str,
+                 ):
+        self.f = open(filepath, "rb")
+        self.mm = None
+        self.nrecords = 0
+        try:
+            if not self.f.seek(0, 2):
+                # an empty file, e.g. a log that was created but never written to
+                return
+            self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+            header = BinaryLogHeader.from_bytes(self.mm[:BinaryLogHeader.get_size()])
+            if header.record_size != RECORD_SIZE:
+                raise ValueError("Unsupported record size {0}".format(header.record_size))
+        except (OSError, ValueError, struct.error):
+            self.close()
+            raise
+        self.nrecords = (len(self.mm) - BinaryLogHeader.get_size()) // RECORD_SIZE
+
+    def __len__(self):
+        return self.nrecords
+
+    def timestamp_at(self, idx: int) -> float:
+        """ return the timestamp of a record without creating a frame """
+        return TIMESTAMP.unpack_from(self.mm, BinaryLogHeader.get_size() + (idx * RECORD_SIZE))[0]
+
+    def __getitem__(self, idx: int) -> CanFrame:
+        """ return the frame of a record, the timestamp of the frame is set """
+        if idx < 0:
+            idx += self.nrecords
+        if not (0 <= idx < self.nrecords):
+            raise IndexError("record index out of range")
+        offset = BinaryLogHeader.get_size() + (idx * RECORD_SIZE)
+        frame = CanFrame.unpack_from(self.mm, offset + TIMESTAMP.size)
+        frame.timestamp = TIMESTAMP.unpack_from(self.mm, offset)[0]
+        return frame
+
+    def __iter__(self) -> Iterator[CanFrame]:
+        for idx in range(self.nrecords):
+            yield self[idx]
+
+    def find(self, timestamp: float) -> int:
+        """ binary search the index of the first record with a timestamp not before timestamp """
+        lo = 0
+        hi = self.nrecords
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.timestamp_at(mid) < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def between(self, start: float, stop: float) -> Iterator[CanFrame]:
+        """ iterate over the frames with start <= timestamp < stop """
+        for idx in range(self.find(start), self.find(stop)):
+            yield self[idx]
+
+    def close(self):
+        """ close the log file """
+        if self.mm is not None:
+            self.mm.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,486 @@
+""" Dbc
+
+    A signal database that decodes and encodes the data of CAN frames
+    with message and signal definitions from a DBC file
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import re
+
+from typing import Dict, Iterable, Optional, Union
+
+from socketcan.socketcan import CanFdFrame, CanFlags, CanFrame, CanFrameBatch, CAN_EFF_FLAG, get_key
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import logging
+logger = logging.getLogger("socketcan.dbc")
+
+# bit 31 of a message id in a DBC file marks an extended id
+DBC_EXTENDED_ID_FLAG = 0x80000000
+
+MESSAGE_PATTERN = re.compile(r"^BO_\s+(?P<can_id>\d+)\s+(?P<name>\w+)\s*:\s*(?P<length>\d+)\s+(?P<sender>\w+)")
+# m1M of extended multiplexing is a multiplexed signal that is the multiplexer of further signals
+SIGNAL_PATTERN = re.compile(r"^SG_\s+(?P<name>\w+)\s*(?P<mux>M|m\d+M?)?\s*:\s*"
+                            r"(?P<start_bit>\d+)\|(?P<length>\d+)@(?P<byte_order>[01])(?P<sign>[+-])\s*"
+                            r"\(\s*(?P<factor>[^,\s]+)\s*,\s*(?P<offset>[^)\s]+)\s*\)\s*"
+                            r"\[\s*(?P<minimum>[^|\s]+)\s*\|\s*(?P<maximum>[^\]\s]+)\s*\]\s*"
+                            r"\"(?P<unit>[^\"]*)\"\s*(?P<receivers>.*)$")
+
+
+def parse_number(text: str) -> Union[int, float]:
+    """ parse a number of a DBC file, integers stay integers so unscaled values stay integers """
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+class Signal:
+    """ A signal inside the data of a CAN frame
+
+        @param name: the name
+        @param start_bit: the start bit as in a DBC file, the lsb for little endian and the msb for big endian
+        @param length: the length in bits
+        @param byte_order: "little_endian" (intel, @1) or "big_endian" (motorola, @0)
+        @param is_signed: the raw value is a two's complement
+        @param factor: the factor of the physical value
+        @param offset: the offset of the physical value
+        @param minimum: the minimum physical value
+        @param maximum: the maximum physical value
+        @param unit: the unit of the physical value
+        @param is_multiplexer: this signal is the multiplexer of the message
+        @param multiplexer_id: the value of the multiplexer for which this signal is present, None if always present
+    """
+
+    def __init__(self,
+                 name: str,
+                 start_bit: int,
+                 length: int,
+                 byte_order: str = "little_endian",
+                 is_signed: bool = False,
+                 factor: Union[int, float] = 1,
+                 offset: Union[int, float] = 0,
+                 minimum: Union[int, float] = 0,
+                 maximum: Union[int, float] = 0,
+                 unit: str = "",
+                 is_multiplexer: bool = False,
+                 multiplexer_id: Optional[int] = None,
+                 ):
+        if byte_order not in ("little_endian", "big_endian"):
+            raise ValueError("Unknown byte_order {0}".format(byte_order))
+        self.name = name
+        self.start_bit = start_bit
+        self.length = length
+        self.byte_order = byte_order
+        self.is_signed = is_signed
+        self.factor = factor
+        self.offset = offset
+        self.minimum = minimum
+        self.maximum = maximum
+        self.unit = unit
+        self.is_multiplexer = is_multiplexer
+        self.multiplexer_id = multiplexer_id
+
+    def get_shift(self, nbytes: int) -> int:
+        """ the position of the lsb of the signal in the data read as an integer
+
+            Little endian signals are read from int.from_bytes(data, "little"),
+            big endian signals from int.from_bytes(data, "big").
+
+            @param nbytes: the length of the data
+        """
+        if self.byte_order == "little_endian":
+            shift = self.start_bit
+        else:
+            msb = ((nbytes - 1 - (self.start_bit // 8)) * 8) + (self.start_bit % 8)
+            shift = msb - self.length + 1
+        if (shift < 0) or ((shift + self.length) > (nbytes * 8)):
+            raise ValueError("Signal {0} does not fit into {1} bytes".format(self.name, nbytes))
+        return shift
+
+    @property
+    def mask(self) -> int:
+        """ the mask of the raw value """
+        return (1 << self.length) - 1
+
+    @property
+    def raw_range(self):
+        """ the minimum and maximum raw value """
+        if self.is_signed:
+            return -(1 << (self.length - 1)), (1 << (self.length - 1)) - 1
+        return 0, self.mask
+
+    def to_raw(self,
+               value: Union[int, float],
+               scaled: bool = True) -> int:
+        """ convert a physical value to a raw value
+
+            @param value: the value
+            @param scaled: value is a physical value, otherwise it is a raw value
+            @return: the raw value in two's complement
+        """
+        if scaled and ((self.factor != 1) or (self.offset != 0)):
+            value = round((value - self.offset) / self.factor)
+        else:
+            value = int(value)
+        minimum, maximum = self.raw_range
+        if not (minimum <= value <= maximum):
+            raise ValueError("Raw value {0} of signal {1} is out of range {2}..{3}".format(
+                value, self.name, minimum, maximum))
+        return value & self.mask
+
+    @classmethod
+    def from_dbc_line(cls, line: str):
+        """ factory to create instance from a SG_ line of a DBC file
+
+            @param line: the line without leading whitespace
+        """
+        match = SIGNAL_PATTERN.match(line)
+        if match is None:
+            raise ValueError("Not a signal definition {0}".format(line))
+        mux = match.group("mux")
+        return cls(name=match.group("name"),
+                   start_bit=int(match.group("start_bit")),
+                   length=int(match.group("length")),
+                   byte_order="little_endian" if match.group("byte_order") == "1" else "big_endian",
+                   is_signed=(match.group("sign") == "-"),
+                   factor=parse_number(match.group("factor")),
+                   offset=parse_number(match.group("offset")),
+                   minimum=parse_number(match.group("minimum")),
+                   maximum=parse_number(match.group("maximum")),
+                   unit=match.group("unit"),
+                   is_multiplexer=(mux == "M"),
+                   # nested multiplexing is not decoded, a m1M signal is a plain multiplexed signal
+                   multiplexer_id=int(mux[1:].rstrip("M")) if (mux and mux != "M") else None,
+                   )
+
+
+class Message:
+    """ A CAN message and its signals
+
+        The signals are compiled into extractors on creation. Decoding reads the data
+        once per byte order as an integer and extracts each signal with a shift and a mask.
+
+        @param can_id: the can id
+        @param name: the name
+        @param length: the length of the data in bytes
+        @param signals: the signals
+        @param is_extended: the can id is an extended id
+        @param sender: the sending node
+    """
+
+    def __init__(self,
+                 can_id: int,
+                 name: str,
+                 length: int,
+                 signals: Iterable[Signal] = (),
+                 is_extended: bool = False,
+                 sender: str = "",
+                 ):
+        self.can_id = can_id
+        self.name = name
+        self.length = length
+        self.signals = list(signals)
+        self.is_extended = is_extended or (can_id > 0x7FF)
+        self.sender = sender
+        self.compile()
+
+    def compile(self):
+        """ precompute the extractors, call again after changing signals """
+        self.multiplexer = None
+        common = []
+        by_mux = {}
+        for signal in self.signals:
+            extractor = self._make_extractor(signal)
+            if signal.is_multiplexer:
+                self.multiplexer = extractor
+            if signal.multiplexer_id is None:
+                common.append(extractor)
+            else:
+                by_mux.setdefault(signal.multiplexer_id, []).append(extractor)
+        self.extractors = tuple(common)
+        self.extractors_by_mux = {mux: tuple(extractors) for mux, extractors in by_mux.items()}
+        self.uses_big_endian = any(signal.byte_order == "big_endian" for signal in self.signals)
+
+    def _make_extractor(self, signal: Signal):
+        """ return a tuple of name, is_big_endian, shift, mask, sign_bit, factor, offset """
+        sign_bit = 0
+        if signal.is_signed:
+            sign_bit = 1 << (signal.length - 1)
+        return (signal.name,
+                signal.byte_order == "big_endian",
+                signal.get_shift(self.length),
+                signal.mask,
+                sign_bit,
+                signal.factor,
+                signal.offset,
+                )
+
+    def get_signal(self, name: str) -> Signal:
+        """ signal getter by name """
+        for signal in self.signals:
+            if signal.name == name:
+                return signal
+        raise KeyError(name)
+
+    def decode(self,
+               data: bytes,
+               scaled: bool = True) -> Dict[str, Union[int, float]]:
+        """ decode the data of a frame
+
+            @param data: the data
+            @param scaled: return physical values, otherwise raw values
+            @return: a dictionary of signal name to value
+        """
+        if len(data) < self.length:
+            data = bytes(data).ljust(self.length, b"\x00")
+        elif len(data) > self.length:
+            data = data[:self.length]
+        little = int.from_bytes(data, "little")
+        big = 0
+        if self.uses_big_endian:
+            big = int.from_bytes(data, "big")
+        extractors = self.extractors
+        if self.multiplexer is not None:
+            name, is_big, shift, mask, sign_bit, factor, offset = self.multiplexer
+            mux = ((big if is_big else little) >> shift) & mask
+            extractors = extractors + self.extractors_by_mux.get(mux, ())
+        values = {}
+        for name, is_big, shift, mask, sign_bit, factor, offset in extractors:
+            raw = ((big if is_big else little) >> shift) & mask
+            if raw & sign_bit:
+                raw -= (sign_bit << 1)
+            if scaled:
+                raw = (raw * factor) + offset
+            values[name] = raw
+        return values
+
+    def encode(self,
+               values: Dict[str, Union[int, float]],
+               scaled: bool = True) -> bytes:
+        """ encode values into the data of a frame, signals that are not in values are zero
+
+            @param values: a dictionary of signal name to value
+            @param scaled: the values are physical values, otherwise raw values
+            @return: the data
+        """
+        little = 0
+        big = 0
+        for signal in self.signals:
+            if signal.name not in values:
+                continue
+            raw = signal.to_raw(values[signal.name], scaled=scaled) << signal.get_shift(self.length)
+            if signal.byte_order == "big_endian":
+                big |= raw
+            else:
+                little |= raw
+        data = little.to_bytes(self.length, "little")
+        if big:
+            data = bytes(a | b for a, b in zip(data, big.to_bytes(self.length, "big")))
+        return data
+
+    def encode_frame(self,
+                     values: Dict[str, Union[int, float]],
+                     scaled: bool = True) -> CanFrame:
+        """ encode values into a frame, a CanFdFrame if the message is longer than 8 bytes
+
+            @param values: a dictionary of signal name to value
+            @param scaled: the values are physical values, otherwise raw values
+            @return: the frame
+        """
+        flags = 0
+        if self.is_extended:
+            flags = CanFlags.CAN_EFF_FLAG
+        data = self.encode(values, scaled=scaled)
+        if self.length > 8:
+            return CanFdFrame(can_id=self.can_id, data=data, flags=flags)
+        return CanFrame(can_id=self.can_id, data=data, flags=flags)
+
+    def decode_array(self,
+                     data: "np.ndarray",
+                     scaled: bool = True) -> Dict[str, "np.ndarray"]:
+        """ decode the data of many frames at once, requires numpy and a message length up to 8 bytes
+
+            @param data: an array of shape (n, 8) and dtype uint8, e.g. CanFrameBatch.data
+            @param scaled: return physical values as float64, otherwise raw values as int64
+            @return: a dictionary of signal name to an array of values,
+                     multiplexed signals are NaN where they are not present and scaled is True
+        """
+        if np is None:
+            raise ImportError("decode_array requires numpy")
+        if self.length > 8:
+            raise ValueError("decode_array supports messages up to 8 bytes")
+        data = np.ascontiguousarray(data, dtype=np.uint8)
+        words = {False: data.view("<u8").ravel()}
+        if self.uses_big_endian:
+            words[True] = data.view(">u8").ravel()
+        values = {}
+        for extractor in self.extractors:
+            raw = self._extract_array(words, extractor)
+            if scaled:
+                raw = (raw.astype(np.float64) * extractor[5]) + extractor[6]
+            values[extractor[0]] = raw
+        if self.multiplexer is not None:
+            mux = self._extract_array(words, self.multiplexer)
+            for mux_value, extractors in self.extractors_by_mux.items():
+                present = (mux == mux_value)
+                for extractor in extractors:
+                    raw = self._extract_array(words, extractor)
+                    if scaled:
+                        raw = np.where(present, (raw.astype(np.float64) * extractor[5]) + extractor[6], np.nan)
+                    values[extractor[0]] = raw
+        return values
+
+    def _extract_array(self,
+                       words: dict,
+                       extractor: tuple) -> "np.ndarray":
+        """ extract the raw values of a signal from the data read as uint64 per byte order """
+        name, is_big, shift, mask, sign_bit, factor, offset = extractor
+        if is_big:
+            # the extractors are compiled for self.length bytes, big endian shifts move up for 8 bytes
+            shift += (8 - self.length) * 8
+        raw = ((words[is_big] >> np.uint64(shift)) & np.uint64(mask)).astype(np.int64)
+        if sign_bit:
+            raw = np.where(raw & sign_bit, raw - (sign_bit << 1), raw)
+        return raw
+
+
+class SignalDatabase:
+    """ A collection of messages indexed by can id and by name
+
+        The can ids of extended messages carry CAN_EFF_FLAG in the index,
+        so a standard and an extended message with the same number do not collide.
+
+        @param messages: the messages
+    """
+
+    def __init__(self, messages: Iterable[Message] = ()):
+        self.messages_by_id = {}
+        self.messages_by_name = {}
+        for message in messages:
+            self.add_message(message)
+
+    def add_message(self, message: Message):
+        """ add a message """
+        self.messages_by_id[get_key(message.can_id, message.is_extended)] = message
+        self.messages_by_name[message.name] = message
+
+    def get_message(self,
+                    key: Union[int, str],
+                    extended: bool = None) -> Message:
+        """ message getter by can id or by name
+
+            @param key: the can id or the name of the message
+            @param extended: the frame format of a can id, None for extended if the can id exceeds 11 bits
+        """
+        if isinstance(key, str):
+            return self.messages_by_name[key]
+        return self.messages_by_id[get_key(key, extended)]
+
+    def decode(self,
+               frame: CanFrame,
+               scaled: bool = True) -> Optional[Dict[str, Union[int, float]]]:
+        """ decode a frame
+
+            @param frame: the frame
+            @param scaled: return physical values, otherwise raw values
+            @return: a dictionary of signal name to value, None if the can id is unknown
+        """
+        message = self.messages_by_id.get(frame.can_id | (frame.flags & CAN_EFF_FLAG))
+        if message is None:
+            return None
+        return message.decode(frame.data, scaled=scaled)
+
+    def decode_batch(self,
+                     batch: CanFrameBatch,
+                     scaled: bool = True) -> Dict[str, Dict[str, "np.ndarray"]]:
+        """ decode a batch of frames, requires numpy
+
+            @param batch: the frames
+            @param scaled: return physical values, otherwise raw values
+            @return: a dictionary of message name to a dictionary of signal name to an array of values,
+                     only messages with frames in the batch are included
+        """
+        keys = batch.can_id | (batch.flags & CAN_EFF_FLAG)
+        result = {}
+        for key in np.unique(keys):
+            message = self.messages_by_id.get(int(key))
+            if message is None:
+                continue
+            result[message.name] = message.decode_array(batch.data[keys == key], scaled=scaled)
+        return result
+
+    def encode(self,
+               key: Union[int, str],
+               values: Dict[str, Union[int, float]],
+               scaled: bool = True,
+               extended: bool = None) -> CanFrame:
+        """ encode values into a frame
+
+            @param key: the can id or the name of the message
+            @param values: a dictionary of signal name to value
+            @param scaled: the values are physical values, otherwise raw values
+            @param extended: the frame format of a can id, None for extended if the can id exceeds 11 bits
+            @return: the frame
+        """
+        return self.get_message(key, extended=extended).encode_frame(values, scaled=scaled)
+
+    @classmethod
+    def from_dbc_string(cls, text: str):
+        """ factory to create instance from the content of a DBC file
+
+            Only message and signal definitions are read, everything else is ignored.
+            Messages without data bytes, e.g. VECTOR__INDEPENDENT_SIG_MSG, are skipped with their signals.
+
+            @param text: the content
+        """
+        database = cls()
+        message = None
+        skipping = False
+        for line in text.splitlines():
+            line = line.strip()
+            if line.startswith("BO_ "):
+                match = MESSAGE_PATTERN.match(line)
+                if match is None:
+                    raise ValueError("Not a message definition {0}".format(line))
+                message = None
+                skipping = (int(match.group("length")) == 0)
+                if skipping:
+                    logger.debug("skipping message without data %s", match.group("name"))
+                    continue
+                can_id = int(match.group("can_id"))
+                message = Message(can_id=can_id & ~DBC_EXTENDED_ID_FLAG,
+                                  name=match.group("name"),
+                                  length=int(match.group("length")),
+                                  is_extended=bool(can_id & DBC_EXTENDED_ID_FLAG),
+                                  sender=match.group("sender"),
+                                  )
+                database.add_message(message)
+            elif line.startswith("SG_ ") and not skipping:
+                if message is None:
+                    raise ValueError("Signal definition outside of a message {0}".format(line))
+                message.signals.append(Signal.from_dbc_line(line))
+            elif not line:
+                message = None
+                skipping = False
+        for message in database.messages_by_id.values():
+            message.compile()
+        logger.debug("loaded %d messages", len(database.messages_by_id))
+        return database
+
+    @classmethod
+    def from_dbc_file(cls,
+                      filepath: str,
+                      encoding: str = "cp1252"):
+        """ factory to create instance from a DBC file
+
+            @param filepath: the path of the file
+            @param encoding: the encoding of the file, DBC files are usually cp1252
+        """
+        with open(filepath, encoding=encoding) as fp:
+            return cls.from_dbc_string(fp.read())
@@ -0,0 +1,547 @@
+""" Gw
+
+    Routing rules of the kernel CAN gateway can-gw, they forward frames between interfaces
+    and modify them on the way without leaving the kernel.
+    The rules are managed over rtnetlink, which requires CAP_NET_ADMIN and the can-gw kernel module.
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import os
+import socket
+import struct
+
+from enum import IntEnum
+from typing import Iterator, List, Optional, Tuple
+
+from socketcan.socketcan import CanFilter
+
+import logging
+logger = logging.getLogger("socketcan.gw")
+
+
+class NetlinkMsgTypes(IntEnum):
+    NLMSG_ERROR = 2
+    NLMSG_DONE = 3
+    RTM_NEWROUTE = 24
+    RTM_DELROUTE = 25
+    RTM_GETROUTE = 26
+
+
+class NetlinkFlags(IntEnum):
+    NLM_F_REQUEST = 0x01
+    NLM_F_MULTI = 0x02
+    NLM_F_ACK = 0x04
+    NLM_F_DUMP = 0x300
+
+
+class CgwTypes(IntEnum):
+    CGW_TYPE_CAN_CAN = 1
+
+
+class CgwFlags(IntEnum):
+    """ the flags of a rule """
+    CGW_FLAGS_CAN_ECHO = 0x01
+    CGW_FLAGS_CAN_SRC_TSTAMP = 0x02
+    CGW_FLAGS_CAN_IIF_TX_OK = 0x04
+    CGW_FLAGS_CAN_FD = 0x08
+
+
+class CgwAttributes(IntEnum):
+    CGW_MOD_AND = 1
+    CGW_MOD_OR = 2
+    CGW_MOD_XOR = 3
+    CGW_MOD_SET = 4
+    CGW_CS_XOR = 5
+    CGW_CS_CRC8 = 6
+    CGW_HANDLED = 7
+    CGW_DROPPED = 8
+    CGW_SRC_IF = 9
+    CGW_DST_IF = 10
+    CGW_FILTER = 11
+    CGW_DELETED = 12
+    CGW_LIM_HOPS = 13
+    CGW_MOD_UID = 14
+    CGW_FDMOD_AND = 15
+    CGW_FDMOD_OR = 16
+    CGW_FDMOD_XOR = 17
+    CGW_FDMOD_SET = 18
+
+
+class CgwModOps(IntEnum):
+    """ the operations of a frame modification, the value is the attribute of a CAN frame modification """
+    AND = 1
+    OR = 2
+    XOR = 3
+    SET = 4
+
+
+# the attribute of a CAN FD frame modification is the operation plus this offset
+CGW_FDMOD_OFFSET = CgwAttributes.CGW_FDMOD_AND - CgwAttributes.CGW_MOD_AND
+
+
+class CgwModTypes(IntEnum):
+    """ the elements of the frame that a modification affects """
+    CGW_MOD_ID = 0x01
+    CGW_MOD_DLC = 0x02
+    CGW_MOD_DATA = 0x04
+    CGW_MOD_FLAGS = 0x08
+
+
+class CgwCrc8Profiles(IntEnum):
+    CGW_CRC8PRF_UNSPEC = 0
+    CGW_CRC8PRF_1U8 = 1
+    CGW_CRC8PRF_16U8 = 2
+    CGW_CRC8PRF_SFFID_XOR = 3
+
+
+AF_CAN = socket.AF_CAN
+NETLINK_ROUTE = 0
+
+# struct nlmsghdr, struct rtcanmsg and struct rtattr
+NLMSGHDR = struct.Struct("=IHHII")
+RTCANMSG = struct.Struct("=BBH")
+RTATTR = struct.Struct("=HH")
+NLMSGERR = struct.Struct("=i")
+U32 = struct.Struct("=I")
+
+
+def nla_align(length: int) -> int:
+    """ helper to align a length to 4 bytes like netlink does """
+    return (length + 3) & ~3
+
+
+def crc8_table(polynomial: int) -> bytes:
+    """ helper to calculate the table of a crc8 for CgwCsumCrc8
+
+        @param polynomial: the polynomial without the leading bit, e.g. 0x1D for SAE J1850
+        @return: 256 bytes
+    """
+    table = bytearray(256)
+    for idx in range(256):
+        crc = idx
+        for _ in range(8):
+            crc = ((crc << 1) ^ polynomial) if (crc & 0x80) else (crc << 1)
+        table[idx] = crc & 0xFF
+    return bytes(table)
+
+
+class CgwFrameMod:
+    """ A modification of the forwarded frame, struct cgw_frame_mod
+
+        The elements of modtype are combined with the matching elements of this frame
+        by op, e.g. AND with a can_id of 0x700 and CGW_MOD_ID clears the lower bits of the can_id.
+
+        @param op: one of CgwModOps
+        @param modtype: an or combination of CgwModTypes
+        @param can_id: the can_id including the CanFlags
+        @param dlc: the data length in bytes
+        @param data: the data, 8 bytes or up to 64 bytes for CAN FD
+        @param fd: modify CAN FD frames, struct cgw_fdframe_mod
+        @param fd_flags: the CanFdFlags for CGW_MOD_FLAGS, CAN FD only
+    """
+
+    FORMAT = "=IB3x8sB"
+    STRUCT = struct.Struct(FORMAT)
+    FD_FORMAT = "=IBBxx64sB"
+    FD_STRUCT = struct.Struct(FD_FORMAT)
+
+    def __init__(self,
+                 op: int,
+                 modtype: int,
+                 can_id: int = 0,
+                 dlc: int = 0,
+                 data: bytes = bytes(8),
+                 fd: bool = False,
+                 fd_flags: int = 0,
+                 ):
+        self.op = op
+        self.modtype = modtype
+        self.can_id = can_id
+        self.dlc = dlc
+        self.data = data
+        self.fd = fd
+        self.fd_flags = fd_flags
+
+    def get_attribute(self) -> int:
+        """ the rtattr type of the modification """
+        if self.fd:
+            return self.op + CGW_FDMOD_OFFSET
+        return self.op
+
+    def to_bytes(self):
+        """ return the byte representation of the modification that socketcan expects """
+        if self.fd:
+            return self.FD_STRUCT.pack(self.can_id, self.dlc, self.fd_flags, self.data, self.modtype)
+        return self.STRUCT.pack(self.can_id, self.dlc, self.data, self.modtype)
+
+    def __eq__(self, other):
+        """ standard equality operation """
+        return all((self.get_attribute() == other.get_attribute(),
+                    self.to_bytes() == other.to_bytes(),
+                    ))
+
+    def __ne__(self, other):
+        """ standard non equality operation """
+        return not self.__eq__(other)
+
+    @classmethod
+    def from_bytes(cls, attribute: int, byte_repr: bytes):
+        """ factory to create instance from an attribute and its bytes representation """
+        if attribute >= CgwAttributes.CGW_FDMOD_AND:
+            can_id, dlc, fd_flags, data, modtype = cls.FD_STRUCT.unpack(byte_repr)
+            return cls(op=attribute - CGW_FDMOD_OFFSET, modtype=modtype, can_id=can_id, dlc=dlc, data=data,
+                       fd=True, fd_flags=fd_flags)
+        can_id, dlc, data, modtype = cls.STRUCT.unpack(byte_repr)
+        return cls(op=attribute, modtype=modtype, can_id=can_id, dlc=dlc, data=data)
+
+
+class CgwCsumXor:
+    """ An xor checksum over data[from_idx:to_idx + 1] that is written to data[result_idx],
+        struct cgw_csum_xor, negative indexes count from the end of the data
+
+        @param from_idx: the first byte
+        @param to_idx: the last byte
+        @param result_idx: the byte of the checksum
+        @param init_xor_val: the initial value
+    """
+
+    FORMAT = "=bbbB"
+    STRUCT = struct.Struct(FORMAT)
+
+    def __init__(self,
+                 from_idx: int,
+                 to_idx: int,
+                 result_idx: int,
+                 init_xor_val: int = 0,
+                 ):
+        self.from_idx = from_idx
+        self.to_idx = to_idx
+        self.result_idx = result_idx
+        self.init_xor_val = init_xor_val
+
+    def to_bytes(self):
+        """ return the byte representation of the checksum that socketcan expects """
+        return self.STRUCT.pack(self.from_idx, self.to_idx, self.result_idx, self.init_xor_val)
+
+    def __eq__(self, other):
+        """ standard equality operation """
+        return self.to_bytes() == other.to_bytes()
+
+    def __ne__(self, other):
+        """ standard non equality operation """
+        return not self.__eq__(other)
+
+    @classmethod
+    def from_bytes(cls, byte_repr: bytes):
+        """ factory to create instance from bytes representation """
+        return cls(*cls.STRUCT.unpack(byte_repr))
+
+
+class CgwCsumCrc8:
+    """ A crc8 over data[from_idx:to_idx + 1] that is written to data[result_idx], struct cgw_csum_crc8
+
+        @param from_idx: the first byte
+        @param to_idx: the last byte
+        @param result_idx: the byte of the checksum
+        @param polynomial: the polynomial, see crc8_table()
+        @param init_crc_val: the initial value
+        @param final_xor_val: the value to xor the result with
+        @param profile: one of CgwCrc8Profiles, e.g. to include a rolling counter like AUTOSAR E2E
+        @param profile_data: the data of the profile, up to 20 bytes
+        @param crctab: the table instead of polynomial
+    """
+
+    FORMAT = "=bbbBB256sB20s"
+    STRUCT = struct.Struct(FORMAT)
+
+    def __init__(self,
+                 from_idx: int,
+                 to_idx: int,
+                 result_idx: int,
+                 polynomial: int = 0x1D,
+                 init_crc_val: int = 0,
+                 final_xor_val: int = 0,
+                 profile: int = CgwCrc8Profiles.CGW_CRC8PRF_UNSPEC,
+                 profile_data: bytes = bytes(20),
+                 crctab: bytes = None,
+                 ):
+        self.from_idx = from_idx
+        self.to_idx = to_idx
+        self.result_idx = result_idx
+        self.init_crc_val = init_crc_val
+        self.final_xor_val = final_xor_val
+        self.profile = profile
+        self.profile_data = profile_data
+        if crctab is None:
+            crctab = crc8_table(polynomial)
+        self.crctab = crctab
+
+    def to_bytes(self):
+        """ return the byte representation of the checksum that socketcan expects """
+        return self.STRUCT.pack(self.from_idx, self.to_idx, self.result_idx, self.init_crc_val, self.final_xor_val,
+                                self.crctab, self.profile, self.profile_data)
+
+    def __eq__(self, other):
+        """ standard equality operation """
+        return self.to_bytes() == other.to_bytes()
+
+    def __ne__(self, other):
+        """ standard non equality operation """
+        return not self.__eq__(other)
+
+    @classmethod
+    def from_bytes(cls, byte_repr: bytes):
+        """ factory to create instance from bytes representation """
+        from_idx, to_idx, result_idx, init_crc_val, final_xor_val, crctab, profile, profile_data = \
+            cls.STRUCT.unpack(byte_repr)
+        return cls(from_idx=from_idx, to_idx=to_idx, result_idx=result_idx, init_crc_val=init_crc_val,
+                   final_xor_val=final_xor_val, profile=profile, profile_data=profile_data, crctab=crctab)
+
+
+def get_ifindex(interface) -> int:
+    """ helper to resolve an interface name, an int is taken as index """
+    if isinstance(interface, int):
+        return interface
+    return socket.if_nametoindex(interface)
+
+
+def get_ifname(ifindex: int):
+    """ helper to resolve an interface index, the index is returned if the interface is gone """
+    try:
+        return socket.if_indextoname(ifindex)
+    except OSError:
+        return ifindex
+
+
+def iter_attributes(buffer, offset: int = 0) -> Iterator[Tuple[int, memoryview]]:
+    """ iterate over the rtattrs in a buffer
+
+        @param buffer: a bytes like object
+        @param offset: the offset of the first rtattr
+        @return: an iterator of attribute type and payload
+    """
+    view = memoryview(buffer)
+    while offset + RTATTR.size <= len(view):
+        length, attribute = RTATTR.unpack_from(view, offset)
+        if length < RTATTR.size:
+            break
+        yield attribute, view[offset + RTATTR.size:offset + length]
+        offset += nla_align(length)
+
+
+def pack_attribute(attribute: int, payload: bytes) -> bytes:
+    """ helper to pack a rtattr with padding """
+    length = RTATTR.size + len(payload)
+    return RTATTR.pack(length, attribute) + payload + bytes(nla_align(length) - length)
+
+
+class CanGwRule:
+    """ A routing rule of the kernel CAN gateway
+
+        @param src_if: the interface to receive from, a name or an index
+        @param dst_if: the interface to send to, a name or an index
+        @param can_filter: a CanFilter that selects the frames to forward, None for all frames
+        @param mods: CgwFrameMods, at most one per operation, they are applied in the order AND, OR, XOR, SET
+        @param csum_xor: an optional CgwCsumXor that is calculated after the modifications
+        @param csum_crc8: an optional CgwCsumCrc8 that is calculated after the modifications
+        @param lim_hops: the maximum number of gateway hops of a frame, 0 for the module default
+        @param mod_uid: a unique id of the rule, adding a rule with the same id updates its modifications
+        @param flags: an or combination of CgwFlags, CGW_FLAGS_CAN_FD to forward CAN FD frames
+
+        The counters handled, dropped and deleted are read from the kernel by CanGateway.get_rules().
+    """
+
+    def __init__(self,
+                 src_if,
+                 dst_if,
+                 can_filter: CanFilter = None,
+                 mods: List[CgwFrameMod] = None,
+                 csum_xor: CgwCsumXor = None,
+                 csum_crc8: CgwCsumCrc8 = None,
+                 lim_hops: int = 0,
+                 mod_uid: int = 0,
+                 flags: int = 0,
+                 ):
+        self.src_if = src_if
+        self.dst_if = dst_if
+        self.can_filter = can_filter
+        self.mods = mods or []
+        if len(set(mod.get_attribute() for mod in self.mods)) != len(self.mods):
+            raise ValueError("A rule takes at most one modification per operation")
+        self.csum_xor = csum_xor
+        self.csum_crc8 = csum_crc8
+        self.lim_hops = lim_hops
+        self.mod_uid = mod_uid
+        self.flags = flags
+        self.handled = 0
+        self.dropped = 0
+        self.deleted = 0
+
+    def __eq__(self, other):
+        """ standard equality operation, the counters are not compared """
+        return self.to_bytes() == other.to_bytes()
+
+    def __ne__(self, other):
+        """ standard non equality operation """
+        return not self.__eq__(other)
+
+    def to_bytes(self):
+        """ return the rtcanmsg and the attributes of the rule """
+        attributes = [pack_attribute(mod.get_attribute(), mod.to_bytes())
+                      for mod in sorted(self.mods, key=CgwFrameMod.get_attribute)]
+        if self.csum_xor is not None:
+            attributes.append(pack_attribute(CgwAttributes.CGW_CS_XOR, self.csum_xor.to_bytes()))
+        if self.csum_crc8 is not None:
+            attributes.append(pack_attribute(CgwAttributes.CGW_CS_CRC8, self.csum_crc8.to_bytes()))
+        if self.mod_uid:
+            attributes.append(pack_attribute(CgwAttributes.CGW_MOD_UID, U32.pack(self.mod_uid)))
+        if self.can_filter is not None:
+            attributes.append(pack_attribute(CgwAttributes.CGW_FILTER, self.can_filter.to_bytes()))
+        attributes.append(pack_attribute(CgwAttributes.CGW_SRC_IF, U32.pack(get_ifindex(self.src_if))))
+        attributes.append(pack_attribute(CgwAttributes.CGW_DST_IF, U32.pack(get_ifindex(self.dst_if))))
+        if self.lim_hops:
+            attributes.append(pack_attribute(CgwAttributes.CGW_LIM_HOPS, bytes((self.lim_hops,))))
+        return RTCANMSG.pack(AF_CAN, CgwTypes.CGW_TYPE_CAN_CAN, self.flags) + b"".join(attributes)
+
+    @classmethod
+    def from_bytes(cls, byte_repr: bytes):
+        """ factory to create instance from the rtcanmsg and the attributes of a rule """
+        _, _, flags = RTCANMSG.unpack_from(byte_repr)
+        rule = cls(src_if=0, dst_if=0, flags=flags)
+        for attribute, payload in iter_attributes(byte_repr, RTCANMSG.size):
+            rule.set_attribute(attribute, bytes(payload))
+        return rule
+
+    def set_attribute(self, attribute: int, payload: bytes):
+        """ set a member from an attribute of a netlink message """
+        if attribute in ATTRIBUTE_PARSERS:
+            name, parser = ATTRIBUTE_PARSERS[attribute]
+            setattr(self, name, parser(payload))
+        elif CgwAttributes.CGW_MOD_AND <= attribute <= CgwAttributes.CGW_MOD_SET \
+                or CgwAttributes.CGW_FDMOD_AND <= attribute <= CgwAttributes.CGW_FDMOD_SET:
+            self.mods.append(CgwFrameMod.from_bytes(attribute, payload))
+        else:
+            logger.debug("ignoring attribute %d", attribute)
+
+
+# attribute to member name and parser
+ATTRIBUTE_PARSERS = {
+    CgwAttributes.CGW_CS_XOR: ("csum_xor", CgwCsumXor.from_bytes),
+    CgwAttributes.CGW_CS_CRC8: ("csum_crc8", CgwCsumCrc8.from_bytes),
+    CgwAttributes.CGW_HANDLED: ("handled", lambda payload: U32.unpack(payload)[0]),
+    CgwAttributes.CGW_DROPPED: ("dropped", lambda payload: U32.unpack(payload)[0]),
+    CgwAttributes.CGW_DELETED: ("deleted", lambda payload: U32.unpack(payload)[0]),
+    CgwAttributes.CGW_SRC_IF: ("src_if", lambda payload: get_ifname(U32.unpack(payload)[0])),
+    CgwAttributes.CGW_DST_IF: ("dst_if", lambda payload: get_ifname(U32.unpack(payload)[0])),
+    CgwAttributes.CGW_FILTER: ("can_filter", CanFilter.from_bytes),
+    CgwAttributes.CGW_LIM_HOPS: ("lim_hops", lambda payload: payload[0]),
+    CgwAttributes.CGW_MOD_UID: ("mod_uid", lambda payload: U32.unpack(payload)[0]),
+}
+
+
+def pack_message(msg_type: int,
+                 flags: int,
+                 seq: int,
+                 payload: bytes) -> bytes:
+    """ helper to pack a netlink message """
+    return NLMSGHDR.pack(NLMSGHDR.size + len(payload), msg_type, flags, seq, 0) + payload
+
+
+def iter_messages(buffer) -> Iterator[Tuple[int, int, int, memoryview]]:
+    """ iterate over the netlink messages in a buffer
+
+        @param buffer: a bytes like object, e.g. the datagram received from a netlink socket
+        @return: an iterator of message type, flags, sequence number and payload
+    """
+    view = memoryview(buffer)
+    offset = 0
+    while offset + NLMSGHDR.size <= len(view):
+        length, msg_type, flags, seq, _ = NLMSGHDR.unpack_from(view, offset)
+        if length < NLMSGHDR.size:
+            break
+        yield msg_type, flags, seq, view[offset + NLMSGHDR.size:offset + length]
+        offset += nla_align(length)
+
+
+class CanGateway:
+    """ Manage the rules of the kernel CAN gateway over rtnetlink
+
+        Requires CAP_NET_ADMIN to change rules and the can-gw kernel module.
+        Errors of the kernel are raised as OSError.
+    """
+
+    # the size of the receive buffer, a dump may hold several rules per datagram
+    BUFSIZE = 65536
+
+    def __init__(self):
+        self.s = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        self.s.bind((0, 0))
+        self.seq = 0
+
+    def __del__(self):
+        self.s.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.s.close()
+
+    def request(self,
+                msg_type: int,
+                flags: int,
+                payload: bytes) -> List[bytes]:
+        """ send a request and collect the answer
+
+            @param msg_type: one of NetlinkMsgTypes
+            @param flags: the NetlinkFlags in addition to NLM_F_REQUEST
+            @param payload: the payload of the request
+            @return: the payloads of the answer, empty for an acknowledge
+        """
+        self.seq += 1
+        self.s.send(pack_message(msg_type, flags | NetlinkFlags.NLM_F_REQUEST, self.seq, payload))
+        answers = []
+        while True:
+            for answer_type, answer_flags, seq, answer in iter_messages(self.s.recv(self.BUFSIZE)):
+                if seq != self.seq:
+                    continue
+                if answer_type == NetlinkMsgTypes.NLMSG_ERROR:
+                    error = NLMSGERR.unpack_from(answer)[0]
+                    if error:
+                        raise OSError(-error, os.strerror(-error))
+                    return answers
+                if answer_type == NetlinkMsgTypes.NLMSG_DONE:
+                    return answers
+                answers.append(bytes(answer))
+                if not answer_flags & NetlinkFlags.NLM_F_MULTI:
+                    return answers
+
+    def add_rule(self, rule: CanGwRule):
+        """ add a rule, a rule with the mod_uid of an existing rule updates its modifications """
+        self.request(NetlinkMsgTypes.RTM_NEWROUTE, NetlinkFlags.NLM_F_ACK, rule.to_bytes())
+
+    def delete_rule(self, rule: CanGwRule):
+        """ delete a rule, the kernel deletes the rule that matches in all members """
+        self.request(NetlinkMsgTypes.RTM_DELROUTE, NetlinkFlags.NLM_F_ACK, rule.to_bytes())
+
+    def flush(self):
+        """ delete all rules, the kernel requires both interfaces, index 0 matches any like cangw -F does """
+        self.request(NetlinkMsgTypes.RTM_DELROUTE, NetlinkFlags.NLM_F_ACK,
+                     RTCANMSG.pack(AF_CAN, CgwTypes.CGW_TYPE_CAN_CAN, 0)
+                     + pack_attribute(CgwAttributes.CGW_SRC_IF, U32.pack(0))
+                     + pack_attribute(CgwAttributes.CGW_DST_IF, U32.pack(0)))
+
+    def get_rules(self, src_if: Optional[str] = None) -> List[CanGwRule]:
+        """ get the rules with their counters
+
+            @param src_if: only the rules of this source interface, None for all
+            @return: a list of CanGwRules
+        """
+        answers = self.request(NetlinkMsgTypes.RTM_GETROUTE, NetlinkFlags.NLM_F_DUMP,
+                               RTCANMSG.pack(AF_CAN, 0, 0))
+        # without the can-gw module, the kernel dumps the routes of all families
+        rules = [CanGwRule.from_bytes(answer) for answer in answers if answer[0] == AF_CAN]
+        if src_if is not None:
+            rules = [rule for rule in rules if rule.src_if == src_if]
+        return rules
@@ -0,0 +1,207 @@
+""" Metrics
+
+    Opt-in runtime statistics of the socketcan sockets
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import socket
+import struct
+
+from bisect import bisect_left
+from collections import deque
+from typing import Optional, Sequence
+
+# the socket option that adds the number of frames the kernel dropped to the ancillary data
+SO_RXQ_OVFL = 40
+RXQ_OVFL = struct.Struct("I")
+
+
+def drops_from_ancdata(ancdata) -> Optional[int]:
+    """ helper to extract the kernel drop counter from the ancillary data of recvmsg()
+
+        @param ancdata: a list of (cmsg_level, cmsg_type, cmsg_data)
+        @return: the number of frames the kernel dropped since the socket was opened, None if there is none
+    """
+    for cmsg_level, cmsg_type, cmsg_data in ancdata:
+        if (cmsg_level == socket.SOL_SOCKET) and (cmsg_type == SO_RXQ_OVFL):
+            return RXQ_OVFL.unpack_from(cmsg_data)[0]
+    return None
+
+
+class LatencyHistogram:
+    """ A histogram of latencies with fixed buckets, constant memory and cost per value
+
+        @param bounds: the upper bounds of the buckets in seconds in ascending order,
+                       values above the last bound go into an extra bucket,
+                       default are powers of two from 1 microsecond to about 1 second
+    """
+
+    def __init__(self, bounds: Sequence[float] = None):
+        if bounds is None:
+            bounds = [1E-6 * (2 ** idx) for idx in range(21)]
+        self.bounds = list(bounds)
+        self.reset()
+
+    def reset(self):
+        """ clear all values """
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value: float):
+        """ add a latency in seconds """
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, point: float) -> Optional[float]:
+        """ estimate a percentile
+
+            @param point: the percentile, e.g. 99
+            @return: the upper bound of the bucket that holds the percentile, the maximum for the extra bucket,
+                     None without values
+        """
+        if not self.count:
+            return None
+        threshold = self.count * point / 100
+        total = 0
+        for idx, count in enumerate(self.counts):
+            total += count
+            if total >= threshold and count:
+                if idx < len(self.bounds):
+                    return min(self.bounds[idx], self.max)
+                return self.max
+        return self.max
+
+    def to_dict(self) -> dict:
+        """ return the histogram as dict """
+        return {"count": self.count,
+                "mean": (self.sum / self.count) if self.count else None,
+                "min": self.min,
+                "max": self.max,
+                "p50": self.percentile(50),
+                "p99": self.percentile(99),
+                "buckets": {"{0:g}".format(bound): count for bound, count in zip(self.bounds, self.counts) if count},
+                "overflow": self.counts[-1],
+                }
+
+
+def get_loopback_key(byte_repr) -> bytes:
+    """ helper for the content of a frame, can_id, length and data, without the flags byte
+        that the kernel may change on the echo of a CAN FD frame
+    """
+    return bytes(byte_repr[:5]) + bytes(byte_repr[8:])
+
+
+class SocketMetrics:
+    """ The statistics of a socket
+
+        frames are datagrams, i.e. frames on a raw socket, bcm messages on a bcm socket and pdus on an isotp socket.
+
+        kernel_drops is the number of frames the kernel dropped because the receive queue of the socket was full,
+        it is only available on a raw socket.
+        tx_rejected is the number of send attempts the kernel rejected with ENOBUFS or EAGAIN because
+        the tx queue of the interface or the socket buffer was full.
+        tx_lost is the number of frames send_batch() gave up on.
+
+        rx_latency is the time from the kernel receive timestamp to the receive call, it requires timestamping.
+        loopback_latency is the time from sending a frame to receiving it back with recv_own_msgs,
+        it requires set_recv_own_msgs(True). Without timestamping, the time of the receive call is taken,
+        which adds the time the frame waited in the receive queue.
+        An echo is matched to its send time by the content of the frame.
+    """
+
+    def __init__(self):
+        self.rx_latency = LatencyHistogram()
+        self.loopback_latency = LatencyHistogram()
+        # the content and send time of frames that are expected to come back, bounded in case they never do
+        self.pending_loopback = deque(maxlen=1024)
+        self.reset()
+
+    def reset(self):
+        """ clear all values """
+        self.frames_in = 0
+        self.bytes_in = 0
+        self.frames_out = 0
+        self.bytes_out = 0
+        self.kernel_drops = 0
+        self.tx_rejected = 0
+        self.tx_lost = 0
+        self.rx_latency.reset()
+        self.loopback_latency.reset()
+        self.pending_loopback.clear()
+
+    def add_rx(self,
+               nframes: int,
+               nbytes: int,
+               ancdata=None):
+        """ count received frames
+
+            @param nframes: the number of frames
+            @param nbytes: the number of bytes
+            @param ancdata: the ancillary data of the last frame to read the kernel drop counter from
+        """
+        self.frames_in += nframes
+        self.bytes_in += nbytes
+        if ancdata:
+            drops = drops_from_ancdata(ancdata)
+            if drops is not None:
+                self.kernel_drops = drops
+
+    def add_pending_loopback(self,
+                             byte_repr,
+                             send_time: float):
+        """ remember a sent frame to match its echo
+
+            @param byte_repr: the bytes of the sent frame
+            @param send_time: the time of sending
+        """
+        self.pending_loopback.append((get_loopback_key(byte_repr), send_time))
+
+    def add_loopback(self,
+                     byte_repr,
+                     receive_time: float) -> bool:
+        """ match an echo of a sent frame and add its latency
+
+            Echoes arrive in the order of sending, pending frames before the match did not come back and are dropped.
+
+            @param byte_repr: the bytes of the received echo
+            @param receive_time: the receive timestamp of the echo
+            @return: True if a sent frame matched
+        """
+        key = get_loopback_key(byte_repr)
+        pending = self.pending_loopback
+        for idx, (pending_key, send_time) in enumerate(pending):
+            if pending_key == key:
+                for _ in range(idx + 1):
+                    pending.popleft()
+                self.loopback_latency.add(receive_time - send_time)
+                return True
+        return False
+
+    def add_tx(self,
+               nframes: int,
+               nbytes: int):
+        """ count sent frames """
+        self.frames_out += nframes
+        self.bytes_out += nbytes
+
+    def snapshot(self) -> dict:
+        """ return the statistics as dict """
+        return {"frames_in": self.frames_in,
+                "bytes_in": self.bytes_in,
+                "frames_out": self.frames_out,
+                "bytes_out": self.bytes_out,
+                "kernel_drops": self.kernel_drops,
+                "tx_rejected": self.tx_rejected,
+                "tx_lost": self.tx_lost,
+                "rx_latency": self.rx_latency.to_dict(),
+                "loopback_latency": self.loopback_latency.to_dict(),
+                }
@@ -0,0 +1,365 @@
+""" Mmsg
+
+    Batched datagram receive and transmit with preallocated buffers via recvmmsg / sendmmsg
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import socket
+import struct
+import time
+
+import logging
+logger = logging.getLogger("socketcan.mmsg")
+
+
+class IoVec(ctypes.Structure):
+    """ struct iovec """
+    _fields_ = [("iov_base", ctypes.c_void_p),
+                ("iov_len", ctypes.c_size_t),
+                ]
+
+
+class MsgHdr(ctypes.Structure):
+    """ struct msghdr """
+    _fields_ = [("msg_name", ctypes.c_void_p),
+                ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(IoVec)),
+                ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p),
+                ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int),
+                ]
+
+
+class MMsgHdr(ctypes.Structure):
+    """ struct mmsghdr """
+    _fields_ = [("msg_hdr", MsgHdr),
+                ("msg_len", ctypes.c_uint),
+                ]
+
+
+def _load_libc():
+    """ helper to load libc with recvmmsg and sendmmsg, returns None if not available """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        recvmmsg = libc.recvmmsg
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        logger.info("recvmmsg / sendmmsg are not available, falling back to recv_into / send")
+        return None
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    recvmmsg.restype = ctypes.c_int
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return libc
+
+
+libc = _load_libc()
+
+# struct cmsghdr, size_t cmsg_len, int cmsg_level, int cmsg_type
+CMSGHDR = struct.Struct("@Nii")
+CMSG_ALIGN = ctypes.sizeof(ctypes.c_size_t)
+
+
+def cmsg_align(length: int) -> int:
+    """ helper to align a length to the cmsg boundary """
+    return (length + CMSG_ALIGN - 1) & ~(CMSG_ALIGN - 1)
+
+
+def parse_cmsgs(buffer, offset: int, length: int) -> list:
+    """ parse the control messages in a control buffer
+
+        @param buffer: the control buffer
+        @param offset: the start of the control messages in buffer
+        @param length: the msg_controllen the kernel returned
+        @return: a list of (cmsg_level, cmsg_type, cmsg_data) like socket.recvmsg() returns
+    """
+    ancdata = []
+    end = offset + length
+    while offset + CMSGHDR.size <= end:
+        cmsg_len, cmsg_level, cmsg_type = CMSGHDR.unpack_from(buffer, offset)
+        if cmsg_len < CMSGHDR.size:
+            break
+        ancdata.append((cmsg_level, cmsg_type, bytes(buffer[offset + cmsg_align(CMSGHDR.size):offset + cmsg_len])))
+        offset += cmsg_align(cmsg_len)
+    return ancdata
+
+
+def buffer_address(buffer: bytearray, offset: int = 0):
+    """ helper to get the memory address of a bytearray for use in ctypes structures """
+    return ctypes.addressof(ctypes.c_char.from_buffer(buffer, offset))
+
+
+class MmsgReceiver:
+    """ A receiver that fills a preallocated buffer with datagrams, one datagram per slot
+
+        The buffer is reused on every call, so the received data is only valid until the next call.
+        Uses recvmmsg to receive all slots with one syscall if libc provides it, otherwise
+        falls back to a recv_into loop on the same buffer.
+
+        @param sock: the socket to receive from
+        @param slot_size: the size of a slot, the maximum size of a datagram
+        @param nslots: the number of slots
+        @param use_recvmmsg: use recvmmsg if available
+        @param ancbufsize: the size of the ancillary data buffer per slot, 0 to not receive ancillary data
+    """
+
+    def __init__(self,
+                 sock: socket.socket,
+                 slot_size: int,
+                 nslots: int,
+                 use_recvmmsg: bool = True,
+                 ancbufsize: int = 0,
+                 ):
+        self.sock = sock
+        self.slot_size = slot_size
+        self.nslots = nslots
+        self.buffer = bytearray(slot_size * nslots)
+        self.view = memoryview(self.buffer)
+        self.lengths = [0] * nslots
+        # the msg_flags of each datagram, e.g. MSG_CONFIRM for the echo of a frame sent by the same socket
+        self.msg_flags = [0] * nslots
+        self.ancbufsize = ancbufsize
+        self.control = bytearray(ancbufsize * nslots)
+        self.controllens = [0] * nslots
+        self.ancdata = [[] for idx in range(nslots)]
+        self.poller = select.poll()
+        self.poller.register(sock.fileno(), select.POLLIN)
+        self.msgs = None
+        if use_recvmmsg and (libc is not None):
+            self._setup_msgs()
+
+    def _setup_msgs(self):
+        """ set up the mmsghdr array pointing into the buffer """
+        self.iovecs = (IoVec * self.nslots)()
+        self.msgs = (MMsgHdr * self.nslots)()
+        base = buffer_address(self.buffer)
+        for idx in range(self.nslots):
+            self.iovecs[idx].iov_base = base + (idx * self.slot_size)
+            self.iovecs[idx].iov_len = self.slot_size
+            self.msgs[idx].msg_hdr.msg_iov = ctypes.pointer(self.iovecs[idx])
+            self.msgs[idx].msg_hdr.msg_iovlen = 1
+        if self.ancbufsize:
+            control_base = buffer_address(self.control)
+            for idx in range(self.nslots):
+                self.msgs[idx].msg_hdr.msg_control = control_base + (idx * self.ancbufsize)
+
+    def wait(self, timeout: float = None) -> bool:
+        """ wait until the socket is readable
+
+            @param timeout: the timeout in seconds, None blocks forever
+            @return: True if readable
+        """
+        if timeout is None:
+            timeout_ms = -1
+        else:
+            timeout_ms = max(int(timeout * 1000), 0)
+        return bool(self.poller.poll(timeout_ms))
+
+    def recv(self, max_msgs: int = None, timeout: float = None) -> int:
+        """ receive up to max_msgs datagrams into the buffer
+
+            Waits for the first datagram up to timeout, then takes
+            whatever else is queued without blocking.
+
+            @param max_msgs: the maximum number of datagrams, defaults to nslots
+            @param timeout: the timeout in seconds, None blocks forever
+            @return: the number of datagrams received, the sizes are in lengths
+        """
+        if max_msgs is None or max_msgs > self.nslots:
+            max_msgs = self.nslots
+        if not self.wait(timeout):
+            return 0
+        if self.msgs is not None:
+            return self._recvmmsg(max_msgs)
+        return self._recv_into(max_msgs)
+
+    def get_ancdata(self, idx: int) -> list:
+        """ return the ancillary data of a received datagram
+
+            @param idx: the slot index
+            @return: a list of (cmsg_level, cmsg_type, cmsg_data) like socket.recvmsg() returns
+        """
+        if self.msgs is not None:
+            return parse_cmsgs(self.control, idx * self.ancbufsize, self.controllens[idx])
+        return self.ancdata[idx]
+
+    def _recvmmsg(self, max_msgs: int) -> int:
+        """ receive with one recvmmsg syscall """
+        msgs = self.msgs
+        if self.ancbufsize:
+            # the kernel overwrites msg_controllen with the used length
+            for idx in range(max_msgs):
+                msgs[idx].msg_hdr.msg_controllen = self.ancbufsize
+        nmsgs = libc.recvmmsg(self.sock.fileno(), msgs, max_msgs, socket.MSG_DONTWAIT, None)
+        if nmsgs < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return 0
+            raise OSError(err, os.strerror(err))
+        for idx in range(nmsgs):
+            self.lengths[idx] = msgs[idx].msg_len
+            self.msg_flags[idx] = msgs[idx].msg_hdr.msg_flags
+        if self.ancbufsize:
+            for idx in range(nmsgs):
+                self.controllens[idx] = msgs[idx].msg_hdr.msg_controllen
+        return nmsgs
+
+    def _recv_into(self, max_msgs: int) -> int:
+        """ receive with a recv_into loop, or a recvmsg_into loop for ancillary data """
+        sock = self.sock
+        slot_size = self.slot_size
+        ancbufsize = self.ancbufsize
+        view = self.view
+        nmsgs = 0
+        # python polls a socket with a timeout for the full timeout before every call,
+        # regardless of MSG_DONTWAIT, so the socket is non-blocking for the loop
+        previous_timeout = sock.gettimeout()
+        if previous_timeout:
+            sock.setblocking(False)
+        try:
+            for idx in range(max_msgs):
+                offset = idx * slot_size
+                try:
+                    if ancbufsize:
+                        self.lengths[idx], self.ancdata[idx], self.msg_flags[idx], _ = sock.recvmsg_into(
+                            [view[offset:offset + slot_size]], ancbufsize, socket.MSG_DONTWAIT)
+                    else:
+                        self.lengths[idx] = sock.recv_into(view[offset:offset + slot_size], slot_size,
+                                                           socket.MSG_DONTWAIT)
+                except BlockingIOError:
+                    break
+                nmsgs += 1
+        finally:
+            if previous_timeout:
+                sock.settimeout(previous_timeout)
+        return nmsgs
+
+
+class MmsgSender:
+    """ A sender that transmits datagrams from a preallocated buffer, one datagram per slot
+
+        The caller writes the datagrams into buffer and sets lengths, then calls send().
+        Uses sendmmsg to send all slots with one syscall if libc provides it, otherwise
+        falls back to a send loop on the same buffer.
+
+        @param sock: the socket to send to
+        @param slot_size: the size of a slot, the maximum size of a datagram
+        @param nslots: the number of slots
+        @param use_sendmmsg: use sendmmsg if available, a socket with the attribute use_sendmmsg set to False
+                             opts out, e.g. a VirtualSocket that routes every send in python
+        @param retry_delay: the initial delay between retries while the kernel returns ENOBUFS
+        @param max_retry_delay: the upper limit of the delay, it doubles on every retry
+    """
+
+    def __init__(self,
+                 sock: socket.socket,
+                 slot_size: int,
+                 nslots: int,
+                 use_sendmmsg: bool = True,
+                 retry_delay: float = 0.0005,
+                 max_retry_delay: float = 0.02,
+                 ):
+        self.sock = sock
+        self.slot_size = slot_size
+        self.nslots = nslots
+        self.buffer = bytearray(slot_size * nslots)
+        self.view = memoryview(self.buffer)
+        self.lengths = [slot_size] * nslots
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.retries = 0
+        self.poller = select.poll()
+        self.poller.register(sock.fileno(), select.POLLOUT)
+        self.msgs = None
+        if use_sendmmsg and (libc is not None) and getattr(sock, "use_sendmmsg", True):
+            self._setup_msgs()
+
+    def _setup_msgs(self):
+        """ set up the mmsghdr array pointing into the buffer """
+        self.iovecs = (IoVec * self.nslots)()
+        self.msgs = (MMsgHdr * self.nslots)()
+        base = buffer_address(self.buffer)
+        for idx in range(self.nslots):
+            self.iovecs[idx].iov_base = base + (idx * self.slot_size)
+            self.msgs[idx].msg_hdr.msg_iov = ctypes.pointer(self.iovecs[idx])
+            self.msgs[idx].msg_hdr.msg_iovlen = 1
+
+    def send(self, nmsgs: int, timeout: float = 1) -> int:
+        """ send the first nmsgs slots of the buffer
+
+            While the kernel rejects datagrams with ENOBUFS or EAGAIN, the remaining slots
+            are retried after waiting for the socket to become writable and an increasing delay,
+            because a full tx queue of a CAN interface does not reliably clear POLLOUT.
+
+            @param nmsgs: the number of slots to send
+            @param timeout: the time to retry at most, 0 to not retry at all
+            @return: the number of datagrams the kernel accepted
+        """
+        deadline = time.monotonic() + timeout
+        delay = self.retry_delay
+        sent = 0
+        while sent < nmsgs:
+            if self.msgs is not None:
+                count = self._sendmmsg(sent, nmsgs - sent)
+            else:
+                count = self._send(sent, nmsgs - sent)
+            if count:
+                sent += count
+                delay = self.retry_delay
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self.retries += 1
+            self.poller.poll(max(int(remaining * 1000), 0))
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, self.max_retry_delay)
+        return sent
+
+    def _sendmmsg(self, start: int, count: int) -> int:
+        """ send with one sendmmsg syscall """
+        for idx in range(start, start + count):
+            self.iovecs[idx].iov_len = self.lengths[idx]
+        nmsgs = libc.sendmmsg(self.sock.fileno(), ctypes.byref(self.msgs, start * ctypes.sizeof(MMsgHdr)),
+                              count, socket.MSG_DONTWAIT)
+        if nmsgs < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                return 0
+            raise OSError(err, os.strerror(err))
+        return nmsgs
+
+    def _send(self, start: int, count: int) -> int:
+        """ send with a send loop """
+        sock = self.sock
+        slot_size = self.slot_size
+        view = self.view
+        nmsgs = 0
+        # python polls a socket with a timeout for the full timeout before every call,
+        # regardless of MSG_DONTWAIT, so the socket is non-blocking for the loop
+        previous_timeout = sock.gettimeout()
+        if previous_timeout:
+            sock.setblocking(False)
+        try:
+            for idx in range(start, start + count):
+                offset = idx * slot_size
+                try:
+                    sock.send(view[offset:offset + self.lengths[idx]], socket.MSG_DONTWAIT)
+                except BlockingIOError:
+                    break
+                except OSError as e:
+                    if e.errno != errno.ENOBUFS:
+                        raise
+                    break
+                nmsgs += 1
+        finally:
+            if previous_timeout:
+                sock.settimeout(previous_timeout)
+        return nmsgs
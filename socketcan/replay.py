@@ -0,0 +1,251 @@
+""" Replay
+
+    Replay of recorded CAN traffic with accurate inter-frame timing
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import math
+import time
+
+from itertools import chain, islice
+from typing import Callable, Iterable, List, Tuple
+
+from socketcan.socketcan import BcmMsg, BcmOpCodes, CanBcmSocket, CanFrame
+
+import logging
+logger = logging.getLogger("socketcan.replay")
+
+
+class ReplayStatistics:
+    """ Timing error statistics of a replay, the error is the actual minus the scheduled send time
+
+        The values are accumulated in constant memory, so a replay can run for hours.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.late = 0
+
+    def add(self, error: float, late_threshold: float = 0.001):
+        """ add a timing error
+
+            @param error: the timing error in seconds
+            @param late_threshold: the error from which on a frame is counted as late
+        """
+        self.count += 1
+        delta = error - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (error - self.mean)
+        self.min = min(self.min, error)
+        self.max = max(self.max, error)
+        if error > late_threshold:
+            self.late += 1
+
+    @property
+    def stddev(self) -> float:
+        """ the standard deviation of the timing error """
+        if self.count < 2:
+            return 0.0
+        return math.sqrt(self.m2 / (self.count - 1))
+
+    def to_dict(self) -> dict:
+        """ return the statistics as dict """
+        return {"count": self.count,
+                "mean": self.mean,
+                "stddev": self.stddev,
+                "min": self.min if self.count else 0.0,
+                "max": self.max if self.count else 0.0,
+                "late": self.late,
+                }
+
+
+def find_cyclic_frames(frames: List[CanFrame],
+                       min_count: int = 10,
+                       tolerance: float = 0.05) -> dict:
+    """ find the can_ids that are sent with constant data at a constant interval
+
+        @param frames: the timestamped frames of a trace
+        @param min_count: the minimum number of frames of a can_id
+        @param tolerance: the maximum deviation of an interval from the mean interval, relative to the mean interval
+        @return: a dictionary of can_id to (first frame, mean interval)
+    """
+    by_id = {}
+    for frame in frames:
+        by_id.setdefault(frame.can_id, []).append(frame)
+    cyclic = {}
+    for can_id, id_frames in by_id.items():
+        if len(id_frames) < min_count or any(frame != id_frames[0] for frame in id_frames):
+            continue
+        intervals = [frame2.timestamp - frame1.timestamp for frame1, frame2 in zip(id_frames, id_frames[1:])]
+        interval = sum(intervals) / len(intervals)
+        if interval > 0 and all(abs(val - interval) <= (interval * tolerance) for val in intervals):
+            cyclic[can_id] = (id_frames[0], interval)
+    return cyclic
+
+
+class TraceReplayer:
+    """ Replay timestamped frames to a socket at their recorded inter-frame timing
+
+        Each frame is scheduled at an absolute deadline relative to the start of the replay,
+        so timing errors do not accumulate. The replayer sleeps until shortly before the deadline
+        and busy-spins for the remainder, which trades CPU time for accuracy.
+
+        @param sock: the socket to send to, e.g. a CanRawSocket
+        @param speed: the speed-up factor, 2 replays twice as fast
+        @param spin: the time before a deadline to stop sleeping and start spinning
+        @param bcm_sock: an optional CanBcmSocket to offload cyclic frames with constant data to the kernel
+        @param min_cyclic_count: the minimum number of frames of a can_id to offload it to bcm_sock
+        @param cyclic_prefix: the number of frames at the start of the trace to find cyclic frames in,
+                              a can_id whose data changes later is sent from the trace again
+        @param clock: the time source, time.perf_counter by default
+        @param sleep: the sleep function that goes with clock
+    """
+
+    def __init__(self,
+                 sock,
+                 speed: float = 1.0,
+                 spin: float = 0.0002,
+                 bcm_sock: CanBcmSocket = None,
+                 min_cyclic_count: int = 10,
+                 cyclic_prefix: int = 10000,
+                 clock: Callable[[], float] = time.perf_counter,
+                 sleep: Callable[[float], None] = time.sleep,
+                 ):
+        self.sock = sock
+        self.speed = speed
+        self.spin = spin
+        self.bcm_sock = bcm_sock
+        self.min_cyclic_count = min_cyclic_count
+        self.cyclic_prefix = cyclic_prefix
+        self.clock = clock
+        self.sleep = sleep
+        self.statistics = ReplayStatistics()
+        self.cyclic_frames = {}
+
+    def wait_until(self, deadline: float) -> float:
+        """ wait until deadline, sleep first, then spin
+
+            @param deadline: the deadline on the clock
+            @return: the timing error, positive if late
+        """
+        clock = self.clock
+        remaining = deadline - clock()
+        if remaining > self.spin:
+            self.sleep(remaining - self.spin)
+        now = clock()
+        while now < deadline:
+            now = clock()
+        return now - deadline
+
+    def offload_cyclic(self, frames: List[CanFrame]):
+        """ start bcm cyclic transmissions for the can_ids with constant data and interval
+
+            @param frames: the timestamped frames of the start of a trace
+        """
+        cyclic = find_cyclic_frames(frames, min_count=self.min_cyclic_count)
+        for can_id, (frame, interval) in cyclic.items():
+            logger.info("offloading can_id %X with interval %f to bcm", can_id, interval)
+            self.bcm_sock.setup_cyclic_transmit(frame=frame,
+                                                interval=interval / self.speed)
+            self.cyclic_frames[can_id] = frame
+
+    def is_offloaded(self, frame: CanFrame) -> bool:
+        """ check if bcm_sock sends a frame
+
+            @param frame: a frame of the trace
+            @return: True if the frame is not to be sent to the socket
+        """
+        return self.cyclic_frames.get(frame.can_id) == frame
+
+    def stop_cyclic_id(self, can_id: int):
+        """ stop the bcm cyclic transmission of a can_id """
+        self.bcm_sock.send(BcmMsg(opcode=BcmOpCodes.TX_DELETE,
+                                  flags=0,
+                                  can_id=can_id,
+                                  frames=[],
+                                  ival2=0,
+                                  ))
+        del self.cyclic_frames[can_id]
+
+    def stop_cyclic(self):
+        """ stop the bcm cyclic transmissions """
+        for can_id in list(self.cyclic_frames):
+            self.stop_cyclic_id(can_id)
+
+    def replay(self,
+               frames: Iterable[CanFrame],
+               loops: int = 1,
+               loop_gap: float = 0) -> ReplayStatistics:
+        """ replay frames to the socket
+
+            @param frames: timestamped frames in time order, e.g. from a CandumpLogReader,
+                           must be iterable repeatedly for loops > 1
+            @param loops: the number of repetitions, 0 repeats forever
+            @param loop_gap: the time between the last frame of a loop and the first frame of the next
+            @return: the timing error statistics
+        """
+        self.cyclic_frames = {}
+        first_loop = frames
+        if self.bcm_sock is not None:
+            # only a prefix is read ahead, so a trace of any length is streamed
+            iterator = iter(frames)
+            prefix = list(islice(iterator, self.cyclic_prefix))
+            self.offload_cyclic(prefix)
+            first_loop = chain(prefix, iterator)
+        start = self.clock()
+        offset = 0.0
+        loop = 0
+        try:
+            while (loops == 0) or (loop < loops):
+                end, nframes = self.replay_loop(first_loop if loop == 0 else frames, start=start, offset=offset)
+                offset = end + loop_gap
+                loop += 1
+                if not nframes:
+                    # an empty trace would repeat forever without ever waiting
+                    logger.warning("no frames to replay in loop %d, stop", loop)
+                    break
+            if self.cyclic_frames:
+                # bcm_sock sends until the end of the trace
+                self.wait_until(start + (end / self.speed))
+        finally:
+            if self.cyclic_frames:
+                self.stop_cyclic()
+        return self.statistics
+
+    def replay_loop(self,
+                    frames: Iterable[CanFrame],
+                    start: float,
+                    offset: float) -> Tuple[float, int]:
+        """ replay a single loop
+
+            The frames that bcm_sock sends are skipped but keep their place in time,
+            so the loop starts with the first frame and ends with the last frame of the trace.
+
+            @param frames: timestamped frames in time order
+            @param start: the start of the replay on the clock
+            @param offset: the offset of this loop in trace time
+            @return: the offset of the last frame in trace time and the number of frames in the loop
+        """
+        first = None
+        trace_time = offset
+        nframes = 0
+        for frame in frames:
+            nframes += 1
+            if first is None:
+                first = frame.timestamp
+            trace_time = offset + frame.timestamp - first
+            if self.cyclic_frames and self.is_offloaded(frame):
+                continue
+            error = self.wait_until(start + (trace_time / self.speed))
+            if frame.can_id in self.cyclic_frames:
+                # a can_id whose data changes is stopped and replayed again
+                logger.info("can_id %X changed its data, stop offloading it", frame.can_id)
+                self.stop_cyclic_id(frame.can_id)
+            self.sock.send(frame)
+            self.statistics.add(error)
+        return trace_time, nframes
@@ -0,0 +1,308 @@
+""" Scheduler
+
+    Manage many cyclic transmissions of the broadcast manager and update their data in place,
+    e.g. to simulate an ECU with hundreds of cyclic messages that carry counters and checksums.
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import socket
+import struct
+import time
+
+from typing import Dict, List, Sequence, Union
+
+from socketcan.mmsg import MmsgSender
+from socketcan.socketcan import BCMFlags, BcmMsg, BcmOpCodes, CanBcmSocket, CanFdFrame, CanFrame, CAN_EFF_FLAG, \
+    CAN_SFF_MASK
+
+import logging
+logger = logging.getLogger("socketcan.scheduler")
+
+# the offset and format of the flags in the bcm_msg_head
+BCM_FLAGS = struct.Struct("I")
+BCM_FLAGS_OFFSET = 4
+
+
+class CyclicJob:
+    """ A cyclic transmission of the broadcast manager
+
+        The job keeps the TX_SETUP message that updates its frames as a preallocated buffer,
+        an update packs the new data into that buffer and sends it without a timer,
+        so the kernel replaces the data and keeps the timing.
+
+        @param can_id: the can id of the job
+        @param frames: the frames, the kernel sends one per interval and starts over after the last one
+        @param interval: the interval between two frames in seconds
+        @param count: the number of frames to send with ival1 before continuing with interval, 0 to not do so
+        @param ival1: the interval of the first count frames
+    """
+
+    def __init__(self,
+                 can_id: int,
+                 frames: Sequence[CanFrame],
+                 interval: float,
+                 count: int = 0,
+                 ival1: float = 0,
+                 ):
+        if not 0 < len(frames) <= CanBcmSocket.MAX_NFRAMES:
+            raise ValueError("A cyclic job takes 1 to {0} frames".format(CanBcmSocket.MAX_NFRAMES))
+        self.can_id = can_id
+        self.interval = interval
+        self.count = count
+        self.ival1 = ival1
+        self.flags = 0
+        if isinstance(frames[0], CanFdFrame):
+            self.flags = BCMFlags.CAN_FD_FRAME
+        self.frame_size = frames[0].get_size()
+        if any(frame.get_size() != self.frame_size for frame in frames):
+            raise ValueError("A cyclic job takes either CanFrames or CanFdFrames")
+        self.nframes = len(frames)
+        update = BcmMsg(opcode=BcmOpCodes.TX_SETUP,
+                        flags=self.flags,
+                        can_id=self.get_bcm_can_id(),
+                        frames=frames,
+                        count=0,
+                        ival2=0,
+                        )
+        self.buffer = update.to_bytes()
+        self.dirty = False
+
+    def get_bcm_can_id(self) -> int:
+        """ the can id with CAN_EFF_FLAG for extended can ids like the kernel expects it """
+        if self.can_id > CAN_SFF_MASK:
+            return self.can_id | CAN_EFF_FLAG
+        return self.can_id
+
+    def get_setup_msg(self) -> BcmMsg:
+        """ the TX_SETUP message that starts the job """
+        return BcmMsg(opcode=BcmOpCodes.TX_SETUP,
+                      flags=(self.flags | BCMFlags.SETTIMER | BCMFlags.STARTTIMER),
+                      can_id=self.get_bcm_can_id(),
+                      frames=self.get_frames(),
+                      count=self.count,
+                      ival1=self.ival1,
+                      ival2=self.interval,
+                      )
+
+    def get_frames(self) -> List[CanFrame]:
+        """ the frames as they are sent with the next update """
+        return BcmMsg.unpack_from(self.buffer).frames
+
+    def set_frame(self,
+                  frame: CanFrame,
+                  index: int = 0):
+        """ pack a frame into the update buffer
+
+            @param frame: the new frame, it must be of the same type as the other frames of the job
+            @param index: the index of the frame in the sequence
+        """
+        if not 0 <= index < self.nframes:
+            raise IndexError("The job has {0} frames".format(self.nframes))
+        if frame.get_size() != self.frame_size:
+            raise ValueError("The frame does not match the type of the job")
+        frame.pack_into(self.buffer, BcmMsg.get_size() + (index * self.frame_size))
+        self.dirty = True
+
+    def set_update_flags(self, flags: int):
+        """ set the flags of the next update, e.g. TX_ANNOUNCE or TX_RESET_MULTI_IDX """
+        BCM_FLAGS.pack_into(self.buffer, BCM_FLAGS_OFFSET, self.flags | flags)
+
+
+class CyclicScheduler:
+    """ Track the cyclic transmissions of a bcm socket
+
+        Jobs are started with add_job() and deleted with delete_job() or close().
+        Data is either updated immediately with update() or staged with stage()
+        and sent for all jobs at once with flush(), which takes one sendmmsg syscall.
+
+        The socket should be used for transmissions only, read() discards other messages
+        while it waits for the answer of the kernel.
+
+        @param interface: the interface name, ignored if bcm_sock is given
+        @param bcm_sock: an existing CanBcmSocket to use
+    """
+
+    def __init__(self,
+                 interface: str = None,
+                 bcm_sock: CanBcmSocket = None,
+                 ):
+        self.own_sock = bcm_sock is None
+        if bcm_sock is None:
+            bcm_sock = CanBcmSocket(interface=interface)
+        self.bcm_sock = bcm_sock
+        self.jobs: Dict[int, CyclicJob] = {}
+        self.sender = None
+
+    def __contains__(self, can_id: int) -> bool:
+        return can_id in self.jobs
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add_job(self,
+                can_id: int,
+                frames: Union[bytes, Sequence[CanFrame]],
+                interval: float,
+                count: int = 0,
+                ival1: float = 0,
+                ) -> CyclicJob:
+        """ start a cyclic transmission, an existing job of can_id is replaced
+
+            @param can_id: the can id
+            @param frames: the data of a single frame or a sequence of frames, e.g. one per value of a rolling counter
+            @param interval: the interval between two frames in seconds
+            @param count: the number of frames to send with ival1 before continuing with interval, 0 to not do so
+            @param ival1: the interval of the first count frames
+            @return: the CyclicJob
+        """
+        if isinstance(frames, (bytes, bytearray)):
+            frames = [CanFrame(can_id=can_id, data=bytes(frames))]
+        job = CyclicJob(can_id=can_id, frames=frames, interval=interval, count=count, ival1=ival1)
+        if can_id in self.jobs:
+            self.delete_job(can_id)
+        self.bcm_sock.send(job.get_setup_msg())
+        self.jobs[can_id] = job
+        return job
+
+    def get_job(self, can_id: int) -> CyclicJob:
+        """ get the job of a can id """
+        return self.jobs[can_id]
+
+    def stage(self,
+              can_id: int,
+              data: bytes,
+              index: int = 0):
+        """ change the data of a frame of a job, it is sent with the next flush()
+
+            @param can_id: the can id of the job
+            @param data: the new data
+            @param index: the index of the frame in the sequence
+        """
+        job = self.jobs[can_id]
+        if job.flags & BCMFlags.CAN_FD_FRAME:
+            frame = CanFdFrame(can_id=can_id, data=data)
+        else:
+            frame = CanFrame(can_id=can_id, data=data)
+        job.set_frame(frame, index=index)
+
+    def update(self,
+               can_id: int,
+               data: bytes,
+               index: int = 0,
+               announce: bool = False,
+               reset_index: bool = False):
+        """ change the data of a frame of a job and send it to the kernel
+
+            @param can_id: the can id of the job
+            @param data: the new data
+            @param index: the index of the frame in the sequence
+            @param announce: send the changed frame immediately in addition to the cyclic transmission
+            @param reset_index: continue the sequence with the first frame
+        """
+        self.stage(can_id=can_id, data=data, index=index)
+        flags = 0
+        if announce:
+            flags |= BCMFlags.TX_ANNOUNCE
+        if reset_index:
+            flags |= BCMFlags.TX_RESET_MULTI_IDX
+        job = self.jobs[can_id]
+        job.set_update_flags(flags)
+        self.bcm_sock.send_raw(job.buffer)
+        job.set_update_flags(0)
+        job.dirty = False
+
+    def flush(self, timeout: float = 1) -> int:
+        """ send the updates of all staged jobs with one syscall
+
+            @param timeout: the time to retry while the socket buffer is full
+            @return: the number of updated jobs
+        """
+        dirty = [job for job in self.jobs.values() if job.dirty]
+        if not dirty:
+            return 0
+        slot_size = max(len(job.buffer) for job in dirty)
+        if self.sender is None or self.sender.slot_size < slot_size or self.sender.nslots < len(dirty):
+            if self.sender is not None:
+                slot_size = max(slot_size, self.sender.slot_size)
+            self.sender = MmsgSender(sock=self.bcm_sock.s,
+                                     slot_size=slot_size,
+                                     nslots=len(self.jobs))
+        sender = self.sender
+        for idx, job in enumerate(dirty):
+            size = len(job.buffer)
+            offset = idx * sender.slot_size
+            sender.view[offset:offset + size] = job.buffer
+            sender.lengths[idx] = size
+        sent = sender.send(len(dirty), timeout=timeout)
+        if self.bcm_sock.metrics is not None:
+            self.bcm_sock.metrics.add_tx(sent, sum(sender.lengths[:sent]))
+        for job in dirty[:sent]:
+            job.dirty = False
+        if sent < len(dirty):
+            logger.warning("%d of %d updates were not sent", len(dirty) - sent, len(dirty))
+        return sent
+
+    def read(self, can_id: int, timeout: float = 1) -> BcmMsg:
+        """ read a job back from the kernel
+
+            @param can_id: the can id of the job
+            @param timeout: the time to wait for the TX_STATUS message
+            @return: the TX_STATUS message with the frames and intervals the kernel uses
+            @raise TimeoutError: if there is no TX_STATUS message within timeout
+        """
+        job = self.jobs[can_id]
+        bcm_can_id = job.get_bcm_can_id()
+        self.bcm_sock.send(BcmMsg(opcode=BcmOpCodes.TX_READ,
+                                  flags=job.flags,
+                                  can_id=bcm_can_id,
+                                  frames=[],
+                                  ival2=0,
+                                  ))
+        previous_timeout = self.bcm_sock.s.gettimeout()
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("No TX_STATUS for can_id {0:X} within timeout".format(can_id))
+                self.bcm_sock.s.settimeout(remaining)
+                try:
+                    bcm_msg = self.bcm_sock.recv()
+                except socket.timeout:
+                    raise TimeoutError("No TX_STATUS for can_id {0:X} within timeout".format(can_id))
+                if bcm_msg.opcode == BcmOpCodes.TX_STATUS and bcm_msg.can_id == bcm_can_id:
+                    return bcm_msg
+                logger.debug("discarding bcm message with opcode %d for can_id %X", bcm_msg.opcode, bcm_msg.can_id)
+        finally:
+            # the socket may have a timeout of the caller
+            self.bcm_sock.s.settimeout(previous_timeout)
+
+    def delete_job(self, can_id: int):
+        """ stop a cyclic transmission
+
+            @param can_id: the can id of the job
+        """
+        job = self.jobs.pop(can_id)
+        self.bcm_sock.send(BcmMsg(opcode=BcmOpCodes.TX_DELETE,
+                                  flags=job.flags,
+                                  can_id=job.get_bcm_can_id(),
+                                  frames=[],
+                                  ival2=0,
+                                  ))
+
+    def close(self):
+        """ stop all cyclic transmissions, the socket is closed if the scheduler created it """
+        for can_id in list(self.jobs):
+            try:
+                self.delete_job(can_id)
+            except OSError as e:
+                logger.warning("could not delete job of can_id %X: %s", can_id, e)
+        if self.own_sock:
+            self.bcm_sock.s.close()
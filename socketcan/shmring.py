@@ -0,0 +1,419 @@
+""" Shmring
+
+    A single producer multi consumer ring buffer of CAN frames in shared memory,
+    to fan out received frames to worker processes without pickling. Requires python >= 3.8,
+    the module imports on python 3.7 but raises ImportError on use.
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import math
+import struct
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from socketcan.socketcan import CanFrame, CanFrameBatch, CanRawSocket
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # shared_memory is new in python 3.8
+    shared_memory = None
+
+import logging
+logger = logging.getLogger("socketcan.shmring")
+
+
+class ShmRingHeader:
+    """ The header at the start of the shared memory
+
+        @param nslots: the number of frames the ring holds
+        @param max_readers: the number of reader positions
+        @param write_seq: the number of frames written so far
+    """
+
+    MAGIC = b"SCANRING"
+    FORMAT = "=8sIIQII"
+    STRUCT = struct.Struct(FORMAT)
+    # the header is followed by the reader positions at this offset, a cache line
+    READERS_OFFSET = 64
+    WRITE_SEQ = struct.Struct("=Q")
+    WRITE_SEQ_OFFSET = 16
+    # the sequence up to which the writer may be overwriting slots, it leads write_seq during a write
+    CLAIM_SEQ_OFFSET = STRUCT.size
+
+    def __init__(self,
+                 nslots: int,
+                 max_readers: int,
+                 write_seq: int = 0,
+                 ):
+        self.nslots = nslots
+        self.max_readers = max_readers
+        self.write_seq = write_seq
+
+    def to_bytes(self):
+        """ return the byte representation of the header """
+        return self.STRUCT.pack(self.MAGIC, self.nslots, CanFrame.get_size(), self.write_seq, self.max_readers, 0)
+
+    @classmethod
+    def from_bytes(cls, byte_repr: bytes):
+        """ factory to create instance from bytes representation """
+        magic, nslots, frame_size, write_seq, max_readers, _ = cls.STRUCT.unpack_from(byte_repr)
+        if magic != cls.MAGIC:
+            raise ValueError("Not a socketcan ring {0}".format(magic))
+        if frame_size != CanFrame.get_size():
+            raise ValueError("Unsupported frame size {0}".format(frame_size))
+        return cls(nslots=nslots, max_readers=max_readers, write_seq=write_seq)
+
+    @property
+    def frames_offset(self) -> int:
+        """ the offset of the frames, after the reader positions, aligned to a cache line """
+        return self.READERS_OFFSET + (math.ceil(self.max_readers * 8 / 64) * 64)
+
+    @property
+    def timestamps_offset(self) -> int:
+        """ the offset of the timestamps, after the frames """
+        return self.frames_offset + (self.nslots * CanFrame.get_size())
+
+    @property
+    def total_size(self) -> int:
+        """ the size of the shared memory """
+        return self.timestamps_offset + (self.nslots * 8)
+
+
+def get_shared_memory_module():
+    """ return the shared_memory module, raise ImportError on python < 3.8 """
+    if shared_memory is None:
+        raise ImportError("ShmRing requires multiprocessing.shared_memory of python >= 3.8")
+    return shared_memory
+
+
+def attach_shared_memory(name: str) -> "shared_memory.SharedMemory":
+    """ attach to an existing shared memory without handing it to the resource tracker of this process,
+        which would unlink it when a reader process exits, track is available from python 3.13 on
+    """
+    get_shared_memory_module()
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+class ShmRing:
+    """ The shared part of ShmRingWriter and ShmRingReader
+
+        The frames are stored in CanFrame.FORMAT as consecutive records, the timestamps as a separate
+        column of doubles, NaN if there is none. This way a batch of frames from CanRawSocket.recv_batch_raw()
+        is copied with one slice assignment and read back as one memoryview or CanFrameBatch.
+
+        There are no locks. Like a seqlock, the writer publishes claim_seq before it overwrites slots
+        and write_seq after the frames are written, each reader publishes its read position.
+        A reader checks claim_seq after copying, a frame of a slot the writer claimed meanwhile may be torn.
+    """
+
+    def __init__(self,
+                 shm: "shared_memory.SharedMemory",
+                 header: ShmRingHeader):
+        self.shm = shm
+        self.header = header
+        self.nslots = header.nslots
+        self.max_readers = header.max_readers
+        self.buf = shm.buf
+        frames_offset = header.frames_offset
+        timestamps_offset = header.timestamps_offset
+        self.frames = self.buf[frames_offset:timestamps_offset]
+        self.timestamps = self.buf[timestamps_offset:header.total_size].cast("d")
+
+    @property
+    def name(self) -> str:
+        """ the name of the shared memory, pass it to ShmRingReader """
+        return self.shm.name
+
+    def get_write_seq(self) -> int:
+        """ the number of frames written so far """
+        return ShmRingHeader.WRITE_SEQ.unpack_from(self.buf, ShmRingHeader.WRITE_SEQ_OFFSET)[0]
+
+    def get_claim_seq(self) -> int:
+        """ the number of frames written so far including those the writer is writing right now """
+        return ShmRingHeader.WRITE_SEQ.unpack_from(self.buf, ShmRingHeader.CLAIM_SEQ_OFFSET)[0]
+
+    def get_read_seq(self, reader_id: int) -> Optional[int]:
+        """ the read position of a reader, None if it is not registered """
+        value = ShmRingHeader.WRITE_SEQ.unpack_from(self.buf, ShmRingHeader.READERS_OFFSET + (reader_id * 8))[0]
+        if not value:
+            return None
+        return value - 1
+
+    def set_read_seq(self, reader_id: int, read_seq: Optional[int]):
+        """ publish the read position of a reader, None to unregister """
+        value = 0 if read_seq is None else read_seq + 1
+        ShmRingHeader.WRITE_SEQ.pack_into(self.buf, ShmRingHeader.READERS_OFFSET + (reader_id * 8), value)
+
+    def close(self):
+        """ release the views and detach from the shared memory """
+        self.frames.release()
+        self.timestamps.release()
+        self.buf = None
+        self.shm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ShmRingWriter(ShmRing):
+    """ The producer side, creates the shared memory
+
+        @param nslots: the number of frames the ring holds
+        @param max_readers: the number of readers that can report their position
+        @param name: the name of the shared memory, None for a random name
+    """
+
+    def __init__(self,
+                 nslots: int = 65536,
+                 max_readers: int = 16,
+                 name: str = None,
+                 ):
+        header = ShmRingHeader(nslots=nslots, max_readers=max_readers)
+        shm = get_shared_memory_module().SharedMemory(name=name, create=True, size=header.total_size)
+        shm.buf[:header.STRUCT.size] = header.to_bytes()
+        header.WRITE_SEQ.pack_into(shm.buf, header.CLAIM_SEQ_OFFSET, 0)
+        shm.buf[header.READERS_OFFSET:header.frames_offset] = bytes(header.frames_offset - header.READERS_OFFSET)
+        super().__init__(shm=shm, header=header)
+        self.write_seq = 0
+
+    def claim(self, nframes: int):
+        """ announce that the next nframes slots are about to be overwritten, call before writing them """
+        ShmRingHeader.WRITE_SEQ.pack_into(self.buf, ShmRingHeader.CLAIM_SEQ_OFFSET, self.write_seq + nframes)
+
+    def publish(self, nframes: int):
+        """ make nframes more frames visible to the readers """
+        self.write_seq += nframes
+        ShmRingHeader.WRITE_SEQ.pack_into(self.buf, ShmRingHeader.WRITE_SEQ_OFFSET, self.write_seq)
+
+    def write_raw(self,
+                  view: memoryview,
+                  timestamps: Optional[List[Optional[float]]] = None) -> int:
+        """ write consecutive frames in CanFrame.FORMAT
+
+            @param view: the frames, e.g. the return value of CanRawSocket.recv_batch_raw()
+            @param timestamps: the timestamps of the frames, None for no timestamps
+            @return: the number of frames written
+        """
+        frame_size = CanFrame.get_size()
+        nframes = len(view) // frame_size
+        if nframes > self.nslots:
+            raise ValueError("Cannot write {0} frames to a ring of {1} slots".format(nframes, self.nslots))
+        self.claim(nframes)
+        written = 0
+        while written < nframes:
+            slot = (self.write_seq + written) % self.nslots
+            count = min(nframes - written, self.nslots - slot)
+            self.frames[slot * frame_size:(slot + count) * frame_size] = \
+                view[written * frame_size:(written + count) * frame_size]
+            for idx in range(count):
+                timestamp = None
+                if timestamps is not None:
+                    timestamp = timestamps[written + idx]
+                self.timestamps[slot + idx] = math.nan if timestamp is None else timestamp
+            written += count
+        self.publish(nframes)
+        return nframes
+
+    def write_frames(self, frames: Iterable[CanFrame]) -> int:
+        """ write frames, only CanFrames, CanFdFrames do not fit into a slot
+
+            @param frames: the frames
+            @return: the number of frames written
+        """
+        frame_size = CanFrame.get_size()
+        nframes = 0
+        for frame in frames:
+            if frame.get_size() != frame_size:
+                raise ValueError("A ring holds only CanFrames")
+            slot = self.write_seq % self.nslots
+            self.claim(1)
+            frame.pack_into(self.frames, slot * frame_size)
+            self.timestamps[slot] = math.nan if frame.timestamp is None else frame.timestamp
+            self.publish(1)
+            nframes += 1
+        return nframes
+
+    def write_from_socket(self,
+                          sock: CanRawSocket,
+                          max_frames: int = 64,
+                          timeout: float = None) -> int:
+        """ receive frames from a socket and write them without unpacking
+
+            @param sock: a CanRawSocket without fd=True
+            @param max_frames: the maximum number of frames to receive
+            @param timeout: the time to wait for the first frame, None blocks forever
+            @return: the number of frames written
+        """
+        if sock.mtu != CanFrame.get_size():
+            raise ValueError("A ring holds only CanFrames")
+        view = sock.recv_batch_raw(max_frames=max_frames, timeout=timeout)
+        timestamps = None
+        if sock.timestamping is not None:
+            timestamps = sock.get_batch_timestamps(len(view) // CanFrame.get_size())
+        return self.write_raw(view, timestamps=timestamps)
+
+    def get_reader_lags(self) -> Dict[int, int]:
+        """ the number of frames each registered reader is behind the writer,
+            a lag larger than nslots means that the reader lost frames
+        """
+        write_seq = self.write_seq
+        lags = {}
+        for reader_id in range(self.max_readers):
+            read_seq = self.get_read_seq(reader_id)
+            if read_seq is not None:
+                lags[reader_id] = write_seq - read_seq
+        return lags
+
+    def check_readers(self, threshold: float = 0.5) -> List[int]:
+        """ report readers that fall behind
+
+            @param threshold: the fraction of the ring a reader may be behind
+            @return: the reader ids that are behind more than threshold, they are also logged
+        """
+        lagging = []
+        for reader_id, lag in self.get_reader_lags().items():
+            if lag > self.nslots * threshold:
+                logger.warning("reader %d is %d frames behind in a ring of %d", reader_id, lag, self.nslots)
+                lagging.append(reader_id)
+        return lagging
+
+    def close(self, unlink: bool = True):
+        """ release the shared memory
+
+            @param unlink: remove the shared memory, the readers keep their mapping until they close
+        """
+        super().close()
+        if unlink:
+            self.shm.unlink()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ShmRingReader(ShmRing):
+    """ A consumer side, attaches to the shared memory of a ShmRingWriter
+
+        Frames are returned as views into the shared memory, they are only valid until the writer
+        wraps around. A reader that falls more than nslots behind skips to the oldest frame
+        in the ring and counts the skipped frames in lost.
+
+        @param name: the name of the shared memory
+        @param reader_id: a unique id below max_readers to report the position to the writer,
+                          None to not report
+        @param start: "latest" to start with the next written frame, "oldest" for the oldest frame in the ring
+    """
+
+    def __init__(self,
+                 name: str,
+                 reader_id: Optional[int] = None,
+                 start: str = "latest",
+                 ):
+        shm = attach_shared_memory(name)
+        header = ShmRingHeader.from_bytes(bytes(shm.buf[:ShmRingHeader.STRUCT.size]))
+        super().__init__(shm=shm, header=header)
+        if reader_id is not None and not (0 <= reader_id < self.max_readers):
+            raise ValueError("reader_id must be below {0}".format(self.max_readers))
+        self.reader_id = reader_id
+        write_seq = self.get_write_seq()
+        if start == "latest":
+            self.read_seq = write_seq
+        elif start == "oldest":
+            self.read_seq = max(write_seq - self.nslots, 0)
+        else:
+            raise ValueError("Unknown start {0}".format(start))
+        self.lost = 0
+        self.last_seq = self.read_seq
+        self.report()
+
+    def report(self):
+        """ publish the read position to the writer """
+        if self.reader_id is not None:
+            self.set_read_seq(self.reader_id, self.read_seq)
+
+    @property
+    def lag(self) -> int:
+        """ the number of frames the reader is behind the writer """
+        return self.get_write_seq() - self.read_seq
+
+    def skip_lost(self, claim_seq: int):
+        """ move the read position to the oldest frame in the ring if the writer overtook the reader
+
+            @param claim_seq: the claim_seq of the writer, slots it claimed are lost too
+        """
+        lost = claim_seq - self.read_seq - self.nslots
+        if lost > 0:
+            logger.warning("reader %s lost %d frames", self.reader_id, lost)
+            self.lost += lost
+            self.read_seq += lost
+
+    def read_raw(self, max_frames: int = 64) -> Tuple[memoryview, memoryview]:
+        """ read up to max_frames frames as zero copy views
+
+            The views are contiguous, so fewer frames than available are returned at the end of the ring.
+            Call is_valid() after processing to check that the writer did not overwrite them meanwhile.
+
+            @param max_frames: the maximum number of frames
+            @return: a memoryview of consecutive frames in CanFrame.FORMAT and a memoryview of their timestamps
+        """
+        # claim_seq first, it leads write_seq, so a writer that laps the reader in between
+        # can not move read_seq past write_seq
+        claim_seq = self.get_claim_seq()
+        write_seq = self.get_write_seq()
+        self.skip_lost(claim_seq)
+        slot = self.read_seq % self.nslots
+        count = max(min(write_seq - self.read_seq, max_frames, self.nslots - slot), 0)
+        frame_size = CanFrame.get_size()
+        self.last_seq = self.read_seq
+        self.read_seq += count
+        self.report()
+        return self.frames[slot * frame_size:(slot + count) * frame_size], self.timestamps[slot:slot + count]
+
+    def is_valid(self) -> bool:
+        """ check that the writer did not start to overwrite the frames of the last read """
+        return self.get_claim_seq() - self.last_seq <= self.nslots
+
+    def read_frames(self, max_frames: int = 64) -> List[CanFrame]:
+        """ read up to max_frames frames as CanFrames
+
+            Frames that the writer claimed while they were unpacked may be torn, they are dropped and counted in lost.
+
+            @param max_frames: the maximum number of frames
+            @return: a list of CanFrames
+        """
+        view, timestamps = self.read_raw(max_frames=max_frames)
+        frame_size = CanFrame.get_size()
+        frames = []
+        for idx in range(len(timestamps)):
+            frame = CanFrame.unpack_from(view, idx * frame_size)
+            timestamp = timestamps[idx]
+            if timestamp == timestamp:
+                frame.timestamp = timestamp
+            frames.append(frame)
+        overwritten = self.get_claim_seq() - self.last_seq - self.nslots
+        if overwritten > 0:
+            self.lost += min(overwritten, len(frames))
+            frames = frames[overwritten:]
+        return frames
+
+    def read_batch(self, max_frames: int = 64) -> CanFrameBatch:
+        """ read up to max_frames frames as a CanFrameBatch on the shared memory, requires numpy
+
+            @param max_frames: the maximum number of frames
+            @return: a CanFrameBatch, call is_valid() after processing
+        """
+        view, timestamps = self.read_raw(max_frames=max_frames)
+        return CanFrameBatch.from_buffer(view, timestamps=timestamps)
+
+    def close(self):
+        """ unregister and detach from the shared memory """
+        if self.reader_id is not None:
+            self.set_read_seq(self.reader_id, None)
+        super().close()
@@ -5,13 +5,24 @@
     @license: GPL v3 
 """
 
-# TODO: Add CAN FD support
-
+import errno
+import select
 import socket
 import struct
+import time
 
+from collections import OrderedDict
 from enum import IntEnum
-from typing import Iterable
+from typing import Iterable, Iterator, List, Optional, Union
+
+from socketcan.metrics import SO_RXQ_OVFL, RXQ_OVFL, SocketMetrics
+from socketcan.mmsg import MmsgReceiver, MmsgSender
+
+try:
+    import numpy as np
+except ImportError:
+    # numpy is optional, only CanFrameBatch needs it
+    np = None
 
 
 import logging
@@ -23,17 +34,31 @@ class BcmOpCodes(IntEnum):
     TX_SETUP = 1
     TX_DELETE = 2
     TX_READ = 3
+    TX_SEND = 4
     RX_SETUP = 5
     RX_DELETE = 6
     RX_READ = 7
+    TX_STATUS = 8
+    TX_EXPIRED = 9
     RX_STATUS = 10
     RX_TIMEOUT = 11
     RX_CHANGED = 12
 
+
 class BCMFlags(IntEnum):
-    SETTIMER =     0x01
-    STARTTIMER =   0x02
+    SETTIMER = 0x01
+    STARTTIMER = 0x02
+    TX_COUNTEVT = 0x04
+    TX_ANNOUNCE = 0x08
+    TX_CP_CAN_ID = 0x10
     RX_FILTER_ID = 0x20
+    RX_CHECK_DLC = 0x40
+    RX_NO_AUTOTIMER = 0x80
+    RX_ANNOUNCE_RESUME = 0x100
+    TX_RESET_MULTI_IDX = 0x200
+    RX_RTR_FRAME = 0x400
+    CAN_FD_FRAME = 0x800
+
 
 class CanFlags(IntEnum):
     CAN_ERR_FLAG = 0x20000000
@@ -41,6 +66,120 @@ class CanFlags(IntEnum):
     CAN_EFF_FLAG = 0x80000000
 
 
+class CanFdFlags(IntEnum):
+    """ the flags of a CAN FD frame, they are separate from the CanFlags in the can_id """
+    CANFD_BRS = 0x01
+    CANFD_ESI = 0x02
+    CANFD_FDF = 0x04
+
+
+class CanErrorClass(IntEnum):
+    """ the error classes in the can_id of an error frame, used as CAN_RAW_ERR_FILTER mask """
+    CAN_ERR_TX_TIMEOUT = 0x001
+    CAN_ERR_LOSTARB = 0x002
+    CAN_ERR_CRTL = 0x004
+    CAN_ERR_PROT = 0x008
+    CAN_ERR_TRX = 0x010
+    CAN_ERR_ACK = 0x020
+    CAN_ERR_BUSOFF = 0x040
+    CAN_ERR_BUSERROR = 0x080
+    CAN_ERR_RESTARTED = 0x100
+    CAN_ERR_CNT = 0x200
+
+
+class CanIsoTpOptions(IntEnum):
+    """ socket options of level SOL_CAN_ISOTP """
+    CAN_ISOTP_OPTS = 1
+    CAN_ISOTP_RECV_FC = 2
+    CAN_ISOTP_TX_STMIN = 3
+    CAN_ISOTP_RX_STMIN = 4
+    CAN_ISOTP_LL_OPTS = 5
+
+
+class IsoTpFlags(IntEnum):
+    """ the flags of IsoTpOpts """
+    CAN_ISOTP_LISTEN_MODE = 0x0001
+    CAN_ISOTP_EXTEND_ADDR = 0x0002
+    CAN_ISOTP_TX_PADDING = 0x0004
+    CAN_ISOTP_RX_PADDING = 0x0008
+    CAN_ISOTP_CHK_PAD_LEN = 0x0010
+    CAN_ISOTP_CHK_PAD_DATA = 0x0020
+    CAN_ISOTP_HALF_DUPLEX = 0x0040
+    CAN_ISOTP_FORCE_TXSTMIN = 0x0080
+    CAN_ISOTP_FORCE_RXSTMIN = 0x0100
+    CAN_ISOTP_RX_EXT_ADDR = 0x0200
+    CAN_ISOTP_WAIT_TX_DONE = 0x0400
+    CAN_ISOTP_SF_BROADCAST = 0x0800
+    CAN_ISOTP_CF_BROADCAST = 0x1000
+
+
+class CanRawOptions(IntEnum):
+    """ socket options of level SOL_CAN_RAW """
+    CAN_RAW_FILTER = 1
+    CAN_RAW_ERR_FILTER = 2
+    CAN_RAW_LOOPBACK = 3
+    CAN_RAW_RECV_OWN_MSGS = 4
+    CAN_RAW_FD_FRAMES = 5
+    CAN_RAW_JOIN_FILTERS = 6
+
+
+class CanJ1939Options(IntEnum):
+    SO_J1939_FILTER = 1
+    SO_J1939_PROMISC = 2
+    SO_J1939_SEND_PRIO = 3
+    SO_J1939_ERRQUEUE = 4
+
+
+class CanJ1939CmsgTypes(IntEnum):
+    """ the cmsg_type of the ancillary data of a received J1939 message """
+    SCM_J1939_DEST_ADDR = 1
+    SCM_J1939_DEST_NAME = 2
+    SCM_J1939_PRIO = 3
+
+
+SOL_CAN_BASE = 100
+SOL_CAN_RAW = SOL_CAN_BASE + socket.CAN_RAW
+SOL_CAN_ISOTP = SOL_CAN_BASE + 6
+# a frame_txtime of 0 means kernel default, this value means no gap between frames
+CAN_ISOTP_FRAME_TXTIME_ZERO = 0xFFFFFFFF
+
+# python defines CAN_J1939 from 3.9 on
+CAN_J1939 = getattr(socket, "CAN_J1939", 7)
+SOL_CAN_J1939 = SOL_CAN_BASE + CAN_J1939
+J1939_NO_ADDR = 0xFF
+J1939_IDLE_ADDR = 0xFE
+J1939_NO_NAME = 0
+J1939_NO_PGN = 0x40000
+J1939_PGN_REQUEST = 0x0EA00
+J1939_PGN_ADDRESS_CLAIMED = 0x0EE00
+# the largest message of the transport protocol, the extended transport protocol takes up to 117440505 bytes
+J1939_MAX_TP_PACKET_SIZE = 1785
+
+CAN_SFF_MASK = 0x000007FF
+CAN_EFF_MASK = 0x1FFFFFFF
+CAN_ERR_MASK = 0x1FFFFFFF
+# the bit of the CanFlags.CAN_ERR_FLAG is reused to invert a filter
+CAN_INV_FILTER = 0x20000000
+
+# plain int for the hot path, enum attribute lookup is comparatively slow
+CAN_EFF_FLAG = int(CanFlags.CAN_EFF_FLAG)
+CAN_RTR_FLAG = int(CanFlags.CAN_RTR_FLAG)
+
+
+def get_key(can_id: int, extended: bool = None) -> int:
+    """ helper for the key of a can id in a table, extended can ids carry CAN_EFF_FLAG,
+        so a standard and an extended frame with the same number do not collide
+
+        @param can_id: the can id
+        @param extended: the frame format, None for extended if the can id exceeds 11 bits
+    """
+    if extended is None:
+        extended = can_id > CAN_SFF_MASK
+    if extended:
+        return can_id | CAN_EFF_FLAG
+    return can_id
+
+
 def float_to_timeval(val):
     """ helper to split time value """
     sec = int(val)
@@ -53,66 +192,592 @@ def timeval_to_float(sec,usec):
     return sec+(usec/1000000)
 
 
+class TimestampingOptions(IntEnum):
+    """ the socket options to request receive timestamps, the cmsg_type of the ancillary data is the same """
+    SO_TIMESTAMP = 29
+    SO_TIMESTAMPNS = 35
+    SO_TIMESTAMPING = 37
+
+
+class TimestampingFlags(IntEnum):
+    """ the flags for SO_TIMESTAMPING """
+    SOF_TIMESTAMPING_RX_HARDWARE = 0x04
+    SOF_TIMESTAMPING_RX_SOFTWARE = 0x08
+    SOF_TIMESTAMPING_SOFTWARE = 0x10
+    SOF_TIMESTAMPING_RAW_HARDWARE = 0x40
+
+
+# struct timeval and struct timespec, struct scm_timestamping is 3 timespecs
+TIMESPEC = struct.Struct("@ll")
+SCM_TIMESTAMPING = struct.Struct("@llllll")
+
+
+def timestamp_from_ancdata(ancdata) -> float:
+    """ helper to extract a receive timestamp from the ancillary data of recvmsg()
+
+        SO_TIMESTAMPING prefers the hardware timestamp and falls back to the software timestamp.
+
+        @param ancdata: a list of (cmsg_level, cmsg_type, cmsg_data)
+        @return: the timestamp in seconds or None if there is none
+    """
+    for cmsg_level, cmsg_type, cmsg_data in ancdata:
+        if cmsg_level != socket.SOL_SOCKET:
+            continue
+        if cmsg_type == TimestampingOptions.SO_TIMESTAMPNS:
+            sec, nsec = TIMESPEC.unpack_from(cmsg_data)
+            return sec + (nsec / 1E9)
+        if cmsg_type == TimestampingOptions.SO_TIMESTAMP:
+            return timeval_to_float(*TIMESPEC.unpack_from(cmsg_data))
+        if cmsg_type == TimestampingOptions.SO_TIMESTAMPING:
+            sw_sec, sw_nsec, _, _, hw_sec, hw_nsec = SCM_TIMESTAMPING.unpack_from(cmsg_data)
+            if hw_sec or hw_nsec:
+                return hw_sec + (hw_nsec / 1E9)
+            return sw_sec + (sw_nsec / 1E9)
+    return None
+
+
 class CanFrame:
     """ A CAN frame or message, low level calls it frame, high level calls it a message
-    
+
         @param can_id: the can bus id of the frame, integer in range 0-0x1FFFFFFF
         @param data: the data bytes of the frame
         @param flags: the flags, the 3 top bits in the MSB of the can_id
+        @param timestamp: the receive timestamp if the socket provides it, it is not part of the comparison
     """
 
     FORMAT = "IB3x8s"
-    
+    STRUCT = struct.Struct(FORMAT)
+
+    __slots__ = ("can_id", "flags", "data", "timestamp")
+
     def __init__(self,
                  can_id: int,
                  data: bytes,
                  flags: int = 0,
+                 timestamp: float = None,
                  ):
 
-        logger.info("CanFrame creation with {0:08X} {1:08X} {2}".format(can_id,flags,data.hex()))
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("CanFrame creation with %08X %08X %s", can_id, flags, data.hex())
+        if (can_id > 0x7FF) and not (CAN_EFF_FLAG & flags):
+            # convenience function but at least log this mangling
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("adding CAN_EFF_FLAG for extended can_id %08X", can_id)
+            flags = flags | CAN_EFF_FLAG
         self.can_id = can_id
         self.flags = flags
-        if (can_id > 0x7FF) and not (CanFlags.CAN_EFF_FLAG & self.flags):
-            #convenience function but at least log this mangling
-            logger.debug("adding CAN_EFF_FLAG for extended can_id {0:08X}".format(can_id))
-            self.flags = self.flags | CanFlags.CAN_EFF_FLAG
         self.data = data
-        
+        self.timestamp = timestamp
+
     def to_bytes(self):
         """ return the byte representation of the can frame that socketcan expects """
-        data = self.data
-        data.ljust(8)
-        return struct.pack(self.FORMAT, (self.can_id | self.flags), len(self.data), data)
-    
+        return self.STRUCT.pack((self.can_id | self.flags), len(self.data), self.data)
+
+    def pack_into(self, buffer, offset: int = 0):
+        """ write the byte representation of the can frame into a buffer
+
+            @param buffer: a writable bytes like object, e.g. a bytearray
+            @param offset: the offset in buffer
+        """
+        self.STRUCT.pack_into(buffer, offset, (self.can_id | self.flags), len(self.data), self.data)
+
+    def __eq__(self, other):
+        """ standard equality operation, a can frame never equals a can fd frame """
+        if not isinstance(other, CanFrame):
+            return NotImplemented
+        return all((isinstance(self, CanFdFrame) == isinstance(other, CanFdFrame),
+                    self.can_id == other.can_id,
+                    self.flags == other.flags,
+                    self.data == other.data
+                    ))
+
+    def __ne__(self, other):
+        """ standard non equality operation """
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    @classmethod
+    def from_bytes(cls, byte_repr):
+        """ factory to create instance from bytes representation """
+        can_id_w_flags, data_length, data = cls.STRUCT.unpack(byte_repr)
+        return cls(can_id=(can_id_w_flags & 0x1FFFFFFF),
+                   flags=(can_id_w_flags & 0xE0000000),
+                   data=data[:data_length])
+
+    @classmethod
+    def unpack_from(cls, buffer, offset: int = 0):
+        """ factory to create instance from a bytes representation inside a buffer
+
+            @param buffer: a bytes like object, e.g. a memoryview of a receive buffer
+            @param offset: the offset in buffer
+        """
+        can_id_w_flags, data_length, data = cls.STRUCT.unpack_from(buffer, offset)
+        return cls(can_id=(can_id_w_flags & 0x1FFFFFFF),
+                   flags=(can_id_w_flags & 0xE0000000),
+                   data=data[:data_length])
+
+    @classmethod
+    def get_size(cls):
+        """ size getter """
+        return cls.STRUCT.size
+
+    def freeze(self) -> "FrozenCanFrame":
+        """ return an immutable and hashable copy of the frame """
+        return FrozenCanFrame(can_id=self.can_id,
+                              data=self.data,
+                              flags=self.flags,
+                              timestamp=self.timestamp)
+
+
+CAN_FD_DLC_TO_LEN = (0, 1, 2, 3, 4, 5, 6, 7, 8, 12, 16, 20, 24, 32, 48, 64)
+
+
+def dlc_to_len(dlc: int) -> int:
+    """ helper to convert a CAN FD dlc to the data length """
+    return CAN_FD_DLC_TO_LEN[dlc]
+
+
+def len_to_dlc(length: int) -> int:
+    """ helper to convert a data length to the smallest CAN FD dlc that holds it """
+    for dlc, dlc_length in enumerate(CAN_FD_DLC_TO_LEN):
+        if length <= dlc_length:
+            return dlc
+    raise ValueError("CAN FD data length {0} exceeds 64 bytes".format(length))
+
+
+class CanFdFrame(CanFrame):
+    """ A CAN FD frame, it carries up to 64 data bytes
+
+        @param can_id: the can bus id of the frame, integer in range 0-0x1FFFFFFF
+        @param data: the data bytes of the frame, padded with zeros to the next valid CAN FD length
+        @param flags: the flags, the 3 top bits in the MSB of the can_id
+        @param fd_flags: the CanFdFlags, e.g. CANFD_BRS for bit rate switch
+        @param timestamp: the receive timestamp if the socket provides it, it is not part of the comparison
+    """
+
+    FORMAT = "IBBxx64s"
+    STRUCT = struct.Struct(FORMAT)
+
+    __slots__ = ("fd_flags",)
+
+    def __init__(self,
+                 can_id: int,
+                 data: bytes,
+                 flags: int = 0,
+                 fd_flags: int = 0,
+                 timestamp: float = None,
+                 ):
+        length = dlc_to_len(len_to_dlc(len(data)))
+        if length != len(data):
+            data = data.ljust(length, b"\x00")
+        super().__init__(can_id=can_id,
+                         data=data,
+                         flags=flags,
+                         timestamp=timestamp)
+        self.fd_flags = fd_flags
+
+    def to_bytes(self):
+        """ return the byte representation of the can fd frame that socketcan expects """
+        return self.STRUCT.pack((self.can_id | self.flags), len(self.data), self.fd_flags, self.data)
+
+    def pack_into(self, buffer, offset: int = 0):
+        """ write the byte representation of the can fd frame into a buffer
+
+            @param buffer: a writable bytes like object, e.g. a bytearray
+            @param offset: the offset in buffer
+        """
+        self.STRUCT.pack_into(buffer, offset, (self.can_id | self.flags), len(self.data), self.fd_flags, self.data)
+
+    def __eq__(self, other):
+        """ standard equality operation """
+        equal = super().__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return equal and (self.fd_flags == other.fd_flags)
+
+    @classmethod
+    def from_bytes(cls, byte_repr):
+        """ factory to create instance from bytes representation """
+        can_id_w_flags, data_length, fd_flags, data = cls.STRUCT.unpack(byte_repr)
+        return cls(can_id=(can_id_w_flags & 0x1FFFFFFF),
+                   flags=(can_id_w_flags & 0xE0000000),
+                   fd_flags=fd_flags,
+                   data=data[:data_length])
+
+    @classmethod
+    def unpack_from(cls, buffer, offset: int = 0):
+        """ factory to create instance from a bytes representation inside a buffer
+
+            @param buffer: a bytes like object, e.g. a memoryview of a receive buffer
+            @param offset: the offset in buffer
+        """
+        can_id_w_flags, data_length, fd_flags, data = cls.STRUCT.unpack_from(buffer, offset)
+        return cls(can_id=(can_id_w_flags & 0x1FFFFFFF),
+                   flags=(can_id_w_flags & 0xE0000000),
+                   fd_flags=fd_flags,
+                   data=data[:data_length])
+
+    def freeze(self) -> "FrozenCanFdFrame":
+        """ return an immutable and hashable copy of the frame """
+        return FrozenCanFdFrame(can_id=self.can_id,
+                                data=self.data,
+                                flags=self.flags,
+                                fd_flags=self.fd_flags,
+                                timestamp=self.timestamp)
+
+
+# the frame type of a received record is given by its size
+FRAME_TYPES_BY_SIZE = {CanFrame.get_size(): CanFrame,
+                       CanFdFrame.get_size(): CanFdFrame,
+                       }
+
+
+def frame_from_bytes(byte_repr) -> Union[CanFrame, CanFdFrame]:
+    """ helper to create a CanFrame or CanFdFrame depending on the size of byte_repr """
+    return FRAME_TYPES_BY_SIZE[len(byte_repr)].from_bytes(byte_repr)
+
+
+class FrozenFrameMixin:
+    """ A mixin that makes a frame immutable and hashable, so one instance can be shared safely
+
+        The attributes are set once in __init__, the hash is set last and any later assignment
+        raises AttributeError.
+    """
+
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        if self._hash is not None:
+            raise AttributeError("{0} is immutable".format(type(self).__name__))
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        raise AttributeError("{0} is immutable".format(type(self).__name__))
+
+    def __hash__(self):
+        return self._hash
+
+    def freeze(self):
+        """ a frozen frame is its own frozen copy """
+        return self
+
+
+class FrozenCanFrame(FrozenFrameMixin, CanFrame):
+    """ An immutable and hashable CanFrame, it compares equal to a CanFrame with the same content
+
+        @param can_id: the can bus id of the frame, integer in range 0-0x1FFFFFFF
+        @param data: the data bytes of the frame
+        @param flags: the flags, the 3 top bits in the MSB of the can_id
+        @param timestamp: the receive timestamp, a frame that is shared by a FrameCache has none
+    """
+
+    __slots__ = ("_hash",)
+
+    def __init__(self,
+                 can_id: int,
+                 data: bytes,
+                 flags: int = 0,
+                 timestamp: float = None,
+                 ):
+        object.__setattr__(self, "_hash", None)
+        super().__init__(can_id=can_id,
+                         data=bytes(data),
+                         flags=flags,
+                         timestamp=timestamp)
+        self._hash = hash((self.can_id, self.flags, self.data))
+
+    def __reduce__(self):
+        """ pickle support, the default would assign the slots one by one """
+        return type(self), (self.can_id, self.data, self.flags, self.timestamp)
+
+
+class FrozenCanFdFrame(FrozenFrameMixin, CanFdFrame):
+    """ An immutable and hashable CanFdFrame
+
+        @param can_id: the can bus id of the frame, integer in range 0-0x1FFFFFFF
+        @param data: the data bytes of the frame, padded with zeros to the next valid CAN FD length
+        @param flags: the flags, the 3 top bits in the MSB of the can_id
+        @param fd_flags: the CanFdFlags, e.g. CANFD_BRS for bit rate switch
+        @param timestamp: the receive timestamp, a frame that is shared by a FrameCache has none
+    """
+
+    __slots__ = ("_hash",)
+
+    def __init__(self,
+                 can_id: int,
+                 data: bytes,
+                 flags: int = 0,
+                 fd_flags: int = 0,
+                 timestamp: float = None,
+                 ):
+        object.__setattr__(self, "_hash", None)
+        super().__init__(can_id=can_id,
+                         data=bytes(data),
+                         flags=flags,
+                         fd_flags=fd_flags,
+                         timestamp=timestamp)
+        self._hash = hash((self.can_id, self.flags, self.fd_flags, self.data))
+
+    def __reduce__(self):
+        """ pickle support, the default would assign the slots one by one """
+        return type(self), (self.can_id, self.data, self.flags, self.fd_flags, self.timestamp)
+
+
+FROZEN_FRAME_TYPES_BY_SIZE = {CanFrame.get_size(): FrozenCanFrame,
+                              CanFdFrame.get_size(): FrozenCanFdFrame,
+                              }
+
+
+class FrameCache:
+    """ A bounded cache of frozen frames keyed on the raw bytes of the can_frame they were unpacked from
+
+        Cyclic traffic mostly repeats the bytes of the previous frame of a can id.
+        A hit hands back the frame that was unpacked before instead of a new one,
+        the least recently used frame is evicted when the cache is full.
+
+        @param maxsize: the maximum number of frames in the cache
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1, got {0}".format(maxsize))
+        self.maxsize = maxsize
+        self.frames = OrderedDict()
+        self.reset()
+
+    def reset(self):
+        """ clear the cache and the counters """
+        self.frames.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def get(self, byte_repr: bytes) -> Union[FrozenCanFrame, FrozenCanFdFrame]:
+        """ return the frame of byte_repr, it is unpacked and cached on a miss
+
+            @param byte_repr: the bytes of a can_frame or canfd_frame, the size selects the frame type
+            @return: a FrozenCanFrame or FrozenCanFdFrame
+        """
+        frames = self.frames
+        frame = frames.get(byte_repr)
+        if frame is not None:
+            frames.move_to_end(byte_repr)
+            self.hits += 1
+            return frame
+        self.misses += 1
+        frame = FROZEN_FRAME_TYPES_BY_SIZE[len(byte_repr)].from_bytes(byte_repr)
+        frames[byte_repr] = frame
+        if len(frames) > self.maxsize:
+            frames.popitem(last=False)
+            self.evictions += 1
+        return frame
+
+    def get_hit_ratio(self) -> float:
+        """ return the share of hits of all lookups, 0 without lookups """
+        lookups = self.hits + self.misses
+        if not lookups:
+            return 0
+        return self.hits / lookups
+
+    def snapshot(self) -> dict:
+        """ return the counters as dict """
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self.frames),
+                "maxsize": self.maxsize,
+                "hit_ratio": self.get_hit_ratio(),
+                }
+
+
+if np is not None:
+    # numpy view of CanFrame.FORMAT, can_id and flags share the first field
+    CAN_FRAME_DTYPE = np.dtype([("can_id_w_flags", "=u4"),
+                                ("dlc", "u1"),
+                                ("pad", "u1", (3,)),
+                                ("data", "u1", (8,)),
+                                ])
+else:
+    CAN_FRAME_DTYPE = None
+
+
+class CanFrameBatch:
+    """ A batch of CAN frames as columns of a numpy structured array
+
+        The records are a view on the raw buffer of can_frame records in CanFrame.FORMAT,
+        nothing is copied until a subset is selected or a CanFrame is requested.
+        Requires numpy.
+
+        @param records: a numpy array of CAN_FRAME_DTYPE
+        @param timestamps: optional array of receive timestamps, one per record
+    """
+
+    def __init__(self,
+                 records,
+                 timestamps=None,
+                 ):
+        if np is None:
+            raise ImportError("CanFrameBatch requires numpy")
+        self.records = records
+        if timestamps is not None:
+            timestamps = np.asarray(timestamps)
+        self.timestamps = timestamps
+
+    @classmethod
+    def from_buffer(cls,
+                    buffer,
+                    timestamps=None):
+        """ factory to view a buffer of can_frame records without copying
+
+            @param buffer: a bytes like object, e.g. the return value of CanRawSocket.recv_batch_raw()
+            @param timestamps: optional array of receive timestamps, one per record
+        """
+        if np is None:
+            raise ImportError("CanFrameBatch requires numpy")
+        return cls(records=np.frombuffer(buffer, dtype=CAN_FRAME_DTYPE),
+                   timestamps=timestamps)
+
+    @classmethod
+    def from_frames(cls,
+                    frames: Iterable[CanFrame],
+                    timestamps=None):
+        """ factory to create a batch from CanFrames """
+        return cls.from_buffer(bytearray(b"".join(frame.to_bytes() for frame in frames)),
+                               timestamps=timestamps)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, item):
+        """ an integer returns a CanFrame, anything else that numpy accepts as index returns a CanFrameBatch """
+        if isinstance(item, (int, np.integer)):
+            return self.frame(item)
+        timestamps = self.timestamps
+        if timestamps is not None:
+            timestamps = timestamps[item]
+        return CanFrameBatch(records=self.records[item],
+                             timestamps=timestamps)
+
+    def __iter__(self):
+        """ iterate over CanFrames, they are created one by one """
+        for idx in range(len(self.records)):
+            yield self.frame(idx)
+
+    def frame(self, idx: int) -> CanFrame:
+        """ materialize a single CanFrame """
+        return CanFrame.from_bytes(self.records[idx].tobytes())
+
+    @property
+    def can_id(self):
+        """ the can ids without flags """
+        return self.records["can_id_w_flags"] & 0x1FFFFFFF
+
+    @property
+    def flags(self):
+        """ the flags without can ids """
+        return self.records["can_id_w_flags"] & 0xE0000000
+
+    @property
+    def dlc(self):
+        """ the data lengths """
+        return self.records["dlc"]
+
+    @property
+    def data(self):
+        """ the data bytes, a (n, 8) array, bytes beyond dlc are padding """
+        return self.records["data"]
+
+    def mask_flags(self, flags: int):
+        """ return a boolean mask of records that have all of the given flags set """
+        return (self.records["can_id_w_flags"] & flags) == flags
+
+    def mask_ids(self, can_ids: Iterable[int]):
+        """ return a boolean mask of records with a can_id in can_ids """
+        return np.isin(self.can_id, np.fromiter(can_ids, dtype=np.uint32))
+
+    def filter_ids(self, can_ids: Iterable[int]):
+        """ return a new CanFrameBatch with only the records with a can_id in can_ids """
+        return self[self.mask_ids(can_ids)]
+
+    def copy(self):
+        """ return a CanFrameBatch that owns its memory """
+        timestamps = self.timestamps
+        if timestamps is not None:
+            timestamps = timestamps.copy()
+        return CanFrameBatch(records=self.records.copy(),
+                             timestamps=timestamps)
+
+    def to_bytes(self):
+        """ return the byte representation of the records, consecutive frames in CanFrame.FORMAT """
+        return self.records.tobytes()
+
+
+class CanFilter:
+    """ A receive filter for a CanRawSocket that is evaluated by the kernel
+
+        A frame matches if received_can_id & can_mask == can_id & can_mask,
+        where the received can_id includes the CanFlags.
+
+        @param can_id: the can id to match, integer in range 0-0x1FFFFFFF
+        @param can_mask: the bits to compare, defaults to the can_id bits plus the EFF and RTR flags,
+                         i.e. an exact match of can_id, frame format and frame type
+        @param flags: the CanFlags to match, CAN_EFF_FLAG is added for extended can_ids
+        @param inverted: match every frame that does not match can_id
+    """
+
+    FORMAT = "II"
+    STRUCT = struct.Struct(FORMAT)
+
+    def __init__(self,
+                 can_id: int,
+                 can_mask: int = (CAN_EFF_MASK | CanFlags.CAN_EFF_FLAG | CanFlags.CAN_RTR_FLAG),
+                 flags: int = 0,
+                 inverted: bool = False,
+                 ):
+        self.can_id = can_id
+        self.can_mask = can_mask
+        if (can_id > CAN_SFF_MASK) and not (CAN_EFF_FLAG & flags):
+            flags = flags | CAN_EFF_FLAG
+        self.flags = flags
+        self.inverted = inverted
+
+    def to_bytes(self):
+        """ return the byte representation of the filter, a struct can_filter """
+        can_id = self.can_id | self.flags
+        if self.inverted:
+            can_id = can_id | CAN_INV_FILTER
+        return self.STRUCT.pack(can_id, self.can_mask)
+
     def __eq__(self, other):
         """ standard equality operation """
         return all((self.can_id == other.can_id,
-                   self.flags == other.flags,
-                   self.data == other.data
-                   ))
-    
+                    self.can_mask == other.can_mask,
+                    self.flags == other.flags,
+                    self.inverted == other.inverted,
+                    ))
+
     def __ne__(self, other):
         """ standard non equality operation """
         return not self.__eq__(other)
-        
-    
-        
 
     @classmethod
-    def from_bytes(cls,byte_repr):
+    def from_bytes(cls, byte_repr):
         """ factory to create instance from bytes representation """
-        can_id_w_flags, data_length, data = struct.unpack(cls.FORMAT,byte_repr)
-        flags = (can_id_w_flags & 0xE0000000)
-        can_id = (can_id_w_flags & 0x1FFFFFFF)
-        logger.debug("extracted flags {0:08X}".format(flags))
-        return CanFrame(can_id=can_id,
-                        flags = flags,
-                        data=data[:data_length])
+        can_id_w_flags, can_mask = cls.STRUCT.unpack(byte_repr)
+        return cls(can_id=(can_id_w_flags & CAN_EFF_MASK),
+                   can_mask=can_mask,
+                   flags=(can_id_w_flags & (CanFlags.CAN_EFF_FLAG | CanFlags.CAN_RTR_FLAG)),
+                   inverted=bool(can_id_w_flags & CAN_INV_FILTER))
 
     @classmethod
     def get_size(cls):
         """ size getter """
-        return struct.calcsize(cls.FORMAT)
+        return cls.STRUCT.size
 
 
 class BcmMsg:
@@ -129,9 +794,10 @@ class BcmMsg:
     """
     
     # this is a great hack, we force alignment to 8 byte boundary
-    # by adding a zero length long long 
-    FORMAT = "IIIllllII0q"  
-    
+    # by adding a zero length long long
+    FORMAT = "IIIllllII0q"
+    STRUCT = struct.Struct(FORMAT)
+
     def __init__(self,
                  opcode: int,
                  flags: int,
@@ -141,8 +807,7 @@ class BcmMsg:
                  count: int = 1,
                  ival1:  float = 0,
                  ):
-        
-        
+
         self.opcode = opcode
         self.flags = flags
         self.count = count
@@ -154,18 +819,21 @@ class BcmMsg:
         
     def to_bytes(self):
         """ return the byte representation of the bcm message that socketcan expects """
-        ival1_sec,ival1_usec = float_to_timeval(self.ival1)
-        ival2_sec,ival2_usec = float_to_timeval(self.ival2)
-        byte_repr = bytearray()
-        byte_repr.extend(struct.pack(self.FORMAT, self.opcode, self.flags, 
-                                     self.count, ival1_sec, ival1_usec,
-                                     ival2_sec, ival2_usec, self.can_id,
-                                     len(self.frames)))
+        ival1_sec, ival1_usec = float_to_timeval(self.ival1)
+        ival2_sec, ival2_usec = float_to_timeval(self.ival2)
+        size = self.get_size()
+        byte_repr = bytearray(size + sum(frame.get_size() for frame in self.frames))
+        self.STRUCT.pack_into(byte_repr, 0, self.opcode, self.flags,
+                              self.count, ival1_sec, ival1_usec,
+                              ival2_sec, ival2_usec, self.can_id,
+                              len(self.frames))
+        offset = size
         for frame in self.frames:
-            byte_repr.extend(frame.to_bytes())
-        
+            frame.pack_into(byte_repr, offset)
+            offset += frame.get_size()
+
         return byte_repr
-    
+
     def __eq__(self, other):
         """ standard equality operation """
         return all((self.opcode == other.opcode,
@@ -176,156 +844,1502 @@ class BcmMsg:
                    self.can_id == other.can_id,
                    self.frames == other.frames,
                    ))
-    
+
     def __ne__(self, other):
         """ standard non equality operation """
         return not self.__eq__(other)
 
-    @classmethod    
-    def from_bytes(cls,byte_repr: bytes):
+    @classmethod
+    def from_bytes(cls, byte_repr: bytes):
         """ factory to create instance from bytes representation """
+        bcm_msg = cls.unpack_from(byte_repr)
+        assert len(byte_repr) == cls.get_size() + sum(frame.get_size() for frame in bcm_msg.frames)
+        return bcm_msg
+
+    @classmethod
+    def unpack_from(cls, buffer, offset: int = 0):
+        """ factory to create instance from a bytes representation inside a buffer
+
+            The frames are unpacked in place, there is no copy of the buffer.
+            They are CanFdFrames if the CAN_FD_FRAME flag is set.
+
+            @param buffer: a bytes like object, e.g. a receive buffer
+            @param offset: the offset in buffer
+        """
         opcode, flags, count, ival1_sec, ival1_usec, ival2_sec, ival2_usec, \
-        can_id, nframes = struct.unpack(cls.FORMAT,byte_repr[:cls.get_size()])
-        ival1 = timeval_to_float(ival1_sec, ival1_usec)
-        ival2 = timeval_to_float(ival2_sec, ival2_usec)
-        frames = [CanFrame.from_bytes(byte_repr[idx:idx+CanFrame.get_size()]) \
-                       for idx in range(cls.get_size(),len(byte_repr),CanFrame.get_size())]
-        assert len(frames) == nframes
-        return BcmMsg(opcode=opcode,
-                      flags=flags,
-                      count=count,
-                      ival1=ival1,
-                      ival2=ival2,
-                      can_id=can_id,
-                      frames=frames,
-                      )
+            can_id, nframes = cls.STRUCT.unpack_from(buffer, offset)
+        frame_type = CanFrame
+        if flags & BCMFlags.CAN_FD_FRAME:
+            frame_type = CanFdFrame
+        frame_size = frame_type.get_size()
+        offset += cls.get_size()
+        frames = [frame_type.unpack_from(buffer, offset + (idx * frame_size)) for idx in range(nframes)]
+        return cls(opcode=opcode,
+                   flags=flags,
+                   count=count,
+                   ival1=timeval_to_float(ival1_sec, ival1_usec),
+                   ival2=timeval_to_float(ival2_sec, ival2_usec),
+                   can_id=can_id,
+                   frames=frames,
+                   )
 
     @classmethod
-    def get_nframes_from_bytes(cls,byte_repr: bytes):
+    def get_nframes_from_bytes(cls, byte_repr: bytes):
         """ return the nframes value from a bcm_msg_head"""
-        return struct.unpack(cls.FORMAT,byte_repr[:cls.get_size()])[-1]
+        return cls.STRUCT.unpack_from(byte_repr)[-1]
 
     @classmethod
     def get_size(cls):
         """ size getter """
-        return struct.calcsize(cls.FORMAT)
- 
+        return cls.STRUCT.size
 
-class CanRawSocket:
-    """ A socket to raw CAN interface
-    
-        @param: interface name
+
+class BcmRxEvent:
+    """ An event of the bcm receive side
+
+        @param can_id: the can id of the receive job
+        @param flags: the flags of the receive job
     """
-    
-    def __init__(self,interface):
-        self.s = socket.socket(socket.AF_CAN,socket.SOCK_RAW,socket.CAN_RAW)
-        self.s.bind((interface,))
 
-    def __del__(self):
-        self.s.close()
-    
-    def send(self, frame: CanFrame):
-        """ send a CAN frame
-        
-            @param frame: a CanFrame 
+    def __init__(self,
+                 can_id: int,
+                 flags: int = 0,
+                 ):
+        self.can_id = can_id
+        self.flags = flags
+
+    @classmethod
+    def from_bcm_msg(cls, bcm_msg: BcmMsg):
+        """ factory to create the event that matches the opcode of a bcm message
+
+            @param bcm_msg: a BcmMsg received from a CanBcmSocket
+            @return: a BcmRxChanged, BcmRxTimeout or BcmRxStatus
         """
-        return self.s.send(frame.to_bytes())
-    
-    def recv(self):
-        """ receive a CAN frame """
-        data = self.s.recv(CanFrame.get_size())
-        assert len(data) == CanFrame.get_size()
-        frame = CanFrame.from_bytes(data)
-        return frame
+        can_id = bcm_msg.can_id & CAN_EFF_MASK
+        if bcm_msg.opcode == BcmOpCodes.RX_CHANGED:
+            return BcmRxChanged(can_id=can_id, flags=bcm_msg.flags, frame=bcm_msg.frames[0])
+        if bcm_msg.opcode == BcmOpCodes.RX_TIMEOUT:
+            return BcmRxTimeout(can_id=can_id, flags=bcm_msg.flags)
+        return BcmRxStatus(can_id=can_id, flags=bcm_msg.flags, bcm_msg=bcm_msg)
 
 
-# Note: RX side is untested
-class CanBcmSocket:
+class BcmRxChanged(BcmRxEvent):
+    """ RX_CHANGED, the content of a frame changed or a frame was received for the first time
+
+        @param can_id: the can id of the receive job
+        @param flags: the flags of the receive job
+        @param frame: the received frame
+    """
+
+    def __init__(self,
+                 can_id: int,
+                 frame: CanFrame,
+                 flags: int = 0,
+                 ):
+        super().__init__(can_id=can_id, flags=flags)
+        self.frame = frame
+
+
+class BcmRxTimeout(BcmRxEvent):
+    """ RX_TIMEOUT, a cyclic frame was not received within the timeout """
+
+
+class BcmRxStatus(BcmRxEvent):
+    """ any other message of the bcm, e.g. the RX_STATUS answer to RX_READ
+
+        @param can_id: the can id of the receive job
+        @param flags: the flags of the receive job
+        @param bcm_msg: the BcmMsg
+    """
+
+    def __init__(self,
+                 can_id: int,
+                 bcm_msg: BcmMsg,
+                 flags: int = 0,
+                 ):
+        super().__init__(can_id=can_id, flags=flags)
+        self.bcm_msg = bcm_msg
+
+
+class SocketBufferOptions(IntEnum):
+    """ the generic socket options that python does not define on all versions """
+    SO_SNDBUF = 7
+    SO_RCVBUF = 8
+    SO_PRIORITY = 12
+    SO_RCVBUFFORCE = 33
+
+
+class SocketOptionsMixin:
+    """ The options that all CAN sockets share, they operate on the attribute s
+
+        The kernel doubles the buffer sizes that are set for its bookkeeping overhead,
+        the getters return the doubled value. Without force, rcvbuf is capped by net.core.rmem_max.
+    """
+
+    # the time in seconds to spin for a datagram before a receive call blocks, None to not spin
+    busy_poll = None
+
+    def apply_socket_options(self,
+                             rcvbuf: int = None,
+                             sndbuf: int = None,
+                             priority: int = None,
+                             rcvbuf_force: bool = False,
+                             busy_poll: float = None):
+        """ apply the constructor options that are not None """
+        if rcvbuf is not None:
+            self.set_rcvbuf(rcvbuf, force=rcvbuf_force)
+        if sndbuf is not None:
+            self.set_sndbuf(sndbuf)
+        if priority is not None:
+            self.set_priority(priority)
+        if busy_poll is not None:
+            self.set_busy_poll(busy_poll)
+
+    def set_rcvbuf(self,
+                   size: int,
+                   force: bool = False):
+        """ set the size of the receive buffer, a larger buffer absorbs longer bursts while the process is not scheduled
+
+            @param size: the size in bytes
+            @param force: use SO_RCVBUFFORCE to exceed net.core.rmem_max, requires CAP_NET_ADMIN
+        """
+        option = SocketBufferOptions.SO_RCVBUFFORCE if force else SocketBufferOptions.SO_RCVBUF
+        self.s.setsockopt(socket.SOL_SOCKET, option, size)
+
+    def get_rcvbuf(self) -> int:
+        """ get the size of the receive buffer """
+        return self.s.getsockopt(socket.SOL_SOCKET, SocketBufferOptions.SO_RCVBUF)
+
+    def set_sndbuf(self, size: int):
+        """ set the size of the send buffer
+
+            @param size: the size in bytes
+        """
+        self.s.setsockopt(socket.SOL_SOCKET, SocketBufferOptions.SO_SNDBUF, size)
+
+    def get_sndbuf(self) -> int:
+        """ get the size of the send buffer """
+        return self.s.getsockopt(socket.SOL_SOCKET, SocketBufferOptions.SO_SNDBUF)
+
+    def set_priority(self, priority: int):
+        """ set the priority of sent frames, a queueing discipline on the interface may order by it
+
+            @param priority: 0 to 6 without CAP_NET_ADMIN
+        """
+        self.s.setsockopt(socket.SOL_SOCKET, SocketBufferOptions.SO_PRIORITY, priority)
+
+    def get_priority(self) -> int:
+        """ get the priority of sent frames """
+        return self.s.getsockopt(socket.SOL_SOCKET, SocketBufferOptions.SO_PRIORITY)
+
+    def set_busy_poll(self, budget: float = None):
+        """ spin on the socket before a receive call blocks
+
+            Blocking on a socket puts the process to sleep and waking it up costs a context switch.
+            Spinning polls the socket with a zero timeout and returns as soon as a datagram is queued,
+            that lowers the receive latency at the price of one cpu core being busy for the budget.
+            Use it for request / response patterns where the answer is expected within the budget.
+
+            @param budget: the time in seconds to spin, None to disable
+        """
+        self.busy_poll = budget
+
+    def busy_wait(self, timeout: float = None) -> bool:
+        """ spin until a datagram is queued, the budget is exceeded or timeout expires
+
+            @param timeout: the maximum time in seconds, None for the budget
+            @return: True if a datagram is queued, the next receive call does not block
+        """
+        budget = self.busy_poll
+        if timeout is not None and timeout < budget:
+            budget = timeout
+        # a zero timeout poll does not block, unlike a MSG_DONTWAIT receive on a socket with settimeout()
+        poller = select.poll()
+        poller.register(self.s, select.POLLIN)
+        poll = poller.poll
+        deadline = time.perf_counter() + budget
+        while not poll(0):
+            if time.perf_counter() >= deadline:
+                return False
+        return True
+
+
+class CanRawSocket(SocketOptionsMixin):
+    """ A socket to raw CAN interface
+
+        @param interface: name
+        @param filters: optional CanFilters that are installed before binding,
+                        so no unwanted frame is ever queued, see set_filters()
+        @param fd: enable CAN_RAW_FD_FRAMES to send and receive CanFdFrames along with CanFrames
+        @param timestamping: one of TimestampingOptions to set the timestamp of received frames,
+                             None to not request timestamps at all
+        @param metrics: collect SocketMetrics, see enable_metrics()
+        @param rcvbuf: the size of the receive buffer in bytes, see set_rcvbuf()
+        @param sndbuf: the size of the send buffer in bytes, see set_sndbuf()
+        @param priority: the priority of sent frames, see set_priority()
+        @param rcvbuf_force: exceed net.core.rmem_max with rcvbuf, requires CAP_NET_ADMIN
+        @param busy_poll: the time in seconds to spin before a receive call blocks, see set_busy_poll()
+        @param sock: an existing socket to use instead of a new one, e.g. a node of a VirtualBus
+        @param frame_cache: the size of a FrameCache to receive shared FrozenCanFrames, see enable_frame_cache()
+    """
+
+    def __init__(self,
+                 interface: str,
+                 filters: Iterable[CanFilter] = None,
+                 fd: bool = False,
+                 timestamping: int = None,
+                 metrics: bool = False,
+                 rcvbuf: int = None,
+                 sndbuf: int = None,
+                 priority: int = None,
+                 rcvbuf_force: bool = False,
+                 busy_poll: float = None,
+                 sock: socket.socket = None,
+                 frame_cache: int = None,
+                 ):
+        self.s = sock if sock is not None else socket.socket(socket.AF_CAN, socket.SOCK_RAW, socket.CAN_RAW)
+        if filters is not None:
+            self.set_filters(filters)
+        self.mtu = CanFrame.get_size()
+        if fd:
+            self.s.setsockopt(SOL_CAN_RAW, CanRawOptions.CAN_RAW_FD_FRAMES, 1)
+            self.mtu = CanFdFrame.get_size()
+        self.timestamping = None
+        self.metrics = None
+        self.recv_own_msgs = False
+        self.ancbufsize = 0
+        self.sender = None
+        self.frame_cache = None
+        if timestamping is not None:
+            self.set_timestamping(timestamping)
+        if metrics:
+            self.enable_metrics()
+        if frame_cache is not None:
+            self.enable_frame_cache(maxsize=frame_cache)
+        self.apply_socket_options(rcvbuf=rcvbuf, sndbuf=sndbuf, priority=priority,
+                                  rcvbuf_force=rcvbuf_force, busy_poll=busy_poll)
+        self.s.bind((interface,))
+        self.receiver = None
+
+    def set_filters(self, filters: Iterable[CanFilter]):
+        """ install receive filters in the kernel
+
+            A frame is received if it matches any of the filters,
+            or all of them if set_join_filters() is enabled.
+            An empty iterable receives no frames at all.
+
+            @param filters: an iterable of CanFilters
+        """
+        self.s.setsockopt(SOL_CAN_RAW, CanRawOptions.CAN_RAW_FILTER,
+                          b"".join(can_filter.to_bytes() for can_filter in filters))
+
+    def set_error_filter(self, err_mask: int):
+        """ receive error frames of the error classes in err_mask, no error frames are received by default
+
+            @param err_mask: an or combination of CanErrorClass, CAN_ERR_MASK for all error frames
+        """
+        self.s.setsockopt(SOL_CAN_RAW, CanRawOptions.CAN_RAW_ERR_FILTER, struct.pack("I", err_mask))
+
+    def set_join_filters(self, enable: bool):
+        """ require a frame to match all filters instead of any filter, requires Linux >= 4.1 """
+        self.s.setsockopt(SOL_CAN_RAW, CanRawOptions.CAN_RAW_JOIN_FILTERS, int(enable))
+
+    def set_loopback(self, enable: bool):
+        """ deliver sent frames to other sockets on this host, enabled by default """
+        self.s.setsockopt(SOL_CAN_RAW, CanRawOptions.CAN_RAW_LOOPBACK, int(enable))
+
+    def set_recv_own_msgs(self, enable: bool):
+        """ deliver sent frames to this socket too, disabled by default """
+        self.s.setsockopt(SOL_CAN_RAW, CanRawOptions.CAN_RAW_RECV_OWN_MSGS, int(enable))
+        self.recv_own_msgs = enable
+
+    def set_timestamping(self, timestamping: int):
+        """ request a receive timestamp for every frame
+
+            @param timestamping: one of TimestampingOptions, SO_TIMESTAMPING requests
+                                 hardware timestamps with software timestamps as fallback
+        """
+        value = 1
+        if timestamping == TimestampingOptions.SO_TIMESTAMPING:
+            value = (TimestampingFlags.SOF_TIMESTAMPING_RX_HARDWARE | TimestampingFlags.SOF_TIMESTAMPING_RAW_HARDWARE
+                     | TimestampingFlags.SOF_TIMESTAMPING_RX_SOFTWARE | TimestampingFlags.SOF_TIMESTAMPING_SOFTWARE)
+        self.s.setsockopt(socket.SOL_SOCKET, timestamping, value)
+        self.timestamping = timestamping
+        self.update_ancbufsize()
+
+    def enable_metrics(self) -> SocketMetrics:
+        """ collect statistics of this socket, the kernel drop counter is requested with SO_RXQ_OVFL
+
+            Without metrics, there is no overhead except one attribute check per call.
+            With metrics, recv() uses recvmsg() to get the kernel drop counter.
+
+            @return: the SocketMetrics, also available as attribute metrics
+        """
+        self.s.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+        self.metrics = SocketMetrics()
+        self.update_ancbufsize()
+        return self.metrics
+
+    def enable_frame_cache(self, maxsize: int = 1024) -> FrameCache:
+        """ receive shared FrozenCanFrames from a FrameCache instead of a new CanFrame per frame
+
+            A frame with the same bytes as a cached one is handed back without unpacking and allocating,
+            which saves most of the receive cost on cyclic traffic.
+            The frames are immutable and carry no timestamp, with timestamping the timestamps
+            of recv_batch() are available from get_batch_timestamps().
+
+            @param maxsize: the maximum number of frames in the cache, at least the number of can ids on the bus
+            @return: the FrameCache, also available as attribute frame_cache
+        """
+        self.frame_cache = FrameCache(maxsize=maxsize)
+        return self.frame_cache
+
+    def update_ancbufsize(self):
+        """ size the ancillary data buffer for the requested ancillary data """
+        ancbufsize = 0
+        if self.timestamping is not None:
+            ancbufsize += socket.CMSG_SPACE(SCM_TIMESTAMPING.size)
+        if self.metrics is not None:
+            ancbufsize += socket.CMSG_SPACE(RXQ_OVFL.size)
+        self.ancbufsize = ancbufsize
+        self.receiver = None
+
+    def __del__(self):
+        self.s.close()
+
+    def send(self, frame: CanFrame):
+        """ send a CAN frame
+
+            @param frame: a CanFrame or a CanFdFrame if the socket was opened with fd=True
+        """
+        if self.metrics is None:
+            return self.s.send(frame.to_bytes())
+        metrics = self.metrics
+        byte_repr = frame.to_bytes()
+        try:
+            size = self.s.send(byte_repr)
+        except OSError as e:
+            if e.errno in (errno.ENOBUFS, errno.EAGAIN):
+                metrics.tx_rejected += 1
+            raise
+        metrics.add_tx(1, size)
+        if self.recv_own_msgs:
+            metrics.add_pending_loopback(byte_repr, time.time())
+        return size
+
+    def send_batch(self,
+                   frames: Iterable[CanFrame],
+                   timeout: float = 1,
+                   batch_size: int = 64) -> int:
+        """ send many CAN frames with as few syscalls as possible
+
+            The frames are packed into a reusable buffer and handed to the kernel with sendmmsg.
+            If the tx queue of the interface is full, the kernel returns ENOBUFS and the frames
+            that were not yet accepted are retried until timeout.
+
+            @param frames: an iterable of CanFrames, CanFdFrames need a socket with fd=True
+            @param timeout: the time to retry frames the kernel did not accept, 0 to not retry
+            @param batch_size: the number of frames per syscall
+            @return: the number of frames the kernel accepted, frames after the first rejected one are not sent
+        """
+        if self.sender is None or self.sender.nslots < batch_size:
+            self.sender = MmsgSender(sock=self.s,
+                                     slot_size=self.mtu,
+                                     nslots=batch_size)
+        sender = self.sender
+        mtu = self.mtu
+        deadline = time.monotonic() + timeout
+        accepted = 0
+        nframes = 0
+        for frame in frames:
+            frame.pack_into(sender.buffer, nframes * mtu)
+            sender.lengths[nframes] = frame.get_size()
+            nframes += 1
+            if nframes == batch_size:
+                sent = self._send_slots(nframes, deadline)
+                accepted += sent
+                if sent < nframes:
+                    return accepted
+                nframes = 0
+        if nframes:
+            accepted += self._send_slots(nframes, deadline)
+        return accepted
+
+    def _send_slots(self, nframes: int, deadline: float) -> int:
+        """ send the first nframes slots of the sender and count them """
+        sender = self.sender
+        if self.metrics is None:
+            return sender.send(nframes, timeout=max(deadline - time.monotonic(), 0))
+        metrics = self.metrics
+        retries = sender.retries
+        sent = sender.send(nframes, timeout=max(deadline - time.monotonic(), 0))
+        metrics.tx_rejected += sender.retries - retries
+        metrics.tx_lost += nframes - sent
+        metrics.add_tx(sent, sum(sender.lengths[:sent]))
+        if self.recv_own_msgs:
+            now = time.time()
+            mtu = self.mtu
+            for idx in range(sent):
+                metrics.add_pending_loopback(sender.buffer[idx * mtu:(idx * mtu) + sender.lengths[idx]], now)
+        return sent
+
+    def recv(self):
+        """ receive a CAN frame, on a socket with fd=True this may also be a CanFdFrame """
+        if self.busy_poll is not None:
+            self.busy_wait()
+        if not self.ancbufsize:
+            data = self.s.recv(self.mtu)
+            assert len(data) in FRAME_TYPES_BY_SIZE
+            if self.frame_cache is not None:
+                return self.frame_cache.get(data)
+            return frame_from_bytes(data)
+        data, ancdata, msg_flags, _ = self.s.recvmsg(self.mtu, self.ancbufsize)
+        assert len(data) in FRAME_TYPES_BY_SIZE
+        timestamp = timestamp_from_ancdata(ancdata)
+        if self.frame_cache is not None:
+            frame = self.frame_cache.get(data)
+        else:
+            frame = frame_from_bytes(data)
+            frame.timestamp = timestamp
+        if self.metrics is not None:
+            self._count_rx(timestamp, data, ancdata, msg_flags)
+        return frame
+
+    def _count_rx(self,
+                  timestamp: float,
+                  data: bytes,
+                  ancdata,
+                  msg_flags: int):
+        """ count a received frame and its latencies """
+        metrics = self.metrics
+        metrics.add_rx(1, len(data), ancdata)
+        now = time.time()
+        if timestamp is not None:
+            metrics.rx_latency.add(now - timestamp)
+        # the kernel flags frames that this socket sent itself with MSG_CONFIRM
+        if (msg_flags & socket.MSG_CONFIRM) and metrics.pending_loopback:
+            metrics.add_loopback(data, timestamp or now)
+
+    def recv_batch_raw(self,
+                       max_frames: int = 64,
+                       timeout: float = None) -> memoryview:
+        """ receive up to max_frames CAN frames as raw bytes
+
+            The frames are received into a reusable buffer with one syscall if possible,
+            the returned memoryview is only valid until the next receive call.
+
+            On a socket with fd=True, each frame occupies a slot of CanFdFrame.get_size() bytes
+            and the actual size of each frame is in receiver.lengths.
+
+            @param max_frames: the maximum number of frames to receive
+            @param timeout: the time to wait for the first frame, None blocks forever
+            @return: a memoryview of consecutive frames in CanFrame.FORMAT, empty on timeout
+        """
+        if (self.busy_poll is not None) and not self.busy_wait(timeout) and (timeout is not None):
+            timeout = max(timeout - self.busy_poll, 0)
+        if self.receiver is None or self.receiver.nslots < max_frames:
+            self.receiver = MmsgReceiver(sock=self.s,
+                                         slot_size=self.mtu,
+                                         nslots=max_frames,
+                                         ancbufsize=self.ancbufsize)
+        nframes = self.receiver.recv(max_msgs=max_frames, timeout=timeout)
+        if (self.metrics is not None) and nframes:
+            self.metrics.add_rx(nframes, sum(self.receiver.lengths[:nframes]), self.receiver.get_ancdata(nframes - 1))
+            if self.metrics.pending_loopback:
+                self._count_loopback(nframes)
+        return self.receiver.view[:nframes * self.mtu]
+
+    def _count_loopback(self, nframes: int):
+        """ match the echoes of the last recv_batch_raw() call to the sent frames """
+        receiver = self.receiver
+        mtu = self.mtu
+        now = time.time()
+        for idx in range(nframes):
+            if receiver.msg_flags[idx] & socket.MSG_CONFIRM:
+                timestamp = None
+                if self.timestamping is not None:
+                    timestamp = timestamp_from_ancdata(receiver.get_ancdata(idx))
+                self.metrics.add_loopback(receiver.view[idx * mtu:(idx * mtu) + receiver.lengths[idx]],
+                                          timestamp or now)
+
+    def get_batch_timestamps(self, nframes: int) -> List[float]:
+        """ return the receive timestamps of the frames of the last recv_batch_raw() call
+
+            @param nframes: the number of frames received
+            @return: a list of timestamps, None if the socket has no timestamping
+        """
+        if self.timestamping is None:
+            return [None] * nframes
+        return [timestamp_from_ancdata(self.receiver.get_ancdata(idx)) for idx in range(nframes)]
+
+    def recv_batch(self,
+                   max_frames: int = 64,
+                   timeout: float = None) -> List[CanFrame]:
+        """ receive up to max_frames CAN frames
+
+            @param max_frames: the maximum number of frames to receive
+            @param timeout: the time to wait for the first frame, None blocks forever
+            @return: a list of CanFrames and CanFdFrames, empty on timeout,
+                     shared FrozenCanFrames and FrozenCanFdFrames without timestamp with a frame cache
+        """
+        view = self.recv_batch_raw(max_frames=max_frames, timeout=timeout)
+        if self.frame_cache is not None:
+            return self._get_cached_frames(view)
+        mtu = self.mtu
+        if mtu == CanFrame.get_size():
+            frames = [CanFrame.unpack_from(view, offset) for offset in range(0, len(view), mtu)]
+        else:
+            lengths = self.receiver.lengths
+            frames = [FRAME_TYPES_BY_SIZE[lengths[idx]].unpack_from(view, idx * mtu)
+                      for idx in range(len(view) // mtu)]
+        if self.timestamping is not None:
+            for frame, timestamp in zip(frames, self.get_batch_timestamps(len(frames))):
+                frame.timestamp = timestamp
+        return frames
+
+    def _get_cached_frames(self, view: memoryview) -> List[CanFrame]:
+        """ look up the frames of a received buffer in the frame cache """
+        get = self.frame_cache.get
+        mtu = self.mtu
+        # one copy of the whole buffer, the keys are slices of it
+        raw = view.tobytes()
+        if mtu == CanFrame.get_size():
+            return [get(raw[offset:offset + mtu]) for offset in range(0, len(raw), mtu)]
+        lengths = self.receiver.lengths
+        return [get(raw[idx * mtu:(idx * mtu) + lengths[idx]]) for idx in range(len(raw) // mtu)]
+
+    def recv_frame_batch(self,
+                         max_frames: int = 64,
+                         timeout: float = None,
+                         copy: bool = False) -> CanFrameBatch:
+        """ receive up to max_frames CAN frames as a CanFrameBatch, requires numpy
+
+            @param max_frames: the maximum number of frames to receive
+            @param timeout: the time to wait for the first frame, None blocks forever
+            @param copy: copy the frames out of the reusable buffer, otherwise
+                         the batch is only valid until the next receive call
+            @return: a CanFrameBatch, empty on timeout
+        """
+        if self.mtu != CanFrame.get_size():
+            raise ValueError("CanFrameBatch does not support sockets with fd=True")
+        view = self.recv_batch_raw(max_frames=max_frames, timeout=timeout)
+        timestamps = None
+        if self.timestamping is not None:
+            timestamps = self.get_batch_timestamps(len(view) // self.mtu)
+        batch = CanFrameBatch.from_buffer(view, timestamps=timestamps)
+        if copy:
+            batch = batch.copy()
+        return batch
+
+
+class CanBcmSocket(SocketOptionsMixin):
     """ A socket to broadcast manager
-    
+
         @param: interface name
+        @param metrics: collect SocketMetrics, see enable_metrics()
+        @param rcvbuf: the size of the receive buffer in bytes, see set_rcvbuf()
+        @param sndbuf: the size of the send buffer in bytes, see set_sndbuf()
+        @param priority: the priority of sent frames, see set_priority()
+        @param rcvbuf_force: exceed net.core.rmem_max with rcvbuf, requires CAP_NET_ADMIN
+        @param busy_poll: the time in seconds to spin before a receive call blocks, see set_busy_poll()
+        @param sock: an existing socket to use instead of a new one, e.g. a node of a VirtualBus
     """
-    
-    def __init__(self,interface: str):
-        self.s = socket.socket(socket.PF_CAN,socket.SOCK_DGRAM,socket.CAN_BCM)
+
+    # the maximum number of frames in a bcm message
+    MAX_NFRAMES = 256
+
+    def __init__(self,
+                 interface: str,
+                 metrics: bool = False,
+                 rcvbuf: int = None,
+                 sndbuf: int = None,
+                 priority: int = None,
+                 rcvbuf_force: bool = False,
+                 busy_poll: float = None,
+                 sock: socket.socket = None,
+                 ):
+        self.s = sock if sock is not None else socket.socket(socket.PF_CAN, socket.SOCK_DGRAM, socket.CAN_BCM)
+        self.apply_socket_options(rcvbuf=rcvbuf, sndbuf=sndbuf, priority=priority,
+                                  rcvbuf_force=rcvbuf_force, busy_poll=busy_poll)
         self.s.connect((interface,))
+        self.rxbuf = bytearray(BcmMsg.get_size() + (self.MAX_NFRAMES * CanFdFrame.get_size()))
+        self.metrics = None
+        if metrics:
+            self.enable_metrics()
+
+    def enable_metrics(self) -> SocketMetrics:
+        """ collect statistics of this socket, frames are bcm messages
+
+            @return: the SocketMetrics, also available as attribute metrics
+        """
+        self.metrics = SocketMetrics()
+        return self.metrics
 
     def __del__(self):
         self.s.close()
-    
+
     def send(self, bcm_msg: BcmMsg):
         """ send a bcm message to bcm socket
-        
-            @param bcm: A bcm message to be sent 
+
+            @param bcm: A bcm message to be sent
         """
-        return self.s.send(bcm_msg.to_bytes())
-    
+        return self.send_raw(bcm_msg.to_bytes())
+
+    def send_raw(self, buffer):
+        """ send a bcm message that is already packed, e.g. a preallocated buffer that is updated in place
+
+            @param buffer: the byte representation of a bcm message
+        """
+        size = self.s.send(buffer)
+        if self.metrics is not None:
+            self.metrics.add_tx(1, size)
+        return size
+
     def recv(self):
-        """ receive a bcm message from bcm socket """
-        data = bytearray()
-        data.extend(self.s.recv(BcmMsg.get_size()))
-        assert len(data) == BcmMsg.get_size()
-        nframes = BcmMsg.get_nframes_from_bytes()
-        data.extend(self.s.recv(CanFrame.get_size() * nframes))        
-        return BcmMsg.from_bytes(data)
-    
+        """ receive a bcm message from bcm socket
+
+            The whole datagram is received into a reusable buffer and parsed in place.
+        """
+        if self.busy_poll is not None:
+            self.busy_wait()
+        size = self.s.recv_into(self.rxbuf)
+        assert size >= BcmMsg.get_size()
+        if self.metrics is not None:
+            self.metrics.add_rx(1, size)
+        return BcmMsg.unpack_from(self.rxbuf)
+
+    def recv_event(self) -> BcmRxEvent:
+        """ receive the next event of the receive side
+
+            @return: a BcmRxChanged, BcmRxTimeout or BcmRxStatus
+        """
+        return BcmRxEvent.from_bcm_msg(self.recv())
+
+    def events(self) -> Iterator[BcmRxEvent]:
+        """ iterate over the events of the receive side, this blocks until an event happens """
+        while True:
+            yield self.recv_event()
+
     def setup_cyclic_transmit(self,
                               frame: CanFrame,
                               interval: float):
         """ convenience function to abstract the socket interface
-        
+
             @param frame: A CAN frame to be sent
-            @param interval: the interval it should be sent  
+            @param interval: the interval it should be sent
         """
         bcm = BcmMsg(opcode=BcmOpCodes.TX_SETUP,
-             flags=(BCMFlags.SETTIMER | BCMFlags.STARTTIMER),
-             can_id=frame.can_id,
-             frames = [frame,],
-             ival1=0,
-             ival2=interval,
-             )
+                     flags=(BCMFlags.SETTIMER | BCMFlags.STARTTIMER),
+                     can_id=frame.can_id,
+                     frames=[frame, ],
+                     ival1=0,
+                     ival2=interval,
+                     )
         return self.send(bcm)
-    
+
     def setup_cyclic_receive(self,
                              frame: CanFrame,
                              interval: float):
         """ convenience function to abstract the socket interface
-        
+
             @param frame: A CAN frame to be received, the frame data is a filter
-            @param interval: the interval it should be received  
+            @param interval: the interval it should be received
         """
         bcm = BcmMsg(opcode=BcmOpCodes.RX_SETUP,
-             flags=(BCMFlags.SETTIMER | BCMFlags.STARTTIMER),
-             can_id=frame.can_id,
-             frames = [frame,],
-             ival1=0,
-             ival2=interval,
-             )
+                     flags=(BCMFlags.SETTIMER | BCMFlags.STARTTIMER),
+                     can_id=frame.can_id,
+                     frames=[frame, ],
+                     ival1=0,
+                     ival2=interval,
+                     )
         return self.send(bcm)
 
+    def setup_receive(self,
+                      can_id: int,
+                      mask: bytes = None,
+                      timeout: float = 0,
+                      throttle: float = 0,
+                      flags: int = 0):
+        """ set up a receive job, the kernel only reports changes as RX_CHANGED event
+
+            @param can_id: the can id to receive
+            @param mask: the bits of the data to watch for changes, None to report every frame (RX_FILTER_ID)
+            @param timeout: report RX_TIMEOUT if no frame is received within timeout, 0 to disable
+            @param throttle: the minimum time between two RX_CHANGED events, 0 to disable
+            @param flags: additional BCMFlags, e.g. RX_CHECK_DLC or RX_ANNOUNCE_RESUME
+        """
+        frames = []
+        if mask is None:
+            flags = flags | BCMFlags.RX_FILTER_ID
+        else:
+            frames.append(CanFrame(can_id=can_id, data=mask))
+        return self._send_rx_setup(can_id=can_id, frames=frames, timeout=timeout, throttle=throttle, flags=flags)
+
+    def setup_multiplex_receive(self,
+                                can_id: int,
+                                mux_mask: bytes,
+                                filters: Iterable[bytes],
+                                timeout: float = 0,
+                                throttle: float = 0,
+                                flags: int = 0):
+        """ set up a receive job for a multiplexed frame
+
+            The bits of mux_mask select the multiplexer in the data. Each filter holds the
+            multiplexer value in the mux_mask bits and the bits to watch for changes in the other bits.
+
+            @param can_id: the can id to receive
+            @param mux_mask: the bits of the data that hold the multiplexer
+            @param filters: the data filters, one per multiplexer value, at most 255
+            @param timeout: report RX_TIMEOUT if no frame is received within timeout, 0 to disable
+            @param throttle: the minimum time between two RX_CHANGED events, 0 to disable
+            @param flags: additional BCMFlags, e.g. RX_CHECK_DLC or RX_ANNOUNCE_RESUME
+        """
+        frames = [CanFrame(can_id=can_id, data=mux_mask)]
+        frames.extend(CanFrame(can_id=can_id, data=data) for data in filters)
+        if len(frames) > self.MAX_NFRAMES:
+            raise ValueError("A multiplex receive job takes at most {0} filters".format(self.MAX_NFRAMES - 1))
+        return self._send_rx_setup(can_id=can_id, frames=frames, timeout=timeout, throttle=throttle, flags=flags)
+
+    def _send_rx_setup(self,
+                       can_id: int,
+                       frames: List[CanFrame],
+                       timeout: float,
+                       throttle: float,
+                       flags: int):
+        """ send RX_SETUP, ival1 is the timeout and ival2 the throttle interval """
+        if timeout or throttle:
+            flags = flags | BCMFlags.SETTIMER
+        if can_id > CAN_SFF_MASK:
+            can_id = can_id | CAN_EFF_FLAG
+        return self.send(BcmMsg(opcode=BcmOpCodes.RX_SETUP,
+                                flags=flags,
+                                can_id=can_id,
+                                frames=frames,
+                                count=0,
+                                ival1=timeout,
+                                ival2=throttle,
+                                ))
+
+    def delete_receive(self, can_id: int):
+        """ delete a receive job
+
+            @param can_id: the can id of the receive job
+        """
+        if can_id > CAN_SFF_MASK:
+            can_id = can_id | CAN_EFF_FLAG
+        return self.send(BcmMsg(opcode=BcmOpCodes.RX_DELETE,
+                                flags=0,
+                                can_id=can_id,
+                                frames=[],
+                                count=0,
+                                ival2=0,
+                                ))
+
+
+class IsoTpOpts:
+    """ The general options of an isotp socket, a struct can_isotp_options
+
+        @param flags: an or combination of IsoTpFlags, the flags for addressing and padding
+                      are added by the respective parameters
+        @param frame_txtime: the time between two frames in nanoseconds, 0 for the kernel default,
+                             CAN_ISOTP_FRAME_TXTIME_ZERO for no time
+        @param ext_address: the address byte for extended addressing, None for normal addressing
+        @param tx_padding: the padding byte of sent frames, None to not pad
+        @param rx_padding: the padding byte that is expected in received frames, None to not check
+        @param rx_ext_address: a different address byte for receiving with extended addressing
+    """
+
+    FORMAT = "IIBBBB"
+    STRUCT = struct.Struct(FORMAT)
+
+    def __init__(self,
+                 flags: int = 0,
+                 frame_txtime: int = 0,
+                 ext_address: int = None,
+                 tx_padding: int = None,
+                 rx_padding: int = None,
+                 rx_ext_address: int = None,
+                 ):
+        self.flags = flags
+        self.frame_txtime = frame_txtime
+        self.ext_address = ext_address
+        self.tx_padding = tx_padding
+        self.rx_padding = rx_padding
+        self.rx_ext_address = rx_ext_address
+        if ext_address is not None:
+            self.flags = self.flags | IsoTpFlags.CAN_ISOTP_EXTEND_ADDR
+        if tx_padding is not None:
+            self.flags = self.flags | IsoTpFlags.CAN_ISOTP_TX_PADDING
+        if rx_padding is not None:
+            self.flags = self.flags | IsoTpFlags.CAN_ISOTP_RX_PADDING
+        if rx_ext_address is not None:
+            self.flags = self.flags | IsoTpFlags.CAN_ISOTP_RX_EXT_ADDR
+
+    def to_bytes(self):
+        """ return the byte representation of the options that socketcan expects """
+        return self.STRUCT.pack(self.flags,
+                                self.frame_txtime,
+                                self.ext_address or 0,
+                                self.tx_padding or 0,
+                                self.rx_padding or 0,
+                                self.rx_ext_address or 0)
+
+    def __eq__(self, other):
+        """ standard equality operation """
+        return self.to_bytes() == other.to_bytes()
+
+    def __ne__(self, other):
+        """ standard non equality operation """
+        return not self.__eq__(other)
+
+    @classmethod
+    def from_bytes(cls, byte_repr: bytes):
+        """ factory to create instance from bytes representation """
+        flags, frame_txtime, ext_address, txpad_content, rxpad_content, rx_ext_address = cls.STRUCT.unpack(byte_repr)
+        return cls(flags=flags,
+                   frame_txtime=frame_txtime,
+                   ext_address=ext_address if (flags & IsoTpFlags.CAN_ISOTP_EXTEND_ADDR) else None,
+                   tx_padding=txpad_content if (flags & IsoTpFlags.CAN_ISOTP_TX_PADDING) else None,
+                   rx_padding=rxpad_content if (flags & IsoTpFlags.CAN_ISOTP_RX_PADDING) else None,
+                   rx_ext_address=rx_ext_address if (flags & IsoTpFlags.CAN_ISOTP_RX_EXT_ADDR) else None,
+                   )
+
+    @classmethod
+    def get_size(cls):
+        """ size getter """
+        return cls.STRUCT.size
+
+
+class IsoTpFcOpts:
+    """ The flow control options of an isotp socket, a struct can_isotp_fc_options
+
+        These are sent to the other side in flow control frames.
+
+        @param bs: the block size, the number of consecutive frames before the next flow control, 0 for no limit
+        @param stmin: the separation time between consecutive frames,
+                      0x00 - 0x7F milliseconds, 0xF1 - 0xF9 100 - 900 microseconds
+        @param wftmax: the maximum number of wait frames, 0 to omit wait frames
+    """
+
+    FORMAT = "BBB"
+    STRUCT = struct.Struct(FORMAT)
+
+    def __init__(self,
+                 bs: int = 0,
+                 stmin: int = 0,
+                 wftmax: int = 0,
+                 ):
+        self.bs = bs
+        self.stmin = stmin
+        self.wftmax = wftmax
+
+    def to_bytes(self):
+        """ return the byte representation of the options that socketcan expects """
+        return self.STRUCT.pack(self.bs, self.stmin, self.wftmax)
+
+    def __eq__(self, other):
+        """ standard equality operation """
+        return self.to_bytes() == other.to_bytes()
+
+    def __ne__(self, other):
+        """ standard non equality operation """
+        return not self.__eq__(other)
+
+    @classmethod
+    def from_bytes(cls, byte_repr: bytes):
+        """ factory to create instance from bytes representation """
+        bs, stmin, wftmax = cls.STRUCT.unpack(byte_repr)
+        return cls(bs=bs, stmin=stmin, wftmax=wftmax)
+
+    @classmethod
+    def get_size(cls):
+        """ size getter """
+        return cls.STRUCT.size
+
+
+class IsoTpLlOpts:
+    """ The link layer options of an isotp socket, a struct can_isotp_ll_options
+
+        @param mtu: CAN_MTU (16) for CAN 2.0 or CANFD_MTU (72) for CAN FD
+        @param tx_dl: the maximum data length of sent frames, 8, 12, 16, 20, 24, 32, 48 or 64
+        @param tx_flags: the CanFdFlags of sent CAN FD frames
+    """
+
+    FORMAT = "BBB"
+    STRUCT = struct.Struct(FORMAT)
+
+    def __init__(self,
+                 mtu: int = 16,
+                 tx_dl: int = 8,
+                 tx_flags: int = 0,
+                 ):
+        self.mtu = mtu
+        self.tx_dl = tx_dl
+        self.tx_flags = tx_flags
 
-class CanIsoTpSocket:
+    def to_bytes(self):
+        """ return the byte representation of the options that socketcan expects """
+        return self.STRUCT.pack(self.mtu, self.tx_dl, self.tx_flags)
+
+    def __eq__(self, other):
+        """ standard equality operation """
+        return self.to_bytes() == other.to_bytes()
+
+    def __ne__(self, other):
+        """ standard non equality operation """
+        return not self.__eq__(other)
+
+    @classmethod
+    def from_bytes(cls, byte_repr: bytes):
+        """ factory to create instance from bytes representation """
+        mtu, tx_dl, tx_flags = cls.STRUCT.unpack(byte_repr)
+        return cls(mtu=mtu, tx_dl=tx_dl, tx_flags=tx_flags)
+
+    @classmethod
+    def get_size(cls):
+        """ size getter """
+        return cls.STRUCT.size
+
+
+class CanIsoTpSocket(SocketOptionsMixin):
     """ A socket to IsoTp
-    
+
+        The options are set before the socket is bound, the kernel ignores most of them afterwards.
+
         @param interface: name
         @param rx_addr: the can_id that is received
-        @param tx_addr: the can_id that is transmitted 
+        @param tx_addr: the can_id that is transmitted
+        @param opts: the general options, IsoTpOpts
+        @param fc_opts: the flow control options, IsoTpFcOpts
+        @param ll_opts: the link layer options, IsoTpLlOpts, use them for CAN FD
+        @param tx_stmin: the minimum separation time of sent consecutive frames in nanoseconds,
+                         overrides the stmin of the other side if larger
+        @param rx_stmin: drop received consecutive frames that arrive faster than this in nanoseconds
+        @param bufsize: the size of the reusable receive buffer of recv_view(),
+                        the maximum pdu length of the kernel is 8200 with CAN FD
+        @param metrics: collect SocketMetrics, see enable_metrics()
+        @param rcvbuf: the size of the receive buffer in bytes, see set_rcvbuf()
+        @param sndbuf: the size of the send buffer in bytes, see set_sndbuf()
+        @param priority: the priority of sent frames, see set_priority()
+        @param rcvbuf_force: exceed net.core.rmem_max with rcvbuf, requires CAP_NET_ADMIN
+        @param busy_poll: the time in seconds to spin before a receive call blocks, see set_busy_poll()
+        @param sock: an existing socket to use instead of a new one, e.g. a node of a VirtualBus
     """
+
     def __init__(self,
                  interface: str,
                  rx_addr: int,
-                 tx_addr: int):
-        self.s = socket.socket(socket.AF_CAN,socket.SOCK_DGRAM,socket.CAN_ISOTP)
+                 tx_addr: int,
+                 opts: IsoTpOpts = None,
+                 fc_opts: IsoTpFcOpts = None,
+                 ll_opts: IsoTpLlOpts = None,
+                 tx_stmin: int = None,
+                 rx_stmin: int = None,
+                 bufsize: int = 8200,
+                 metrics: bool = False,
+                 rcvbuf: int = None,
+                 sndbuf: int = None,
+                 priority: int = None,
+                 rcvbuf_force: bool = False,
+                 busy_poll: float = None,
+                 sock: socket.socket = None,
+                 ):
+        self.s = sock if sock is not None else socket.socket(socket.AF_CAN, socket.SOCK_DGRAM, socket.CAN_ISOTP)
+        if opts is not None:
+            self.set_opts(opts)
+        if fc_opts is not None:
+            self.set_fc_opts(fc_opts)
+        if ll_opts is not None:
+            self.set_ll_opts(ll_opts)
+        if tx_stmin is not None:
+            self.set_tx_stmin(tx_stmin)
+        if rx_stmin is not None:
+            self.set_rx_stmin(rx_stmin)
+        self.apply_socket_options(rcvbuf=rcvbuf, sndbuf=sndbuf, priority=priority,
+                                  rcvbuf_force=rcvbuf_force, busy_poll=busy_poll)
         self.s.bind((interface, rx_addr, tx_addr))
+        self.bufsize = bufsize
+        self.rxbuf = None
+        self.metrics = None
+        if metrics:
+            self.enable_metrics()
 
     def __del__(self):
         self.s.close()
-    
+
+    def enable_metrics(self) -> SocketMetrics:
+        """ collect statistics of this socket, frames are pdus
+
+            @return: the SocketMetrics, also available as attribute metrics
+        """
+        self.metrics = SocketMetrics()
+        return self.metrics
+
+    def set_opts(self, opts: IsoTpOpts):
+        """ set the general options """
+        self.s.setsockopt(SOL_CAN_ISOTP, CanIsoTpOptions.CAN_ISOTP_OPTS, opts.to_bytes())
+
+    def get_opts(self) -> IsoTpOpts:
+        """ get the general options """
+        return IsoTpOpts.from_bytes(self.s.getsockopt(SOL_CAN_ISOTP, CanIsoTpOptions.CAN_ISOTP_OPTS,
+                                                      IsoTpOpts.get_size()))
+
+    def set_fc_opts(self, fc_opts: IsoTpFcOpts):
+        """ set the flow control options """
+        self.s.setsockopt(SOL_CAN_ISOTP, CanIsoTpOptions.CAN_ISOTP_RECV_FC, fc_opts.to_bytes())
+
+    def get_fc_opts(self) -> IsoTpFcOpts:
+        """ get the flow control options """
+        return IsoTpFcOpts.from_bytes(self.s.getsockopt(SOL_CAN_ISOTP, CanIsoTpOptions.CAN_ISOTP_RECV_FC,
+                                                        IsoTpFcOpts.get_size()))
+
+    def set_ll_opts(self, ll_opts: IsoTpLlOpts):
+        """ set the link layer options """
+        self.s.setsockopt(SOL_CAN_ISOTP, CanIsoTpOptions.CAN_ISOTP_LL_OPTS, ll_opts.to_bytes())
+
+    def get_ll_opts(self) -> IsoTpLlOpts:
+        """ get the link layer options """
+        return IsoTpLlOpts.from_bytes(self.s.getsockopt(SOL_CAN_ISOTP, CanIsoTpOptions.CAN_ISOTP_LL_OPTS,
+                                                        IsoTpLlOpts.get_size()))
+
+    def set_tx_stmin(self, tx_stmin: int):
+        """ set the minimum separation time of sent consecutive frames in nanoseconds """
+        self.s.setsockopt(SOL_CAN_ISOTP, CanIsoTpOptions.CAN_ISOTP_TX_STMIN, struct.pack("I", tx_stmin))
+
+    def get_tx_stmin(self) -> int:
+        """ get the minimum separation time of sent consecutive frames in nanoseconds """
+        return struct.unpack("I", self.s.getsockopt(SOL_CAN_ISOTP, CanIsoTpOptions.CAN_ISOTP_TX_STMIN, 4))[0]
+
+    def set_rx_stmin(self, rx_stmin: int):
+        """ set the minimum separation time of received consecutive frames in nanoseconds """
+        self.s.setsockopt(SOL_CAN_ISOTP, CanIsoTpOptions.CAN_ISOTP_RX_STMIN, struct.pack("I", rx_stmin))
+
+    def get_rx_stmin(self) -> int:
+        """ get the minimum separation time of received consecutive frames in nanoseconds """
+        return struct.unpack("I", self.s.getsockopt(SOL_CAN_ISOTP, CanIsoTpOptions.CAN_ISOTP_RX_STMIN, 4))[0]
+
     def send(self, data: bytes):
-        """ wrapper for send """
-        return self.s.send(data)
-    
+        """ wrapper for send, data can be any bytes like object, e.g. a memoryview on a larger buffer """
+        size = self.s.send(data)
+        if self.metrics is not None:
+            self.metrics.add_tx(1, size)
+        return size
+
+    def sendmsg(self, buffers):
+        """ send a pdu that is gathered from several buffers without joining them
+
+            @param buffers: an iterable of bytes like objects
+        """
+        size = self.s.sendmsg(buffers)
+        if self.metrics is not None:
+            self.metrics.add_tx(1, size)
+        return size
+
     def recv(self, bufsize: int):
         """ wrapper for receive """
-        return self.s.recv(bufsize)
+        if self.busy_poll is not None:
+            self.busy_wait()
+        data = self.s.recv(bufsize)
+        if self.metrics is not None:
+            self.metrics.add_rx(1, len(data))
+        return data
+
+    def recv_into(self, buffer, nbytes: int = 0) -> int:
+        """ receive a pdu into a buffer
+
+            @param buffer: a writable bytes like object, e.g. a bytearray
+            @param nbytes: the maximum number of bytes, 0 for the size of buffer
+            @return: the length of the pdu
+        """
+        if self.busy_poll is not None:
+            self.busy_wait()
+        size = self.s.recv_into(buffer, nbytes)
+        if self.metrics is not None:
+            self.metrics.add_rx(1, size)
+        return size
+
+    def recv_view(self) -> memoryview:
+        """ receive a pdu into a reusable buffer
+
+            @return: a memoryview on the pdu, it is only valid until the next call
+        """
+        if self.busy_poll is not None:
+            self.busy_wait()
+        if self.rxbuf is None:
+            self.rxbuf = bytearray(self.bufsize)
+            self.rxview = memoryview(self.rxbuf)
+        size = self.s.recv_into(self.rxbuf)
+        if self.metrics is not None:
+            self.metrics.add_rx(1, size)
+        return self.rxview[:size]
+
+
+class J1939Filter:
+    """ A receive filter of a CanJ1939Socket, a message is received if it matches any filter
+
+        A field matches if the masked value of the message equals the masked value of the filter.
+
+        @param name: the name of the source
+        @param name_mask: the bits of name that have to match, 0 to ignore name
+        @param pgn: the parameter group number
+        @param pgn_mask: the bits of pgn that have to match, 0 to ignore pgn
+        @param addr: the source address
+        @param addr_mask: the bits of addr that have to match, 0 to ignore addr
+    """
+
+    # force alignment to 8 byte boundary like struct j1939_filter
+    FORMAT = "QQIIBB0q"
+    STRUCT = struct.Struct(FORMAT)
+
+    def __init__(self,
+                 name: int = 0,
+                 name_mask: int = 0,
+                 pgn: int = 0,
+                 pgn_mask: int = 0,
+                 addr: int = 0,
+                 addr_mask: int = 0,
+                 ):
+        self.name = name
+        self.name_mask = name_mask
+        self.pgn = pgn
+        self.pgn_mask = pgn_mask
+        self.addr = addr
+        self.addr_mask = addr_mask
+
+    def to_bytes(self):
+        """ return the byte representation of the filter that socketcan expects """
+        return self.STRUCT.pack(self.name, self.name_mask, self.pgn, self.pgn_mask, self.addr, self.addr_mask)
+
+    def __eq__(self, other):
+        """ standard equality operation """
+        return self.to_bytes() == other.to_bytes()
+
+    def __ne__(self, other):
+        """ standard non equality operation """
+        return not self.__eq__(other)
+
+    @classmethod
+    def from_bytes(cls, byte_repr: bytes):
+        """ factory to create instance from bytes representation """
+        name, name_mask, pgn, pgn_mask, addr, addr_mask = cls.STRUCT.unpack(byte_repr)
+        return cls(name=name, name_mask=name_mask, pgn=pgn, pgn_mask=pgn_mask, addr=addr, addr_mask=addr_mask)
+
+    @classmethod
+    def get_size(cls):
+        """ size getter """
+        return cls.STRUCT.size
+
+
+class J1939Message:
+    """ A J1939 message as the kernel delivers it, large messages are already reassembled
+
+        @param pgn: the parameter group number
+        @param data: the data bytes
+        @param src_addr: the source address
+        @param src_name: the name of the source, J1939_NO_NAME if the kernel does not know it
+        @param dst_addr: the destination address, J1939_NO_ADDR for a broadcast
+        @param dst_name: the name of the destination, J1939_NO_NAME if the kernel does not know it
+        @param priority: the priority 0 to 7, None if unknown
+    """
+
+    def __init__(self,
+                 pgn: int,
+                 data: bytes,
+                 src_addr: int = J1939_NO_ADDR,
+                 src_name: int = J1939_NO_NAME,
+                 dst_addr: int = J1939_NO_ADDR,
+                 dst_name: int = J1939_NO_NAME,
+                 priority: int = None,
+                 ):
+        self.pgn = pgn
+        self.data = data
+        self.src_addr = src_addr
+        self.src_name = src_name
+        self.dst_addr = dst_addr
+        self.dst_name = dst_name
+        self.priority = priority
+
+    def __eq__(self, other):
+        """ standard equality operation """
+        return all((self.pgn == other.pgn,
+                    self.data == other.data,
+                    self.src_addr == other.src_addr,
+                    self.dst_addr == other.dst_addr,
+                    ))
+
+    def __ne__(self, other):
+        """ standard non equality operation """
+        return not self.__eq__(other)
+
+
+def j1939_info_from_ancdata(ancdata) -> tuple:
+    """ helper to extract the destination and priority of a received J1939 message from the ancillary data
+
+        @param ancdata: a list of (cmsg_level, cmsg_type, cmsg_data)
+        @return: a tuple of destination address, destination name and priority
+    """
+    dst_addr = J1939_NO_ADDR
+    dst_name = J1939_NO_NAME
+    priority = None
+    for cmsg_level, cmsg_type, cmsg_data in ancdata:
+        if cmsg_level != SOL_CAN_J1939:
+            continue
+        if cmsg_type == CanJ1939CmsgTypes.SCM_J1939_DEST_ADDR:
+            dst_addr = cmsg_data[0]
+        elif cmsg_type == CanJ1939CmsgTypes.SCM_J1939_DEST_NAME:
+            dst_name = struct.unpack("Q", cmsg_data[:8])[0]
+        elif cmsg_type == CanJ1939CmsgTypes.SCM_J1939_PRIO:
+            priority = cmsg_data[0]
+    return dst_addr, dst_name, priority
+
+
+class CanJ1939Socket(SocketOptionsMixin):
+    """ A socket to the J1939 protocol of the kernel
+
+        The kernel handles the transport protocols, a message of up to 1785 bytes is sent
+        and received with one syscall instead of one per frame.
+        The socket is bound to a source address or to a name whose address the kernel
+        learns from the address claims on the bus, see claim_address().
+
+        @param interface: name
+        @param name: the 64 bit name of this node, J1939_NO_NAME to use addr only
+        @param addr: the source address of this node, J1939_NO_ADDR to receive only
+        @param pgn: receive only this parameter group number, J1939_NO_PGN for all
+        @param filters: optional J1939Filters that are installed before binding
+        @param promisc: receive all messages on the bus, not only those for addr and broadcasts
+        @param send_prio: the priority 0 to 7 of sent messages, the kernel default is 6
+        @param broadcast: allow sending to J1939_NO_ADDR
+        @param bufsize: the size of the reusable receive buffer,
+                        larger than J1939_MAX_TP_PACKET_SIZE for the extended transport protocol
+        @param metrics: collect SocketMetrics, see enable_metrics()
+        @param rcvbuf: the size of the receive buffer in bytes, see set_rcvbuf()
+        @param sndbuf: the size of the send buffer in bytes, see set_sndbuf()
+        @param priority: the priority of sent frames, see set_priority()
+        @param rcvbuf_force: exceed net.core.rmem_max with rcvbuf, requires CAP_NET_ADMIN
+        @param busy_poll: the time in seconds to spin before a receive call blocks, see set_busy_poll()
+    """
+
+    # the ancillary data of a received message, destination address, destination name and priority
+    ANCBUFSIZE = (socket.CMSG_SPACE(1) * 2) + socket.CMSG_SPACE(8)
+
+    def __init__(self,
+                 interface: str,
+                 name: int = J1939_NO_NAME,
+                 addr: int = J1939_NO_ADDR,
+                 pgn: int = J1939_NO_PGN,
+                 filters: Iterable[J1939Filter] = None,
+                 promisc: bool = False,
+                 send_prio: int = None,
+                 broadcast: bool = False,
+                 bufsize: int = J1939_MAX_TP_PACKET_SIZE,
+                 metrics: bool = False,
+                 rcvbuf: int = None,
+                 sndbuf: int = None,
+                 priority: int = None,
+                 rcvbuf_force: bool = False,
+                 busy_poll: float = None,
+                 ):
+        self.s = socket.socket(socket.AF_CAN, socket.SOCK_DGRAM, CAN_J1939)
+        if filters is not None:
+            self.set_filters(filters)
+        if promisc:
+            self.set_promisc(True)
+        if send_prio is not None:
+            self.set_send_prio(send_prio)
+        if broadcast:
+            self.set_broadcast(True)
+        self.apply_socket_options(rcvbuf=rcvbuf, sndbuf=sndbuf, priority=priority,
+                                  rcvbuf_force=rcvbuf_force, busy_poll=busy_poll)
+        self.s.bind((interface, name, pgn, addr))
+        self.name = name
+        self.addr = addr
+        self.rxbuf = bytearray(bufsize)
+        self.rxview = memoryview(self.rxbuf)
+        self.metrics = None
+        if metrics:
+            self.enable_metrics()
+
+    def __del__(self):
+        self.s.close()
+
+    def enable_metrics(self) -> SocketMetrics:
+        """ collect statistics of this socket, frames are messages
+
+            @return: the SocketMetrics, also available as attribute metrics
+        """
+        self.metrics = SocketMetrics()
+        return self.metrics
+
+    def set_filters(self, filters: Iterable[J1939Filter]):
+        """ install receive filters in the kernel, at most 512
+
+            @param filters: an iterable of J1939Filters, an empty one removes the filters
+        """
+        self.s.setsockopt(SOL_CAN_J1939, CanJ1939Options.SO_J1939_FILTER,
+                          b"".join(j1939_filter.to_bytes() for j1939_filter in filters))
+
+    def set_promisc(self, enable: bool):
+        """ receive all messages on the bus, regardless of destination and filters """
+        self.s.setsockopt(SOL_CAN_J1939, CanJ1939Options.SO_J1939_PROMISC, int(enable))
+
+    def get_promisc(self) -> bool:
+        """ get the promiscuous mode """
+        return bool(self.s.getsockopt(SOL_CAN_J1939, CanJ1939Options.SO_J1939_PROMISC))
+
+    def set_send_prio(self, send_prio: int):
+        """ set the priority of sent messages, 0 is the highest, 0 and 1 require CAP_NET_ADMIN """
+        self.s.setsockopt(SOL_CAN_J1939, CanJ1939Options.SO_J1939_SEND_PRIO, send_prio)
+
+    def get_send_prio(self) -> int:
+        """ get the priority of sent messages """
+        return self.s.getsockopt(SOL_CAN_J1939, CanJ1939Options.SO_J1939_SEND_PRIO)
+
+    def set_broadcast(self, enable: bool):
+        """ allow sending to J1939_NO_ADDR, the kernel rejects broadcasts otherwise """
+        self.s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, int(enable))
+
+    def connect(self,
+                pgn: int,
+                addr: int = J1939_NO_ADDR,
+                name: int = J1939_NO_NAME):
+        """ set the default destination of send()
+
+            @param pgn: the parameter group number
+            @param addr: the destination address, J1939_NO_ADDR for a broadcast
+            @param name: the name of the destination instead of addr
+        """
+        self.s.connect(("", name, pgn, addr))
+
+    def send(self, data: bytes):
+        """ send a message to the destination of connect(), data can be any bytes like object """
+        size = self.s.send(data)
+        if self.metrics is not None:
+            self.metrics.add_tx(1, size)
+        return size
+
+    def sendto(self,
+               data: bytes,
+               pgn: int,
+               addr: int = J1939_NO_ADDR,
+               name: int = J1939_NO_NAME):
+        """ send a message
+
+            @param data: the data, messages above 8 bytes are sent with a transport protocol by the kernel
+            @param pgn: the parameter group number
+            @param addr: the destination address, J1939_NO_ADDR for a broadcast
+            @param name: the name of the destination instead of addr
+        """
+        size = self.s.sendto(data, ("", name, pgn, addr))
+        if self.metrics is not None:
+            self.metrics.add_tx(1, size)
+        return size
+
+    def recvfrom(self) -> tuple:
+        """ receive a message
+
+            @return: a tuple of data, pgn and source address
+        """
+        if self.busy_poll is not None:
+            self.busy_wait()
+        size, address = self.s.recvfrom_into(self.rxbuf)
+        if self.metrics is not None:
+            self.metrics.add_rx(1, size)
+        _, _, pgn, addr = address
+        return bytes(self.rxview[:size]), pgn, addr
+
+    def recv_message(self) -> J1939Message:
+        """ receive a message with source, destination and priority
+
+            @return: a J1939Message
+        """
+        if self.busy_poll is not None:
+            self.busy_wait()
+        size, ancdata, msg_flags, address = self.s.recvmsg_into([self.rxbuf], self.ANCBUFSIZE)
+        if self.metrics is not None:
+            self.metrics.add_rx(1, size)
+        _, src_name, pgn, src_addr = address
+        dst_addr, dst_name, priority = j1939_info_from_ancdata(ancdata)
+        return J1939Message(pgn=pgn,
+                            data=bytes(self.rxview[:size]),
+                            src_addr=src_addr,
+                            src_name=src_name,
+                            dst_addr=dst_addr,
+                            dst_name=dst_name,
+                            priority=priority,
+                            )
+
+    def claim_address(self, timeout: float = 0.25) -> bool:
+        """ claim the source address for the name of this socket
+
+            Sends an address claim and defends it for timeout against claims of the same address.
+            The node with the lower name wins. Requests for address claims are answered.
+            The kernel learns the address of the name from the claim, so messages can be
+            addressed to the name afterwards.
+
+            @param timeout: the time to wait for contending claims, 250 ms by the standard
+            @return: True if the address is claimed, False if a node with a lower name claimed it
+        """
+        if self.name == J1939_NO_NAME or self.addr == J1939_NO_ADDR:
+            raise ValueError("Claiming an address requires a name and an address")
+        self.set_broadcast(True)
+        self.send_address_claim()
+        previous_timeout = self.s.gettimeout()
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return True
+                self.s.settimeout(remaining)
+                try:
+                    msg = self.recv_message()
+                except socket.timeout:
+                    return True
+                if self.is_claim_lost(msg):
+                    logger.warning("address %02X is claimed by name %016X", self.addr, msg.src_name)
+                    return False
+                if self.is_claim_requested(msg) or self.is_claim_contended(msg):
+                    self.send_address_claim()
+        finally:
+            self.s.settimeout(previous_timeout)
+
+    def send_address_claim(self):
+        """ send an address claim of our address for our name """
+        self.sendto(self.name.to_bytes(8, "little"), pgn=J1939_PGN_ADDRESS_CLAIMED)
+
+    def get_claim_contender(self, msg: J1939Message) -> Optional[int]:
+        """ get the name of another node that claims our address
+
+            @param msg: a received message
+            @return: the name of the other node, None if the message is no contending address claim
+        """
+        if msg.pgn != J1939_PGN_ADDRESS_CLAIMED or msg.src_addr != self.addr or len(msg.data) < 8:
+            return None
+        other_name = int.from_bytes(msg.data[:8], "little")
+        if other_name == self.name:
+            return None
+        return other_name
+
+    def is_claim_lost(self, msg: J1939Message) -> bool:
+        """ check a received message for a contending address claim that wins over ours
+
+            @param msg: a received message
+            @return: True if a node with a lower name claims our address
+        """
+        other_name = self.get_claim_contender(msg)
+        return other_name is not None and other_name < self.name
+
+    def is_claim_contended(self, msg: J1939Message) -> bool:
+        """ check a received message for a contending address claim that we win and have to answer with our claim
+
+            @param msg: a received message
+            @return: True if a node with a higher name claims our address
+        """
+        other_name = self.get_claim_contender(msg)
+        return other_name is not None and other_name > self.name
 
+    def is_claim_requested(self, msg: J1939Message) -> bool:
+        """ check a received message for a request of the address claims to all nodes or to us """
+        return (msg.pgn == J1939_PGN_REQUEST
+                and msg.dst_addr in (J1939_NO_ADDR, self.addr)
+                and int.from_bytes(msg.data[:3], "little") == J1939_PGN_ADDRESS_CLAIMED)
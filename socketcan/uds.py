@@ -0,0 +1,368 @@
+""" Uds
+
+    A diagnostic client for Unified Diagnostic Services (ISO 14229) on top of CanIsoTpSocket
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import socket
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from enum import IntEnum
+from typing import Callable, Dict, Hashable, Optional
+
+from socketcan.socketcan import CanIsoTpSocket
+
+import logging
+logger = logging.getLogger("socketcan.uds")
+
+
+class UdsServices(IntEnum):
+    DIAGNOSTIC_SESSION_CONTROL = 0x10
+    ECU_RESET = 0x11
+    CLEAR_DIAGNOSTIC_INFORMATION = 0x14
+    READ_DTC_INFORMATION = 0x19
+    READ_DATA_BY_IDENTIFIER = 0x22
+    READ_MEMORY_BY_ADDRESS = 0x23
+    SECURITY_ACCESS = 0x27
+    COMMUNICATION_CONTROL = 0x28
+    WRITE_DATA_BY_IDENTIFIER = 0x2E
+    ROUTINE_CONTROL = 0x31
+    REQUEST_DOWNLOAD = 0x34
+    REQUEST_UPLOAD = 0x35
+    TRANSFER_DATA = 0x36
+    REQUEST_TRANSFER_EXIT = 0x37
+    TESTER_PRESENT = 0x3E
+    CONTROL_DTC_SETTING = 0x85
+
+
+class UdsNrc(IntEnum):
+    """ negative response codes """
+    GENERAL_REJECT = 0x10
+    SERVICE_NOT_SUPPORTED = 0x11
+    SUB_FUNCTION_NOT_SUPPORTED = 0x12
+    INCORRECT_MESSAGE_LENGTH_OR_INVALID_FORMAT = 0x13
+    RESPONSE_TOO_LONG = 0x14
+    BUSY_REPEAT_REQUEST = 0x21
+    CONDITIONS_NOT_CORRECT = 0x22
+    REQUEST_SEQUENCE_ERROR = 0x24
+    REQUEST_OUT_OF_RANGE = 0x31
+    SECURITY_ACCESS_DENIED = 0x33
+    INVALID_KEY = 0x35
+    EXCEEDED_NUMBER_OF_ATTEMPTS = 0x36
+    REQUIRED_TIME_DELAY_NOT_EXPIRED = 0x37
+    UPLOAD_DOWNLOAD_NOT_ACCEPTED = 0x70
+    TRANSFER_DATA_SUSPENDED = 0x71
+    GENERAL_PROGRAMMING_FAILURE = 0x72
+    WRONG_BLOCK_SEQUENCE_COUNTER = 0x73
+    RESPONSE_PENDING = 0x78
+    SUB_FUNCTION_NOT_SUPPORTED_IN_ACTIVE_SESSION = 0x7E
+    SERVICE_NOT_SUPPORTED_IN_ACTIVE_SESSION = 0x7F
+
+
+NEGATIVE_RESPONSE = 0x7F
+POSITIVE_RESPONSE_OFFSET = 0x40
+SUPPRESS_POSITIVE_RESPONSE = 0x80
+
+
+class UdsError(Exception):
+    """ base class of the uds exceptions """
+
+
+class UdsTimeout(UdsError):
+    """ the ecu did not respond within P2 or P2* """
+
+
+class UdsNegativeResponse(UdsError):
+    """ the ecu responded with a negative response code
+
+        @param service: the service of the request
+        @param nrc: the negative response code
+    """
+
+    def __init__(self, service: int, nrc: int):
+        try:
+            nrc_name = UdsNrc(nrc).name
+        except ValueError:
+            nrc_name = "UNKNOWN"
+        super().__init__("Negative response to service {0:02X}: {1:02X} {2}".format(service, nrc, nrc_name))
+        self.service = service
+        self.nrc = nrc
+
+
+class UdsInvalidResponse(UdsError):
+    """ the response does not match the request """
+
+
+class UdsClient:
+    """ A client for one ecu
+
+        Every request waits P2 for the response. If the ecu responds with RESPONSE_PENDING,
+        the client waits P2* from then on, until the final response.
+        Responses to other services are dropped as stale responses of earlier requests.
+
+        @param sock: a CanIsoTpSocket to the ecu
+        @param p2: the response timeout in seconds
+        @param p2_star: the response timeout after RESPONSE_PENDING in seconds
+    """
+
+    def __init__(self,
+                 sock: CanIsoTpSocket,
+                 p2: float = 0.05,
+                 p2_star: float = 5.0,
+                 ):
+        self.sock = sock
+        self.p2 = p2
+        self.p2_star = p2_star
+
+    def request(self,
+                service: int,
+                data: bytes = b"",
+                suppress_response: bool = False) -> Optional[bytes]:
+        """ send a request and wait for the response
+
+            @param service: the service id
+            @param data: the parameters of the request, a bytes like object or a tuple of bytes like objects,
+                         they are not joined with the service id, so a memoryview is not copied
+            @param suppress_response: the request has the suppress positive response bit set,
+                                      do not wait for a response
+            @return: the positive response without the service id, None if suppressed
+        """
+        if isinstance(data, tuple):
+            self.sock.sendmsg((bytes((service,)),) + data)
+        else:
+            self.sock.sendmsg((bytes((service,)), data))
+        if suppress_response:
+            return None
+        deadline = time.monotonic() + self.p2
+        while True:
+            response = self.recv_response(deadline - time.monotonic())
+            if response[0] == service + POSITIVE_RESPONSE_OFFSET:
+                return response[1:]
+            if (response[0] == NEGATIVE_RESPONSE) and (len(response) >= 3) and (response[1] == service):
+                if response[2] != UdsNrc.RESPONSE_PENDING:
+                    raise UdsNegativeResponse(service=service, nrc=response[2])
+                logger.debug("response pending for service %02X", service)
+                deadline = time.monotonic() + self.p2_star
+            else:
+                logger.debug("dropping stale response %s", response.hex())
+
+    def recv_response(self, timeout: float) -> bytes:
+        """ receive a response
+
+            @param timeout: the time to wait
+            @return: the response
+        """
+        if timeout <= 0:
+            raise UdsTimeout("No response within timeout")
+        previous_timeout = self.sock.s.gettimeout()
+        self.sock.s.settimeout(timeout)
+        try:
+            response = bytes(self.sock.recv_view())
+        except socket.timeout:
+            raise UdsTimeout("No response within timeout")
+        finally:
+            # the socket may be non blocking for asyncio or have a timeout of the caller
+            self.sock.s.settimeout(previous_timeout)
+        if not response:
+            raise UdsInvalidResponse("Empty response")
+        return response
+
+    def diagnostic_session_control(self, session: int) -> bytes:
+        """ change the diagnostic session
+
+            @param session: the session, e.g. 1 default, 2 programming, 3 extended
+            @return: the session parameter record
+        """
+        return self.request(UdsServices.DIAGNOSTIC_SESSION_CONTROL, bytes((session,)))[1:]
+
+    def ecu_reset(self, reset_type: int = 1) -> bytes:
+        """ reset the ecu
+
+            @param reset_type: the reset type, e.g. 1 hard reset
+            @return: the response parameters
+        """
+        return self.request(UdsServices.ECU_RESET, bytes((reset_type,)))[1:]
+
+    def tester_present(self, suppress_response: bool = True):
+        """ keep the diagnostic session alive
+
+            @param suppress_response: set the suppress positive response bit
+        """
+        sub_function = SUPPRESS_POSITIVE_RESPONSE if suppress_response else 0
+        self.request(UdsServices.TESTER_PRESENT, bytes((sub_function,)), suppress_response=suppress_response)
+
+    def read_data_by_identifier(self, did: int) -> bytes:
+        """ read a data identifier
+
+            @param did: the data identifier
+            @return: the data record
+        """
+        response = self.request(UdsServices.READ_DATA_BY_IDENTIFIER, did.to_bytes(2, "big"))
+        if int.from_bytes(response[:2], "big") != did:
+            raise UdsInvalidResponse("Response for data identifier {0:04X} instead of {1:04X}".format(
+                int.from_bytes(response[:2], "big"), did))
+        return response[2:]
+
+    def write_data_by_identifier(self, did: int, data: bytes):
+        """ write a data identifier
+
+            @param did: the data identifier
+            @param data: the data record
+        """
+        self.request(UdsServices.WRITE_DATA_BY_IDENTIFIER, did.to_bytes(2, "big") + bytes(data))
+
+    def request_seed(self, level: int) -> bytes:
+        """ request the seed of a security access level
+
+            @param level: the odd request seed sub function
+            @return: the seed
+        """
+        return self.request(UdsServices.SECURITY_ACCESS, bytes((level,)))[1:]
+
+    def send_key(self, level: int, key: bytes):
+        """ send the key of a security access level
+
+            @param level: the odd request seed sub function, the key is sent with level + 1
+            @param key: the key
+        """
+        self.request(UdsServices.SECURITY_ACCESS, bytes((level + 1,)) + bytes(key))
+
+    def routine_control(self,
+                        control_type: int,
+                        routine_id: int,
+                        data: bytes = b"") -> bytes:
+        """ start, stop or request the results of a routine
+
+            @param control_type: 1 start, 2 stop, 3 request results
+            @param routine_id: the routine identifier
+            @param data: the routine control option record
+            @return: the routine status record
+        """
+        return self.request(UdsServices.ROUTINE_CONTROL,
+                            bytes((control_type,)) + routine_id.to_bytes(2, "big") + bytes(data))[3:]
+
+    def request_download(self,
+                         address: int,
+                         size: int,
+                         address_length: int = 4,
+                         size_length: int = 4,
+                         data_format: int = 0) -> int:
+        """ request a download to the ecu
+
+            @param address: the memory address
+            @param size: the memory size
+            @param address_length: the number of bytes of the address
+            @param size_length: the number of bytes of the size
+            @param data_format: the data format identifier, compression and encryption
+            @return: the maximum number of bytes of a TransferData request, including service id and sequence counter
+        """
+        data = bytes((data_format, (size_length << 4) | address_length)) \
+            + address.to_bytes(address_length, "big") + size.to_bytes(size_length, "big")
+        response = self.request(UdsServices.REQUEST_DOWNLOAD, data)
+        length = response[0] >> 4
+        return int.from_bytes(response[1:1 + length], "big")
+
+    def transfer_data(self,
+                      sequence: int,
+                      data: bytes = b"") -> bytes:
+        """ transfer a block
+
+            @param sequence: the block sequence counter
+            @param data: the block, any bytes like object, a memoryview is not copied
+            @return: the transfer response parameter record
+        """
+        response = self.request(UdsServices.TRANSFER_DATA, (bytes((sequence & 0xFF,)), data))
+        if response[0] != (sequence & 0xFF):
+            raise UdsInvalidResponse("Response for block {0} instead of {1}".format(response[0], sequence & 0xFF))
+        return response[1:]
+
+    def request_transfer_exit(self, data: bytes = b"") -> bytes:
+        """ finish a transfer
+
+            @param data: the transfer request parameter record
+            @return: the transfer response parameter record
+        """
+        return self.request(UdsServices.REQUEST_TRANSFER_EXIT, data)
+
+    def download(self,
+                 address: int,
+                 data: bytes,
+                 address_length: int = 4,
+                 size_length: int = 4,
+                 data_format: int = 0) -> int:
+        """ download data to the ecu, RequestDownload, TransferData blocks and RequestTransferExit
+
+            The blocks are memoryview slices of data, so nothing is copied.
+
+            @param address: the memory address
+            @param data: the data
+            @param address_length: the number of bytes of the address
+            @param size_length: the number of bytes of the size
+            @param data_format: the data format identifier, compression and encryption
+            @return: the number of blocks
+        """
+        max_block_length = self.request_download(address=address,
+                                                 size=len(data),
+                                                 address_length=address_length,
+                                                 size_length=size_length,
+                                                 data_format=data_format)
+        # the block length includes the service id and the sequence counter
+        block_size = max_block_length - 2
+        if block_size < 1:
+            raise UdsInvalidResponse("Maximum block length {0} is too small".format(max_block_length))
+        view = memoryview(data)
+        nblocks = 0
+        for offset in range(0, len(view), block_size):
+            nblocks += 1
+            self.transfer_data(sequence=nblocks, data=view[offset:offset + block_size])
+        self.request_transfer_exit()
+        return nblocks
+
+
+class UdsClientPool:
+    """ Run requests on many ecus concurrently
+
+        Each ecu has its own UdsClient and socket. A blocking receive releases the GIL,
+        so a thread pool lets the waits for P2 overlap and a scan takes as long
+        as the slowest ecu instead of the sum of all ecus.
+
+        @param clients: a dictionary of a key, e.g. the ecu name, to a UdsClient
+        @param max_workers: the number of threads, None for one per client
+    """
+
+    def __init__(self,
+                 clients: Dict[Hashable, UdsClient],
+                 max_workers: int = None,
+                 ):
+        self.clients = clients
+        if max_workers is None:
+            max_workers = max(len(clients), 1)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def run(self, func: Callable[[UdsClient], object]) -> dict:
+        """ call func with each client concurrently
+
+            @param func: a function that takes a UdsClient, e.g. lambda client: client.read_data_by_identifier(0xF190)
+            @return: a dictionary of key to the return value of func or the exception it raised
+        """
+        futures = {key: self.executor.submit(func, client) for key, client in self.clients.items()}
+        results = {}
+        for key, future in futures.items():
+            exception = future.exception()
+            if exception is not None:
+                results[key] = exception
+            else:
+                results[key] = future.result()
+        return results
+
+    def close(self):
+        """ shut down the thread pool """
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
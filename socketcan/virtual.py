@@ -0,0 +1,781 @@
+""" Virtual
+
+    An in-process CAN bus for tests and benchmarks that need neither vcan nor privileges.
+
+    Each node of a VirtualBus is one end of a unix datagram socket pair, the bus holds the other end.
+    A CanRawSocket, CanBcmSocket or CanIsoTpSocket takes a node as its socket and works unchanged,
+    the datagrams are the same bytes the kernel exchanges, e.g. CanFrame.FORMAT for raw sockets.
+
+    The bus emulates what the kernel does with these bytes:
+    - raw frames are delivered to the other raw nodes with loopback semantics, filters, error filters,
+      CAN_RAW_RECV_OWN_MSGS and CAN_RAW_FD_FRAMES
+    - the broadcast manager runs its transmit jobs and receive jobs on a VirtualClock,
+      cyclic frames are only sent when the clock is advanced
+    - ISO-TP pdus are delivered whole to the node that receives the tx_addr of the sender,
+      there is no segmentation into frames and raw nodes do not see them
+
+    Every send is routed immediately, errors raise like the kernel does, send_batch() and
+    CyclicScheduler.flush() fall back from sendmmsg to a send loop for that.
+    Datagrams that still bypass the python socket methods, e.g. a sendmmsg through ctypes,
+    are routed by the next pump(), which every receive call of a node does first,
+    or continuously by a router thread, see start().
+
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import errno
+import heapq
+import itertools
+import select
+import socket
+import struct
+
+from threading import Event, RLock, Thread
+from typing import Callable, Dict, List, Optional
+
+from socketcan.socketcan import BCMFlags, BcmMsg, BcmOpCodes, CanBcmSocket, CanFdFrame, CanFrame, CanFlags, \
+    CanIsoTpSocket, CanRawOptions, CanRawSocket, CAN_EFF_MASK, CAN_ERR_MASK, CAN_INV_FILTER, SOL_CAN_ISOTP, \
+    SOL_CAN_J1939, SOL_CAN_RAW, float_to_timeval
+
+import logging
+logger = logging.getLogger("socketcan.virtual")
+
+CAN_ID = struct.Struct("I")
+CAN_FILTER = struct.Struct("II")
+# the bits of the can_id a bcm job matches, a job of a standard id does not receive an extended id
+BCM_ID_MASK = CAN_EFF_MASK | CanFlags.CAN_EFF_FLAG | CanFlags.CAN_RTR_FLAG
+# the offset of the data in a frame
+DATA_OFFSET = 8
+# the largest datagram a node can send, a bcm message with 256 CanFdFrames
+MAX_DATAGRAM_SIZE = BcmMsg.get_size() + (CanBcmSocket.MAX_NFRAMES * CanFdFrame.get_size())
+
+FRAME_SIZES = (CanFrame.get_size(), CanFdFrame.get_size())
+# exceeds net.core.wmem_max, requires CAP_NET_ADMIN
+SO_SNDBUFFORCE = 32
+
+
+class VirtualClock:
+    """ A clock that only moves when it is advanced
+
+        Timers run in the order of their due time, the clock is set to the due time
+        of each timer while it runs, so the callbacks see the time they were scheduled for.
+
+        @param start: the initial time in seconds
+    """
+
+    def __init__(self, start: float = 0):
+        self.now = start
+        self.timers = []
+        self.counter = itertools.count()
+
+    def time(self) -> float:
+        """ the current time, a drop-in for time.time() """
+        return self.now
+
+    def call_at(self,
+                when: float,
+                callback: Callable[[], None]) -> list:
+        """ run a callback at a time
+
+            @param when: the time in seconds
+            @param callback: a callable without arguments
+            @return: the timer, see cancel()
+        """
+        timer = [when, next(self.counter), callback]
+        heapq.heappush(self.timers, timer)
+        return timer
+
+    def call_later(self,
+                   delay: float,
+                   callback: Callable[[], None]) -> list:
+        """ run a callback after a delay
+
+            @param delay: the delay in seconds
+            @param callback: a callable without arguments
+            @return: the timer, see cancel()
+        """
+        return self.call_at(self.now + delay, callback)
+
+    @staticmethod
+    def cancel(timer: Optional[list]):
+        """ cancel a timer, it is removed from the heap when it is due
+
+            @param timer: the timer or None
+        """
+        if timer is not None:
+            timer[2] = None
+
+    def advance(self, seconds: float) -> int:
+        """ advance the clock and run the timers that become due
+
+            @param seconds: the time to advance in seconds
+            @return: the number of timers that ran
+        """
+        end = self.now + seconds
+        timers = self.timers
+        count = 0
+        while timers and timers[0][0] <= end:
+            when, _, callback = heapq.heappop(timers)
+            if callback is None:
+                continue
+            self.now = when
+            callback()
+            count += 1
+        self.now = end
+        return count
+
+
+class BcmTxOp:
+    """ A transmit job of the virtual broadcast manager
+
+        @param node: the bcm node that owns the job
+        @param can_id: the can id of the job
+    """
+
+    def __init__(self,
+                 node: "VirtualSocket",
+                 can_id: int):
+        self.node = node
+        self.can_id = can_id
+        self.flags = 0
+        self.frames: List[bytes] = []
+        self.currframe = 0
+        self.count = 0
+        self.ival1 = 0
+        self.ival2 = 0
+        self.timer = None
+
+    def setup(self, bcm_msg: BcmMsg, frames: List[bytes]):
+        """ apply a TX_SETUP message the way the kernel does """
+        bus = self.node.bus
+        self.flags = bcm_msg.flags
+        if frames:
+            self.frames = frames
+            if self.currframe >= len(frames):
+                self.currframe = 0
+        if self.flags & BCMFlags.TX_RESET_MULTI_IDX:
+            self.currframe = 0
+        if self.flags & BCMFlags.SETTIMER:
+            self.count = bcm_msg.count
+            self.ival1 = bcm_msg.ival1
+            self.ival2 = bcm_msg.ival2
+            if not (self.ival1 or self.ival2):
+                bus.clock.cancel(self.timer)
+                self.timer = None
+        announce = self.flags & BCMFlags.TX_ANNOUNCE
+        if self.flags & BCMFlags.STARTTIMER:
+            bus.clock.cancel(self.timer)
+            self.timer = None
+            # the kernel sends the first frame when the timer starts
+            announce = True
+        if announce:
+            self.transmit()
+            if self.count:
+                self.count -= 1
+        if self.flags & BCMFlags.STARTTIMER:
+            self.start_timer()
+
+    def transmit(self):
+        """ send the current frame and move on to the next one """
+        frame = self.frames[self.currframe]
+        self.currframe = (self.currframe + 1) % len(self.frames)
+        self.node.bus.deliver_frame(frame)
+
+    def start_timer(self):
+        """ schedule the next transmission, ival1 for the first count frames, then ival2 """
+        if self.ival1 and self.count:
+            interval = self.ival1
+        elif self.ival2:
+            interval = self.ival2
+        else:
+            self.timer = None
+            return
+        self.timer = self.node.bus.clock.call_later(interval, self.on_timer)
+
+    def on_timer(self):
+        """ the timer callback """
+        if self.ival1 and self.count > 0:
+            self.count -= 1
+            if not self.count and (self.flags & BCMFlags.TX_COUNTEVT):
+                self.node.bus.notify(self.node, self.get_msg(BcmOpCodes.TX_EXPIRED, frames=[]))
+            self.transmit()
+        elif self.ival2:
+            self.transmit()
+        self.start_timer()
+
+    def get_msg(self, opcode: int, frames: List[bytes] = None) -> bytes:
+        """ a message to the owner of the job, with the frames of the job by default """
+        if frames is None:
+            frames = self.frames
+        return pack_bcm_msg(opcode=opcode, flags=self.flags, count=self.count, ival1=self.ival1,
+                            ival2=self.ival2, can_id=self.can_id, frames=frames)
+
+    def delete(self):
+        """ stop the timer """
+        self.node.bus.clock.cancel(self.timer)
+        self.timer = None
+
+
+class BcmRxOp:
+    """ A receive job of the virtual broadcast manager
+
+        Changes are detected like the kernel does, including multiplexed filters, RX_CHECK_DLC and RX_TIMEOUT.
+        The throttle interval ival2 is not emulated, every change is reported immediately.
+
+        @param node: the bcm node that owns the job
+        @param can_id: the can id of the job
+    """
+
+    def __init__(self,
+                 node: "VirtualSocket",
+                 can_id: int):
+        self.node = node
+        self.can_id = can_id
+        self.flags = 0
+        self.masks: List[int] = []
+        self.frames: List[bytes] = []
+        self.last: List[Optional[bytes]] = [None]
+        self.ival1 = 0
+        self.ival2 = 0
+        self.timer = None
+
+    def setup(self, bcm_msg: BcmMsg, frames: List[bytes]):
+        """ apply a RX_SETUP message the way the kernel does """
+        self.flags = bcm_msg.flags
+        if not frames:
+            self.flags |= BCMFlags.RX_FILTER_ID
+        self.frames = frames
+        self.masks = [int.from_bytes(frame[DATA_OFFSET:], "little") for frame in frames]
+        self.last = [None] * max(len(frames), 1)
+        if self.flags & BCMFlags.SETTIMER:
+            self.ival1 = bcm_msg.ival1
+            self.ival2 = bcm_msg.ival2
+            self.stop_timer()
+        if (self.flags & BCMFlags.STARTTIMER) and self.ival1:
+            self.start_timer()
+
+    def start_timer(self):
+        """ (re)start the timeout """
+        self.stop_timer()
+        self.timer = self.node.bus.clock.call_later(self.ival1, self.on_timeout)
+
+    def stop_timer(self):
+        """ stop the timeout """
+        self.node.bus.clock.cancel(self.timer)
+        self.timer = None
+
+    def on_timeout(self):
+        """ the timer callback, the timeout restarts with the next frame """
+        self.timer = None
+        self.node.bus.notify(self.node, self.get_msg(BcmOpCodes.RX_TIMEOUT, frames=[]))
+        if self.flags & BCMFlags.RX_ANNOUNCE_RESUME:
+            self.last = [None] * len(self.last)
+
+    def process(self, frame: bytes):
+        """ process a frame of the can id of the job """
+        if self.ival1 and not (self.flags & BCMFlags.RX_NO_AUTOTIMER):
+            self.start_timer()
+        if self.flags & BCMFlags.RX_FILTER_ID:
+            self.changed(frame)
+            return
+        data = int.from_bytes(frame[DATA_OFFSET:], "little")
+        if len(self.masks) == 1:
+            self.compare(0, frame, data)
+            return
+        mux_mask = self.masks[0]
+        for idx in range(1, len(self.masks)):
+            if (data & mux_mask) == (self.masks[idx] & mux_mask):
+                self.compare(idx, frame, data)
+                return
+
+    def compare(self,
+                idx: int,
+                frame: bytes,
+                data: int):
+        """ report a frame if the masked data or the dlc changed """
+        last = self.last[idx]
+        self.last[idx] = frame
+        if last is None:
+            self.changed(frame)
+            return
+        mask = self.masks[idx]
+        if (data & mask) != (int.from_bytes(last[DATA_OFFSET:], "little") & mask):
+            self.changed(frame)
+        elif (self.flags & BCMFlags.RX_CHECK_DLC) and frame[4] != last[4]:
+            self.changed(frame)
+
+    def changed(self, frame: bytes):
+        """ send RX_CHANGED with the received frame """
+        self.node.bus.notify(self.node, self.get_msg(BcmOpCodes.RX_CHANGED, frames=[frame]))
+
+    def get_msg(self, opcode: int, frames: List[bytes] = None) -> bytes:
+        """ a message to the owner of the job, with the filters of the job by default """
+        if frames is None:
+            frames = self.frames
+        return pack_bcm_msg(opcode=opcode, flags=self.flags, count=0, ival1=self.ival1,
+                            ival2=self.ival2, can_id=self.can_id, frames=frames)
+
+    def delete(self):
+        """ stop the timer """
+        self.stop_timer()
+
+
+def pack_bcm_msg(opcode: int,
+                 flags: int,
+                 count: int,
+                 ival1: float,
+                 ival2: float,
+                 can_id: int,
+                 frames: List[bytes]) -> bytes:
+    """ helper to pack a bcm message with frames that are already packed """
+    return BcmMsg.STRUCT.pack(opcode, flags, count, *float_to_timeval(ival1), *float_to_timeval(ival2),
+                              can_id, len(frames)) + b"".join(frames)
+
+
+def unpack_bcm_datagram(data: bytes):
+    """ helper to split a bcm message into its head and its packed frames
+
+        @param data: the bcm message
+        @return: a tuple of the BcmMsg and a list of frames as bytes
+    """
+    if len(data) < BcmMsg.get_size():
+        raise OSError(errno.EINVAL, "Invalid bcm message size {0}".format(len(data)))
+    head = BcmMsg.STRUCT.unpack_from(data)
+    flags, nframes = head[1], head[-1]
+    frame_size = CanFdFrame.get_size() if flags & BCMFlags.CAN_FD_FRAME else CanFrame.get_size()
+    if len(data) != BcmMsg.get_size() + (nframes * frame_size):
+        raise OSError(errno.EINVAL, "Invalid bcm message size {0}".format(len(data)))
+    bcm_msg = BcmMsg.unpack_from(data)
+    frames = [bytes(data[offset:offset + frame_size]) for offset in range(BcmMsg.get_size(), len(data), frame_size)]
+    return bcm_msg, frames
+
+
+class VirtualSocket(socket.socket):
+    """ A node of a VirtualBus, a unix datagram socket that a CanRawSocket, CanBcmSocket or CanIsoTpSocket takes
+
+        The type of node is set by the address it is bound or connected to,
+        the socket options of the CAN levels are kept in the node instead of the kernel.
+
+        @param bus: the VirtualBus
+        @param fileno: the file descriptor of the node end of the socket pair
+        @param peer: the bus end of the socket pair
+    """
+
+    # sendmmsg would bypass send(), the MmsgSender of send_batch() falls back to a send loop
+    use_sendmmsg = False
+
+    def __init__(self,
+                 bus: "VirtualBus",
+                 fileno: int,
+                 peer: socket.socket):
+        super().__init__(socket.AF_UNIX, socket.SOCK_DGRAM, 0, fileno)
+        self.bus = bus
+        self.peer = peer
+        self.protocol = None
+        self.interface = None
+        self.options = {}
+        self.filters = [(0, 0, False)]
+        self.err_mask = 0
+        self.loopback = True
+        self.recv_own_msgs = False
+        self.fd_frames = False
+        self.join_filters = False
+        self.rx_addr = None
+        self.tx_addr = None
+        self.tx_ops: Dict[int, BcmTxOp] = {}
+        self.rx_ops: Dict[int, BcmRxOp] = {}
+        # the number of datagrams the bus dropped because the receive queue of the node was full
+        self.dropped = 0
+
+    def setsockopt(self, level, optname, *args):
+        """ keep the options of the CAN levels, pass the others to the socket """
+        if level not in (SOL_CAN_RAW, SOL_CAN_ISOTP, SOL_CAN_J1939):
+            return super().setsockopt(level, optname, *args)
+        value = args[0]
+        self.options[(level, optname)] = value
+        if level == SOL_CAN_RAW:
+            self.set_raw_option(optname, value)
+
+    def set_raw_option(self, optname: int, value):
+        """ apply an option of SOL_CAN_RAW """
+        if optname == CanRawOptions.CAN_RAW_FILTER:
+            self.filters = [(can_id & ~CAN_INV_FILTER, can_mask, bool(can_id & CAN_INV_FILTER))
+                            for can_id, can_mask in CAN_FILTER.iter_unpack(value)]
+        elif optname == CanRawOptions.CAN_RAW_ERR_FILTER:
+            self.err_mask = value if isinstance(value, int) else CAN_ID.unpack(value)[0]
+        elif optname == CanRawOptions.CAN_RAW_LOOPBACK:
+            self.loopback = bool(value)
+        elif optname == CanRawOptions.CAN_RAW_RECV_OWN_MSGS:
+            self.recv_own_msgs = bool(value)
+        elif optname == CanRawOptions.CAN_RAW_FD_FRAMES:
+            self.fd_frames = bool(value)
+        elif optname == CanRawOptions.CAN_RAW_JOIN_FILTERS:
+            self.join_filters = bool(value)
+
+    def getsockopt(self, level, optname, buflen=None):
+        """ return the kept options of the CAN levels, get the others from the socket """
+        if level not in (SOL_CAN_RAW, SOL_CAN_ISOTP, SOL_CAN_J1939):
+            if buflen is None:
+                return super().getsockopt(level, optname)
+            return super().getsockopt(level, optname, buflen)
+        value = self.options.get((level, optname))
+        if value is None and (level, optname) == (SOL_CAN_RAW, CanRawOptions.CAN_RAW_LOOPBACK):
+            value = 1
+        if buflen is None:
+            if isinstance(value, int):
+                return value
+            return int.from_bytes(value or bytes(4), "little")
+        if isinstance(value, int):
+            value = struct.pack("i", value)
+        return (value or bytes(buflen))[:buflen]
+
+    def bind(self, address):
+        """ bind a raw node with (interface,) or an ISO-TP node with (interface, rx_addr, tx_addr) """
+        if len(address) == 1:
+            self.attach(address[0], socket.CAN_RAW)
+        elif len(address) == 3:
+            self.attach(address[0], socket.CAN_ISOTP)
+            self.rx_addr = address[1]
+            self.tx_addr = address[2]
+        else:
+            raise OSError(errno.EPROTONOSUPPORT, "A VirtualBus supports raw, bcm and isotp nodes")
+
+    def connect(self, address):
+        """ connect a bcm node with (interface,) """
+        if len(address) != 1:
+            raise OSError(errno.EPROTONOSUPPORT, "A VirtualBus supports raw, bcm and isotp nodes")
+        self.attach(address[0], socket.CAN_BCM)
+
+    def attach(self,
+               interface: str,
+               protocol: int):
+        """ set the type of node """
+        if interface != self.bus.interface:
+            raise OSError(errno.ENODEV, "No such device {0}".format(interface))
+        if self.protocol is not None:
+            raise OSError(errno.EINVAL, "The node is already bound")
+        self.interface = interface
+        self.protocol = protocol
+
+    def match(self, can_id: int) -> bool:
+        """ apply the filters of a raw node to a received can_id """
+        if can_id & CanFlags.CAN_ERR_FLAG:
+            return bool(self.err_mask & can_id & CAN_ERR_MASK)
+        filters = self.filters
+        if not filters:
+            return False
+        matches = ((((can_id & can_mask) == (filter_id & can_mask)) != inverted)
+                   for filter_id, can_mask, inverted in filters)
+        if self.join_filters:
+            return all(matches)
+        return any(matches)
+
+    def send(self, data, flags=0):
+        """ route a datagram immediately """
+        return self.bus.transmit(self, data)
+
+    def sendmsg(self, buffers, ancdata=(), flags=0, address=None):
+        """ route a datagram that is gathered from several buffers immediately """
+        return self.bus.transmit(self, b"".join(buffers))
+
+    def recv(self, *args):
+        self.bus.pump()
+        return super().recv(*args)
+
+    def recv_into(self, *args):
+        self.bus.pump()
+        return super().recv_into(*args)
+
+    def recvmsg(self, *args):
+        self.bus.pump()
+        return super().recvmsg(*args)
+
+    def recvmsg_into(self, *args):
+        self.bus.pump()
+        return super().recvmsg_into(*args)
+
+    def close(self):
+        """ close the node and remove it from the bus """
+        self.bus.remove(self)
+        super().close()
+
+
+class VirtualBus:
+    """ An in-process CAN bus with any number of nodes
+
+        @param interface: the interface name the nodes bind to
+        @param clock: the VirtualClock of the broadcast manager, a new one if None
+        @param bufsize: the send buffer of the bus end of each node in bytes, it limits the datagrams
+                        that wait in the receive queue of the node, further datagrams are dropped
+                        and counted in the dropped attribute of the node, without CAP_NET_ADMIN
+                        the size is capped by net.core.wmem_max
+    """
+
+    def __init__(self,
+                 interface: str = "vcan0",
+                 clock: VirtualClock = None,
+                 bufsize: int = 4 * 1024 * 1024,
+                 ):
+        self.interface = interface
+        self.clock = clock if clock is not None else VirtualClock()
+        self.bufsize = bufsize
+        self.nodes: List[VirtualSocket] = []
+        self.lock = RLock()
+        # the bus ends of all nodes, to check for datagrams that bypassed transmit() with one syscall
+        self.poller = select.poll()
+        self.rxbuf = bytearray(MAX_DATAGRAM_SIZE)
+        self.rxview = memoryview(self.rxbuf)
+        self.stop_event = Event()
+        self.thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def create_socket(self) -> VirtualSocket:
+        """ create a node, pass it as sock to a CanRawSocket, CanBcmSocket or CanIsoTpSocket """
+        s1, s2 = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            s2.setsockopt(socket.SOL_SOCKET, SO_SNDBUFFORCE, self.bufsize)
+        except PermissionError:
+            s2.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.bufsize)
+        node = VirtualSocket(bus=self, fileno=s1.detach(), peer=s2)
+        with self.lock:
+            self.nodes.append(node)
+            self.poller.register(s2, select.POLLIN)
+        return node
+
+    def create_raw_socket(self, **kwargs) -> CanRawSocket:
+        """ create a CanRawSocket on a new node
+
+            @param kwargs: the arguments of CanRawSocket except interface and sock
+        """
+        return CanRawSocket(interface=self.interface, sock=self.create_socket(), **kwargs)
+
+    def create_bcm_socket(self, **kwargs) -> CanBcmSocket:
+        """ create a CanBcmSocket on a new node
+
+            @param kwargs: the arguments of CanBcmSocket except interface and sock
+        """
+        return CanBcmSocket(interface=self.interface, sock=self.create_socket(), **kwargs)
+
+    def create_isotp_socket(self,
+                            rx_addr: int,
+                            tx_addr: int,
+                            **kwargs) -> CanIsoTpSocket:
+        """ create a CanIsoTpSocket on a new node
+
+            @param rx_addr: the can_id that is received
+            @param tx_addr: the can_id that is transmitted
+            @param kwargs: the other arguments of CanIsoTpSocket except interface and sock
+        """
+        return CanIsoTpSocket(interface=self.interface, rx_addr=rx_addr, tx_addr=tx_addr,
+                              sock=self.create_socket(), **kwargs)
+
+    def remove(self, node: VirtualSocket):
+        """ remove a node, its jobs are deleted """
+        with self.lock:
+            if node not in self.nodes:
+                return
+            self.nodes.remove(node)
+            for op in list(node.tx_ops.values()) + list(node.rx_ops.values()):
+                op.delete()
+            node.tx_ops.clear()
+            node.rx_ops.clear()
+            self.poller.unregister(node.peer)
+            node.peer.close()
+
+    def close(self):
+        """ stop the router thread and remove all nodes """
+        self.stop()
+        with self.lock:
+            for node in list(self.nodes):
+                self.remove(node)
+
+    def transmit(self,
+                 node: VirtualSocket,
+                 data) -> int:
+        """ route a datagram that a node sends, datagrams that were sent before are routed first
+
+            @param node: the sending node
+            @param data: the datagram
+            @return: the size of the datagram
+        """
+        with self.lock:
+            self.pump()
+            self.route(node, data)
+        return len(data)
+
+    def pump(self) -> int:
+        """ route the datagrams that nodes sent without transmit(), e.g. with sendmmsg
+
+            Errors are logged since there is no caller to raise them to.
+
+            @return: the number of datagrams routed
+        """
+        count = 0
+        with self.lock:
+            ready = self.poller.poll(0)
+            if not ready:
+                return 0
+            ready = {fd for fd, _ in ready}
+            for node in [node for node in self.nodes if node.peer.fileno() in ready]:
+                while True:
+                    try:
+                        size = node.peer.recv_into(self.rxbuf, MAX_DATAGRAM_SIZE, socket.MSG_DONTWAIT)
+                    except OSError:
+                        break
+                    count += 1
+                    try:
+                        self.route(node, bytes(self.rxview[:size]))
+                    except OSError as e:
+                        logger.warning("dropping a datagram of a %s node: %s", node.protocol, e)
+        return count
+
+    def advance(self, seconds: float) -> int:
+        """ advance the clock and run the cyclic jobs of the broadcast manager
+
+            @param seconds: the time to advance in seconds
+            @return: the number of timers that ran
+        """
+        with self.lock:
+            self.pump()
+            return self.clock.advance(seconds)
+
+    def route(self,
+              node: VirtualSocket,
+              data: bytes):
+        """ route a datagram by the type of the sending node """
+        if node.protocol == socket.CAN_RAW:
+            if len(data) not in FRAME_SIZES or ((len(data) == CanFdFrame.get_size()) and not node.fd_frames):
+                raise OSError(errno.EINVAL, "Invalid frame size {0}".format(len(data)))
+            if node.loopback:
+                self.deliver_frame(bytes(data), sender=node)
+        elif node.protocol == socket.CAN_BCM:
+            self.route_bcm_msg(node, data)
+        elif node.protocol == socket.CAN_ISOTP:
+            for other in self.nodes:
+                if other.protocol == socket.CAN_ISOTP and other is not node and other.rx_addr == node.tx_addr:
+                    self.notify(other, bytes(data))
+        else:
+            raise OSError(errno.EDESTADDRREQ, "The node is not bound")
+
+    def deliver_frame(self,
+                      frame: bytes,
+                      sender: VirtualSocket = None):
+        """ deliver a frame to the raw nodes and the bcm receive jobs
+
+            @param frame: the frame in CanFrame.FORMAT or CanFdFrame.FORMAT
+            @param sender: the raw node that sent the frame, None for the broadcast manager
+        """
+        can_id = CAN_ID.unpack_from(frame)[0]
+        is_fd = len(frame) == CanFdFrame.get_size()
+        for node in self.nodes:
+            if node.protocol == socket.CAN_RAW:
+                if node is sender and not node.recv_own_msgs:
+                    continue
+                if is_fd and not node.fd_frames:
+                    continue
+                if node.match(can_id):
+                    self.notify(node, frame)
+            elif node.protocol == socket.CAN_BCM and node.rx_ops:
+                op = node.rx_ops.get(can_id & BCM_ID_MASK)
+                if op is not None and is_fd == bool(op.flags & BCMFlags.CAN_FD_FRAME):
+                    op.process(frame)
+
+    def notify(self,
+               node: VirtualSocket,
+               data: bytes):
+        """ queue a datagram to a node, it is dropped if the receive queue is full """
+        try:
+            node.peer.send(data, socket.MSG_DONTWAIT)
+        except (BlockingIOError, ConnectionError):
+            node.dropped += 1
+
+    def route_bcm_msg(self,
+                      node: VirtualSocket,
+                      data: bytes):
+        """ handle a bcm message like the broadcast manager of the kernel """
+        bcm_msg, frames = unpack_bcm_datagram(data)
+        opcode = bcm_msg.opcode
+        if opcode == BcmOpCodes.TX_SETUP:
+            self.bcm_tx_setup(node, bcm_msg, frames)
+        elif opcode == BcmOpCodes.TX_SEND:
+            if len(frames) != 1:
+                raise OSError(errno.EINVAL, "TX_SEND takes one frame")
+            self.deliver_frame(frames[0])
+        elif opcode == BcmOpCodes.RX_SETUP:
+            op = node.rx_ops.get(bcm_msg.can_id)
+            if op is None:
+                op = node.rx_ops[bcm_msg.can_id] = BcmRxOp(node=node, can_id=bcm_msg.can_id)
+            op.setup(bcm_msg, frames)
+        elif opcode in (BcmOpCodes.TX_DELETE, BcmOpCodes.RX_DELETE):
+            ops = node.tx_ops if opcode == BcmOpCodes.TX_DELETE else node.rx_ops
+            self.get_bcm_op(ops, bcm_msg.can_id)
+            ops.pop(bcm_msg.can_id).delete()
+        elif opcode in (BcmOpCodes.TX_READ, BcmOpCodes.RX_READ):
+            if opcode == BcmOpCodes.TX_READ:
+                op = self.get_bcm_op(node.tx_ops, bcm_msg.can_id)
+                self.notify(node, op.get_msg(BcmOpCodes.TX_STATUS))
+            else:
+                op = self.get_bcm_op(node.rx_ops, bcm_msg.can_id)
+                self.notify(node, op.get_msg(BcmOpCodes.RX_STATUS))
+        else:
+            raise OSError(errno.EINVAL, "Invalid bcm opcode {0}".format(opcode))
+
+    @staticmethod
+    def get_bcm_op(ops: dict, can_id: int):
+        """ get a job, the kernel answers EINVAL if there is none """
+        if can_id not in ops:
+            raise OSError(errno.EINVAL, "No job for can_id {0:X}".format(can_id))
+        return ops[can_id]
+
+    def bcm_tx_setup(self,
+                     node: VirtualSocket,
+                     bcm_msg: BcmMsg,
+                     frames: List[bytes]):
+        """ create or update a transmit job """
+        op = node.tx_ops.get(bcm_msg.can_id)
+        if op is None:
+            if not frames:
+                raise OSError(errno.EINVAL, "TX_SETUP of a new job takes at least one frame")
+            op = BcmTxOp(node=node, can_id=bcm_msg.can_id)
+        if bcm_msg.flags & BCMFlags.TX_CP_CAN_ID:
+            frames = [CAN_ID.pack(bcm_msg.can_id) + frame[CAN_ID.size:] for frame in frames]
+        op.setup(bcm_msg, frames)
+        node.tx_ops[bcm_msg.can_id] = op
+
+    def start(self, interval: float = 0.01):
+        """ start a thread that routes datagrams as soon as they are sent
+
+            This is needed if a receiver waits for datagrams that bypass the python socket methods,
+            e.g. a recv_batch() in one thread for a send_batch() in another.
+
+            @param interval: the maximum time in seconds between two checks for new nodes
+        """
+        if self.thread is not None:
+            return
+        self.stop_event.clear()
+        self.thread = Thread(target=self.run, args=(interval,), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """ stop the router thread """
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+    def run(self, interval: float):
+        """ the router thread, it has its own poll object, a poll object must not be polled concurrently """
+        while not self.stop_event.is_set():
+            poller = select.poll()
+            with self.lock:
+                for node in self.nodes:
+                    poller.register(node.peer, select.POLLIN)
+            if poller.poll(interval * 1000):
+                self.pump()
@@ -0,0 +1,95 @@
+""" Test_aio
+
+    Collection of tests for aio module to be run with pytest / tox / coverage
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import pytest
+
+import asyncio
+import errno
+import socket
+
+from socketcan import CanFrame
+from socketcan.aio import AsyncCanSocket
+from socketcan.virtual import VirtualBus
+
+
+@pytest.fixture
+def raw_socket_pair():
+    """ two CanRawSockets on a virtual bus """
+    with VirtualBus() as bus:
+        yield [bus.create_raw_socket(), bus.create_raw_socket()]
+
+
+class EnobufsSocket:
+    """ a socket that fails to send with ENOBUFS a number of times """
+
+    def __init__(self, s, failures):
+        self.s = s
+        self.failures = failures
+
+    def send(self, data):
+        if self.failures:
+            self.failures -= 1
+            raise OSError(errno.ENOBUFS, "No buffer space available")
+        return self.s.send(data)
+
+
+class TestAsyncCanSocket:
+
+    def test_send_and_recv(self, raw_socket_pair):
+        frame1 = CanFrame(can_id=0x123, data=bytes(range(8)))
+
+        async def run():
+            tx, rx = [AsyncCanSocket(sock) for sock in raw_socket_pair]
+            receiver = asyncio.ensure_future(rx.recv())
+            await asyncio.sleep(0.01)
+            assert not receiver.done()
+            await tx.send(frame1)
+            return await asyncio.wait_for(receiver, 1)
+
+        assert asyncio.run(run()) == frame1
+
+    def test_async_iterator(self, raw_socket_pair):
+        frames = [CanFrame(can_id=can_id, data=bytes(range(can_id % 9))) for can_id in range(0x100, 0x108)]
+
+        async def send(tx):
+            for frame in frames:
+                await tx.send(frame)
+                await asyncio.sleep(0)
+
+        async def run():
+            tx, rx = [AsyncCanSocket(sock) for sock in raw_socket_pair]
+            sender = asyncio.ensure_future(send(tx))
+            received = []
+            async for frame in rx:
+                received.append(frame)
+                if len(received) == len(frames):
+                    break
+            await sender
+            return received
+
+        assert asyncio.run(run()) == frames
+
+    def test_recv_batch(self, raw_socket_pair):
+        frames = [CanFrame(can_id=can_id, data=bytes(range(can_id % 9))) for can_id in range(0x100, 0x108)]
+        tx, rx = raw_socket_pair
+        for frame in frames:
+            tx.send(frame)
+
+        async def run():
+            return await AsyncCanSocket(rx).recv_batch(max_frames=16)
+
+        assert asyncio.run(run()) == frames
+
+    def test_send_backs_off_on_enobufs(self, raw_socket_pair):
+        tx, rx = raw_socket_pair
+        sock = EnobufsSocket(s=tx.s, failures=3)
+
+        async def run():
+            return await AsyncCanSocket(sock, enobufs_delay=0.001).send(bytes(CanFrame.get_size()))
+
+        assert asyncio.run(run()) == CanFrame.get_size()
+        assert sock.failures == 0
@@ -0,0 +1,165 @@
+""" Test_analyzer
+
+    Collection of tests for analyzer module to be run with pytest / tox / coverage
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import pytest
+
+from importlib.util import find_spec
+
+from socketcan import CanFdFrame, CanFlags, CanFrame, CanFrameBatch
+from socketcan.analyzer import BusAnalyzer, frame_bits
+
+
+def cyclic_frames(can_id, period, count, start=0, data=bytes(8)):
+    """ helper function """
+    return [CanFrame(can_id=can_id, data=data, timestamp=start + (idx * period)) for idx in range(count)]
+
+
+class TestFrameBits:
+
+    def test_classic(self):
+        # the well known lengths of a frame with 8 data bytes including the interframe space
+        assert frame_bits(8, worst_case=False) == 111
+        assert frame_bits(8) == 135
+        assert frame_bits(8, extended=True, worst_case=False) == 131
+        assert frame_bits(8, extended=True) == 160
+        assert frame_bits(0, worst_case=False) == 47
+
+    def test_fd(self):
+        # the 21 bit crc and its fixed stuff bits make the frame longer than the data alone
+        assert frame_bits(64, fd=True, worst_case=False) == 22 + 512 + 4 + 21 + 7 + 13
+        assert frame_bits(16, fd=True, worst_case=False) == 22 + 128 + 4 + 17 + 6 + 13
+
+
+class TestBusAnalyzer:
+
+    def test_periods(self):
+        analyzer = BusAnalyzer()
+        for timestamp in (0, 0.01, 0.021, 0.030):
+            analyzer.add(CanFrame(can_id=0x123, data=bytes(8)), timestamp=timestamp)
+        stats = analyzer.get_stats(0x123)
+        assert stats["count"] == 4
+        assert stats["min_period"] == pytest.approx(0.009)
+        assert stats["max_period"] == pytest.approx(0.011)
+        assert stats["mean_period"] == pytest.approx(0.01)
+        assert stats["jitter"] == pytest.approx(0.000816, abs=1E-6)
+        # the first period has no mean to compare with
+        assert sum(stats["jitter_histogram"]) == 2
+        assert analyzer.get_stats(0x124) is None
+
+    def test_standard_and_extended_ids(self):
+        analyzer = BusAnalyzer(bitrate=1000000)
+        analyzer.add_frames(cyclic_frames(0x123, 0.01, 10))
+        analyzer.add_frames([CanFrame(can_id=0x123, flags=0x80000000, data=bytes(8), timestamp=0.05)])
+        assert analyzer.get_stats(0x123)["count"] == 10
+        assert analyzer.get_stats(0x123, extended=True)["count"] == 1
+        assert analyzer.bits == (10 * 111) + 131
+        assert analyzer.worst_bits == (10 * 135) + 160
+
+    def test_remote_frames_carry_no_data_bits(self):
+        analyzer = BusAnalyzer(bitrate=1000000)
+        analyzer.add(CanFrame(can_id=0x123, flags=CanFlags.CAN_RTR_FLAG, data=bytes(8)), timestamp=0)
+        analyzer.add(CanFrame(can_id=0x12345, flags=CanFlags.CAN_RTR_FLAG, data=bytes(4)), timestamp=0.01)
+        assert analyzer.bits == frame_bits(0, worst_case=False) + frame_bits(0, extended=True, worst_case=False)
+        assert analyzer.worst_bits == frame_bits(0) + frame_bits(0, extended=True)
+        # the dlc still counts as the length of the frame
+        assert analyzer.get_stats(0x123)["count"] == 1
+
+    def test_changes(self):
+        analyzer = BusAnalyzer()
+        for idx, data in enumerate((b"\x00\x01", b"\x00\x01", b"\x00\x02", b"\x00\x02\x03", b"\x00\x02\x03")):
+            analyzer.add(CanFrame(can_id=0x200, data=data), timestamp=idx * 0.1)
+        stats = analyzer.get_stats(0x200)
+        assert stats["length_changes"] == 1
+        assert stats["payload_changes"] == 2
+
+    def test_sliding_window(self):
+        now = [0.5]
+        analyzer = BusAnalyzer(bitrate=100000, window=1, nbuckets=10, clock=lambda: now[0])
+        analyzer.add_frames(cyclic_frames(0x100, 0.001, 500))
+        assert analyzer.get_bus_load() == pytest.approx(500 * 111 / 100000)
+        assert analyzer.get_bus_load(worst_case=True) == pytest.approx(500 * 135 / 100000)
+        assert analyzer.get_stats(0x100)["rate"] == 500
+        # at 1.05 the window covers the buckets from 0.1 to 1.1, the first 100 frames moved out
+        now[0] = 1.05
+        analyzer.add_frames(cyclic_frames(0x101, 0.1, 1, start=1.05))
+        assert analyzer.get_stats(0x100)["rate"] == 400
+        assert analyzer.snapshot()["frames_per_s"] == 401
+        now[0] = 10
+        analyzer.add_frames(cyclic_frames(0x101, 0.1, 1, start=10))
+        assert analyzer.get_bus_load() == pytest.approx(111 / 100000)
+        # the totals are not windowed
+        assert analyzer.frames == 502
+
+    def test_silent_bus_decays(self):
+        now = [0.5]
+        analyzer = BusAnalyzer(bitrate=100000, window=1, nbuckets=10, clock=lambda: now[0])
+        analyzer.add_frames(cyclic_frames(0x100, 0.001, 500))
+        assert analyzer.get_bus_load() == pytest.approx(500 * 111 / 100000)
+        # no frames for half a window, the buckets from 0 to 0.5 moved out
+        now[0] = 1.05
+        assert analyzer.get_bus_load() == pytest.approx(400 * 111 / 100000)
+        assert analyzer.get_stats(0x100)["rate"] == 400
+        now[0] = 5
+        snapshot = analyzer.snapshot()
+        assert snapshot["bus_load"] == 0
+        assert snapshot["frames_per_s"] == 0
+        assert snapshot["ids"][0]["rate"] == 0
+        assert snapshot["frames"] == 500
+
+    def test_fd_frames(self):
+        analyzer = BusAnalyzer()
+        analyzer.add(CanFdFrame(can_id=0x300, data=bytes(64)), timestamp=0)
+        assert analyzer.bits == frame_bits(64, fd=True, worst_case=False)
+
+    def test_check_periods(self):
+        analyzer = BusAnalyzer()
+        analyzer.set_expected_period(0x100, 0.01)
+        analyzer.set_expected_period(0x101, 0.01)
+        analyzer.set_expected_period(0x102, 0.01)
+        analyzer.add_frames(cyclic_frames(0x100, 0.01, 10))
+        analyzer.add_frames(cyclic_frames(0x101, 0.02, 5))
+        assert [stats["can_id"] for stats in analyzer.check_periods()] == [0x101, 0x102]
+        assert [stats["can_id"] for stats in analyzer.check_periods(now=0.5)] == [0x100, 0x101, 0x102]
+        stats = analyzer.get_stats(0x100)
+        assert stats["jitter_histogram"][0] == 9
+
+    def test_many_ids_and_reset(self):
+        analyzer = BusAnalyzer(capacity=1)
+        analyzer.set_expected_period(0x1000, 0.5)
+        for can_id in range(0x100, 0x200):
+            analyzer.add(CanFrame(can_id=can_id, data=bytes(1)), timestamp=0)
+        assert analyzer.capacity == 512
+        assert len(analyzer.snapshot()["ids"]) == 256
+        analyzer.reset()
+        assert analyzer.frames == 0
+        assert analyzer.snapshot()["ids"] == []
+        assert analyzer.check_periods()[0]["expected_period"] == 0.5
+
+    @pytest.mark.skipif(find_spec("numpy") is None, reason="this test requires numpy")
+    def test_batch_matches_frames(self):
+        frames = []
+        for idx in range(300):
+            data = bytes((idx // 7,)) * (8 if idx % 50 else 4)
+            frames.append(CanFrame(can_id=(0x100, 0x101, 0x1234567)[idx % 3], data=data, timestamp=idx * 0.001))
+        frames.append(CanFrame(can_id=0x102, flags=CanFlags.CAN_RTR_FLAG, data=bytes(8), timestamp=0.3))
+        analyzer = BusAnalyzer(bitrate=250000, clock=lambda: 0.3)
+        analyzer.add_frames(frames)
+        batch_analyzer = BusAnalyzer(bitrate=250000, capacity=1, clock=lambda: 0.3)
+        for idx in range(0, len(frames), 64):
+            chunk = frames[idx:idx + 64]
+            batch_analyzer.add_batch(CanFrameBatch.from_frames(chunk, timestamps=[frame.timestamp for frame in chunk]))
+        snapshot = analyzer.snapshot()
+        batch_snapshot = batch_analyzer.snapshot()
+        assert batch_snapshot["bits"] == snapshot["bits"]
+        assert batch_snapshot["worst_case_bits"] == snapshot["worst_case_bits"]
+        assert snapshot["bus_load"] > 0
+        assert batch_snapshot["bus_load"] == pytest.approx(snapshot["bus_load"])
+        for stats, batch_stats in zip(snapshot["ids"], batch_snapshot["ids"]):
+            for key in ("can_id", "extended", "count", "rate", "length_changes", "payload_changes"):
+                assert batch_stats[key] == stats[key]
+            for key in ("min_period", "mean_period", "max_period", "jitter"):
+                assert batch_stats[key] == pytest.approx(stats[key])
@@ -0,0 +1,102 @@
+""" Test_bus
+
+    Collection of tests for bus module to be run with pytest / tox / coverage
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import pytest
+
+from socketcan import CanFlags, CanFrame
+from socketcan.bus import CanBus
+from socketcan.virtual import VirtualBus
+
+
+@pytest.fixture
+def bus():
+    """ a CanBus with two interfaces on virtual buses, yields the bus and the sending nodes """
+    bus = CanBus()
+    senders = {}
+    virtual_buses = []
+    for interface in ("can0", "can1"):
+        virtual_bus = VirtualBus(interface=interface)
+        virtual_buses.append(virtual_bus)
+        bus.add_interface(interface, sock=virtual_bus.create_raw_socket())
+        senders[interface] = virtual_bus.create_raw_socket()
+    yield bus, senders
+    bus.close()
+    for virtual_bus in virtual_buses:
+        virtual_bus.close()
+
+
+class TestCanBus:
+
+    def test_route_by_can_id_and_interface(self, bus):
+        bus, senders = bus
+        sub_123 = bus.subscribe(can_ids=[0x123])
+        sub_can1 = bus.subscribe(interface="can1")
+        sub_all = bus.subscribe()
+        frame1 = CanFrame(can_id=0x123, data=bytes(8))
+        frame2 = CanFrame(can_id=0x456, data=bytes(8))
+        senders["can0"].send(frame1)
+        senders["can0"].send(frame2)
+        senders["can1"].send(frame1)
+
+        count = 0
+        while count < 3:
+            count += bus.poll(timeout=1)
+
+        assert [sub_123.get(timeout=0) for idx in range(2)] == [("can0", frame1), ("can1", frame1)]
+        assert sub_123.get(timeout=0) is None
+        assert sub_can1.get(timeout=0) == ("can1", frame1)
+        assert sub_can1.get(timeout=0) is None
+        assert sub_all.queue.qsize() == 3
+
+    def test_standard_and_extended_ids(self, bus):
+        bus, senders = bus
+        standard = bus.subscribe(can_ids=[0x100])
+        extended = bus.subscribe(can_ids=[0x100 | CanFlags.CAN_EFF_FLAG, 0x12345678])
+        frames = [CanFrame(can_id=0x100, data=bytes(8)),
+                  CanFrame(can_id=0x100, flags=CanFlags.CAN_EFF_FLAG, data=bytes(8)),
+                  CanFrame(can_id=0x12345678, data=bytes(8))]
+        bus.dispatch("can0", frames)
+        assert [frame for interface, frame in standard.queue.queue] == frames[:1]
+        assert [frame for interface, frame in extended.queue.queue] == frames[1:]
+
+    def test_add_interface_while_dispatching(self, bus):
+        bus, senders = bus
+        subscription = bus.subscribe()
+        bus.start(poll_interval=0.01)
+        with VirtualBus(interface="can2") as virtual_bus:
+            bus.add_interface("can2", sock=virtual_bus.create_raw_socket())
+            virtual_bus.create_raw_socket().send(CanFrame(can_id=0x123, data=bytes(8)))
+            assert subscription.get(timeout=1)[0] == "can2"
+            bus.stop()
+
+    def test_unsubscribe(self, bus):
+        bus, senders = bus
+        subscription = bus.subscribe(can_ids=[0x123])
+        bus.unsubscribe(subscription)
+        bus.dispatch("can0", [CanFrame(can_id=0x123, data=bytes(8))])
+        assert subscription.get(timeout=0) is None
+
+    def test_bounded_queue_drops(self, bus):
+        bus, senders = bus
+        subscription = bus.subscribe(can_ids=[0x123], maxsize=2)
+        bus.dispatch("can0", [CanFrame(can_id=0x123, data=bytes(8))] * 5)
+        assert subscription.queue.qsize() == 2
+        assert subscription.dropped == 3
+
+    def test_callback_in_dispatch_thread(self, bus):
+        bus, senders = bus
+        received = []
+        bus.subscribe(can_ids=[0x123], callback=lambda interface, frame: received.append((interface, frame)))
+        frame = CanFrame(can_id=0x123, data=bytes(8))
+        bus.start(poll_interval=0.01)
+        senders["can1"].send(frame)
+        for idx in range(100):
+            if received:
+                break
+            bus.stop_event.wait(0.01)
+        bus.stop()
+        assert received == [("can1", frame)]
@@ -0,0 +1,149 @@
+""" Test_canlog
+
+    Collection of tests for canlog module to be run with pytest / tox / coverage
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import pytest
+
+from socketcan import CanFrame, CanFdFrame, CanFlags, CanFdFlags
+from socketcan.canlog import BinaryLogReader, BinaryLogWriter, CandumpLogReader, CandumpLogWriter, \
+    format_candump_frame, parse_candump_frame, parse_candump_line
+
+
+def get_frames(count=100, start=1600000000.0, interval=0.01):
+    """ helper function """
+    frames = []
+    for idx in range(count):
+        frame = CanFrame(can_id=0x100 + (idx % 16), data=bytes([idx & 0xFF] * (idx % 9)))
+        frame.timestamp = start + (idx * interval)
+        frames.append(frame)
+    return frames
+
+
+class TestCandumpFormat:
+
+    @pytest.mark.parametrize("frame, frame_repr", [
+        (CanFrame(can_id=0x123, data=bytes.fromhex("DEADBEEF")), "123#DEADBEEF"),
+        (CanFrame(can_id=0x123, data=bytes()), "123#"),
+        (CanFrame(can_id=0x12345678, data=bytes(range(8))), "12345678#0001020304050607"),
+        (CanFrame(can_id=0x123, flags=CanFlags.CAN_EFF_FLAG, data=bytes(1)), "00000123#00"),
+        (CanFrame(can_id=0x123, flags=CanFlags.CAN_RTR_FLAG, data=bytes()), "123#R"),
+        (CanFrame(can_id=0x123, flags=CanFlags.CAN_RTR_FLAG, data=bytes(4)), "123#R4"),
+        (CanFrame(can_id=0x004, flags=CanFlags.CAN_ERR_FLAG, data=bytes(8)), "20000004#0000000000000000"),
+        (CanFdFrame(can_id=0x123, fd_flags=CanFdFlags.CANFD_BRS, data=bytes(range(12))), "123##1000102030405060708090A0B"),
+    ])
+    def test_round_trip(self, frame, frame_repr):
+        assert format_candump_frame(frame) == frame_repr
+        assert parse_candump_frame(frame_repr) == frame
+
+    def test_parse_line(self):
+        interface, frame = parse_candump_line(b"(1600000000.123456) vcan0 123#DEADBEEF\n")
+        assert interface == "vcan0"
+        assert frame == CanFrame(can_id=0x123, data=bytes.fromhex("DEADBEEF"))
+        assert frame.timestamp == 1600000000.123456
+
+    @pytest.mark.parametrize("line", [b"(1600000000.1) vcan0 123##", b"(1600000000.1) vcan0 123##1A",
+                                      b"(1600000000.1) vcan0", b"(1600000000.1) vcan0 XYZ#00"])
+    def test_parse_bad_line(self, line):
+        with pytest.raises(ValueError):
+            parse_candump_line(line)
+
+
+class TestCandumpLog:
+
+    def test_write_and_read(self, tmp_path):
+        filepath = str(tmp_path / "candump.log")
+        frames = get_frames()
+        with CandumpLogWriter(filepath, interface="vcan0") as writer:
+            writer.write_frames(frames)
+
+        with CandumpLogReader(filepath) as reader:
+            received = list(reader)
+            assert [interface for interface, frame in reader.iter_lines()] == ["vcan0"] * len(frames)
+        assert received == frames
+        assert [frame.timestamp for frame in received] == pytest.approx([frame.timestamp for frame in frames])
+
+    def test_between(self, tmp_path):
+        filepath = str(tmp_path / "candump.log")
+        frames = get_frames()
+        with CandumpLogWriter(filepath) as writer:
+            writer.write_frames(frames)
+
+        with CandumpLogReader(filepath) as reader:
+            assert list(reader.between(frames[10].timestamp, frames[20].timestamp)) == frames[10:20]
+            assert list(reader.between(0, frames[5].timestamp)) == frames[:5]
+            assert list(reader.between(frames[95].timestamp, frames[-1].timestamp + 1)) == frames[95:]
+            assert list(reader.between(frames[-1].timestamp + 1, frames[-1].timestamp + 2)) == []
+
+    def test_empty_log(self, tmp_path):
+        filepath = str(tmp_path / "candump.log")
+        with CandumpLogWriter(filepath):
+            pass
+
+        with CandumpLogReader(filepath) as reader:
+            assert list(reader) == []
+            assert list(reader.between(0, 1)) == []
+
+    def test_lines_that_do_not_parse(self, tmp_path):
+        filepath = tmp_path / "candump.log"
+        frames = get_frames(count=10)
+        lines = ["({0:.6f}) vcan0 {1}\n".format(frame.timestamp, format_candump_frame(frame)) for frame in frames]
+        lines[5:5] = ["\n", "   \n", "not a candump line\n"]
+        lines.extend(["\n", "(1600000000.xyz) vcan0 123#\n", "(1600000001.0) vcan0 123##\n", "\n"])
+        filepath.write_text("".join(lines))
+
+        with CandumpLogReader(str(filepath)) as reader:
+            assert list(reader) == frames
+            assert list(reader.between(frames[3].timestamp, frames[7].timestamp)) == frames[3:7]
+            assert list(reader.between(frames[5].timestamp, frames[-1].timestamp + 1)) == frames[5:]
+            assert list(reader.between(frames[-1].timestamp + 1, frames[-1].timestamp + 2)) == []
+
+
+class TestBinaryLog:
+
+    def test_write_and_read(self, tmp_path):
+        filepath = str(tmp_path / "can.bin")
+        frames = get_frames(count=1000)
+        with BinaryLogWriter(filepath, buffer_records=64) as writer:
+            writer.write_frames(frames)
+
+        with BinaryLogReader(filepath) as reader:
+            assert len(reader) == len(frames)
+            received = list(reader)
+            assert reader[-1] == frames[-1]
+            with pytest.raises(IndexError):
+                reader[len(frames)]
+        assert received == frames
+        assert [frame.timestamp for frame in received] == [frame.timestamp for frame in frames]
+
+    def test_between(self, tmp_path):
+        filepath = str(tmp_path / "can.bin")
+        frames = get_frames()
+        with BinaryLogWriter(filepath) as writer:
+            writer.write_frames(frames)
+
+        with BinaryLogReader(filepath) as reader:
+            assert list(reader.between(frames[10].timestamp, frames[20].timestamp)) == frames[10:20]
+            assert list(reader.between(0, frames[5].timestamp)) == frames[:5]
+            assert list(reader.between(frames[-1].timestamp + 1, frames[-1].timestamp + 2)) == []
+
+    def test_fd_frames_are_rejected(self, tmp_path):
+        with BinaryLogWriter(str(tmp_path / "can.bin")) as writer:
+            with pytest.raises(ValueError):
+                writer.write(CanFdFrame(can_id=0x123, data=bytes(64)))
+
+    def test_empty_file(self, tmp_path):
+        filepath = tmp_path / "can.bin"
+        filepath.write_bytes(bytes())
+        with BinaryLogReader(str(filepath)) as reader:
+            assert len(reader) == 0
+            assert list(reader) == []
+            assert list(reader.between(0, 1)) == []
+
+    def test_not_a_binary_log(self, tmp_path):
+        filepath = tmp_path / "can.bin"
+        filepath.write_bytes(bytes(64))
+        with pytest.raises(ValueError):
+            BinaryLogReader(str(filepath))
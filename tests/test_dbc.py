@@ -0,0 +1,134 @@
+""" Test_dbc
+
+    Collection of tests for dbc module to be run with pytest / tox / coverage
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import pytest
+
+from importlib.util import find_spec
+
+from socketcan import CanFrame, CanFrameBatch, CanFlags
+from socketcan.dbc import Message, Signal, SignalDatabase
+
+DBC = """VERSION ""
+
+BU_: ECU GATEWAY
+
+BO_ 256 EngineData: 8 ECU
+ SG_ EngineSpeed : 0|16@1+ (0.25,0) [0|16383.75] "rpm" GATEWAY
+ SG_ CoolantTemp : 16|8@1+ (1,-40) [-40|215] "degC" GATEWAY
+ SG_ Torque : 24|12@1- (0.5,0) [-1024|1023.5] "Nm" GATEWAY
+ SG_ Pressure : 47|16@0+ (1,0) [0|65535] "kPa" GATEWAY
+
+BO_ 2566848768 MuxData: 8 ECU
+ SG_ Page M : 0|8@1+ (1,0) [0|255] "" GATEWAY
+ SG_ Value1 m1 : 8|16@1+ (1,0) [0|65535] "" GATEWAY
+ SG_ Value2 m2 : 8|8@1- (1,0) [-128|127] "" GATEWAY
+
+CM_ SG_ 256 EngineSpeed "the speed of the crankshaft";
+"""
+
+
+@pytest.fixture
+def database():
+    return SignalDatabase.from_dbc_string(DBC)
+
+
+class TestSignalDatabase:
+
+    def test_load(self, database):
+        engine = database.get_message("EngineData")
+        assert engine is database.get_message(256)
+        assert [signal.name for signal in engine.signals] == ["EngineSpeed", "CoolantTemp", "Torque", "Pressure"]
+        assert engine.get_signal("Torque").is_signed
+        assert engine.get_signal("Pressure").byte_order == "big_endian"
+        mux = database.get_message(0x18FF0100)
+        assert mux.is_extended
+
+    def test_decode(self, database):
+        data = bytes((0x20, 0x4E, 0x5A, 0xFE, 0x0F, 0x12, 0x34, 0x00))
+        values = database.decode(CanFrame(can_id=256, data=data))
+        assert values == {"EngineSpeed": 0x4E20 * 0.25,
+                          "CoolantTemp": 0x5A - 40,
+                          "Torque": -2 * 0.5,
+                          "Pressure": 0x1234,
+                          }
+        assert database.decode(CanFrame(can_id=256, data=data), scaled=False)["Torque"] == -2
+        assert database.decode(CanFrame(can_id=0x7FF, data=data)) is None
+
+    def test_decode_multiplexed(self, database):
+        message = database.get_message("MuxData")
+        assert message.decode(bytes((1, 0x34, 0x12))) == {"Page": 1, "Value1": 0x1234}
+        assert message.decode(bytes((2, 0xFF, 0x12))) == {"Page": 2, "Value2": -1}
+        assert message.decode(bytes((3, 0xFF, 0x12))) == {"Page": 3}
+
+    def test_encode(self, database):
+        values = {"EngineSpeed": 5000, "CoolantTemp": 90, "Torque": -100.5, "Pressure": 0xABCD}
+        frame = database.encode("EngineData", values)
+        assert frame.can_id == 256
+        assert database.decode(frame) == values
+
+        frame = database.encode(0x18FF0100, {"Page": 2, "Value2": -5})
+        assert frame.flags & CanFlags.CAN_EFF_FLAG
+        assert database.decode(frame) == {"Page": 2, "Value2": -5}
+
+    def test_encode_out_of_range(self, database):
+        with pytest.raises(ValueError):
+            database.encode("EngineData", {"CoolantTemp": 300})
+
+    def test_vector_independent_signals_and_extended_multiplexing(self):
+        database = SignalDatabase.from_dbc_string(DBC + """
+BO_ 3221225472 VECTOR__INDEPENDENT_SIG_MSG: 0 Vector__XXX
+ SG_ Unused : 0|8@1+ (1,0) [0|255] "" Vector__XXX
+
+BO_ 512 Nested: 8 ECU
+ SG_ Mode M : 0|8@1+ (1,0) [0|255] "" GATEWAY
+ SG_ SubMode m1M : 8|8@1+ (1,0) [0|255] "" GATEWAY
+""")
+        assert "VECTOR__INDEPENDENT_SIG_MSG" not in database.messages_by_name
+        assert database.get_message(512).get_signal("SubMode").multiplexer_id == 1
+
+    def test_standard_and_extended_id_with_the_same_number(self):
+        database = SignalDatabase.from_dbc_string(DBC + """
+BO_ 2147483904 ExtendedData: 8 ECU
+ SG_ Counter : 0|8@1+ (1,0) [0|255] "" GATEWAY
+""")
+        assert database.get_message(256).name == "EngineData"
+        assert database.get_message(256, extended=True).name == "ExtendedData"
+        data = bytes((0x20, 0x4E, 0x5A, 0xFE, 0x0F, 0x12, 0x34, 0x00))
+        assert database.decode(CanFrame(can_id=256, data=data))["EngineSpeed"] == 0x4E20 * 0.25
+        frame = database.encode(256, {"Counter": 7}, extended=True)
+        assert frame.can_id == 256 and frame.flags & CanFlags.CAN_EFF_FLAG
+        assert database.decode(frame) == {"Counter": 7}
+        if find_spec("numpy") is not None:
+            result = database.decode_batch(CanFrameBatch.from_frames([CanFrame(can_id=256, data=data), frame]))
+            assert list(result["ExtendedData"]["Counter"]) == [7]
+            assert list(result["EngineData"]["CoolantTemp"]) == [0x5A - 40]
+
+    def test_signal_does_not_fit(self):
+        with pytest.raises(ValueError):
+            Message(can_id=0x123, name="Short", length=2, signals=[Signal(name="Long", start_bit=8, length=16)])
+
+    @pytest.mark.skipif(find_spec("numpy") is None, reason="this test requires numpy")
+    def test_decode_batch(self, database):
+        frames = [database.encode("EngineData", {"EngineSpeed": idx * 100, "Torque": -idx, "Pressure": idx})
+                  for idx in range(10)]
+        frames.append(database.encode("MuxData", {"Page": 1, "Value1": 1000}))
+        frames.append(database.encode("MuxData", {"Page": 2, "Value2": -3}))
+        frames.append(CanFrame(can_id=0x7FF, data=bytes(8)))
+        result = database.decode_batch(CanFrameBatch.from_frames(frames))
+        assert set(result) == {"EngineData", "MuxData"}
+        engine = result["EngineData"]
+        # integer factors and offsets still give physical values as floats
+        assert engine["Pressure"].dtype.kind == "f"
+        for idx in range(10):
+            assert engine["EngineSpeed"][idx] == idx * 100
+            assert engine["Torque"][idx] == -idx
+            assert engine["Pressure"][idx] == idx
+        mux = result["MuxData"]
+        assert list(mux["Page"]) == [1, 2]
+        assert mux["Value1"][0] == 1000
+        assert mux["Value2"][1] == -3
+        assert mux["Value1"][1] != mux["Value1"][1]
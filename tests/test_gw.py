@@ -0,0 +1,194 @@
+""" Test_gw
+
+    Collection of tests for gw module to be run with pytest / tox / coverage
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import pytest
+
+import errno
+import socket
+import struct
+import time
+
+from socketcan import CanFilter, CanFrame, CanRawSocket
+from socketcan.gw import CanGateway, CanGwRule, CgwAttributes, CgwCsumCrc8, CgwCsumXor, CgwFlags, CgwFrameMod, \
+    CgwModOps, CgwModTypes, NetlinkFlags, NetlinkMsgTypes, NLMSGHDR, RTCANMSG, U32, crc8_table, iter_attributes, \
+    iter_messages, pack_attribute, pack_message
+
+
+def get_rule():
+    """ helper function """
+    return CanGwRule(src_if="lo",
+                     dst_if="lo",
+                     can_filter=CanFilter(can_id=0x100, can_mask=0x700),
+                     mods=[CgwFrameMod(op=CgwModOps.SET, modtype=CgwModTypes.CGW_MOD_ID, can_id=0x200),
+                           CgwFrameMod(op=CgwModOps.AND, modtype=CgwModTypes.CGW_MOD_DATA, data=bytes((0xFF,)) * 8),
+                           ],
+                     csum_xor=CgwCsumXor(from_idx=0, to_idx=6, result_idx=7, init_xor_val=0xAA),
+                     csum_crc8=CgwCsumCrc8(from_idx=1, to_idx=7, result_idx=0, init_crc_val=0xFF, final_xor_val=0xFF),
+                     lim_hops=2,
+                     mod_uid=0x1234,
+                     flags=CgwFlags.CGW_FLAGS_CAN_ECHO,
+                     )
+
+
+class TestEncoding:
+
+    def test_crc8_table(self):
+        table = crc8_table(0x1D)
+        assert len(table) == 256
+        assert table[1] == 0x1D
+        # the check value of CRC-8/SAE-J1850
+        crc = 0xFF
+        for byte in b"123456789":
+            crc = table[crc ^ byte]
+        assert crc ^ 0xFF == 0x4B
+
+    def test_struct_sizes(self):
+        assert CgwFrameMod.STRUCT.size == 17
+        assert CgwFrameMod.FD_STRUCT.size == 73
+        assert CgwCsumXor.STRUCT.size == 4
+        assert CgwCsumCrc8.STRUCT.size == 282
+
+    def test_attributes(self):
+        packed = pack_attribute(CgwAttributes.CGW_LIM_HOPS, bytes((3,))) + pack_attribute(
+            CgwAttributes.CGW_SRC_IF, U32.pack(1))
+        # the first attribute is padded to 4 bytes
+        assert len(packed) == 8 + 8
+        assert [(attribute, bytes(payload)) for attribute, payload in iter_attributes(packed)] == \
+            [(CgwAttributes.CGW_LIM_HOPS, bytes((3,))), (CgwAttributes.CGW_SRC_IF, U32.pack(1))]
+
+    def test_rule_round_trip(self):
+        rule = get_rule()
+        rule2 = CanGwRule.from_bytes(rule.to_bytes())
+        assert rule2 == rule
+        assert rule2.src_if == "lo"
+        assert rule2.can_filter == CanFilter(can_id=0x100, can_mask=0x700)
+        assert rule2.csum_crc8.crctab == crc8_table(0x1D)
+        assert rule2.lim_hops == 2
+        assert rule2.mod_uid == 0x1234
+        # the kernel takes the modifications in the order of the operations
+        assert [mod.op for mod in CanGwRule.from_bytes(rule.to_bytes()).mods] == [CgwModOps.AND, CgwModOps.SET]
+
+    def test_fd_mod(self):
+        mod = CgwFrameMod(op=CgwModOps.XOR, modtype=CgwModTypes.CGW_MOD_DATA, data=bytes(range(64)), fd=True)
+        assert mod.get_attribute() == CgwAttributes.CGW_FDMOD_XOR
+        assert CgwFrameMod.from_bytes(mod.get_attribute(), mod.to_bytes()) == mod
+
+    def test_duplicate_mods(self):
+        with pytest.raises(ValueError):
+            CanGwRule(src_if="lo", dst_if="lo", mods=[CgwFrameMod(op=CgwModOps.SET, modtype=1),
+                                                      CgwFrameMod(op=CgwModOps.SET, modtype=2)])
+
+    def test_counters(self):
+        payload = get_rule().to_bytes() + pack_attribute(CgwAttributes.CGW_HANDLED, U32.pack(10)) + \
+            pack_attribute(CgwAttributes.CGW_DROPPED, U32.pack(2))
+        rule = CanGwRule.from_bytes(payload)
+        assert (rule.handled, rule.dropped, rule.deleted) == (10, 2, 0)
+
+
+@pytest.fixture
+def gateway():
+    """ a gateway on a datagram socket pair, the peer plays the kernel """
+    s1, s2 = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    gw = CanGateway.__new__(CanGateway)
+    gw.s = s1
+    gw.seq = 0
+    s1.settimeout(1)
+    yield gw, s2
+    s2.close()
+
+
+def ack(seq, error=0):
+    """ helper function """
+    return pack_message(NetlinkMsgTypes.NLMSG_ERROR, 0, seq, struct.pack("=i", error) + bytes(NLMSGHDR.size))
+
+
+class TestCanGateway:
+
+    def test_add_rule(self, gateway):
+        gw, peer = gateway
+        peer.send(ack(1))
+        gw.add_rule(get_rule())
+        msg_type, flags, seq, payload = next(iter_messages(peer.recv(4096)))
+        assert msg_type == NetlinkMsgTypes.RTM_NEWROUTE
+        assert flags == NetlinkFlags.NLM_F_REQUEST | NetlinkFlags.NLM_F_ACK
+        assert seq == 1
+        assert CanGwRule.from_bytes(payload) == get_rule()
+
+    def test_flush(self, gateway):
+        gw, peer = gateway
+        peer.send(ack(1))
+        gw.flush()
+        msg_type, flags, seq, payload = next(iter_messages(peer.recv(4096)))
+        assert msg_type == NetlinkMsgTypes.RTM_DELROUTE
+        # without both interfaces the kernel answers ENODEV
+        assert dict((attribute, bytes(value)) for attribute, value in iter_attributes(payload, RTCANMSG.size)) == \
+            {CgwAttributes.CGW_SRC_IF: U32.pack(0), CgwAttributes.CGW_DST_IF: U32.pack(0)}
+
+    def test_error(self, gateway):
+        gw, peer = gateway
+        peer.send(ack(1, -errno.EPERM))
+        with pytest.raises(PermissionError):
+            gw.flush()
+
+    def test_get_rules(self, gateway):
+        gw, peer = gateway
+        rule = get_rule()
+        rule_msg = pack_message(NetlinkMsgTypes.RTM_NEWROUTE, NetlinkFlags.NLM_F_MULTI, 1,
+                                rule.to_bytes() + pack_attribute(CgwAttributes.CGW_HANDLED, U32.pack(5)))
+        # a route of another family and a message of an older request are skipped
+        other_family = pack_message(NetlinkMsgTypes.RTM_NEWROUTE, NetlinkFlags.NLM_F_MULTI, 1,
+                                    RTCANMSG.pack(socket.AF_INET, 0, 0))
+        stale = pack_message(NetlinkMsgTypes.RTM_NEWROUTE, NetlinkFlags.NLM_F_MULTI, 0, rule.to_bytes())
+        peer.send(stale + rule_msg + other_family)
+        peer.send(pack_message(NetlinkMsgTypes.NLMSG_DONE, NetlinkFlags.NLM_F_MULTI, 1, struct.pack("=i", 0)))
+        rules = gw.get_rules()
+        assert rules == [rule]
+        assert rules[0].handled == 5
+        assert next(iter_messages(peer.recv(4096)))[0] == NetlinkMsgTypes.RTM_GETROUTE
+
+
+def is_gateway_available():
+    """ helper function """
+    for interface in ("vcan0", "vcan1"):
+        try:
+            socket.if_nametoindex(interface)
+        except OSError:
+            return False
+    try:
+        with CanGateway() as gw:
+            gw.get_rules()
+            gw.add_rule(CanGwRule(src_if="vcan0", dst_if="vcan1", can_filter=CanFilter(can_id=0x7FF)))
+            gw.delete_rule(CanGwRule(src_if="vcan0", dst_if="vcan1", can_filter=CanFilter(can_id=0x7FF)))
+    except OSError:
+        return False
+    return True
+
+
+@pytest.mark.skipif(not is_gateway_available(), reason="this test requires vcan0, vcan1, can-gw and CAP_NET_ADMIN")
+class TestCanGatewayOnVcan:
+
+    def test_forward_and_modify(self):
+        rule = CanGwRule(src_if="vcan0",
+                         dst_if="vcan1",
+                         can_filter=CanFilter(can_id=0x123),
+                         mods=[CgwFrameMod(op=CgwModOps.SET, modtype=CgwModTypes.CGW_MOD_ID, can_id=0x321)],
+                         csum_xor=CgwCsumXor(from_idx=0, to_idx=6, result_idx=7),
+                         )
+        tx = CanRawSocket(interface="vcan0")
+        rx = CanRawSocket(interface="vcan1")
+        with CanGateway() as gw:
+            gw.add_rule(rule)
+            try:
+                tx.send(CanFrame(can_id=0x123, data=bytes((1, 2, 4, 8, 0, 0, 0, 0))))
+                assert rx.recv() == CanFrame(can_id=0x321, data=bytes((1, 2, 4, 8, 0, 0, 0, 15)))
+                time.sleep(0.01)
+                rules = gw.get_rules(src_if="vcan0")
+                assert rules == [rule]
+                assert rules[0].handled == 1
+            finally:
+                gw.delete_rule(rule)
+        assert rule not in CanGateway().get_rules()
@@ -0,0 +1,93 @@
+""" Test_metrics
+
+    Collection of tests for metrics module to be run with pytest / tox / coverage
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import pytest
+
+import socket
+
+from socketcan import CanFrame
+from socketcan.metrics import LatencyHistogram, RXQ_OVFL, SO_RXQ_OVFL, SocketMetrics, drops_from_ancdata
+from socketcan.virtual import VirtualBus
+
+
+@pytest.fixture
+def raw_socket_pair():
+    """ two CanRawSockets on a virtual bus, the second one collects metrics """
+    with VirtualBus() as bus:
+        yield bus.create_raw_socket(), bus.create_raw_socket(metrics=True)
+
+
+class TestLatencyHistogram:
+
+    def test_add_and_percentile(self):
+        histogram = LatencyHistogram(bounds=[0.001, 0.01, 0.1])
+        assert histogram.percentile(50) is None
+        for value in [0.0005] * 90 + [0.05] * 9 + [1.0]:
+            histogram.add(value)
+        assert histogram.counts == [90, 0, 9, 1]
+        assert histogram.percentile(50) == 0.001
+        assert histogram.percentile(99) == 0.1
+        assert histogram.percentile(100) == 1.0
+        snapshot = histogram.to_dict()
+        assert snapshot["count"] == 100
+        assert snapshot["max"] == 1.0
+        assert snapshot["overflow"] == 1
+
+
+class TestSocketMetrics:
+
+    def test_drops_from_ancdata(self):
+        assert drops_from_ancdata([(socket.SOL_SOCKET, SO_RXQ_OVFL, RXQ_OVFL.pack(42))]) == 42
+        assert drops_from_ancdata([]) is None
+
+    def test_kernel_drops_are_cumulative(self):
+        metrics = SocketMetrics()
+        metrics.add_rx(1, 16, [(socket.SOL_SOCKET, SO_RXQ_OVFL, RXQ_OVFL.pack(3))])
+        metrics.add_rx(1, 16)
+        assert metrics.snapshot()["kernel_drops"] == 3
+        assert metrics.snapshot()["frames_in"] == 2
+
+    def test_raw_socket_counts(self, raw_socket_pair):
+        tx, rx = raw_socket_pair
+        frame = CanFrame(can_id=0x123, data=bytes(8))
+        assert tx.send_batch([frame] * 10) == 10
+        rx.recv()
+        assert len(rx.recv_batch(max_frames=16, timeout=1)) == 9
+        snapshot = rx.metrics.snapshot()
+        assert snapshot["frames_in"] == 10
+        assert snapshot["bytes_in"] == 10 * CanFrame.get_size()
+        assert snapshot["frames_out"] == 0
+
+        rx.send(frame)
+        assert rx.metrics.snapshot()["frames_out"] == 1
+        rx.metrics.reset()
+        assert rx.metrics.snapshot()["frames_in"] == 0
+
+    def test_loopback_matched_by_content(self):
+        metrics = SocketMetrics()
+        frames = [CanFrame(can_id=can_id, data=bytes(8)) for can_id in (0x100, 0x101, 0x102)]
+        for idx, frame in enumerate(frames):
+            metrics.add_pending_loopback(frame.to_bytes(), send_time=idx)
+        assert not metrics.add_loopback(CanFrame(can_id=0x200, data=bytes(8)).to_bytes(), 10)
+        # the echo of 0x100 never came back
+        assert metrics.add_loopback(frames[1].to_bytes(), 10)
+        assert metrics.loopback_latency.to_dict()["max"] == 9
+        assert [send_time for key, send_time in metrics.pending_loopback] == [2]
+
+    def test_loopback_pending_on_all_send_paths(self, raw_socket_pair):
+        tx, rx = raw_socket_pair
+        rx.set_recv_own_msgs(True)
+        frame = CanFrame(can_id=0x123, data=bytes(8))
+        rx.send(frame)
+        assert rx.send_batch([frame] * 3) == 3
+        assert len(rx.metrics.pending_loopback) == 4
+
+    def test_disabled_metrics(self, raw_socket_pair):
+        tx, rx = raw_socket_pair
+        tx.send(CanFrame(can_id=0x123, data=bytes(8)))
+        assert tx.metrics is None
+        assert tx.ancbufsize == 0
@@ -0,0 +1,156 @@
+""" Test_mmsg
+
+    Collection of tests for mmsg module to be run with pytest / tox / coverage
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import pytest
+
+import socket
+import struct
+import time
+
+from threading import Thread
+
+from socketcan import CanFrame
+from socketcan.mmsg import MmsgReceiver, MmsgSender, libc
+
+SO_TIMESTAMPNS = 35
+
+
+@pytest.fixture
+def socket_pair():
+    """ a datagram socket pair that mimics a CAN socket """
+    s1, s2 = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    yield s1, s2
+    s1.close()
+    s2.close()
+
+
+@pytest.mark.parametrize("use_recvmmsg", [
+    pytest.param(True, marks=pytest.mark.skipif(libc is None, reason="this test requires recvmmsg in libc")),
+    False])
+class TestMmsgReceiver:
+
+    def test_recv_multiple_frames(self, socket_pair, use_recvmmsg):
+        tx, rx = socket_pair
+        frames = [CanFrame(can_id=can_id, data=bytes(range(can_id % 9))) for can_id in range(0x100, 0x10A)]
+        for frame in frames:
+            tx.send(frame.to_bytes())
+
+        receiver = MmsgReceiver(sock=rx, slot_size=CanFrame.get_size(), nslots=16, use_recvmmsg=use_recvmmsg)
+        nmsgs = receiver.recv(timeout=1)
+        assert nmsgs == len(frames)
+        assert receiver.lengths[:nmsgs] == [CanFrame.get_size()] * nmsgs
+        assert bytes(receiver.view[:nmsgs * CanFrame.get_size()]) == b"".join(frame.to_bytes() for frame in frames)
+
+    def test_recv_limited_by_max_msgs(self, socket_pair, use_recvmmsg):
+        tx, rx = socket_pair
+        frame = CanFrame(can_id=0x123, data=bytes(8))
+        for idx in range(5):
+            tx.send(frame.to_bytes())
+
+        receiver = MmsgReceiver(sock=rx, slot_size=CanFrame.get_size(), nslots=16, use_recvmmsg=use_recvmmsg)
+        assert receiver.recv(max_msgs=3, timeout=1) == 3
+        assert receiver.recv(max_msgs=3, timeout=1) == 2
+
+    def test_recv_ancillary_data(self, socket_pair, use_recvmmsg):
+        tx, rx = socket_pair
+        rx.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+        frame = CanFrame(can_id=0x123, data=bytes(8))
+        before = time.time()
+        for idx in range(3):
+            tx.send(frame.to_bytes())
+        after = time.time()
+
+        receiver = MmsgReceiver(sock=rx, slot_size=CanFrame.get_size(), nslots=4, use_recvmmsg=use_recvmmsg,
+                                ancbufsize=socket.CMSG_SPACE(16))
+        assert receiver.recv(timeout=1) == 3
+        for idx in range(3):
+            [(cmsg_level, cmsg_type, cmsg_data)] = receiver.get_ancdata(idx)
+            assert (cmsg_level, cmsg_type) == (socket.SOL_SOCKET, SO_TIMESTAMPNS)
+            sec, nsec = struct.unpack("@ll", cmsg_data)
+            assert int(before) <= sec <= after
+
+    def test_recv_timeout(self, socket_pair, use_recvmmsg):
+        tx, rx = socket_pair
+        receiver = MmsgReceiver(sock=rx, slot_size=CanFrame.get_size(), nslots=4, use_recvmmsg=use_recvmmsg)
+        assert receiver.recv(timeout=0.01) == 0
+
+    def test_recv_does_not_wait_for_the_socket_timeout(self, socket_pair, use_recvmmsg):
+        tx, rx = socket_pair
+        rx.settimeout(1)
+        frame = CanFrame(can_id=0x123, data=bytes(8))
+        for idx in range(2):
+            tx.send(frame.to_bytes())
+
+        receiver = MmsgReceiver(sock=rx, slot_size=CanFrame.get_size(), nslots=4, use_recvmmsg=use_recvmmsg)
+        start = time.perf_counter()
+        assert receiver.recv(timeout=1) == 2
+        assert time.perf_counter() - start < 0.5
+        assert rx.gettimeout() == 1
+
+
+def fill_sender(sender, frames):
+    """ helper function """
+    for idx, frame in enumerate(frames):
+        frame.pack_into(sender.buffer, idx * sender.slot_size)
+        sender.lengths[idx] = frame.get_size()
+
+
+@pytest.mark.parametrize("use_sendmmsg", [
+    pytest.param(True, marks=pytest.mark.skipif(libc is None, reason="this test requires sendmmsg in libc")),
+    False])
+class TestMmsgSender:
+
+    def test_send_multiple_frames(self, socket_pair, use_sendmmsg):
+        tx, rx = socket_pair
+        frames = [CanFrame(can_id=can_id, data=bytes(range(can_id % 9))) for can_id in range(0x100, 0x10A)]
+        sender = MmsgSender(sock=tx, slot_size=CanFrame.get_size(), nslots=16, use_sendmmsg=use_sendmmsg)
+        fill_sender(sender, frames)
+
+        assert sender.send(len(frames)) == len(frames)
+        for frame in frames:
+            assert CanFrame.from_bytes(rx.recv(CanFrame.get_size())) == frame
+
+    def test_send_retries_until_drained(self, socket_pair, use_sendmmsg):
+        tx, rx = socket_pair
+        frame = CanFrame(can_id=0x123, data=bytes(8))
+        sender = MmsgSender(sock=tx, slot_size=CanFrame.get_size(), nslots=64, use_sendmmsg=use_sendmmsg)
+        fill_sender(sender, [frame] * 64)
+        # fill the socket queue until the kernel rejects frames
+        while sender.send(64, timeout=0) == 64:
+            pass
+        assert sender.retries == 0
+
+        received = []
+
+        def drain():
+            time.sleep(0.05)
+            rx.settimeout(0.5)
+            try:
+                while True:
+                    received.append(rx.recv(CanFrame.get_size()))
+            except socket.timeout:
+                pass
+
+        p = Thread(target=drain)
+        p.start()
+        assert sender.send(64, timeout=2) == 64
+        p.join()
+        assert sender.retries > 0
+
+    def test_send_does_not_wait_for_the_socket_timeout(self, socket_pair, use_sendmmsg):
+        tx, rx = socket_pair
+        tx.settimeout(0.5)
+        frame = CanFrame(can_id=0x123, data=bytes(8))
+        sender = MmsgSender(sock=tx, slot_size=CanFrame.get_size(), nslots=64, use_sendmmsg=use_sendmmsg)
+        fill_sender(sender, [frame] * 64)
+        while sender.send(64, timeout=0) == 64:
+            pass
+
+        start = time.perf_counter()
+        assert sender.send(64, timeout=0) == 0
+        assert time.perf_counter() - start < 0.25
+        assert tx.gettimeout() == 0.5
@@ -0,0 +1,182 @@
+""" Test_replay
+
+    Collection of tests for replay module to be run with pytest / tox / coverage
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import pytest
+
+import time
+
+from socketcan import CanFrame, BcmOpCodes
+from socketcan.replay import ReplayStatistics, TraceReplayer, find_cyclic_frames
+
+
+class FakeClock:
+    """ a clock that only moves when sleeping """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class RecordingSocket:
+    """ a socket that records what is sent and when """
+
+    def __init__(self, clock=time.perf_counter):
+        self.sent = []
+        self.clock = clock
+
+    def send(self, obj):
+        self.sent.append((self.clock(), obj))
+
+
+class RecordingBcmSocket(RecordingSocket):
+    """ a bcm socket that records what is sent """
+
+    def setup_cyclic_transmit(self, frame, interval):
+        self.sent.append((BcmOpCodes.TX_SETUP, frame, interval))
+
+
+def get_trace(count=20, interval=0.005):
+    """ helper function """
+    frames = []
+    for idx in range(count):
+        frame = CanFrame(can_id=0x100 + (idx % 4), data=bytes([idx]))
+        frame.timestamp = 1000 + (idx * interval)
+        frames.append(frame)
+    return frames
+
+
+class TestTraceReplayer:
+
+    def test_replay_timing(self):
+        clock = FakeClock()
+        sock = RecordingSocket(clock=clock)
+        frames = get_trace()
+        statistics = TraceReplayer(sock, spin=0, clock=clock, sleep=clock.sleep).replay(frames)
+
+        assert [frame for sent, frame in sock.sent] == frames
+        assert statistics.count == len(frames)
+        # each frame is sent at its absolute deadline
+        assert [sent for sent, frame in sock.sent] == pytest.approx([frame.timestamp - 1000 for frame in frames])
+        assert statistics.mean == 0
+
+    def test_replay_timing_on_wall_clock(self):
+        sock = RecordingSocket()
+        frames = get_trace()
+        statistics = TraceReplayer(sock).replay(frames)
+
+        assert statistics.count == len(frames)
+        duration = sock.sent[-1][0] - sock.sent[0][0]
+        # the scheduler of a loaded machine may add milliseconds
+        assert duration == pytest.approx(frames[-1].timestamp - frames[0].timestamp, abs=0.05)
+        assert statistics.min >= 0
+
+    def test_replay_with_speed_and_loops(self):
+        clock = FakeClock()
+        sock = RecordingSocket(clock=clock)
+        frames = get_trace()
+        statistics = TraceReplayer(sock, speed=2, spin=0, clock=clock, sleep=clock.sleep).replay(
+            frames, loops=3, loop_gap=0.005)
+
+        assert [frame for sent, frame in sock.sent] == frames * 3
+        assert statistics.count == len(frames) * 3
+        duration = sock.sent[-1][0] - sock.sent[0][0]
+        expected = ((frames[-1].timestamp - frames[0].timestamp) * 3 + 0.005 * 2) / 2
+        assert duration == pytest.approx(expected)
+
+    def test_replay_empty_trace_forever(self, caplog):
+        statistics = TraceReplayer(RecordingSocket()).replay([], loops=0)
+        assert statistics.count == 0
+        assert "no frames to replay" in caplog.text
+
+    def test_replay_offloads_cyclic_frames(self):
+        sock = RecordingSocket()
+        bcm_sock = RecordingBcmSocket()
+        frames = get_trace()
+        cyclic = []
+        for idx in range(20):
+            frame = CanFrame(can_id=0x200, data=bytes(8))
+            frame.timestamp = 1000 + (idx * 0.01)
+            cyclic.append(frame)
+        trace = sorted(frames + cyclic, key=lambda frame: frame.timestamp)
+
+        clock = FakeClock()
+        TraceReplayer(sock, bcm_sock=bcm_sock, spin=0, clock=clock, sleep=clock.sleep).replay(iter(trace))
+
+        assert [frame for sent, frame in sock.sent] == frames
+        opcode, frame, interval = bcm_sock.sent[0]
+        assert opcode == BcmOpCodes.TX_SETUP
+        assert frame == cyclic[0]
+        assert interval == pytest.approx(0.01)
+        assert bcm_sock.sent[1][1].opcode == BcmOpCodes.TX_DELETE
+
+    def test_cyclic_frames_are_found_in_a_prefix(self):
+        trace = []
+        for idx in range(30):
+            frame = CanFrame(can_id=0x200, data=bytes(8) if idx < 25 else bytes(1))
+            frame.timestamp = 1000 + (idx * 0.01)
+            trace.append(frame)
+        clock = FakeClock()
+        sock = RecordingSocket(clock=clock)
+        bcm_sock = RecordingBcmSocket(clock=clock)
+        TraceReplayer(sock, bcm_sock=bcm_sock, cyclic_prefix=20, spin=0, clock=clock, sleep=clock.sleep).replay(
+            iter(trace))
+
+        assert bcm_sock.sent[0][0] == BcmOpCodes.TX_SETUP
+        # the data changed after the prefix, the transmission stops and the trace is sent again
+        sent, bcm_msg = bcm_sock.sent[1]
+        assert bcm_msg.opcode == BcmOpCodes.TX_DELETE
+        assert sent == pytest.approx(0.25)
+        assert len(bcm_sock.sent) == 2
+        assert [frame for sent, frame in sock.sent] == trace[25:]
+        # the time origin is the first frame of the trace, not the first frame that is sent
+        assert [sent for sent, frame in sock.sent] == pytest.approx([frame.timestamp - 1000 for frame in trace[25:]])
+
+    def test_cyclic_frames_are_sent_until_the_end_of_the_trace(self):
+        trace = []
+        for idx in range(20):
+            frame = CanFrame(can_id=0x200, data=bytes(8))
+            frame.timestamp = 1000 + (idx * 0.01)
+            trace.append(frame)
+        clock = FakeClock()
+        sock = RecordingSocket(clock=clock)
+        bcm_sock = RecordingBcmSocket(clock=clock)
+        statistics = TraceReplayer(sock, bcm_sock=bcm_sock, speed=2, spin=0, clock=clock,
+                                   sleep=clock.sleep).replay(trace, loops=2, loop_gap=0.01)
+
+        assert sock.sent == []
+        assert statistics.count == 0
+        sent, bcm_msg = bcm_sock.sent[-1]
+        assert bcm_msg.opcode == BcmOpCodes.TX_DELETE
+        # two loops of 0.19 s with a gap of 0.01 s at twice the speed
+        assert sent == pytest.approx(0.195)
+
+
+def test_find_cyclic_frames():
+    frames = get_trace(count=40)
+    assert find_cyclic_frames(frames) == {}
+    for frame in frames:
+        frame.data = bytes(1)
+    cyclic = find_cyclic_frames(frames)
+    assert sorted(cyclic) == [0x100, 0x101, 0x102, 0x103]
+    assert cyclic[0x100][1] == pytest.approx(0.02)
+
+
+def test_replay_statistics():
+    statistics = ReplayStatistics()
+    for error in (0.0001, 0.0002, 0.0003, 0.002):
+        statistics.add(error)
+    assert statistics.count == 4
+    assert statistics.mean == pytest.approx(0.00065)
+    assert statistics.min == 0.0001
+    assert statistics.max == 0.002
+    assert statistics.late == 1
+    assert statistics.to_dict()["stddev"] == pytest.approx(0.000903696, rel=1E-4)
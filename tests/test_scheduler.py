@@ -0,0 +1,157 @@
+""" Test_scheduler
+
+    Collection of tests for scheduler module to be run with pytest / tox / coverage
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import pytest
+
+import socket
+
+from socketcan import BCMFlags, BcmMsg, BcmOpCodes, CanBcmSocket, CanFdFrame, CanFrame, CanRawSocket
+from socketcan.scheduler import CyclicScheduler
+from socketcan.socketcan import CAN_EFF_FLAG
+
+
+@pytest.fixture
+def scheduler():
+    """ a scheduler on a datagram socket pair, the peer plays the kernel """
+    s1, s2 = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    bcm_sock = CanBcmSocket.__new__(CanBcmSocket)
+    bcm_sock.s = s1
+    bcm_sock.rxbuf = bytearray(BcmMsg.get_size() + (CanBcmSocket.MAX_NFRAMES * CanFdFrame.get_size()))
+    bcm_sock.metrics = None
+    s2.settimeout(1)
+    yield CyclicScheduler(bcm_sock=bcm_sock), s2
+    s1.close()
+    s2.close()
+
+
+def receive(peer) -> BcmMsg:
+    """ helper function """
+    return BcmMsg.from_bytes(peer.recv(4096))
+
+
+class TestCyclicScheduler:
+
+    def test_add_job(self, scheduler):
+        sched, peer = scheduler
+        job = sched.add_job(can_id=0x123, frames=bytes(range(8)), interval=0.1)
+        assert 0x123 in sched
+        assert sched.get_job(0x123) is job
+        bcm_msg = receive(peer)
+        assert bcm_msg.opcode == BcmOpCodes.TX_SETUP
+        assert bcm_msg.flags == BCMFlags.SETTIMER | BCMFlags.STARTTIMER
+        assert bcm_msg.ival2 == 0.1
+        assert bcm_msg.frames == [CanFrame(can_id=0x123, data=bytes(range(8)))]
+
+    def test_update_keeps_timer(self, scheduler):
+        sched, peer = scheduler
+        sched.add_job(can_id=0x12345678, frames=bytes(8), interval=0.01)
+        receive(peer)
+        sched.update(can_id=0x12345678, data=bytes((1, 2, 3, 4)), announce=True)
+        bcm_msg = receive(peer)
+        assert bcm_msg.opcode == BcmOpCodes.TX_SETUP
+        assert bcm_msg.flags == BCMFlags.TX_ANNOUNCE
+        assert bcm_msg.can_id == 0x12345678 | CAN_EFF_FLAG
+        assert bcm_msg.frames == [CanFrame(can_id=0x12345678, data=bytes((1, 2, 3, 4)))]
+        # the flags are only for that update
+        assert sched.get_job(0x12345678).get_setup_msg().flags == BCMFlags.SETTIMER | BCMFlags.STARTTIMER
+
+    def test_rolling_counter_sequence(self, scheduler):
+        sched, peer = scheduler
+        frames = [CanFrame(can_id=0x200, data=bytes((counter, 0))) for counter in range(16)]
+        sched.add_job(can_id=0x200, frames=frames, interval=0.02)
+        assert len(receive(peer).frames) == 16
+        sched.update(can_id=0x200, data=bytes((5, 0xFF)), index=5, reset_index=True)
+        bcm_msg = receive(peer)
+        assert bcm_msg.flags == BCMFlags.TX_RESET_MULTI_IDX
+        assert bcm_msg.frames[5].data == bytes((5, 0xFF))
+        assert bcm_msg.frames[4] == frames[4]
+        with pytest.raises(IndexError):
+            sched.stage(can_id=0x200, data=bytes(2), index=16)
+
+    def test_stage_and_flush(self, scheduler):
+        sched, peer = scheduler
+        for can_id in range(0x100, 0x110):
+            sched.add_job(can_id=can_id, frames=bytes(8), interval=0.1)
+            receive(peer)
+        assert sched.flush() == 0
+        for can_id in range(0x100, 0x110, 2):
+            sched.stage(can_id=can_id, data=bytes((can_id & 0xFF,)) * 8)
+        assert sched.flush() == 8
+        updates = [receive(peer) for _ in range(8)]
+        assert [bcm_msg.can_id for bcm_msg in updates] == list(range(0x100, 0x110, 2))
+        assert all(bcm_msg.flags == 0 for bcm_msg in updates)
+        assert updates[1].frames[0].data == bytes((0x02,)) * 8
+        assert sched.flush() == 0
+
+    def test_fd_job(self, scheduler):
+        sched, peer = scheduler
+        sched.add_job(can_id=0x300, frames=[CanFdFrame(can_id=0x300, data=bytes(16))], interval=0.1)
+        assert receive(peer).flags & BCMFlags.CAN_FD_FRAME
+        sched.update(can_id=0x300, data=bytes(range(32)))
+        bcm_msg = receive(peer)
+        assert bcm_msg.frames[0].data == bytes(range(32))
+
+    def test_read(self, scheduler):
+        sched, peer = scheduler
+        frame = CanFrame(can_id=0x123, data=bytes(8))
+        sched.add_job(can_id=0x123, frames=[frame], interval=0.1)
+        receive(peer)
+        # a message that read() has to skip and the answer of the kernel
+        peer.send(BcmMsg(opcode=BcmOpCodes.TX_EXPIRED, flags=0, can_id=0x123, frames=[], ival2=0).to_bytes())
+        peer.send(BcmMsg(opcode=BcmOpCodes.TX_STATUS, flags=0, can_id=0x123, frames=[frame], ival2=0.1).to_bytes())
+        status = sched.read(0x123)
+        assert receive(peer).opcode == BcmOpCodes.TX_READ
+        assert status.opcode == BcmOpCodes.TX_STATUS
+        assert status.frames == [frame]
+
+    def test_read_timeout(self, scheduler):
+        sched, peer = scheduler
+        sched.add_job(can_id=0x123, frames=bytes(8), interval=0.1)
+        receive(peer)
+        # only messages of other jobs
+        peer.send(BcmMsg(opcode=BcmOpCodes.TX_STATUS, flags=0, can_id=0x124, frames=[], ival2=0).to_bytes())
+        with pytest.raises(TimeoutError):
+            sched.read(0x123, timeout=0.05)
+        assert receive(peer).opcode == BcmOpCodes.TX_READ
+        assert sched.bcm_sock.s.gettimeout() is None
+
+    def test_delete_and_close(self, scheduler):
+        sched, peer = scheduler
+        sched.add_job(can_id=0x100, frames=bytes(8), interval=0.1)
+        sched.add_job(can_id=0x101, frames=bytes(8), interval=0.1)
+        receive(peer)
+        receive(peer)
+        sched.delete_job(0x100)
+        assert receive(peer).opcode == BcmOpCodes.TX_DELETE
+        assert 0x100 not in sched
+        sched.close()
+        bcm_msg = receive(peer)
+        assert (bcm_msg.opcode, bcm_msg.can_id) == (BcmOpCodes.TX_DELETE, 0x101)
+        assert len(sched) == 0
+
+
+def is_interface_present(interface):
+    """ helper function """
+    try:
+        socket.if_nametoindex(interface)
+    except OSError:
+        return False
+    return True
+
+
+@pytest.mark.skipif(not is_interface_present("vcan0"), reason="this test requires vcan0 to be set up")
+class TestCyclicSchedulerOnVcan:
+
+    def test_update_and_read(self):
+        interface = "vcan0"
+        s = CanRawSocket(interface=interface)
+        with CyclicScheduler(interface=interface) as sched:
+            sched.add_job(can_id=0x123, frames=bytes(8), interval=0.01)
+            assert s.recv() == CanFrame(can_id=0x123, data=bytes(8))
+            sched.update(can_id=0x123, data=bytes(range(8)))
+            assert sched.read(0x123).frames == [CanFrame(can_id=0x123, data=bytes(range(8)))]
+        assert len(sched) == 0
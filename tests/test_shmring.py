@@ -0,0 +1,214 @@
+""" Test_shmring
+
+    Collection of tests for shmring module to be run with pytest / tox / coverage
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import pytest
+
+import multiprocessing
+import time
+
+from socketcan import CanFrame, shmring
+from socketcan.shmring import ShmRingHeader, ShmRingReader, ShmRingWriter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def make_frames(count: int, start: int = 0):
+    return [CanFrame(can_id=0x100 + ((start + idx) & 0xFF),
+                     data=((start + idx) & 0xFFFFFFFF).to_bytes(4, "little"),
+                     timestamp=float(start + idx))
+            for idx in range(count)]
+
+
+def worker(name, reader_id, count, results):
+    """ sum the payloads of count frames and report the sum """
+    reader = ShmRingReader(name=name, reader_id=reader_id, start="oldest")
+    total = 0
+    received = 0
+    deadline = time.time() + 10
+    while received < count and time.time() < deadline:
+        frames = reader.read_frames(max_frames=32)
+        for frame in frames:
+            total += int.from_bytes(frame.data, "little")
+        received += len(frames)
+        if not frames:
+            time.sleep(0.001)
+    results.put((reader_id, received, total, reader.lost))
+    reader.close()
+
+
+@pytest.fixture
+def writer():
+    ring = ShmRingWriter(nslots=16, max_readers=4)
+    yield ring
+    ring.close()
+
+
+class TestShmRingHeader:
+
+    def test_header(self):
+        header = ShmRingHeader(nslots=16, max_readers=4, write_seq=5)
+        header2 = ShmRingHeader.from_bytes(header.to_bytes())
+        assert header2.nslots == 16
+        assert header2.max_readers == 4
+        assert header2.write_seq == 5
+        assert header.frames_offset % 64 == 0
+        assert header.total_size == header.timestamps_offset + 16 * 8
+
+    def test_bad_magic(self):
+        with pytest.raises(ValueError):
+            ShmRingHeader.from_bytes(bytes(ShmRingHeader.STRUCT.size))
+
+
+class TestShmRing:
+
+    def test_write_read(self, writer):
+        reader = ShmRingReader(name=writer.name, reader_id=0)
+        frames = make_frames(10)
+        assert writer.write_frames(frames) == 10
+        assert reader.lag == 10
+        assert reader.read_frames(max_frames=64) == frames
+        assert reader.lag == 0
+        assert writer.get_reader_lags() == {0: 0}
+        assert reader.read_frames() == []
+        reader.close()
+        assert writer.get_reader_lags() == {}
+
+    def test_timestamps(self, writer):
+        reader = ShmRingReader(name=writer.name)
+        writer.write_frames([CanFrame(can_id=1, data=bytes(1))])
+        writer.write_raw(CanFrame(can_id=2, data=bytes(1)).to_bytes(), timestamps=[1.5])
+        frames = reader.read_frames()
+        assert frames[0].timestamp is None
+        assert frames[1].timestamp == 1.5
+        reader.close()
+
+    def test_write_raw_wraps(self, writer):
+        reader = ShmRingReader(name=writer.name)
+        writer.write_frames(make_frames(12))
+        reader.read_frames(max_frames=12)
+        frames = make_frames(8, start=12)
+        writer.write_raw(b"".join(frame.to_bytes() for frame in frames),
+                         timestamps=[frame.timestamp for frame in frames])
+        # the views are contiguous, so the wrap around splits the read
+        view, timestamps = reader.read_raw(max_frames=64)
+        assert len(timestamps) == 4
+        view.release()
+        timestamps.release()
+        assert reader.read_frames(max_frames=64) == frames[4:]
+        reader.close()
+
+    def test_fd_frame_rejected(self, writer):
+        from socketcan import CanFdFrame
+        with pytest.raises(ValueError):
+            writer.write_frames([CanFdFrame(can_id=1, data=bytes(12))])
+
+    def test_overrun(self, writer, caplog):
+        reader = ShmRingReader(name=writer.name, reader_id=1)
+        writer.write_frames(make_frames(20))
+        assert writer.check_readers() == [1]
+        assert "reader 1 is 20 frames behind" in caplog.text
+        frames = reader.read_frames(max_frames=64) + reader.read_frames(max_frames=64)
+        assert reader.lost == 4
+        assert frames == make_frames(16, start=4)
+        assert writer.check_readers() == []
+        reader.close()
+
+    def test_is_valid(self, writer):
+        reader = ShmRingReader(name=writer.name)
+        writer.write_frames(make_frames(8))
+        view, timestamps = reader.read_raw()
+        assert reader.is_valid()
+        writer.write_frames(make_frames(9))
+        assert not reader.is_valid()
+        view.release()
+        timestamps.release()
+        reader.close()
+
+    def test_write_in_progress(self, writer):
+        reader = ShmRingReader(name=writer.name)
+        writer.write_frames(make_frames(16))
+        reader.read_seq = 0
+        view, timestamps = reader.read_raw(max_frames=4)
+        view.release()
+        timestamps.release()
+        assert reader.is_valid()
+        # the writer is about to overwrite the slot of frame 0 but has not published it yet
+        writer.claim(1)
+        assert writer.get_write_seq() == 16
+        assert not reader.is_valid()
+        # a new read skips the claimed slot
+        reader.read_seq = 0
+        assert reader.read_frames(max_frames=4) == make_frames(4, start=1)
+        assert reader.lost == 1
+        reader.close()
+
+    def test_writer_laps_during_read(self, writer):
+        reader = ShmRingReader(name=writer.name)
+        writer.write_frames(make_frames(16))
+        reader.read_seq = 0
+        get_write_seq = reader.get_write_seq
+
+        def get_write_seq_then_lap():
+            # the writer laps the reader while it reads the sequences
+            reader.get_write_seq = get_write_seq
+            write_seq = get_write_seq()
+            writer.write_frames(make_frames(40, start=16))
+            return write_seq
+
+        reader.get_write_seq = get_write_seq_then_lap
+        received = []
+        read_seqs = [reader.read_seq]
+        for idx in range(4):
+            received.extend(reader.read_frames(max_frames=64))
+            read_seqs.append(reader.read_seq)
+        assert read_seqs == sorted(read_seqs)
+        assert reader.read_seq == 56
+        assert received == make_frames(len(received), start=56 - len(received))
+        assert reader.lost + len(received) == 56
+        reader.close()
+
+    def test_requires_shared_memory(self, monkeypatch):
+        monkeypatch.setattr(shmring, "shared_memory", None)
+        with pytest.raises(ImportError):
+            ShmRingWriter(nslots=16)
+        with pytest.raises(ImportError):
+            ShmRingReader(name="socketcan_test")
+
+    def test_bad_reader_id(self, writer):
+        with pytest.raises(ValueError):
+            ShmRingReader(name=writer.name, reader_id=4)
+
+    @pytest.mark.skipif(np is None, reason="requires numpy")
+    def test_read_batch(self, writer):
+        reader = ShmRingReader(name=writer.name)
+        writer.write_frames(make_frames(5))
+        batch = reader.read_batch()
+        assert list(batch.can_id) == [0x100 + idx for idx in range(5)]
+        assert list(batch.timestamps) == [float(idx) for idx in range(5)]
+        del batch
+        reader.close()
+
+    def test_fan_out(self):
+        count = 200
+        writer = ShmRingWriter(nslots=count, max_readers=4)
+        ctx = multiprocessing.get_context("spawn")
+        results = ctx.Queue()
+        workers = [ctx.Process(target=worker, args=(writer.name, reader_id, count, results)) for reader_id in range(3)]
+        for p in workers:
+            p.start()
+        frames = make_frames(count)
+        for idx in range(0, count, 20):
+            writer.write_frames(frames[idx:idx + 20])
+        collected = sorted(results.get(timeout=30) for _ in workers)
+        for p in workers:
+            p.join(timeout=10)
+        writer.close()
+        expected = sum(range(count))
+        assert collected == [(reader_id, count, expected, 0) for reader_id in range(3)]
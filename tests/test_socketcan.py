@@ -9,7 +9,13 @@ import pytest
 
 from queue import Queue
 
-from socketcan import CanFrame, CanFlags, BCMFlags, BcmMsg, BcmOpCodes, CanRawSocket, CanIsoTpSocket, CanBcmSocket
+from socketcan import CanFrame, CanFlags, BCMFlags, BcmMsg, BcmOpCodes, CanRawSocket, CanIsoTpSocket, CanBcmSocket, \
+    BcmRxChanged, BcmRxEvent, BcmRxTimeout, CanFrameBatch, IsoTpFcOpts, IsoTpFlags, IsoTpLlOpts, IsoTpOpts, CanFilter, CanFdFrame, CanFdFlags, TimestampingOptions
+from socketcan import CanJ1939Socket, J1939Filter, J1939Message, FrameCache, FrozenCanFdFrame, FrozenCanFrame
+from socketcan.socketcan import SocketOptionsMixin, timestamp_from_ancdata, j1939_info_from_ancdata, SOL_CAN_J1939, \
+    J1939_NO_ADDR, J1939_PGN_ADDRESS_CLAIMED, J1939_PGN_REQUEST, CanJ1939CmsgTypes, get_key
+
+from socketcan.virtual import VirtualBus
 
 from subprocess import CalledProcessError, check_output
 
@@ -19,6 +25,14 @@ import time
 
 import platform
 
+import socket
+
+import struct
+
+import pickle
+
+from importlib.util import find_spec
+
 
 # TODO: Add a pytest fixture that sets up vcan0 and tears it down afterwards, this requires superuser permissions
 #       though.
@@ -157,6 +171,125 @@ class TestObjectCreation():
         frame2 = CanFrame.from_bytes(frame_as_bytes)
         assert frame1 == frame2
 
+    def test_can_frame_pack_into_and_unpack_from(self):
+        frames = [CanFrame(can_id=0x123, data=bytes(range(0, 0x88, 0x11))),
+                  CanFrame(can_id=0x12345678, flags=CanFlags.CAN_RTR_FLAG, data=bytes()),
+                  ]
+        buffer = bytearray(CanFrame.get_size() * len(frames))
+        for idx, frame in enumerate(frames):
+            frame.pack_into(buffer, idx * CanFrame.get_size())
+
+        assert bytes(buffer) == b"".join(frame.to_bytes() for frame in frames)
+        for idx, frame in enumerate(frames):
+            assert CanFrame.unpack_from(buffer, idx * CanFrame.get_size()) == frame
+
+    def test_can_frame_has_no_instance_dict(self):
+        frame = CanFrame(can_id=0x123, data=bytes(8))
+        with pytest.raises(AttributeError):
+            frame.comment = ""
+
+    def test_can_frame_timestamp_is_not_compared(self):
+        frame1 = CanFrame(can_id=0x123, data=bytes(8), timestamp=1.5)
+        frame2 = CanFrame.from_bytes(frame1.to_bytes())
+        assert frame2.timestamp is None
+        assert frame1 == frame2
+
+    def test_timestamp_from_ancdata(self):
+        assert timestamp_from_ancdata([]) is None
+        assert timestamp_from_ancdata([(socket.SOL_SOCKET, TimestampingOptions.SO_TIMESTAMP,
+                                        struct.pack("@ll", 1600000000, 250000))]) == 1600000000.25
+        assert timestamp_from_ancdata([(socket.SOL_SOCKET, TimestampingOptions.SO_TIMESTAMPNS,
+                                        struct.pack("@ll", 1600000000, 500000000))]) == 1600000000.5
+        software_only = struct.pack("@llllll", 1600000000, 500000000, 0, 0, 0, 0)
+        assert timestamp_from_ancdata([(socket.SOL_SOCKET, TimestampingOptions.SO_TIMESTAMPING,
+                                        software_only)]) == 1600000000.5
+        with_hardware = struct.pack("@llllll", 1600000000, 500000000, 0, 0, 1000, 750000000)
+        assert timestamp_from_ancdata([(socket.SOL_SOCKET, TimestampingOptions.SO_TIMESTAMPING,
+                                        with_hardware)]) == 1000.75
+
+    def test_can_fd_frame_creation(self):
+        can_id = 0x12345678
+        data = bytes(range(64))
+        frame1 = CanFdFrame(can_id=can_id,
+                            fd_flags=CanFdFlags.CANFD_BRS,
+                            data=data)
+        assert frame1.flags & CanFlags.CAN_EFF_FLAG
+        frame_as_bytes = frame1.to_bytes()
+
+        assert len(frame_as_bytes) == CanFdFrame.get_size() == 72
+
+        frame2 = CanFdFrame.from_bytes(frame_as_bytes)
+        assert frame1 == frame2
+        assert frame2.fd_flags == CanFdFlags.CANFD_BRS
+
+    def test_can_fd_frame_creation_pads_data(self):
+        frame1 = CanFdFrame(can_id=0x123,
+                            data=bytes(range(9)))
+        assert frame1.data == bytes(range(9)) + bytes(3)
+        frame2 = CanFdFrame.from_bytes(frame1.to_bytes())
+        assert frame1 == frame2
+        with pytest.raises(ValueError):
+            CanFdFrame(can_id=0x123, data=bytes(65))
+
+    def test_can_fd_frame_is_not_a_can_frame(self):
+        frame1 = CanFrame(can_id=0x123, data=bytes(8))
+        frame2 = CanFdFrame(can_id=0x123, data=bytes(8))
+        assert frame2 != frame1
+        assert frame1 != frame2
+        assert not (frame1 == frame2 or frame2 == frame1)
+        assert frame1 != frame1.to_bytes()
+        assert frame1 != None  # noqa: E711
+
+    def test_frozen_frames_equal_their_counterparts(self):
+        frame = CanFdFrame(can_id=0x123, data=bytes(8), fd_flags=CanFdFlags.CANFD_BRS)
+        frozen = frame.freeze()
+        assert frozen == frame and frame == frozen
+        assert frozen != CanFrame(can_id=0x123, data=bytes(8))
+        assert CanFrame(can_id=0x123, data=bytes(8)) != frozen
+        assert CanFrame(can_id=0x123, data=bytes(8)).freeze() != frame
+
+    def test_frozen_can_frame(self):
+        frame = CanFrame(can_id=0x12345678, data=bytes(range(8)), timestamp=1.5)
+        frozen = frame.freeze()
+        assert isinstance(frozen, FrozenCanFrame)
+        assert frozen == frame and frame == frozen
+        assert frozen.timestamp == 1.5
+        assert frozen.freeze() is frozen
+        assert hash(frozen) == hash(FrozenCanFrame.from_bytes(frame.to_bytes()))
+        assert len({frozen, FrozenCanFrame(can_id=0x12345678, data=bytearray(range(8)))}) == 1
+        for name, value in (("data", bytes(8)), ("can_id", 0x123), ("timestamp", 2)):
+            with pytest.raises(AttributeError):
+                setattr(frozen, name, value)
+        with pytest.raises(AttributeError):
+            del frozen.data
+        with pytest.raises(TypeError):
+            hash(frame)
+        assert pickle.loads(pickle.dumps(frozen)) == frozen
+
+    def test_frozen_can_fd_frame(self):
+        frozen = CanFdFrame(can_id=0x123, data=bytes(range(9)), fd_flags=CanFdFlags.CANFD_BRS).freeze()
+        assert isinstance(frozen, FrozenCanFdFrame)
+        assert frozen.data == bytes(range(9)) + bytes(3)
+        assert frozen == FrozenCanFdFrame.from_bytes(frozen.to_bytes())
+        assert frozen != CanFdFrame(can_id=0x123, data=bytes(range(9)))
+        with pytest.raises(AttributeError):
+            frozen.fd_flags = 0
+        assert pickle.loads(pickle.dumps(frozen)) == frozen
+
+    def test_can_filter_creation(self):
+        can_filter1 = CanFilter(can_id=0x123)
+        filter_as_bytes = can_filter1.to_bytes()
+        assert len(filter_as_bytes) == CanFilter.get_size()
+        assert filter_as_bytes == bytes.fromhex("23010000ffffffdf")
+        assert CanFilter.from_bytes(filter_as_bytes) == can_filter1
+
+    def test_can_filter_creation_with_long_id_and_inverted(self):
+        can_filter1 = CanFilter(can_id=0x12345678, can_mask=0x1FFFFF00, inverted=True)
+        assert can_filter1.flags & CanFlags.CAN_EFF_FLAG
+        filter_as_bytes = can_filter1.to_bytes()
+        assert filter_as_bytes == bytes.fromhex("785634b200ffff1f")
+        assert CanFilter.from_bytes(filter_as_bytes) == can_filter1
+
     def test_bcm_msg_creation(self):
         can_id = 0x123
         data = bytes(range(0, 0x88, 0x11))
@@ -298,6 +431,286 @@ class TestObjectCreation():
         assert bcm1 == bcm2
 
 
+    def test_bcm_msg_unpack_from_receive_buffer(self):
+        frame = CanFrame(can_id=0x123, data=bytes(range(8)))
+        bcm1 = BcmMsg(opcode=BcmOpCodes.RX_CHANGED,
+                      flags=BCMFlags.RX_FILTER_ID,
+                      can_id=0x123,
+                      frames=[frame, ],
+                      ival2=0,
+                      )
+        buffer = bytearray(1024)
+        bcm_as_bytes = bcm1.to_bytes()
+        buffer[:len(bcm_as_bytes)] = bcm_as_bytes
+        assert BcmMsg.get_nframes_from_bytes(buffer) == 1
+        assert BcmMsg.unpack_from(buffer) == bcm1
+
+    def test_bcm_msg_with_fd_frames(self):
+        frame = CanFdFrame(can_id=0x123, data=bytes(range(20)))
+        bcm1 = BcmMsg(opcode=BcmOpCodes.TX_SETUP,
+                      flags=BCMFlags.CAN_FD_FRAME,
+                      can_id=0x123,
+                      frames=[frame, ],
+                      ival2=1,
+                      )
+        bcm_as_bytes = bcm1.to_bytes()
+        assert len(bcm_as_bytes) == BcmMsg.get_size() + CanFdFrame.get_size()
+        assert BcmMsg.from_bytes(bcm_as_bytes) == bcm1
+
+    def test_bcm_rx_events(self):
+        frame = CanFrame(can_id=0x12345678, data=bytes(8))
+        changed = BcmRxEvent.from_bcm_msg(BcmMsg(opcode=BcmOpCodes.RX_CHANGED,
+                                                 flags=0,
+                                                 can_id=0x12345678 | CanFlags.CAN_EFF_FLAG,
+                                                 frames=[frame, ],
+                                                 ival2=0,
+                                                 ))
+        assert isinstance(changed, BcmRxChanged)
+        assert changed.can_id == 0x12345678
+        assert changed.frame == frame
+
+        timeout = BcmRxEvent.from_bcm_msg(BcmMsg(opcode=BcmOpCodes.RX_TIMEOUT,
+                                                 flags=0,
+                                                 can_id=0x123,
+                                                 frames=[],
+                                                 ival2=0,
+                                                 ))
+        assert isinstance(timeout, BcmRxTimeout)
+        assert timeout.can_id == 0x123
+
+
+    def test_isotp_opts_creation(self):
+        opts1 = IsoTpOpts(ext_address=0xF1, tx_padding=0xCC, frame_txtime=50000)
+        assert opts1.flags == (IsoTpFlags.CAN_ISOTP_EXTEND_ADDR | IsoTpFlags.CAN_ISOTP_TX_PADDING)
+        opts_as_bytes = opts1.to_bytes()
+        assert len(opts_as_bytes) == IsoTpOpts.get_size() == 12
+        opts2 = IsoTpOpts.from_bytes(opts_as_bytes)
+        assert opts1 == opts2
+        assert opts2.ext_address == 0xF1
+        assert opts2.rx_padding is None
+
+    def test_isotp_fc_and_ll_opts_creation(self):
+        fc_opts = IsoTpFcOpts(bs=8, stmin=0xF1, wftmax=2)
+        assert fc_opts.to_bytes() == bytes((8, 0xF1, 2))
+        assert IsoTpFcOpts.from_bytes(fc_opts.to_bytes()) == fc_opts
+        ll_opts = IsoTpLlOpts(mtu=CanFdFrame.get_size(), tx_dl=64, tx_flags=CanFdFlags.CANFD_BRS)
+        assert IsoTpLlOpts.from_bytes(ll_opts.to_bytes()) == ll_opts
+        assert ll_opts != IsoTpLlOpts()
+
+    def test_get_key(self):
+        assert get_key(0x123) == 0x123
+        assert get_key(0x123, extended=True) == 0x123 | CanFlags.CAN_EFF_FLAG
+        assert get_key(0x12345) == 0x12345 | CanFlags.CAN_EFF_FLAG
+
+
+@pytest.mark.skipif(find_spec("numpy") is None, reason="this test requires numpy")
+class TestCanFrameBatch:
+
+    def get_frames(self):
+        """ helper function """
+        return [CanFrame(can_id=0x123, data=bytes(range(8))),
+                CanFrame(can_id=0x12345678, data=bytes(range(4))),
+                CanFrame(can_id=0x456, flags=CanFlags.CAN_RTR_FLAG, data=bytes()),
+                CanFrame(can_id=0x123, data=bytes(range(8, 16))),
+                ]
+
+    def test_round_trip(self):
+        frames = self.get_frames()
+        raw = b"".join(frame.to_bytes() for frame in frames)
+        batch = CanFrameBatch.from_buffer(raw)
+        assert len(batch) == len(frames)
+        assert batch.to_bytes() == raw
+        assert list(batch) == frames
+        assert batch[1] == frames[1]
+
+    def test_columns(self):
+        batch = CanFrameBatch.from_frames(self.get_frames())
+        assert list(batch.can_id) == [0x123, 0x12345678, 0x456, 0x123]
+        assert list(batch.dlc) == [8, 4, 0, 8]
+        assert list(batch.flags) == [0, CanFlags.CAN_EFF_FLAG, CanFlags.CAN_RTR_FLAG, 0]
+        assert bytes(batch.data[3]) == bytes(range(8, 16))
+        assert list(batch.mask_flags(CanFlags.CAN_EFF_FLAG)) == [False, True, False, False]
+
+    def test_no_copy(self):
+        raw = bytearray(b"".join(frame.to_bytes() for frame in self.get_frames()))
+        batch = CanFrameBatch.from_buffer(raw)
+        raw[CanFrame.get_size() * 3 + 8] = 0xFF
+        assert batch[3].data[0] == 0xFF
+        copied = batch.copy()
+        raw[CanFrame.get_size() * 3 + 8] = 0xEE
+        assert copied[3].data[0] == 0xFF
+
+    def test_filter_ids(self):
+        frames = self.get_frames()
+        timestamps = [1.0, 2.0, 3.0, 4.0]
+        batch = CanFrameBatch.from_frames(frames, timestamps=timestamps)
+        filtered = batch.filter_ids([0x123, 0x456])
+        assert list(filtered) == [frames[0], frames[2], frames[3]]
+        assert list(filtered.timestamps) == [1.0, 3.0, 4.0]
+
+
+class TestFrameCache:
+
+    def test_hits_and_eviction(self):
+        cache = FrameCache(maxsize=2)
+        raw = [CanFrame(can_id=can_id, data=bytes(8)).to_bytes() for can_id in (0x100, 0x101, 0x102)]
+        frame = cache.get(raw[0])
+        assert isinstance(frame, FrozenCanFrame)
+        assert frame == CanFrame(can_id=0x100, data=bytes(8))
+        assert cache.get(bytes(raw[0])) is frame
+        cache.get(raw[1])
+        # 0x100 was used more recently than 0x101, so 0x101 is evicted
+        cache.get(raw[0])
+        cache.get(raw[2])
+        assert cache.get(raw[0]) is frame
+        assert cache.snapshot() == {"hits": 3, "misses": 3, "evictions": 1, "size": 2, "maxsize": 2,
+                                    "hit_ratio": 0.5}
+        cache.get(raw[1])
+        assert cache.evictions == 2
+        cache.reset()
+        assert len(cache) == 0
+        assert cache.get_hit_ratio() == 0
+        with pytest.raises(ValueError):
+            FrameCache(maxsize=0)
+
+    def test_fd_frames(self):
+        cache = FrameCache()
+        frame = CanFdFrame(can_id=0x123, data=bytes(64))
+        assert isinstance(cache.get(frame.to_bytes()), FrozenCanFdFrame)
+        assert cache.get(frame.to_bytes()) == frame
+
+    def test_receive_with_frame_cache(self):
+        with VirtualBus() as bus:
+            tx = bus.create_raw_socket()
+            rx = bus.create_raw_socket(frame_cache=16)
+            fd_rx = bus.create_raw_socket(fd=True)
+            fd_rx.enable_frame_cache()
+            frames = [CanFrame(can_id=0x100 + (idx % 2), data=bytes((idx // 4,)) * 8) for idx in range(8)]
+            tx.send_batch(frames)
+            received = rx.recv_batch(timeout=0)
+            assert received == frames
+            assert all(isinstance(frame, FrozenCanFrame) for frame in received)
+            # the first 4 frames have the same bytes per can id as the previous one with that can id
+            assert received[2] is received[0]
+            assert received[4] is not received[0]
+            assert rx.frame_cache.snapshot()["hits"] == 4
+            assert fd_rx.recv_batch(timeout=0) == frames
+            tx.send(frames[0])
+            assert rx.recv() is received[0]
+            assert fd_rx.recv() is fd_rx.frame_cache.get(frames[0].to_bytes())
+
+
+class TestSocketOptions:
+
+    @pytest.fixture
+    def sock_pair(self):
+        """ the socket options of a datagram socket pair, they are generic socket options """
+        s1, s2 = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock = SocketOptionsMixin()
+        sock.s = s2
+        yield s1, sock
+        s1.close()
+        s2.close()
+
+    def test_buffers_and_priority(self, sock_pair):
+        _, sock = sock_pair
+        sock.apply_socket_options(rcvbuf=4096, sndbuf=8192, priority=3)
+        # the kernel doubles the value
+        assert sock.get_rcvbuf() == 8192
+        assert sock.get_sndbuf() == 16384
+        assert sock.get_priority() == 3
+
+    def test_busy_wait(self, sock_pair):
+        peer, sock = sock_pair
+        sock.set_busy_poll(0.01)
+        start = time.perf_counter()
+        assert sock.busy_wait() is False
+        assert time.perf_counter() - start >= 0.01
+        assert sock.busy_wait(timeout=0) is False
+        peer.send(bytes(16))
+        assert sock.busy_wait() is True
+        # the datagram is still queued
+        assert sock.s.recv(16) == bytes(16)
+
+    def test_busy_wait_with_socket_timeout(self, sock_pair):
+        _, sock = sock_pair
+        sock.s.settimeout(1)
+        sock.set_busy_poll(0.001)
+        start = time.perf_counter()
+        assert sock.busy_wait() is False
+        assert time.perf_counter() - start < 0.5
+
+
+class FakeJ1939Socket(CanJ1939Socket):
+    """ a CanJ1939Socket that sends to a list and receives from a list """
+
+    def __init__(self, name, addr, messages):
+        self.s = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.name = name
+        self.addr = addr
+        self.messages = messages
+        self.sent = []
+        self.metrics = None
+
+    def set_broadcast(self, enable):
+        pass
+
+    def sendto(self, data, pgn, addr=J1939_NO_ADDR, name=0):
+        self.sent.append((data, pgn, addr))
+
+    def recv_message(self):
+        if not self.messages:
+            raise socket.timeout
+        return self.messages.pop(0)
+
+
+class TestJ1939:
+
+    def test_j1939_filter(self):
+        j1939_filter = J1939Filter(pgn=0xFEF1, pgn_mask=0x3FFFF, addr=0x20, addr_mask=0xFF)
+        assert J1939Filter.get_size() == 32
+        assert J1939Filter.from_bytes(j1939_filter.to_bytes()) == j1939_filter
+        assert j1939_filter != J1939Filter()
+
+    def test_info_from_ancdata(self):
+        ancdata = [(SOL_CAN_J1939, CanJ1939CmsgTypes.SCM_J1939_DEST_ADDR, bytes((0x20,))),
+                   (SOL_CAN_J1939, CanJ1939CmsgTypes.SCM_J1939_DEST_NAME, struct.pack("Q", 0x1234)),
+                   (SOL_CAN_J1939, CanJ1939CmsgTypes.SCM_J1939_PRIO, bytes((3,))),
+                   ]
+        assert j1939_info_from_ancdata(ancdata) == (0x20, 0x1234, 3)
+        assert j1939_info_from_ancdata([]) == (J1939_NO_ADDR, 0, None)
+
+    def test_claim_address(self):
+        name = 0x8000000000001234
+        request = J1939Message(pgn=J1939_PGN_REQUEST, data=bytes((0x00, 0xEE, 0x00)), src_addr=0x30)
+        higher = J1939Message(pgn=J1939_PGN_ADDRESS_CLAIMED, data=(name + 1).to_bytes(8, "little"), src_addr=0x20)
+        other_address = J1939Message(pgn=J1939_PGN_ADDRESS_CLAIMED, data=(name - 1).to_bytes(8, "little"),
+                                     src_addr=0x21)
+        sock = FakeJ1939Socket(name=name, addr=0x20, messages=[request, higher, other_address])
+        assert sock.claim_address(timeout=0.1) is True
+        claim = (name.to_bytes(8, "little"), J1939_PGN_ADDRESS_CLAIMED, J1939_NO_ADDR)
+        # the initial claim, the answer to the request and the defense against the higher name
+        assert sock.sent == [claim] * 3
+
+    def test_claim_address_lost(self):
+        name = 0x8000000000001234
+        lower = J1939Message(pgn=J1939_PGN_ADDRESS_CLAIMED, data=(name - 1).to_bytes(8, "little"), src_addr=0x20)
+        sock = FakeJ1939Socket(name=name, addr=0x20, messages=[lower])
+        assert sock.claim_address(timeout=0.1) is False
+        # only the initial claim, a lost claim is not answered
+        assert sock.sent == [(name.to_bytes(8, "little"), J1939_PGN_ADDRESS_CLAIMED, J1939_NO_ADDR)]
+
+    def test_claim_checks_do_not_send(self):
+        name = 0x8000000000001234
+        lower = J1939Message(pgn=J1939_PGN_ADDRESS_CLAIMED, data=(name - 1).to_bytes(8, "little"), src_addr=0x20)
+        higher = J1939Message(pgn=J1939_PGN_ADDRESS_CLAIMED, data=(name + 1).to_bytes(8, "little"), src_addr=0x20)
+        own = J1939Message(pgn=J1939_PGN_ADDRESS_CLAIMED, data=name.to_bytes(8, "little"), src_addr=0x20)
+        sock = FakeJ1939Socket(name=name, addr=0x20, messages=[])
+        assert [sock.is_claim_lost(msg) for msg in (lower, higher, own)] == [True, False, False]
+        assert [sock.is_claim_contended(msg) for msg in (lower, higher, own)] == [False, True, False]
+        assert sock.sent == []
+
+
 def is_interface_present(interface):
     """ helper function """
     try:
@@ -318,63 +731,212 @@ def is_isotp_available():
     return False
 
 
-@pytest.mark.skipif(not is_interface_present("vcan0"), reason="this test requires vcan0 to be set up")
+def is_j1939_available():
+    """ helper function """
+    try:
+        socket.socket(socket.AF_CAN, socket.SOCK_DGRAM, socket.CAN_J1939).close()
+    except (OSError, AttributeError):
+        return False
+    return True
+
+
+class CanBus:
+    """ creates the sockets of a test on a VirtualBus or on vcan0
+
+        @param virtual_bus: the VirtualBus, None for vcan0
+    """
+
+    def __init__(self, virtual_bus: VirtualBus = None):
+        self.virtual_bus = virtual_bus
+        self.interface = "vcan0"
+
+    @property
+    def virtual(self) -> bool:
+        return self.virtual_bus is not None
+
+    def raw(self, **kwargs) -> CanRawSocket:
+        if self.virtual:
+            return self.virtual_bus.create_raw_socket(**kwargs)
+        return CanRawSocket(interface=self.interface, **kwargs)
+
+    def bcm(self, **kwargs) -> CanBcmSocket:
+        if self.virtual:
+            return self.virtual_bus.create_bcm_socket(**kwargs)
+        return CanBcmSocket(interface=self.interface, **kwargs)
+
+    def isotp(self, rx_addr: int, tx_addr: int, **kwargs) -> CanIsoTpSocket:
+        if self.virtual:
+            return self.virtual_bus.create_isotp_socket(rx_addr=rx_addr, tx_addr=tx_addr, **kwargs)
+        if not is_isotp_available():
+            pytest.skip("this test requires isotp kernel module, mainline kernel >= 5.10")
+        return CanIsoTpSocket(interface=self.interface, rx_addr=rx_addr, tx_addr=tx_addr, **kwargs)
+
+    def wait(self, seconds: float):
+        """ let the time of the broadcast manager pass """
+        if self.virtual:
+            self.virtual_bus.advance(seconds)
+        else:
+            time.sleep(seconds)
+
+
+@pytest.fixture(params=["virtual", "vcan0"])
+def can_bus(request):
+    """ the socket operations run on a VirtualBus without privileges and on vcan0 if it is set up """
+    if request.param == "vcan0":
+        if not is_interface_present("vcan0"):
+            pytest.skip("this test requires vcan0 to be set up")
+        yield CanBus()
+    else:
+        with VirtualBus() as virtual_bus:
+            yield CanBus(virtual_bus)
+
+
 class TestSocketOperations:
 
-    def receive_from_can_raw_socket(self, interface, q):
+    def receive_from_socket(self, s, q, *args):
         """ helper function """
-        s = CanRawSocket(interface=interface)
-        q.put(s.recv())
+        q.put(s.recv(*args))
 
-    def test_can_raw_socket(self):
-        interface = "vcan0"
-        s = CanRawSocket(interface=interface)
+    def test_can_raw_socket(self, can_bus):
+        s = can_bus.raw()
         can_id = 0x12345678
         data = bytes(range(0, 0x88, 0x11))
         frame1 = CanFrame(can_id=can_id,
                           data=data)
 
         q = Queue()
-        p = Thread(target=self.receive_from_can_raw_socket, args=(interface, q,))
-        p.setDaemon(True)
+        p = Thread(target=self.receive_from_socket, args=(can_bus.raw(), q,))
+        p.daemon = True
         p.start()
-        time.sleep(1)
         s.send(frame1)
-        frame2 = q.get()
+        frame2 = q.get(timeout=5)
         p.join()
 
         assert frame1 == frame2
 
-    def receive_from_can_isotp_socket(self, interface, rx_addr, tx_addr, bufsize, q):
-        """ helper function """
-        s = CanIsoTpSocket(interface=interface, rx_addr=rx_addr, tx_addr=tx_addr)
-        q.put(s.recv(bufsize=bufsize))
-
-    @pytest.mark.skipif(not is_isotp_available(),
-                        reason="this test requires isotp kernel module, mainline kernel >= 5.10")
-    def test_can_isotp_socket(self):
-        interface = "vcan0"
+    def test_can_raw_socket_recv_batch(self, can_bus):
+        s1 = can_bus.raw()
+        s2 = can_bus.raw()
+        frames = [CanFrame(can_id=can_id, data=bytes(range(can_id % 9))) for can_id in range(0x100, 0x110)]
+        for frame in frames:
+            s1.send(frame)
+
+        received = s2.recv_batch(max_frames=32, timeout=1)
+        assert received == frames
+        assert s2.recv_batch(max_frames=32, timeout=0.1) == []
+
+    @pytest.mark.skipif(find_spec("numpy") is None, reason="this test requires numpy")
+    def test_can_raw_socket_recv_frame_batch(self, can_bus):
+        s1 = can_bus.raw()
+        s2 = can_bus.raw()
+        frames = [CanFrame(can_id=can_id, data=bytes(range(can_id % 9))) for can_id in range(0x100, 0x110)]
+        for frame in frames:
+            s1.send(frame)
+
+        batch = s2.recv_frame_batch(max_frames=32, timeout=1, copy=True)
+        assert list(batch) == frames
+
+    def test_can_raw_socket_with_socket_options(self, can_bus):
+        s1 = can_bus.raw(sndbuf=16384, priority=5)
+        s2 = can_bus.raw(rcvbuf=65536, busy_poll=0.01)
+        assert s1.get_priority() == 5
+        assert s2.get_rcvbuf() == 131072
+        frame = CanFrame(can_id=0x123, data=bytes(8))
+        s1.send(frame)
+        assert s2.recv() == frame
+        s1.send(frame)
+        assert s2.recv_batch(timeout=1) == [frame]
+
+    def test_can_raw_socket_send_batch(self, can_bus):
+        s1 = can_bus.raw()
+        s2 = can_bus.raw()
+        frames = [CanFrame(can_id=can_id, data=bytes(range(can_id % 9))) for can_id in range(0x100, 0x110)]
+
+        assert s1.send_batch(frames, batch_size=5) == len(frames)
+        assert s2.recv_batch(max_frames=32, timeout=1) == frames
+
+    def test_can_raw_socket_filters(self, can_bus):
+        s1 = can_bus.raw()
+        s2 = can_bus.raw(filters=[CanFilter(can_id=0x100, can_mask=0x7F0)])
+        s3 = can_bus.raw(filters=[CanFilter(can_id=0x100, can_mask=0x7F0, inverted=True)])
+        s1.set_recv_own_msgs(True)
+        frames = [CanFrame(can_id=can_id, data=bytes(range(8))) for can_id in range(0x0F8, 0x118)]
+        for frame in frames:
+            s1.send(frame)
+
+        assert s1.recv_batch(max_frames=64, timeout=1) == frames
+        assert s2.recv_batch(max_frames=64, timeout=1) == [frame for frame in frames if frame.can_id & 0x7F0 == 0x100]
+        assert s3.recv_batch(max_frames=64, timeout=1) == [frame for frame in frames if frame.can_id & 0x7F0 != 0x100]
+
+    def test_can_raw_socket_with_fd_frames(self, can_bus):
+        s1 = can_bus.raw(fd=True)
+        s2 = can_bus.raw(fd=True)
+        frames = [CanFrame(can_id=0x123, data=bytes(range(8))),
+                  # Note: recent kernels always set CANFD_FDF on CAN FD frames
+                  CanFdFrame(can_id=0x124, data=bytes(range(64)), fd_flags=CanFdFlags.CANFD_BRS | CanFdFlags.CANFD_FDF),
+                  CanFrame(can_id=0x125, data=bytes(range(4))),
+                  ]
+        for frame in frames:
+            s1.send(frame)
+
+        assert s2.recv() == frames[0]
+        assert s2.recv_batch(max_frames=8, timeout=1) == frames[1:]
+
+    def test_can_raw_socket_with_timestamps(self, can_bus):
+        s1 = can_bus.raw()
+        s2 = can_bus.raw(timestamping=TimestampingOptions.SO_TIMESTAMPNS)
+        frames = [CanFrame(can_id=can_id, data=bytes(range(8))) for can_id in range(0x100, 0x104)]
+        before = time.time()
+        for frame in frames:
+            s1.send(frame)
+        after = time.time()
+
+        frame = s2.recv()
+        assert before <= frame.timestamp <= after
+        received = s2.recv_batch(max_frames=8, timeout=1)
+        assert received == frames[1:]
+        timestamps = [frame.timestamp for frame in received]
+        assert timestamps == sorted(timestamps)
+        assert before <= timestamps[0] and timestamps[-1] <= after
+
+    def test_can_isotp_socket(self, can_bus):
         rx_addr = 0x7e0
         tx_addr = 0x7e8
-        s = CanIsoTpSocket(interface=interface, rx_addr=rx_addr, tx_addr=tx_addr)
+        s = can_bus.isotp(rx_addr=rx_addr, tx_addr=tx_addr)
         data = bytes(list(range(64)))
         bufsize = len(data)
         q = Queue()
-        # Note: the receive thread logically has rx_addr, tx_addr inverted!
-        p = Thread(target=self.receive_from_can_isotp_socket, args=(interface, tx_addr, rx_addr, bufsize, q,))
-        p.setDaemon(True)
+        # Note: the receiving socket logically has rx_addr, tx_addr inverted!
+        p = Thread(target=self.receive_from_socket, args=(can_bus.isotp(rx_addr=tx_addr, tx_addr=rx_addr), q, bufsize))
+        p.daemon = True
         p.start()
-        time.sleep(1)
         s.send(data)
 
-        data2 = q.get()
+        data2 = q.get(timeout=5)
         p.join()
 
         assert data == data2
 
-    def test_bcm_msg_and_bcm_socket_send_operation(self):
-        interface = "vcan0"
-        s = CanBcmSocket(interface=interface)
+    def test_can_isotp_socket_with_options(self, can_bus):
+        opts = IsoTpOpts(tx_padding=0xAA, rx_padding=0xAA)
+        fc_opts = IsoTpFcOpts(bs=0, stmin=0)
+        s1 = can_bus.isotp(rx_addr=0x7e0, tx_addr=0x7e8, opts=opts, fc_opts=fc_opts)
+        s2 = can_bus.isotp(rx_addr=0x7e8, tx_addr=0x7e0, opts=opts, fc_opts=fc_opts)
+        assert s1.get_opts() == opts
+        assert s1.get_fc_opts() == fc_opts
+        data = bytes(range(256)) * 16
+
+        p = Thread(target=s1.send, args=(memoryview(data),))
+        p.daemon = True
+        p.start()
+        view = s2.recv_view()
+        p.join()
+
+        assert view == data
+
+    def test_bcm_msg_and_bcm_socket_send_operation(self, can_bus):
+        s = can_bus.bcm()
+        raw = can_bus.raw()
 
         can_id = 0x12345678
         data = bytes(range(0, 0x88, 0x11))
@@ -388,18 +950,54 @@ class TestSocketOperations:
                      ival1=0,
                      ival2=1,
                      )
-        q = Queue()
-        p = Thread(target=self.receive_from_can_raw_socket, args=(interface, q,))
-        p.setDaemon(True)
-        p.start()
         try:
             s.send(bcm)
         except OSError:
             assert False, "The length of bcm_msg is false. Length {0} Platform {1}".format(len(bcm.to_bytes()),
                                                                                            platform.machine())
         else:
-            time.sleep(1)
-            frame2 = q.get()
-            p.join()
+            # the first frame is sent after the interval
+            can_bus.wait(1)
+            frame2 = raw.recv()
 
             assert frame1 == frame2
+
+    def test_bcm_socket_multiplex_receive(self, can_bus):
+        bcm = can_bus.bcm()
+        raw = can_bus.raw()
+        can_id = 0x321
+        bcm.setup_multiplex_receive(can_id=can_id,
+                                    mux_mask=bytes((0xFF, 0, 0, 0, 0, 0, 0, 0)),
+                                    filters=[bytes((1, 0xFF, 0, 0, 0, 0, 0, 0)),
+                                             bytes((2, 0, 0xFF, 0, 0, 0, 0, 0)),
+                                             ],
+                                    timeout=0.2)
+        frame1 = CanFrame(can_id=can_id, data=bytes((1, 0x11, 0, 0, 0, 0, 0, 0)))
+        frame2 = CanFrame(can_id=can_id, data=bytes((2, 0x11, 0x22, 0, 0, 0, 0, 0)))
+        for frame in (frame1, frame1, frame2):
+            raw.send(frame)
+
+        events = bcm.events()
+        event1 = next(events)
+        event2 = next(events)
+        assert isinstance(event1, BcmRxChanged) and event1.frame == frame1
+        assert isinstance(event2, BcmRxChanged) and event2.frame == frame2
+        can_bus.wait(0.3)
+        assert isinstance(next(events), BcmRxTimeout)
+        bcm.delete_receive(can_id=can_id)
+
+
+@pytest.mark.skipif(not is_interface_present("vcan0"), reason="this test requires vcan0 to be set up")
+class TestJ1939SocketOperations:
+
+    @pytest.mark.skipif(not is_j1939_available(), reason="this test requires j1939 kernel module")
+    def test_can_j1939_socket(self):
+        interface = "vcan0"
+        receiver = CanJ1939Socket(interface=interface, addr=0x20)
+        sender = CanJ1939Socket(interface=interface, addr=0x30, send_prio=3)
+        assert sender.get_send_prio() == 3
+        data = bytes(range(256)) * 4
+        sender.sendto(data, pgn=0x0EF00, addr=0x20)
+        msg = receiver.recv_message()
+        assert msg == J1939Message(pgn=0x0EF00, data=data, src_addr=0x30, dst_addr=0x20)
+        assert msg.priority == 3
@@ -0,0 +1,165 @@
+""" Test_uds
+
+    Collection of tests for uds module to be run with pytest / tox / coverage
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import pytest
+
+import socket
+import time
+
+from threading import Thread
+
+from socketcan.uds import UdsClient, UdsClientPool, UdsNegativeResponse, UdsNrc, UdsTimeout
+
+
+class DatagramIsoTpSocket:
+    """ a datagram socket with the interface of CanIsoTpSocket that UdsClient uses """
+
+    def __init__(self, s):
+        self.s = s
+
+    def sendmsg(self, buffers):
+        return self.s.sendmsg(buffers)
+
+    def recv_view(self):
+        return memoryview(self.s.recv(8200))
+
+
+class FakeEcu:
+    """ an ecu that answers requests with a handler function in a thread
+
+        The handler takes the request and returns a list of responses,
+        each response is a tuple of delay and bytes.
+    """
+
+    def __init__(self, s, handler):
+        self.s = s
+        self.handler = handler
+        self.requests = []
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                request = self.s.recv(8200)
+            except OSError:
+                return
+            if not request:
+                return
+            self.requests.append(request)
+            for delay, response in self.handler(request):
+                time.sleep(delay)
+                self.s.send(response)
+
+
+def default_handler(request):
+    """ helper function """
+    service = request[0]
+    if service == 0x22:
+        return [(0, bytes((0x62,)) + request[1:3] + b"VIN1234")]
+    if service == 0x31:
+        return [(0, bytes((0x7F, 0x31, UdsNrc.RESPONSE_PENDING))),
+                (0.03, bytes((0x7F, 0x31, UdsNrc.RESPONSE_PENDING))),
+                (0.03, bytes((0x71,)) + request[1:4] + b"\x00")]
+    if service == 0x34:
+        return [(0, bytes((0x74, 0x20, 0x00, 0x12)))]
+    if service == 0x36:
+        return [(0, bytes((0x76, request[1])))]
+    if service == 0x37:
+        return [(0, bytes((0x77,)))]
+    if service == 0x3E:
+        return []
+    return [(0, bytes((0x7F, service, UdsNrc.SERVICE_NOT_SUPPORTED)))]
+
+
+@pytest.fixture
+def client_and_ecu():
+    s1, s2 = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    s1.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 65536)
+    ecu = FakeEcu(s2, default_handler)
+    yield UdsClient(DatagramIsoTpSocket(s1), p2=0.05, p2_star=1), ecu
+    s1.close()
+    s2.close()
+
+
+class TestUdsClient:
+
+    def test_read_data_by_identifier(self, client_and_ecu):
+        client, ecu = client_and_ecu
+        assert client.read_data_by_identifier(0xF190) == b"VIN1234"
+        assert ecu.requests == [bytes((0x22, 0xF1, 0x90))]
+
+    def test_negative_response(self, client_and_ecu):
+        client, ecu = client_and_ecu
+        with pytest.raises(UdsNegativeResponse) as e:
+            client.ecu_reset()
+        assert e.value.nrc == UdsNrc.SERVICE_NOT_SUPPORTED
+
+    def test_response_pending_extends_timeout(self, client_and_ecu):
+        client, ecu = client_and_ecu
+        # the final response arrives after 60 ms which is longer than p2
+        assert client.routine_control(control_type=1, routine_id=0xFF00) == b"\x00"
+
+    def test_timeout(self, client_and_ecu):
+        client, ecu = client_and_ecu
+        with pytest.raises(UdsTimeout):
+            client.request(0x3E, bytes((0,)))
+
+    def test_socket_timeout_is_restored(self, client_and_ecu):
+        client, ecu = client_and_ecu
+        client.sock.s.setblocking(False)
+        assert client.read_data_by_identifier(0xF190) == b"VIN1234"
+        assert client.sock.s.gettimeout() == 0
+        with pytest.raises(UdsTimeout):
+            client.request(0x3E, bytes((0,)))
+        assert client.sock.s.gettimeout() == 0
+
+    def test_tester_present_suppressed(self, client_and_ecu):
+        client, ecu = client_and_ecu
+        client.tester_present()
+        assert client.read_data_by_identifier(0xF190) == b"VIN1234"
+        assert ecu.requests[0] == bytes((0x3E, 0x80))
+
+    def test_download(self, client_and_ecu):
+        client, ecu = client_and_ecu
+        data = bytes(range(256)) * 1024
+        # the ecu accepts 0x12 bytes per TransferData, 16 bytes of data per block
+        assert client.download(address=0x8000, data=data) == len(data) // 16
+        assert ecu.requests[0] == bytes((0x34, 0x00, 0x44, 0, 0, 0x80, 0, 0, 4, 0, 0))
+        assert ecu.requests[1] == bytes((0x36, 1)) + data[:16]
+        assert ecu.requests[256] == bytes((0x36, 0)) + data[255 * 16:256 * 16]
+        assert b"".join(request[2:] for request in ecu.requests[1:-1]) == data
+        assert ecu.requests[-1] == bytes((0x37,))
+
+
+class TestUdsClientPool:
+
+    def test_concurrent_requests(self):
+        pairs = [socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM) for idx in range(10)]
+
+        def slow_handler(request):
+            return [(0.1, bytes((0x62,)) + request[1:3] + b"\x01")]
+
+        clients = {}
+        for idx, (s1, s2) in enumerate(pairs):
+            FakeEcu(s2, slow_handler)
+            clients["ecu{0}".format(idx)] = UdsClient(DatagramIsoTpSocket(s1), p2=1)
+        # an ecu that never responds
+        pairs.append(socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM))
+        clients["broken"] = UdsClient(DatagramIsoTpSocket(pairs[-1][0]), p2=0.2)
+
+        start = time.monotonic()
+        with UdsClientPool(clients) as pool:
+            results = pool.run(lambda client: client.read_data_by_identifier(0x1234))
+        duration = time.monotonic() - start
+
+        assert duration < 0.5
+        assert all(results["ecu{0}".format(idx)] == b"\x01" for idx in range(10))
+        assert isinstance(results["broken"], UdsTimeout)
+        for s1, s2 in pairs:
+            s1.close()
+            s2.close()
@@ -0,0 +1,220 @@
+""" Test_virtual
+
+    Collection of tests for virtual module to be run with pytest / tox / coverage
+    @author: Patrick Menschel (menschel.p@posteo.de)
+    @license: GPL v3
+"""
+
+import pytest
+
+import errno
+
+from socketcan import BCMFlags, BcmMsg, BcmOpCodes, BcmRxChanged, BcmRxTimeout, CanFdFrame, CanFilter, CanFrame, \
+    CanRawSocket, IsoTpOpts
+from socketcan.scheduler import CyclicScheduler
+from socketcan.socketcan import CanErrorClass, CanFlags
+from socketcan.virtual import VirtualBus, VirtualClock
+
+
+@pytest.fixture
+def bus():
+    """ a virtual bus """
+    with VirtualBus() as bus:
+        yield bus
+
+
+class TestVirtualClock:
+
+    def test_timers_run_in_order(self):
+        clock = VirtualClock()
+        calls = []
+        clock.call_later(0.3, lambda: calls.append(("b", clock.time())))
+        clock.call_later(0.1, lambda: calls.append(("a", clock.time())))
+        timer = clock.call_at(0.2, lambda: calls.append(("cancelled", clock.time())))
+        clock.cancel(timer)
+        assert clock.advance(0.25) == 1
+        assert clock.time() == 0.25
+        assert clock.advance(1) == 1
+        assert calls == [("a", 0.1), ("b", 0.3)]
+
+
+class TestRawNodes:
+
+    def test_loopback_semantics(self, bus):
+        tx = bus.create_raw_socket()
+        rx = bus.create_raw_socket()
+        own = bus.create_raw_socket()
+        own.set_recv_own_msgs(True)
+        frame = CanFrame(can_id=0x123, data=bytes(range(8)))
+        tx.send(frame)
+        own.send(frame)
+        assert rx.recv_batch(timeout=0) == [frame, frame]
+        # a frame is not delivered to its sender without CAN_RAW_RECV_OWN_MSGS
+        assert tx.recv_batch(timeout=0) == [frame]
+        assert own.recv_batch(timeout=0) == [frame, frame]
+
+        tx.set_loopback(False)
+        tx.send(frame)
+        assert rx.recv_batch(timeout=0) == []
+
+    def test_filters(self, bus):
+        tx = bus.create_raw_socket()
+        rx = bus.create_raw_socket(filters=[CanFilter(can_id=0x100, can_mask=0x700)])
+        inverted = bus.create_raw_socket(filters=[CanFilter(can_id=0x123, inverted=True)])
+        nothing = bus.create_raw_socket(filters=[])
+        errors = bus.create_raw_socket(filters=[])
+        errors.set_error_filter(CanErrorClass.CAN_ERR_BUSOFF)
+        frames = [CanFrame(can_id=can_id, data=bytes(8)) for can_id in (0x123, 0x1FF, 0x200, 0x12345678)]
+        tx.send_batch(frames)
+        error_frame = CanFrame(can_id=CanErrorClass.CAN_ERR_BUSOFF, flags=CanFlags.CAN_ERR_FLAG, data=bytes(8))
+        tx.send(error_frame)
+        assert rx.recv_batch(timeout=0) == frames[:2]
+        assert inverted.recv_batch(timeout=0) == frames[1:]
+        assert nothing.recv_batch(timeout=0) == []
+        assert errors.recv_batch(timeout=0) == [error_frame]
+
+    def test_fd_frames(self, bus):
+        tx = bus.create_raw_socket(fd=True)
+        rx_fd = bus.create_raw_socket(fd=True)
+        rx = bus.create_raw_socket()
+        fd_frame = CanFdFrame(can_id=0x123, data=bytes(range(64)))
+        frame = CanFrame(can_id=0x124, data=bytes(8))
+        tx.send(fd_frame)
+        tx.send(frame)
+        assert rx_fd.recv_batch(timeout=0) == [fd_frame, frame]
+        assert rx.recv_batch(timeout=0) == [frame]
+        with pytest.raises(OSError) as e:
+            rx.send(fd_frame)
+        assert e.value.errno == errno.EINVAL
+
+    def test_interface(self, bus):
+        with pytest.raises(OSError) as e:
+            CanRawSocket(interface="can9", sock=bus.create_socket())
+        assert e.value.errno == errno.ENODEV
+
+    def test_bypassed_datagrams_are_pumped(self, bus):
+        tx = bus.create_raw_socket()
+        rx = bus.create_raw_socket()
+        frame = CanFrame(can_id=0x123, data=bytes(8))
+        # a plain socket send, as sendmmsg through ctypes would do it, is routed by the next receive call
+        super(type(tx.s), tx.s).send(frame.to_bytes())
+        assert rx.recv() == frame
+        assert bus.pump() == 0
+
+    def test_router_thread(self, bus):
+        tx = bus.create_raw_socket()
+        rx = bus.create_raw_socket()
+        frame = CanFrame(can_id=0x123, data=bytes(8))
+        bus.start(interval=0.01)
+        super(type(tx.s), tx.s).send(frame.to_bytes())
+        assert rx.recv_batch(timeout=1) == [frame]
+        bus.stop()
+
+    def test_close_removes_node(self, bus):
+        sock = bus.create_raw_socket()
+        assert len(bus.nodes) == 1
+        sock.s.close()
+        assert len(bus.nodes) == 0
+
+
+class TestBcmNodes:
+
+    def test_cyclic_transmit_on_virtual_clock(self, bus):
+        rx = bus.create_raw_socket()
+        bcm = bus.create_bcm_socket()
+        frame = CanFrame(can_id=0x123, data=bytes(8))
+        bcm.setup_cyclic_transmit(frame, interval=0.1)
+        # the first frame is sent when the timer starts
+        assert rx.recv_batch(timeout=0) == [frame]
+        assert bus.advance(1.05) == 10
+        assert len(rx.recv_batch(timeout=0)) == 10
+
+    def test_count_and_ival1(self, bus):
+        rx = bus.create_raw_socket()
+        bcm = bus.create_bcm_socket()
+        frames = [CanFrame(can_id=0x200, data=bytes((counter,))) for counter in range(4)]
+        bcm.send(BcmMsg(opcode=BcmOpCodes.TX_SETUP,
+                        flags=BCMFlags.SETTIMER | BCMFlags.STARTTIMER | BCMFlags.TX_COUNTEVT,
+                        can_id=0x200,
+                        frames=frames,
+                        count=3,
+                        ival1=0.01,
+                        ival2=1,
+                        ))
+        bus.advance(0.05)
+        # one frame at start and two with ival1, then the sequence continues with ival2
+        assert rx.recv_batch(timeout=0) == frames[:3]
+        assert bcm.recv().opcode == BcmOpCodes.TX_EXPIRED
+        bus.advance(1)
+        assert rx.recv_batch(timeout=0) == frames[3:]
+
+    def test_cyclic_scheduler(self, bus):
+        rx = bus.create_raw_socket()
+        with CyclicScheduler(bcm_sock=bus.create_bcm_socket()) as sched:
+            for can_id in range(0x100, 0x104):
+                sched.add_job(can_id=can_id, frames=bytes(8), interval=0.01)
+            assert len(rx.recv_batch(timeout=0)) == 4
+            for can_id in range(0x100, 0x104):
+                sched.stage(can_id=can_id, data=bytes((can_id & 0xFF,)) * 8)
+            assert sched.flush() == 4
+            bus.advance(0.01)
+            assert rx.recv_batch(timeout=0) == [CanFrame(can_id=can_id, data=bytes((can_id & 0xFF,)) * 8)
+                                                 for can_id in range(0x100, 0x104)]
+            assert sched.read(0x101).frames == [CanFrame(can_id=0x101, data=bytes((1,)) * 8)]
+        bus.advance(1)
+        assert rx.recv_batch(timeout=0) == []
+
+    def test_delete_without_job(self, bus):
+        bcm = bus.create_bcm_socket()
+        with pytest.raises(OSError) as e:
+            bcm.delete_receive(0x123)
+        assert e.value.errno == errno.EINVAL
+
+    def test_receive_changes_and_timeout(self, bus):
+        tx = bus.create_raw_socket()
+        bcm = bus.create_bcm_socket()
+        bcm.setup_receive(can_id=0x123, mask=bytes((0xFF,)), timeout=0.5)
+        for data in (b"\x01\x00", b"\x01\x01", b"\x02\x00"):
+            tx.send(CanFrame(can_id=0x123, data=data))
+        changes = [bcm.recv_event(), bcm.recv_event()]
+        assert all(isinstance(event, BcmRxChanged) for event in changes)
+        assert [event.frame.data for event in changes] == [b"\x01\x00", b"\x02\x00"]
+        bus.advance(0.4)
+        tx.send(CanFrame(can_id=0x123, data=b"\x02\x00"))
+        bus.advance(0.4)
+        bcm.s.setblocking(False)
+        with pytest.raises(BlockingIOError):
+            bcm.recv()
+        bus.advance(0.2)
+        assert isinstance(bcm.recv_event(), BcmRxTimeout)
+
+    def test_multiplex_receive(self, bus):
+        tx = bus.create_raw_socket()
+        bcm = bus.create_bcm_socket()
+        bcm.setup_multiplex_receive(can_id=0x200, mux_mask=bytes((0xFF,)), filters=[b"\x01\xFF", b"\x02\x0F"])
+        for data in (b"\x01\x10", b"\x02\x10", b"\x02\x20", b"\x02\x21", b"\x03\x00"):
+            tx.send(CanFrame(can_id=0x200, data=data))
+        bcm.s.setblocking(False)
+        received = []
+        while True:
+            try:
+                received.append(bcm.recv_event().frame.data)
+            except BlockingIOError:
+                break
+        assert received == [b"\x01\x10", b"\x02\x10", b"\x02\x21"]
+
+
+class TestIsoTpNodes:
+
+    def test_pdu(self, bus):
+        client = bus.create_isotp_socket(rx_addr=0x7E8, tx_addr=0x7E0)
+        server = bus.create_isotp_socket(rx_addr=0x7E0, tx_addr=0x7E8, opts=IsoTpOpts(tx_padding=0xAA))
+        other = bus.create_isotp_socket(rx_addr=0x7E1, tx_addr=0x7E9)
+        assert server.get_opts().tx_padding == 0xAA
+        client.send(bytes(range(256)) * 4)
+        assert server.recv(4096) == bytes(range(256)) * 4
+        server.sendmsg([b"\x62", b"\xF1\x90"])
+        assert client.recv_view() == b"\x62\xF1\x90"
+        other.s.setblocking(False)
+        with pytest.raises(BlockingIOError):
+            other.recv(4096)